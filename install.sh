@@ -22,69 +22,112 @@ chmod 700 "$DB_DIR"
 cat > "$INSTALL_PATH" << 'EOL'
 #!/bin/bash
 
-# Check if Docker is running
-if ! docker info > /dev/null 2>&1; then
-    echo "Error: Docker is not running"
-    exit 1
-fi
+IMAGE="lukakap/fastcmd:latest"
 
 # Get user's home directory
 USER_HOME=$(eval echo ~$USER)
 CONFIG_DIR="$USER_HOME/.fastcmd"
 DB_DIR="$CONFIG_DIR/db"
 
+# Updates are looked for at most once per TTL (in seconds), the time of the
+# last check is kept in this file
+UPDATE_STAMP="$CONFIG_DIR/last_update_check"
+UPDATE_CHECK_TTL="${FASTCMD_UPDATE_CHECK_TTL:-86400}"
+
+# --no-update-check (or FASTCMD_NO_UPDATE_CHECK=1) skips the check entirely
+if [ "$1" = "--no-update-check" ]; then
+    FASTCMD_NO_UPDATE_CHECK=1
+    shift
+fi
+
+update_check_due() {
+    if [ "${FASTCMD_NO_UPDATE_CHECK:-0}" = "1" ]; then
+        return 1
+    fi
+    # Always check when the image is missing
+    if ! docker image inspect "$IMAGE" > /dev/null 2>&1; then
+        return 0
+    fi
+    local last_check=$(cat "$UPDATE_STAMP" 2>/dev/null || echo 0)
+    [ $(( $(date +%s) - ${last_check:-0} )) -ge "$UPDATE_CHECK_TTL" ]
+}
+
 # Function to check and update FastCmd
 check_and_update() {
     # Get the current image digest
-    local current_digest=$(docker inspect lukakap/fastcmd:latest --format '{{.Id}}' 2>/dev/null || echo "none")
-    
-    # Pull the latest image without running it
-    docker pull lukakap/fastcmd:latest > /dev/null 2>&1
-    
-    # Get the new image digest
-    local new_digest=$(docker inspect lukakap/fastcmd:latest --format '{{.Id}}' 2>/dev/null)
-    
-    # Compare digests to determine if an update is needed
-    if [ "$current_digest" != "$new_digest" ]; then
-        echo "A new version of FastCmd is available!"
-        echo "Updating to the latest version..."
-        if [ $? -eq 0 ]; then
-            echo "FastCmd updated successfully!"
-        else
-            echo "Error: Failed to update FastCmd"
+    local current_digest=$(docker inspect "$IMAGE" --format '{{.Id}}' 2>/dev/null || echo "none")
+
+    # Pull the latest image without running it. When offline the local image
+    # is used and the check is retried on the next launch.
+    if ! docker pull "$IMAGE" > /dev/null 2>&1; then
+        if [ "$current_digest" = "none" ]; then
+            if ! docker info > /dev/null 2>&1; then
+                echo "Error: Docker is not running"
+            else
+                echo "Error: Failed to pull FastCmd image"
+            fi
             exit 1
         fi
+        return
     fi
-}
+    date +%s > "$UPDATE_STAMP"
 
-# Check and update if needed
-check_and_update
+    # Get the new image digest
+    local new_digest=$(docker inspect "$IMAGE" --format '{{.Id}}' 2>/dev/null)
 
-# Check if image exists, if not pull it
-if ! docker image inspect lukakap/fastcmd:latest > /dev/null 2>&1; then
-    echo "Pulling FastCmd image..."
-    docker pull lukakap/fastcmd:latest
-    if [ $? -ne 0 ]; then
-        echo "Error: Failed to pull FastCmd image"
-        exit 1
+    # Compare digests to tell whether an update was pulled
+    if [ "$current_digest" = "none" ]; then
+        echo "FastCmd image pulled successfully!"
+    elif [ "$current_digest" != "$new_digest" ]; then
+        echo "FastCmd updated to the latest version!"
     fi
+}
+
+if update_check_due; then
+    check_and_update
+fi
+
+# Only allocate a TTY when attached to a terminal, so input can be piped in
+# (e.g. fastcmd batch-search -i - < queries.txt)
+if [ -t 0 ]; then
+    TTY_FLAGS="-it"
+else
+    TTY_FLAGS="-i"
 fi
 
-# Run the container with persistent volumes
-docker run -it --rm \
+# Shell histories are mounted read-only for ingest-history
+HISTORY_MOUNTS=()
+for history_file in .bash_history .zsh_history; do
+    if [ -f "$USER_HOME/$history_file" ]; then
+        HISTORY_MOUNTS+=(-v "$USER_HOME/$history_file:/root/$history_file:ro")
+    fi
+done
+
+# Run the container with persistent volumes. The arguments go to fastcmd,
+# not in place of the command of the image
+docker run $TTY_FLAGS --rm \
     -v "$CONFIG_DIR:/root/.fastcmd" \
     -v "$DB_DIR:/root/.fastcmd/db" \
+    "${HISTORY_MOUNTS[@]}" \
     -e FASTCMD_CONFIG_DIR=/root/.fastcmd \
     -e FASTCMD_DB_DIR=/root/.fastcmd/db \
     -e FASTCMD_HOME=/root \
     -e HOME=/root \
-    lukakap/fastcmd:latest "$@"
+    "$IMAGE" python src/fastcmd.py "$@"
+status=$?
+
+# docker exits with 125 when the container could not be started, checking
+# the daemon only then keeps it off the common path
+if [ $status -eq 125 ] && ! docker info > /dev/null 2>&1; then
+    echo "Error: Docker is not running"
+fi
+exit $status
 EOL
 
 # Make the script executable
 chmod +x "$INSTALL_PATH"
 
 echo "FastCmd installed successfully! You can now use the 'fastcmd' command from anywhere."
-echo "FastCmd will automatically update when new versions are available."
+echo "FastCmd checks for new versions once a day (FASTCMD_UPDATE_CHECK_TTL seconds), pass --no-update-check or set FASTCMD_NO_UPDATE_CHECK=1 to skip it."
 echo "Configuration will be stored in: $CONFIG_DIR"
 echo "Database will be stored in: $DB_DIR"
\ No newline at end of file
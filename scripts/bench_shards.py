@@ -0,0 +1,115 @@
+"""
+Benchmark of search latency and bulk inserts by number of shards.
+
+Fills sharded stores of 1, 2, 4 and 8 shards with the same random vectors,
+then runs the same queries against each one:
+
+    python scripts/bench_shards.py --vectors 100000 --shards 1 2 4 8
+
+Reports the time to insert the vectors and the median and 95th percentile
+search latency. Shards are searched in parallel threads, so search latency
+only drops with the number of shards on a machine with that many cores.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import vector_database  # noqa: E402
+from src.shards import ShardedStore  # noqa: E402
+
+BATCH_SIZE = 1000
+
+
+def random_vectors(
+    rng: random.Random, count: int, dimensions: int
+) -> List[List[float]]:
+    return [[rng.gauss(0, 1) for _ in range(dimensions)] for _ in range(count)]
+
+
+def measure(
+    directory: str,
+    count: int,
+    vectors: List[List[float]],
+    queries: List[List[float]],
+    top_k: int,
+) -> Tuple[float, float, float]:
+    """
+    Fill a store of count shards and search it.
+
+    Returns:
+        Tuple[float, float, float]: Insert seconds, median and 95th
+        percentile search milliseconds
+    """
+    store = ShardedStore(directory, count)
+    try:
+        store.init()
+        started = time.perf_counter()
+        for start in range(0, len(vectors), BATCH_SIZE):
+            store.insert_entries(
+                [
+                    (vector, f"cmd-{start + i}", f"description {start + i}")
+                    for i, vector in enumerate(
+                        vectors[start : start + BATCH_SIZE]
+                    )
+                ]
+            )
+        inserted = time.perf_counter() - started
+
+        # Warm up the connections and page cache of every shard
+        store.fetch_similar(queries[0], top_k)
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            store.fetch_similar(query, top_k)
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        store.close()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    return inserted, statistics.median(latencies), p95
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vectors = random_vectors(rng, args.vectors, args.dimensions)
+    queries = random_vectors(rng, args.queries, args.dimensions)
+
+    print(
+        f"{args.vectors} vectors of {args.dimensions} dimensions, "
+        f"{os.cpu_count()} CPUs"
+    )
+    print(f"{'shards':<8}{'insert s':>10}{'median ms':>11}{'p95 ms':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        # Only the shards are searched, not the installed packs
+        vector_database.PACK_DIR = os.path.join(directory, "packs")
+        for count in args.shards:
+            inserted, median, p95 = measure(
+                os.path.join(directory, f"{count}-shards"),
+                count,
+                vectors,
+                queries,
+                args.top_k,
+            )
+            print(f"{count:<8}{inserted:>10.2f}{median:>11.1f}{p95:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
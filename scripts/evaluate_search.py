@@ -0,0 +1,174 @@
+"""
+Evaluation of search quality and latency under different configurations.
+
+Loads the commands of a labeled dataset (see src/evaluation.py) into a
+temporary database per configuration, runs its queries and reports recall,
+MRR and latency side by side. A configuration is a name and FASTCMD_*
+variables, plus mode=vector to skip the query cache and local fallback of
+the search command:
+
+    python scripts/evaluate_search.py --dataset eval.json \\
+        --config baseline \\
+        --config l2:FASTCMD_DISTANCE_METRIC=l2 \\
+        --config shards:FASTCMD_SHARDS=4 \\
+        --config vector-only:mode=vector \\
+        --config deadline:FASTCMD_SEARCH_DEADLINE_MS=50
+
+Runs offline. Embeddings are stub ones unless --recording names embeddings
+saved once from the API with --record:
+
+    python scripts/evaluate_search.py --dataset eval.json --record eval.rec
+    python scripts/evaluate_search.py --dataset eval.json --recording eval.rec
+
+Every configuration runs in its own process, settings are read on import.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from src.embeddings import record_embeddings  # noqa: E402
+from src.evaluation import (  # noqa: E402
+    EVALUATION_MODES,
+    dataset_texts,
+    evaluate,
+    format_results,
+    load_commands,
+    load_dataset,
+)
+
+# Small example dataset, used when no other one is given
+DATASET = os.path.join(ROOT_DIR, "scripts", "eval_dataset.json")
+
+
+def parse_config(spec: str) -> Tuple[str, str, Dict[str, str]]:
+    """
+    Split "name:KEY=VALUE,..." into the name, mode and variables.
+    """
+    name, _, settings = spec.partition(":")
+    mode = "search"
+    env = {}
+    for setting in filter(None, settings.split(",")):
+        key, separator, value = setting.partition("=")
+        if not separator:
+            raise ValueError(
+                f"Expected KEY=VALUE in '{spec}', got '{setting}'"
+            )
+        if key == "mode":
+            mode = value
+        else:
+            env[key] = value
+    if mode not in EVALUATION_MODES:
+        raise ValueError(f"Unknown mode '{mode}' in '{spec}'")
+    return name, mode, env
+
+
+def run_worker(dataset_path: str, mode: str, top_k: int) -> None:
+    dataset = load_dataset(dataset_path)
+    load_commands(dataset["commands"])
+    print(json.dumps(evaluate(dataset["queries"], top_k=top_k, mode=mode)))
+
+
+def run_config(
+    spec: str, dataset_path: str, recording: str, top_k: int
+) -> dict:
+    name, mode, settings = parse_config(spec)
+    with tempfile.TemporaryDirectory() as db_dir:
+        env = {
+            **os.environ,
+            "FASTCMD_DB_DIR": db_dir,
+            "FASTCMD_WARMUP": "0",
+            "FASTCMD_EMBEDDING_PROVIDER": "recorded" if recording else "stub",
+            "FASTCMD_EMBEDDING_RECORDING": recording,
+            **settings,
+        }
+        env.pop("TESTING", None)
+        process = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--worker",
+                "--dataset",
+                dataset_path,
+                "--mode",
+                mode,
+                "--top-k",
+                str(top_k),
+            ],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+    if process.returncode:
+        raise SystemExit(f"Configuration '{name}' failed:\n{process.stderr}")
+    result = json.loads(process.stdout.splitlines()[-1])
+    # JSON object keys are strings
+    result["recall"] = {int(k): v for k, v in result["recall"].items()}
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--dataset", default=DATASET, help="Labeled JSON file")
+    parser.add_argument(
+        "--config",
+        action="append",
+        default=[],
+        help="name[:KEY=VALUE,...], may be given several times",
+    )
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument(
+        "--recording", default="", help="Embeddings saved with --record"
+    )
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="Embed the dataset with the configured provider and save it",
+    )
+    parser.add_argument(
+        "--worker", action="store_true", help=argparse.SUPPRESS
+    )
+    parser.add_argument("--mode", default="search", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.dataset, args.mode, args.top_k)
+        return
+
+    dataset = load_dataset(args.dataset)
+    if args.record:
+        saved = record_embeddings(dataset_texts(dataset), args.record)
+        print(f"Saved {saved} embeddings to {args.record}")
+        return
+
+    recording = os.path.abspath(args.recording) if args.recording else ""
+    dataset_path = os.path.abspath(args.dataset)
+    results = {}
+    misses: Dict[str, List[str]] = {}
+    for spec in args.config or ["default"]:
+        name = parse_config(spec)[0]
+        results[name] = run_config(spec, dataset_path, recording, args.top_k)
+        misses[name] = results[name]["misses"]
+
+    print(
+        f"{len(dataset['queries'])} queries, "
+        f"{len(dataset['commands'])} commands"
+    )
+    for line in format_results(results, args.top_k):
+        print(line)
+    for name, queries in misses.items():
+        if queries:
+            print(f"\n{name}: missed {len(queries)} queries")
+            for query in queries:
+                print(f"  {query}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Measure the latency of the first search typed at the interactive prompt.
+
+Starts the native entry point of this checkout against a temporary database
+and a local stand-in for the embeddings API, waits for the prompt, "types"
+a search after a think time and times until the prompt comes back. Runs
+with the warm-up disabled and enabled:
+
+    python scripts/first_command.py --runs 5
+
+The stand-in answers with stub embeddings. It delays the first request of
+every connection by --handshake-ms to model the TCP and TLS handshakes with
+the real API, and every request by --latency-ms.
+"""
+
+import argparse
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from src.embeddings import calculate_stub_embedding  # noqa: E402
+from src.vector_database import connect, init_db, insert_entries  # noqa: E402
+
+PROMPT = b"fastcmd> "
+QUERY = "search -d 'show running docker containers'"
+
+
+class StubAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    handshake = 0.0
+    latency = 0.0
+
+    def setup(self) -> None:
+        super().setup()
+        self.connected = False
+
+    def _wait(self) -> None:
+        if not self.connected:
+            time.sleep(self.handshake)
+            self.connected = True
+        time.sleep(self.latency)
+
+    def _send(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def do_HEAD(self) -> None:
+        self._wait()
+        self._send(404, {})
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self._wait()
+        inputs = body["input"]
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        self._send(
+            200,
+            {
+                "object": "list",
+                "model": body["model"],
+                "data": [
+                    {
+                        "object": "embedding",
+                        "index": index,
+                        "embedding": base64.b64encode(
+                            array("f", calculate_stub_embedding(text))
+                        ).decode(),
+                    }
+                    for index, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": 1, "total_tokens": 1},
+            },
+        )
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def populate(db_path: str, count: int) -> None:
+    init_db(db_path)
+    conn = connect(db_path)
+    entries = [
+        (
+            calculate_stub_embedding(f"command number {i} of the catalog"),
+            f"cmd-{i}",
+            f"command number {i} of the catalog",
+        )
+        for i in range(count)
+    ]
+    insert_entries(conn, entries)
+    conn.close()
+
+
+def read_until_prompt(process: "subprocess.Popen[bytes]") -> None:
+    assert process.stdout is not None
+    output = b""
+    while not output.endswith(PROMPT):
+        chunk = process.stdout.read1(4096)  # type: ignore[attr-defined]
+        if not chunk:
+            raise RuntimeError("fastcmd exited before showing the prompt")
+        output += chunk
+
+
+def first_search(env: Dict[str, str], think_time: float) -> float:
+    """
+    Return the seconds the first search takes at a fresh prompt.
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.fastcmd"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        cwd=ROOT_DIR,
+        env=env,
+    )
+    assert process.stdin is not None
+    read_until_prompt(process)
+    time.sleep(think_time)
+
+    started = time.perf_counter()
+    process.stdin.write(QUERY.encode() + b"\n")
+    process.stdin.flush()
+    read_until_prompt(process)
+    elapsed = time.perf_counter() - started
+
+    process.communicate(b"exit\n", timeout=30)
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--commands", type=int, default=10000)
+    parser.add_argument("--think-time", type=float, default=1.0)
+    parser.add_argument("--handshake-ms", type=float, default=150)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    StubAPIHandler.handshake = args.handshake_ms / 1000
+    StubAPIHandler.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAPIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as home:
+        populate(os.path.join(home, "commands.db"), args.commands)
+        base_env = {
+            **os.environ,
+            "HOME": home,
+            "FASTCMD_DB_DIR": home,
+            "FASTCMD_PACK_DIR": os.path.join(home, "packs"),
+            "PYTHONPATH": ROOT_DIR,
+            "PYTHONUNBUFFERED": "1",
+            "OPENAI_API_KEY": "sk-first-command",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_port}/v1",
+        }
+
+        results: Dict[str, List[float]] = {}
+        for label, warmup in (("cold", "0"), ("warm-up", "1")):
+            env = {**base_env, "FASTCMD_WARMUP": warmup}
+            results[label] = []
+            for _ in range(args.runs):
+                # Every run starts with an empty query cache
+                conn = connect(os.path.join(home, "commands.db"))
+                conn.execute("DELETE FROM query_cache")
+                conn.commit()
+                conn.close()
+                results[label].append(first_search(env, args.think_time))
+
+    server.shutdown()
+    print(
+        f"{args.commands} commands, think time {args.think_time:.1f} s, "
+        f"handshake {args.handshake_ms:.0f} ms, "
+        f"request {args.latency_ms:.0f} ms"
+    )
+    for label, timings in results.items():
+        print(
+            f"{label:<8} median {statistics.median(timings) * 1000:6.0f} ms"
+            f"   min {min(timings) * 1000:6.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Measure how long FastCmd takes from launch until the interactive prompt.
+
+By default the native entry point of this checkout is measured on a temporary
+home directory and database, so nothing outside of it is touched:
+
+    python scripts/launch_time.py --runs 10
+
+Pass the command to measure anything else, e.g. the Docker launcher installed
+by install.sh, with and without its update check:
+
+    python scripts/launch_time.py -- fastcmd
+    python scripts/launch_time.py -- fastcmd --no-update-check
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROMPT = b"fastcmd> "
+
+
+def time_to_prompt(command: List[str], env: Dict[str, str]) -> float:
+    """
+    Start the command and return the seconds until it prints the prompt.
+    """
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        cwd=ROOT_DIR,
+        env=env,
+    )
+    assert process.stdout is not None and process.stdin is not None
+
+    output = b""
+    while not output.endswith(PROMPT):
+        chunk = process.stdout.read1(4096)  # type: ignore[attr-defined]
+        if not chunk:
+            process.wait()
+            raise RuntimeError(
+                f"{' '.join(command)} exited before showing the prompt"
+            )
+        output += chunk
+    elapsed = time.perf_counter() - started
+
+    process.communicate(b"exit\n", timeout=30)
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "command",
+        nargs="*",
+        help="Command to measure, defaults to the native entry point",
+    )
+    args = parser.parse_args()
+
+    command = args.command or [sys.executable, "-m", "src.fastcmd"]
+
+    with tempfile.TemporaryDirectory() as home:
+        env = {
+            **os.environ,
+            "HOME": home,
+            "FASTCMD_DB_DIR": home,
+            "PYTHONPATH": ROOT_DIR,
+            "PYTHONUNBUFFERED": "1",
+            # Keeps the key prompt out of the measurement
+            "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "sk-launch-time"),
+        }
+        timings = [time_to_prompt(command, env) for _ in range(args.runs)]
+
+    print(f"Command: {' '.join(command)}")
+    print(f"Runs:    {args.runs}")
+    print(f"First:   {timings[0] * 1000:.0f} ms")
+    print(f"Median:  {statistics.median(timings) * 1000:.0f} ms")
+    print(f"Min:     {min(timings) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Load test for the FastCmd HTTP server.
+
+Measures search throughput and tail latency. By default a local server is
+started on a temporary database with the stub embedding provider, so no API
+key or network access is needed:
+
+    python scripts/load_test.py --concurrency 16 --requests 2000
+
+Pass --url to run against an already running instance instead.
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = [
+    "list",
+    "files",
+    "docker",
+    "containers",
+    "git",
+    "status",
+    "branch",
+    "restart",
+    "service",
+    "logs",
+    "kubernetes",
+    "pods",
+    "disk",
+    "usage",
+    "network",
+    "ports",
+    "python",
+    "tests",
+    "build",
+    "image",
+]
+
+
+def _post(url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    headers = {"Content-Type": "application/json"}
+    # Servers started with a token, see FASTCMD_SERVER_TOKEN
+    token = os.getenv("FASTCMD_SERVER_TOKEN")
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers=headers
+    )
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.loads(response.read())
+
+
+def _phrase(i: int) -> str:
+    return " ".join(WORDS[(i * step) % len(WORDS)] for step in (1, 3, 7))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/health", timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not come up")
+
+
+def start_local_server(
+    db_dir: str, latency_ms: float, batch_window_ms: float
+) -> "tuple[subprocess.Popen, str]":
+    port = _free_port()
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT_DIR,
+        FASTCMD_DB_DIR=db_dir,
+        FASTCMD_EMBEDDING_PROVIDER="stub",
+        FASTCMD_STUB_EMBEDDING_LATENCY_MS=str(latency_ms),
+    )
+    code = (
+        "from src.server import serve; "
+        f"serve(port={port}, batch_window_ms={batch_window_ms})"
+    )
+    process = subprocess.Popen([sys.executable, "-c", code], env=env)
+    url = f"http://127.0.0.1:{port}"
+    _wait_until_up(url)
+    return process, url
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(url: str, seed: int, requests: int, concurrency: int) -> None:
+    _post(
+        f"{url}/import",
+        {
+            "commands": [
+                {"command": f"cmd-{i}", "description": _phrase(i)}
+                for i in range(seed)
+            ]
+        },
+    )
+
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def search(i: int) -> None:
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            _post(f"{url}/search", {"description": _phrase(i), "top_k": 3})
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(search, range(requests)))
+    duration = time.perf_counter() - started
+
+    print(f"requests:    {requests} ({errors} errors)")
+    print(f"concurrency: {concurrency}")
+    print(f"throughput:  {len(latencies) / duration:.1f} req/s")
+    if latencies:
+        print(f"latency p50: {percentile(latencies, 50):.1f} ms")
+        print(f"latency p95: {percentile(latencies, 95):.1f} ms")
+        print(f"latency p99: {percentile(latencies, 99):.1f} ms")
+        print(f"latency avg: {statistics.mean(latencies):.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="URL of a running server")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--seed", type=int, default=500, help="Commands imported first"
+    )
+    parser.add_argument(
+        "--stub-latency-ms",
+        type=float,
+        default=20.0,
+        help="Simulated embedding round trip of the local server",
+    )
+    parser.add_argument("--batch-window-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    process: Optional[subprocess.Popen] = None
+    with tempfile.TemporaryDirectory() as db_dir:
+        url = args.url
+        if not url:
+            process, url = start_local_server(
+                db_dir, args.stub_latency_ms, args.batch_window_ms
+            )
+        try:
+            run(url, args.seed, args.requests, args.concurrency)
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    main()
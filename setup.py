@@ -6,6 +6,7 @@ setup(
     packages=find_packages(),
     install_requires=[
         "numpy",
+        "httpx",
         "openai",
         "scikit-learn",
         "sqlite-vec",
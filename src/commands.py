@@ -1,39 +1,169 @@
+import itertools
 import json
 import os
+import sys
 from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
 
-from src.embeddings import calculate_embedding
-from src.utils import fastcmd_print, print_command_match
-from src.vector_database import (
-    add_entry,
+from src.completion import forget_descriptions, remember_description
+from src.embeddings import (
+    EMBEDDING_BATCH_SIZE,
+    calculate_embedding,
+    calculate_embeddings,
+    get_embedding_model,
+    get_embedding_provider,
+    get_transport_stats,
+    set_embedding_operation,
+)
+from src.history import (
+    default_history_files,
+    get_description_generator,
+    ingest_history,
+)
+from src.jobs import checkpoint, job_manager
+from src.lexical import (
+    normalize_query,
+    rank_lexical,
+    text_similarity,
+    tokenize,
+)
+from src.maintenance import collect_stats, run_maintenance
+from src.reindex import get_checkpoint, run_reindex
+from src.related import fetch_related, rebuild_related
+from src.server import serve
+from src.shards import (
+    delete_entry,
+    enqueue_alias,
+    enqueue_entry,
     fetch_all_commands,
+    fetch_commands_containing,
     fetch_similar,
+    fetch_similar_batch,
+    has_shards,
+    import_entries,
+    is_sharded,
+    reshard,
+    update_entry,
+)
+from src.sync import export_changes, import_changes
+from src.telemetry import phase, record_operation
+from src.usage import (
+    DAILY_TOKEN_BUDGET,
+    check_budget,
+    estimate_cost,
+    estimate_tokens,
+    fetch_usage,
+    today,
+    tokens_used,
+)
+from src.utils import fastcmd_print, print_command_match
+from src.vector_database import (
+    cache_query_embedding,
+    fetch_cached_queries,
+    get_cached_embedding,
+    get_db_path,
+    import_texts,
     init_db,
+    to_import_entries,
+)
+from src.write_queue import drain_worker
+
+# How long a search waits for the query embedding before answering locally
+SEARCH_DEADLINE = float(os.getenv("FASTCMD_SEARCH_DEADLINE_MS", "2000")) / 1000
+
+# A cached query this similar to the current one lends it its embedding
+NEAREST_QUERY_SIMILARITY = 0.6
+
+# Descriptions considered when matching by words only
+LOCAL_CANDIDATES = 500
+
+# Commands waiting for their embedding listed under the match of a search
+PENDING_LISTED = 3
+
+# Commands embedded together and committed in one transaction per shard
+IMPORT_BATCH_SIZE = 100
+
+# Embedding calls run here, so a search can stop waiting at its deadline
+_search_executor = ThreadPoolExecutor(
+    max_workers=2,
+    thread_name_prefix="fastcmd-search",
+    initializer=set_embedding_operation,
+    initargs=("search",),
 )
 
 
+def _to_container_path(path_str: str) -> Path:
+    """
+    Translate a path given on the host into the path mounted in the container.
+    """
+    host_home = os.getenv("HOST_HOME")
+    user_home = os.getenv("USER_HOME")
+
+    if user_home and host_home and path_str.startswith(user_home):
+        return Path(path_str.replace(user_home, host_home, 1))
+    return Path(path_str)
+
+
+def _unavailable_when_sharded(name: str) -> bool:
+    """
+    Tell the user a command needs the single database, see src.shards.
+
+    Returns:
+        bool: True if the commands are sharded and name must not run
+    """
+    if not is_sharded():
+        return False
+    fastcmd_print(
+        f"❌ '{name}' works on a single database, run 'reshard --shards 1' "
+        "first.",
+        with_front_space=False,
+        with_front_text=False,
+    )
+    return True
+
+
 def handle_add(args: Namespace) -> bool:
     """
     Handle adding a new command to the database.
 
+    The command is saved right away and its description is embedded in the
+    background, so adding works offline and does not wait on the API. With
+    --alias, the description is added to the saved command instead, so it
+    can be found by several phrasings without duplicating it.
+
     Args:
-        args: Command line arguments containing description and command to run
+        args: Command line arguments containing description and command to
+            run, and whether to add the description as an alias
     """
     try:
         # Initialize database if it doesn't exist
         # We don't use a custom db_path here, as it should be patched in tests
         init_db()
 
-        # Calculate embedding for the description
-        embedding = calculate_embedding(args.description)
+        if args.alias:
+            alias_id = enqueue_alias(
+                command=args.commandrun, description=args.description
+            )
+            if alias_id is not None:
+                drain_worker.schedule()
+                remember_description(args.description)
+                fastcmd_print(
+                    f"✅ '{args.description}' added as an alias of "
+                    f"'{args.commandrun}'.",
+                    with_front_space=False,
+                    with_front_text=False,
+                )
+                return True
 
-        # Add command to database
-        add_entry(
-            embedding=embedding,
+        enqueue_entry(
             command=args.commandrun,
             description=args.description,
         )
+        drain_worker.schedule()
+        remember_description(args.description)
 
         fastcmd_print(
             f"✅ Command '{args.description}' added successfully.",
@@ -50,110 +180,318 @@ def handle_add(args: Namespace) -> bool:
         return False
 
 
-def handle_search(args: Namespace) -> bool:
+def handle_update(args: Namespace) -> bool:
     """
-    Handle searching for commands by description.
+    Handle changing the command or description of a saved command.
+
+    Only a changed description is embedded again, in the background like
+    for added commands.
 
     Args:
-        args: Command line arguments containing description to search for
+        args: Command line arguments containing the id and the new values
 
     Returns:
-        bool: True if command found and processed, False otherwise
+        bool: True if the command was updated, False otherwise
     """
     try:
-        query_embedding = calculate_embedding(args.description)
-
-        # Fetch only the most similar command (top_k=1)
-        results = fetch_similar(query_embedding, top_k=1)
-
-        if not results:
+        if args.commandrun is None and args.description is None:
             fastcmd_print(
-                "❌ No matching commands found.",
+                "❌ Nothing to update, pass -c and/or -d.",
                 with_front_space=False,
                 with_front_text=False,
             )
             return False
 
-        # Only show the most similar command
-        result = results[0]
-        distance_percent = int((1 - result["distance"]) * 100)
+        init_db()
 
-        print_command_match(result, distance_percent)
+        reembed = update_entry(
+            args.id, command=args.commandrun, description=args.description
+        )
+        if reembed is None:
+            fastcmd_print(
+                f"❌ No command with id {args.id}.",
+                with_front_space=False,
+                with_front_text=False,
+            )
+            return False
+        if reembed:
+            drain_worker.schedule()
+        if args.description is not None:
+            forget_descriptions()
 
+        fastcmd_print(
+            f"✅ Command {args.id} updated successfully.",
+            with_front_space=False,
+            with_front_text=False,
+        )
         return True
-
     except Exception as e:
         fastcmd_print(
-            f"❌ Error searching for command: {str(e)}",
+            f"❌ Error updating command: {str(e)}",
             with_front_space=False,
             with_front_text=False,
         )
         return False
 
 
-def handle_export(args: Namespace) -> bool:
+def handle_delete(args: Namespace) -> bool:
     """
-    Handle exporting all commands to a JSON file.
+    Handle deleting a saved command.
 
     Args:
-        args: Command line arguments containing optional output path
+        args: Command line arguments containing the id of the command
 
     Returns:
-        bool: True if export was successful, False otherwise
+        bool: True if the command was deleted, False otherwise
     """
     try:
-        # Initialize database if it doesn't exist
         init_db()
 
-        # Fetch all commands
-        commands = fetch_all_commands()
-
-        if not commands:
+        if not delete_entry(args.id):
             fastcmd_print(
-                "❌ No commands found in the database.\n",
+                f"❌ No command with id {args.id}.",
                 with_front_space=False,
                 with_front_text=False,
             )
             return False
+        forget_descriptions()
 
-        # Create the export data structure
-        export_data = {"commands": commands}
-
-        # Convert to JSON with pretty printing
-        json_data = json.dumps(export_data, indent=2)
-
-        # Print to console
         fastcmd_print(
-            "\nExported commands:",
+            f"✅ Command {args.id} deleted successfully.",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return True
+    except Exception as e:
+        fastcmd_print(
+            f"❌ Error deleting command: {str(e)}",
             with_front_space=False,
             with_front_text=False,
         )
-        print(f"{json_data}\n")
+        return False
 
-        if args.output:
-            output_path = Path(args.output)
-        else:
-            # Use host's home directory from environment variable
-            host_home = os.getenv("HOST_HOME")
-            if not host_home:
-                raise ValueError("Could not determine host home directory")
-            output_path = Path(host_home) / "fastcmd_commands.json"
 
-        output_path.parent.mkdir(parents=True, exist_ok=True)
+def _search_locally(query: str, top_k: int) -> List[dict]:
+    """
+    Match a normalized query without calling the embedding API.
+
+    The embedding of the most similar cached query is reused when it is close
+    enough, otherwise descriptions are ranked by word and trigram overlap.
+    """
+    nearest = max(
+        fetch_cached_queries(),
+        key=lambda cached: text_similarity(query, cached),
+        default=None,
+    )
+    if nearest and text_similarity(query, nearest) >= NEAREST_QUERY_SIMILARITY:
+        embedding = get_cached_embedding(nearest)
+        if embedding is not None:
+            return fetch_similar(embedding, top_k=top_k)
+
+    candidates = {
+        command["id"]: command
+        for command in fetch_commands_containing(
+            sorted(tokenize(query)), LOCAL_CANDIDATES
+        )
+    }
+    return rank_lexical(query, list(candidates.values()), top_k=top_k)
+
+
+def match_pending(description: str, top_k: int) -> List[dict]:
+    """
+    Match commands still waiting for their embedding by words.
+
+    Their distances come from word and trigram overlap, so they do not
+    compare to the distances of vector matches.
+    """
+    candidates = fetch_commands_containing(
+        sorted(tokenize(normalize_query(description))),
+        LOCAL_CANDIDATES,
+        pending_only=True,
+    )
+    return [
+        {**match, "pending": True}
+        for match in rank_lexical(description, candidates, top_k=top_k)
+    ]
+
+
+def search_commands(
+    description: str, top_k: int = 1, deadline: Optional[float] = None
+) -> Tuple[List[dict], bool]:
+    """
+    Find the commands closest to a description within a deadline.
+
+    Query embeddings are cached, so repeated queries skip the API. When the
+    embedding is not available in time, or the API fails, the search falls
+    back to local matching instead of failing.
+
+    Args:
+        description: Description to search for
+        top_k: Maximum number of results
+        deadline: Seconds to wait for the query embedding, defaults to
+            SEARCH_DEADLINE
+
+    Returns:
+        Tuple[List[dict], bool]: Vector matches closest first, followed by
+        commands still waiting for their embedding when fewer than top_k
+        matched, and whether they were found by the local fallback
+    """
+    deadline = deadline or SEARCH_DEADLINE
+    query = normalize_query(description)
+    query_embedding = get_cached_embedding(query)
+
+    if query_embedding is None:
+        future = _search_executor.submit(
+            calculate_embedding, description, timeout=deadline
+        )
+        try:
+            with phase("embed_query"):
+                query_embedding = future.result(timeout=deadline)
+        except Exception:
+            with phase("local_search"):
+                return _search_locally(query, top_k), True
+        cache_query_embedding(query, query_embedding)
+
+    with phase("vector_search"):
+        results = fetch_similar(query_embedding, top_k=top_k)
+
+    if len(results) < top_k:
+        with phase("pending_match"):
+            results += match_pending(description, top_k - len(results))
+    return results, False
 
-        with open(output_path, "w") as f:
-            f.write(json_data)
 
-        user_home = os.getenv("USER_HOME")
-        if not user_home:
-            user_home = os.getenv("HOME")
-        display_path = f"{user_home}/fastcmd_commands.json"
+def handle_search(args: Namespace) -> bool:
+    """
+    Handle searching for commands by description.
+
+    Args:
+        args: Command line arguments containing description to search for
+
+    Returns:
+        bool: True if command found and processed, False otherwise
+    """
+    try:
+        with record_operation("search"):
+            init_db()
+
+            # Fetch only the most similar command (top_k=1)
+            results, degraded = search_commands(args.description, top_k=1)
+
+            if not results:
+                fastcmd_print(
+                    "❌ No matching commands found.",
+                    with_front_space=False,
+                    with_front_text=False,
+                )
+                return False
+
+            # Only show the most similar command
+            result = results[0]
+            if degraded:
+                result = {**result, "degraded": True}
+            if "id" in result and not result.get("pack") and not is_sharded():
+                result = {**result, "related": fetch_related(result["id"])}
+            if not result.get("pending"):
+                # Listed apart, their word matches do not rank against it
+                pending = [
+                    match
+                    for match in match_pending(
+                        args.description, PENDING_LISTED
+                    )
+                    if match["id"] != result.get("id")
+                ]
+                if pending:
+                    result = {**result, "pending_matches": pending}
+            distance_percent = int((1 - result["distance"]) * 100)
+
+            print_command_match(result, distance_percent)
+
+            return True
+
+    except Exception as e:
         fastcmd_print(
-            f"✅ Commands exported to: {display_path}\n",
+            f"❌ Error searching for command: {str(e)}",
             with_front_space=False,
             with_front_text=False,
         )
-        return True
+        return False
+
+
+def handle_export(args: Namespace) -> bool:
+    """
+    Handle exporting all commands to a JSON file.
+
+    Args:
+        args: Command line arguments containing optional output path
+
+    Returns:
+        bool: True if export was successful, False otherwise
+    """
+    try:
+        with record_operation("export"):
+            # Initialize database if it doesn't exist
+            init_db()
+
+            # Fetch all commands
+            with phase("fetch_all_commands"):
+                commands = fetch_all_commands()
+            checkpoint(0, 2)
+
+            if not commands:
+                fastcmd_print(
+                    "❌ No commands found in the database.\n",
+                    with_front_space=False,
+                    with_front_text=False,
+                )
+                return False
+
+            # Create the export data structure
+            export_data = {"commands": commands}
+
+            # Convert to JSON with pretty printing
+            with phase("json.dumps"):
+                json_data = json.dumps(export_data, indent=2)
+
+            # Print to console
+            fastcmd_print(
+                "\nExported commands:",
+                with_front_space=False,
+                with_front_text=False,
+            )
+            with phase("print"):
+                print(f"{json_data}\n")
+
+            if args.output:
+                output_path = Path(args.output)
+            else:
+                # Use host's home directory from environment variable
+                host_home = os.getenv("HOST_HOME")
+                if not host_home:
+                    raise ValueError("Could not determine host home directory")
+                output_path = Path(host_home) / "fastcmd_commands.json"
+
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+
+            # Written aside and renamed, so a failed or cancelled export
+            # never leaves a truncated file behind
+            checkpoint(1, 2)
+            partial_path = output_path.with_name(output_path.name + ".part")
+            with phase("write_file"):
+                with open(partial_path, "w") as f:
+                    f.write(json_data)
+                os.replace(partial_path, output_path)
+
+            user_home = os.getenv("USER_HOME")
+            if not user_home:
+                user_home = os.getenv("HOME")
+            display_path = f"{user_home}/fastcmd_commands.json"
+            fastcmd_print(
+                f"✅ Commands exported to: {display_path}\n",
+                with_front_space=False,
+                with_front_text=False,
+            )
+            return True
     except Exception as e:
         fastcmd_print(
             f"❌ Error exporting commands: {str(e)}\n",
@@ -174,83 +512,977 @@ def handle_import(args: Namespace) -> bool:
         bool: True if import was successful, False otherwise
     """
     try:
-        if not args.input:
-            fastcmd_print(
-                "❌ Please provide the path to the JSON file with --input",
-                with_front_space=False,
-                with_front_text=False,
-            )
-            return False
+        with record_operation("import"):
+            if not args.input:
+                fastcmd_print(
+                    "❌ Please provide the path to the JSON file with --input",
+                    with_front_space=False,
+                    with_front_text=False,
+                )
+                return False
+
+            input_path = _to_container_path(args.input)
+            if not input_path.exists():
+                fastcmd_print(
+                    f"❌ File not found: {input_path}",
+                    with_front_space=False,
+                    with_front_text=False,
+                )
+                return False
 
-        host_home = os.getenv("HOST_HOME")
-        user_home = os.getenv("USER_HOME")
-        input_path_str = args.input
+            with phase("json.load"), open(input_path, "r") as f:
+                data = json.load(f)
 
-        if user_home and host_home and input_path_str.startswith(user_home):
-            container_input_path = input_path_str.replace(
-                user_home, host_home, 1
-            )
-        else:
-            container_input_path = input_path_str
+            commands = data.get("commands", [])
+            if not commands:
+                fastcmd_print(
+                    "❌ No commands found in the import file.",
+                    with_front_space=False,
+                    with_front_text=False,
+                )
+                return False
 
-        input_path = Path(container_input_path)
-        if not input_path.exists():
+            init_db()
+
+            # Estimated from the length of the texts, the API reports the
+            # actual tokens once they are embedded
+            tokens = estimate_tokens(
+                text
+                for cmd in commands
+                if "description" in cmd and "command" in cmd
+                for text in [cmd["description"], *cmd.get("aliases", [])]
+            )
+            model = (
+                "stub"
+                if get_embedding_provider() == "stub"
+                else get_embedding_model()
+            )
+            cost = estimate_cost(model, tokens)
             fastcmd_print(
-                f"❌ File not found: {input_path}",
+                f"🧮 About {tokens} tokens to embed"
+                + (f", ${cost:.4f} with {model}" if cost is not None else ""),
                 with_front_space=False,
                 with_front_text=False,
             )
-            return False
+            # Nothing is imported if the whole file does not fit the budgets
+            check_budget("import", tokens)
 
-        with open(input_path, "r") as f:
-            data = json.load(f)
+            valid = []
+            for cmd in commands:
+                if "description" in cmd and "command" in cmd:
+                    valid.append(cmd)
+                else:
+                    fastcmd_print(
+                        f"⚠️ Skipping invalid entry: {cmd}",
+                        with_front_space=False,
+                        with_front_text=False,
+                    )
+
+            imported_count = 0
+            skipped_aliases = 0
+            with phase("embed_and_insert"):
+                try:
+                    for start in range(0, len(valid), IMPORT_BATCH_SIZE):
+                        batch = valid[start : start + IMPORT_BATCH_SIZE]
+                        entries = to_import_entries(
+                            batch, calculate_embeddings(import_texts(batch))
+                        )
+                        imported, skipped = import_entries(entries)
+                        imported_count += imported
+                        skipped_aliases += skipped
+                        # Every batch is committed on its own, a cancelled
+                        # job keeps the ones imported so far
+                        checkpoint(start + len(batch), len(valid))
+                finally:
+                    forget_descriptions()
 
-        commands = data.get("commands", [])
-        if not commands:
             fastcmd_print(
-                "❌ No commands found in the import file.",
+                f"\n✅ Imported {imported_count} commands from {input_path}"
+                + (
+                    f", skipped {skipped_aliases} repeated or surplus aliases"
+                    if skipped_aliases
+                    else ""
+                )
+                + "\n",
                 with_front_space=False,
                 with_front_text=False,
             )
+            return True
+    except Exception as e:
+        fastcmd_print(
+            f"❌ Error importing commands: {str(e)}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return False
+
+
+def handle_sync_export(args: Namespace) -> bool:
+    """
+    Handle exporting the changes made after a cursor for another machine.
+
+    Args:
+        args: Command line arguments containing the cursor of the previous
+            export and the output path ("-" for stdout)
+
+    Returns:
+        bool: True if the changes were exported, False otherwise
+    """
+    try:
+        if _unavailable_when_sharded("sync-export"):
             return False
 
-        init_db()
+        data = export_changes(since=args.since)
+        json_data = json.dumps(data)
 
-        imported_count = 0
-        for cmd in commands:
-            if "description" in cmd and "command" in cmd:
-                embedding = calculate_embedding(cmd["description"])
-                add_entry(
-                    embedding=embedding,
-                    command=cmd["command"],
-                    description=cmd["description"],
-                )
-                imported_count += 1
-            else:
+        # Stdout only carries the sync file, so it can be piped to ssh
+        if args.output == "-":
+            print(json_data)
+            return True
+
+        output_path = _to_container_path(args.output)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, "w") as f:
+            f.write(json_data)
+
+        fastcmd_print(
+            f"✅ Exported {len(data['changes'])} changes to {args.output}. "
+            f"Next time run 'sync-export --since {data['cursor']}'.",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return True
+    except Exception as e:
+        fastcmd_print(
+            f"❌ Error exporting changes: {str(e)}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return False
+
+
+def handle_sync_import(args: Namespace) -> bool:
+    """
+    Handle merging changes exported on another machine.
+
+    Args:
+        args: Command line arguments containing the path of the sync file
+            ("-" for stdin)
+
+    Returns:
+        bool: True if the changes were merged, False otherwise
+    """
+    try:
+        if _unavailable_when_sharded("sync-import"):
+            return False
+
+        if args.input == "-":
+            data = json.load(sys.stdin)
+        else:
+            input_path = _to_container_path(args.input)
+            if not input_path.exists():
                 fastcmd_print(
-                    f"⚠️ Skipping invalid entry: {cmd}",
+                    f"❌ File not found: {input_path}",
                     with_front_space=False,
                     with_front_text=False,
                 )
+                return False
+            with open(input_path, "r") as f:
+                data = json.load(f)
+
+        counts = import_changes(data)
+        if counts["queued"]:
+            drain_worker.schedule()
+        forget_descriptions()
 
         fastcmd_print(
-            f"\n✅ Imported {imported_count} commands from {input_path}\n",
+            f"✅ Merged {counts['applied'] + counts['queued']} changes "
+            f"({counts['queued']} waiting for embeddings), "
+            f"{counts['skipped']} older changes skipped.",
             with_front_space=False,
             with_front_text=False,
         )
         return True
     except Exception as e:
         fastcmd_print(
-            f"❌ Error importing commands: {str(e)}",
+            f"❌ Error importing changes: {str(e)}",
             with_front_space=False,
             with_front_text=False,
         )
         return False
 
 
+def _read_queries(stream: TextIO) -> Iterator[str]:
+    for line in stream:
+        query = line.strip()
+        if query:
+            yield query
+
+
+def _embed_in_batches(queries: Iterable[str]) -> Iterator[Tuple[str, list]]:
+    """
+    Pair each query with its embedding, embedding one batch at a time.
+    """
+    iterator = iter(queries)
+    while True:
+        batch: List[str] = list(
+            itertools.islice(iterator, EMBEDDING_BATCH_SIZE)
+        )
+        if not batch:
+            return
+        yield from zip(batch, calculate_embeddings(batch))
+
+
+def _write_batch_results(
+    queries: Iterable[str], top_k: int, output: TextIO
+) -> int:
+    for_queries, for_embeddings = itertools.tee(_embed_in_batches(queries))
+    results = fetch_similar_batch(
+        (embedding for _, embedding in for_embeddings), top_k=top_k
+    )
+
+    count = 0
+    for (query, _), matches in zip(for_queries, results):
+        record = {
+            "query": query,
+            "matches": [
+                {
+                    "command": match["command"],
+                    "description": match["description"],
+                    "distance": match["distance"],
+                    "score": 1 - match["distance"],
+                }
+                for match in matches
+            ],
+        }
+        output.write(json.dumps(record) + "\n")
+        output.flush()
+        count += 1
+    return count
+
+
+def handle_batch_search(args: Namespace) -> bool:
+    """
+    Handle searching for many descriptions read from a file or stdin.
+
+    Queries are read one per line and embedded in batched requests. Results
+    are streamed as JSON lines, one line per query, as soon as each batch
+    has been looked up.
+
+    Args:
+        args: Command line arguments containing the input path ("-" for
+            stdin), the number of matches per query and an optional output
+            path
+
+    Returns:
+        bool: True if all queries were processed, False otherwise
+    """
+    try:
+        init_db()
+
+        if args.input == "-":
+            input_file = sys.stdin
+        else:
+            input_path = _to_container_path(args.input)
+            if not input_path.exists():
+                fastcmd_print(
+                    f"❌ File not found: {input_path}",
+                    with_front_space=False,
+                    with_front_text=False,
+                )
+                return False
+            input_file = open(input_path, "r")
+
+        try:
+            if args.output:
+                output_path = _to_container_path(args.output)
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(output_path, "w") as output:
+                    count = _write_batch_results(
+                        _read_queries(input_file), args.top_k, output
+                    )
+                fastcmd_print(
+                    f"✅ Wrote results for {count} queries to {args.output}",
+                    with_front_space=False,
+                    with_front_text=False,
+                )
+            else:
+                _write_batch_results(
+                    _read_queries(input_file), args.top_k, sys.stdout
+                )
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+
+        return True
+    except Exception as e:
+        fastcmd_print(
+            f"❌ Error running batch search: {str(e)}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return False
+
+
+def handle_serve(args: Namespace) -> bool:
+    """
+    Handle running the HTTP server exposing add/search/export/import.
+
+    Args:
+        args: Command line arguments containing the address to listen on,
+            pool sizes and an optional embedding provider override
+
+    Returns:
+        bool: True once the server has been stopped, False on error
+    """
+    try:
+        if _unavailable_when_sharded("serve"):
+            return False
+
+        if args.embedding_provider:
+            os.environ["FASTCMD_EMBEDDING_PROVIDER"] = args.embedding_provider
+
+        fastcmd_print(
+            f"🌐 Serving commands on http://{args.host}:{args.port} "
+            "(Ctrl+C to stop)",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        serve(
+            host=args.host,
+            port=args.port,
+            pool_size=args.pool_size,
+            embedding_workers=args.workers,
+            batch_window_ms=args.batch_window_ms,
+        )
+        return True
+    except Exception as e:
+        fastcmd_print(
+            f"❌ Error running server: {str(e)}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return False
+
+
+def _print_ingest_progress(added: int, done: int, total: int) -> None:
+    percent = int(done / total * 100) if total else 100
+    fastcmd_print(
+        f"⏳ Added {added} commands, {percent}% of the history read",
+        with_front_space=False,
+        with_front_text=False,
+    )
+
+
+def handle_ingest_history(args: Namespace) -> bool:
+    """
+    Handle saving the commands of bash/zsh history files.
+
+    Only lines written since the previous run are read, so running it again
+    is cheap.
+
+    Args:
+        args: Command line arguments containing optional history file paths
+            and description generator
+
+    Returns:
+        bool: True if every history file was read, False otherwise
+    """
+    try:
+        if _unavailable_when_sharded("ingest-history"):
+            return False
+
+        if args.file:
+            paths = [str(_to_container_path(path)) for path in args.file]
+        else:
+            paths = default_history_files()
+        if not paths:
+            fastcmd_print(
+                "❌ No bash or zsh history file found, pass one with --file",
+                with_front_space=False,
+                with_front_text=False,
+            )
+            return False
+
+        describe = get_description_generator(args.describer)
+        for path in paths:
+            if not os.path.isfile(path):
+                fastcmd_print(
+                    f"❌ File not found: {path}",
+                    with_front_space=False,
+                    with_front_text=False,
+                )
+                return False
+
+            counts = ingest_history(
+                path, describe=describe, progress=_print_ingest_progress
+            )
+            forget_descriptions()
+            fastcmd_print(
+                f"✅ {path}: {counts['added']} new commands saved, "
+                f"{counts['skipped']} of {counts['read']} lines skipped "
+                "as duplicates or too short.",
+                with_front_space=False,
+                with_front_text=False,
+            )
+        return True
+    except Exception as e:
+        fastcmd_print(
+            f"❌ Error ingesting history: {str(e)}. "
+            "Run 'ingest-history' again to resume.",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return False
+
+
+def _print_reindex_progress(
+    done: int, total: int, eta: Optional[float]
+) -> None:
+    percent = int(done / total * 100) if total else 100
+    eta_text = str(timedelta(seconds=int(eta))) if eta is not None else "?"
+    fastcmd_print(
+        f"⏳ Re-embedded {done}/{total} commands ({percent}%), ETA {eta_text}",
+        with_front_space=False,
+        with_front_text=False,
+    )
+
+
+def handle_reindex(args: Namespace) -> bool:
+    """
+    Handle re-embedding all commands, e.g. after switching embedding models.
+
+    The job resumes from its checkpoint when run again after an interruption,
+    and searches keep working against the current vectors until it finishes.
+
+    Args:
+        args: Command line arguments containing the optional model, batch
+            size, restart and status flags
+
+    Returns:
+        bool: True if the job finished (or the status was shown), False
+        otherwise
+    """
+    try:
+        if _unavailable_when_sharded("reindex"):
+            return False
+
+        if args.status:
+            checkpoint = get_checkpoint()
+            if checkpoint is None:
+                message = "✅ No re-index job in progress."
+            else:
+                message = (
+                    f"⏸️ Re-index to {checkpoint['model']} stopped at "
+                    f"{checkpoint['done']}/{checkpoint['total']} commands, "
+                    "run 'reindex' again to resume."
+                )
+            fastcmd_print(
+                message, with_front_space=False, with_front_text=False
+            )
+            return True
+
+        embedded = run_reindex(
+            model=args.model,
+            batch_size=args.batch_size,
+            restart=args.restart,
+            progress=_print_reindex_progress,
+        )
+        if embedded:
+            # Every vector changed, and so did the nearest neighbours
+            rebuild_related()
+
+        fastcmd_print(
+            f"✅ Re-index finished, {embedded} commands embedded in this run.",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        fastcmd_print(
+            f"Queries and new commands are embedded with "
+            f"{get_embedding_model()} from now on.",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return True
+    except Exception as e:
+        fastcmd_print(
+            f"❌ Error re-indexing commands: {str(e)}. "
+            "Run 'reindex' again to resume.",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return False
+
+
+def _format_size(size: Optional[float]) -> str:
+    if size is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return (
+                f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+            )
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def _maintenance_rows(stats: dict) -> List[Tuple[str, str]]:
+    search_ms = stats["search_ms"]
+    return [
+        ("commands", str(stats["commands"])),
+        ("vectors", str(stats["vectors"])),
+        ("orphaned vectors", str(stats["orphaned_vectors"])),
+        ("missing vectors", str(stats["missing_vectors"])),
+        ("pending embeddings", str(stats["pending"])),
+        ("parked embeddings", str(stats["parked"])),
+        ("vector slots", str(stats["vector_slots"])),
+        ("file size", _format_size(stats["file_bytes"])),
+        ("WAL size", _format_size(stats["wal_bytes"])),
+        (
+            "free pages",
+            f"{stats['free_pages']} of {stats['pages']} "
+            f"({_format_size(stats['free_pages'] * stats['page_size'])})",
+        ),
+        ("auto-vacuum", stats["auto_vacuum"]),
+        (
+            "search latency",
+            f"{search_ms:.1f} ms" if search_ms is not None else "-",
+        ),
+    ]
+
+
+def _print_storage_objects(objects: List[dict]) -> None:
+    fastcmd_print(
+        "\n🗂️ Tables and indexes:",
+        with_front_space=False,
+        with_front_text=False,
+    )
+    for entry in objects:
+        stat = f"  stat {entry['stat']}" if entry["stat"] else ""
+        fastcmd_print(
+            f"  {entry['name']:<40} {entry['type']:<6} "
+            f"{_format_size(entry['bytes']):>10}{stat}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+
+
+def _print_maintenance_step(description: str) -> None:
+    fastcmd_print(
+        f"⏳ {description}...", with_front_space=False, with_front_text=False
+    )
+
+
+def handle_maintain(args: Namespace) -> bool:
+    """
+    Handle reporting on and maintaining the health of the database.
+
+    Orphaned vectors are removed, vector chunks compacted, index statistics
+    updated and free pages released, while other sessions keep searching.
+
+    Args:
+        args: Command line arguments containing the full VACUUM and check
+            only flags
+
+    Returns:
+        bool: True if the report (and maintenance) finished, False otherwise
+    """
+    try:
+        if _unavailable_when_sharded("maintain"):
+            return False
+
+        if args.check:
+            stats = collect_stats()
+            fastcmd_print(
+                "\n📊 Database:", with_front_space=False, with_front_text=False
+            )
+            for name, value in _maintenance_rows(stats):
+                fastcmd_print(
+                    f"  {name:<20} {value}",
+                    with_front_space=False,
+                    with_front_text=False,
+                )
+            _print_storage_objects(stats["objects"])
+            return True
+
+        result = run_maintenance(
+            full_vacuum=args.full, progress=_print_maintenance_step
+        )
+
+        fastcmd_print(
+            "\n📊 Database:", with_front_space=False, with_front_text=False
+        )
+        fastcmd_print(
+            f"  {'':<20} {'before':>20} {'after':>20}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        for (name, before), (_, after) in zip(
+            _maintenance_rows(result["before"]),
+            _maintenance_rows(result["after"]),
+        ):
+            fastcmd_print(
+                f"  {name:<20} {before:>20} {after:>20}",
+                with_front_space=False,
+                with_front_text=False,
+            )
+        _print_storage_objects(result["after"]["objects"])
+
+        vectors = "compacted" if result["compacted"] else "already compact"
+        fastcmd_print(
+            f"\n✅ Maintenance finished: {result['orphans_removed']} orphans "
+            f"removed, vectors {vectors}, "
+            f"vacuum {result['vacuum'] or 'skipped'}.",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        if result["vacuum"] is None:
+            fastcmd_print(
+                "Run 'maintain --full' once to release free pages and "
+                "enable incremental vacuum.",
+                with_front_space=False,
+                with_front_text=False,
+            )
+        return True
+    except Exception as e:
+        fastcmd_print(
+            f"❌ Error maintaining the database: {str(e)}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return False
+
+
+def _print_reshard_progress(done: int, total: int) -> None:
+    percent = int(done / total * 100) if total else 100
+    fastcmd_print(
+        f"⏳ Moved {done}/{total} commands ({percent}%)",
+        with_front_space=False,
+        with_front_text=False,
+    )
+
+
+def handle_reshard(args: Namespace) -> bool:
+    """
+    Handle moving the commands into a number of shard files.
+
+    The shards are only used once FASTCMD_SHARDS matches the new count,
+    see src.shards.
+
+    Args:
+        args: Command line arguments containing the number of shards
+
+    Returns:
+        bool: True if the commands were moved, False otherwise
+    """
+    try:
+        from_shards = has_shards()
+        moved = reshard(args.shards, progress=_print_reshard_progress)
+        forget_descriptions()
+        if args.shards == 1 and moved:
+            # Related commands are only kept in the single database
+            rebuild_related()
+
+        if args.shards == 1:
+            message = (
+                f"✅ Moved {moved} commands back into one database, "
+                "unset FASTCMD_SHARDS to use it."
+            )
+        else:
+            message = (
+                f"✅ Moved {moved} commands into {args.shards} shards, set "
+                f"FASTCMD_SHARDS={args.shards} to use them."
+            )
+        if args.shards > 1 and not from_shards:
+            message += (
+                f"\nℹ️ {get_db_path()} still holds its copy of the commands, "
+                "unused while sharded. It can be removed once the shards "
+                "work, which also resets the usage ledger and query cache."
+            )
+        fastcmd_print(message, with_front_space=False, with_front_text=False)
+        return True
+    except Exception as e:
+        fastcmd_print(
+            f"❌ Error resharding commands: {str(e)}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return False
+
+
+def _print_related_progress(done: int, total: int) -> None:
+    percent = int(done / total * 100) if total else 100
+    fastcmd_print(
+        f"⏳ Linked {done}/{total} commands ({percent}%)",
+        with_front_space=False,
+        with_front_text=False,
+    )
+
+
+def handle_related(args: Namespace) -> bool:
+    """
+    Handle showing the commands related to a saved command, or rebuilding
+    the related commands of all of them.
+
+    Args:
+        args: Command line arguments containing the id or the rebuild flag
+
+    Returns:
+        bool: True if related commands were shown or rebuilt, False otherwise
+    """
+    try:
+        if _unavailable_when_sharded("related"):
+            return False
+        init_db()
+
+        if args.rebuild:
+            linked = rebuild_related(progress=_print_related_progress)
+            fastcmd_print(
+                f"✅ Related commands of {linked} commands rebuilt.",
+                with_front_space=False,
+                with_front_text=False,
+            )
+            return True
+
+        if args.id is None:
+            fastcmd_print(
+                "❌ Give the id of a command, or --rebuild.",
+                with_front_space=False,
+                with_front_text=False,
+            )
+            return False
+
+        related = fetch_related(args.id)
+        if not related:
+            fastcmd_print(
+                f"❌ No related commands for id {args.id}.",
+                with_front_space=False,
+                with_front_text=False,
+            )
+            return False
+
+        for match in related:
+            distance_percent = int((1 - match["distance"]) * 100)
+            fastcmd_print(
+                f"  [{distance_percent}%] {match['command']} "
+                f"({match['description']}, id {match['id']})",
+                with_front_space=False,
+                with_front_text=False,
+            )
+        return True
+    except Exception as e:
+        fastcmd_print(
+            f"❌ Error fetching related commands: {str(e)}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return False
+
+
+def handle_jobs(args: Namespace) -> bool:
+    """
+    Handle listing the commands started with --background in this session.
+
+    Args:
+        args: Command line arguments (unused)
+
+    Returns:
+        bool: True once the jobs have been listed
+    """
+    jobs = job_manager.list()
+    if not jobs:
+        fastcmd_print(
+            "No background jobs in this session.",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return True
+
+    fastcmd_print(
+        f"  {'id':<4} {'status':<11} {'progress':<18} {'elapsed':<9} command",
+        with_front_space=False,
+        with_front_text=False,
+    )
+    for job in jobs:
+        elapsed = str(timedelta(seconds=int(job.elapsed)))
+        fastcmd_print(
+            f"  {job.id:<4} {job.status:<11} {job.progress():<18} "
+            f"{elapsed:<9} {job.line}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+    return True
+
+
+def handle_job(args: Namespace) -> bool:
+    """
+    Handle showing the progress and output of a job, or cancelling it.
+
+    A cancelled job stops at its next checkpoint, keeping the work it
+    committed so far.
+
+    Args:
+        args: Command line arguments containing the action and job id
+
+    Returns:
+        bool: True if the job exists (and was still running to cancel)
+    """
+    job = job_manager.get(args.id)
+    if job is None:
+        fastcmd_print(
+            f"❌ No job with id {args.id}, see 'jobs'.",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return False
+
+    if args.action == "cancel":
+        if job.finished:
+            fastcmd_print(
+                f"❌ Job {job.id} has already {job.status}.",
+                with_front_space=False,
+                with_front_text=False,
+            )
+            return False
+        job.cancel()
+        fastcmd_print(
+            f"⏹️ Cancelling job {job.id}, it stops after the current step.",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return True
+
+    fastcmd_print(
+        f"Job {job.id} '{job.line}': {job.status}, progress "
+        f"{job.progress()}, {timedelta(seconds=int(job.elapsed))} elapsed",
+        with_front_space=False,
+        with_front_text=False,
+    )
+    for line in job.output:
+        fastcmd_print(
+            f"  {line}", with_front_space=False, with_front_text=False
+        )
+    return True
+
+
+def handle_usage(args: Namespace) -> bool:
+    """
+    Handle reporting the embedding tokens used per day and command.
+
+    Args:
+        args: Command line arguments containing the number of days
+
+    Returns:
+        bool: True once the report has been printed, False on error
+    """
+    try:
+        init_db()
+        rows = fetch_usage(days=args.days)
+
+        fastcmd_print(
+            f"\n📊 Embedding usage of the last {args.days} days:",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        if not rows:
+            fastcmd_print(
+                "  No embeddings requested.",
+                with_front_space=False,
+                with_front_text=False,
+            )
+        else:
+            fastcmd_print(
+                f"  {'day':<11} {'command':<15} {'model':<23} "
+                f"{'requests':>8} {'tokens':>10} {'cost':>9}",
+                with_front_space=False,
+                with_front_text=False,
+            )
+            total_tokens = 0
+            total_cost = 0.0
+            for row in rows:
+                cost = estimate_cost(row["model"], row["tokens"])
+                total_tokens += row["tokens"]
+                total_cost += cost or 0.0
+                cost_text = f"${cost:.4f}" if cost is not None else "?"
+                fastcmd_print(
+                    f"  {row['day']:<11} {row['operation']:<15} "
+                    f"{row['model']:<23} {row['requests']:>8} "
+                    f"{row['tokens']:>10} {cost_text:>9}",
+                    with_front_space=False,
+                    with_front_text=False,
+                )
+            fastcmd_print(
+                f"  Total {total_tokens} tokens, ${total_cost:.4f}",
+                with_front_space=False,
+                with_front_text=False,
+            )
+
+        if DAILY_TOKEN_BUDGET:
+            fastcmd_print(
+                f"  Today {tokens_used(today())} of {DAILY_TOKEN_BUDGET} "
+                "tokens of the daily budget used",
+                with_front_space=False,
+                with_front_text=False,
+            )
+        return True
+    except Exception as e:
+        fastcmd_print(
+            f"❌ Error reporting usage: {str(e)}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return False
+
+
+def handle_stats(args: Namespace) -> bool:
+    """
+    Handle showing the embedding API counters of the current session.
+
+    Args:
+        args: Command line arguments (unused)
+
+    Returns:
+        bool: True once the counters have been printed
+    """
+    stats = get_transport_stats()
+    if not stats:
+        fastcmd_print(
+            "No embedding requests made in this session yet.",
+            with_front_space=False,
+            with_front_text=False,
+        )
+        return True
+
+    fastcmd_print(
+        "\n📊 Embedding API:", with_front_space=False, with_front_text=False
+    )
+    for name, value in stats.items():
+        fastcmd_print(
+            f"  {name:<16} {value if value is not None else '-'}",
+            with_front_space=False,
+            with_front_text=False,
+        )
+    return True
+
+
 COMMAND_FACTORY = {
     "add": handle_add,
     "search": handle_search,
+    "update": handle_update,
+    "delete": handle_delete,
     "export": handle_export,
     "import": handle_import,
+    "sync-export": handle_sync_export,
+    "sync-import": handle_sync_import,
+    "batch-search": handle_batch_search,
+    "serve": handle_serve,
+    "reindex": handle_reindex,
+    "ingest-history": handle_ingest_history,
+    "stats": handle_stats,
+    "maintain": handle_maintain,
+    "reshard": handle_reshard,
+    "related": handle_related,
+    "jobs": handle_jobs,
+    "job": handle_job,
+    "usage": handle_usage,
 }
@@ -0,0 +1,282 @@
+import re
+import shlex
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from src import vector_database
+from src.lexical import TOKEN_PATTERN
+from src.shards import fetch_all_commands
+from src.utils import PROMPT
+
+# Descriptions offered for one press of Tab
+MAX_SUGGESTIONS = 20
+
+# The description being typed after "search ... -d", with its opening quote
+SEARCH_LINE_PATTERN = re.compile(
+    r"""^(\s*search\s+(?:\S+\s+)*?(?:-d|--description)\s+)(['"]?)(.*)$"""
+)
+
+
+def _words(text: str) -> str:
+    """
+    Lowercase words of text separated by single spaces, so punctuation
+    like "docker-compose" matches what is typed as "docker compose".
+    """
+    return " ".join(TOKEN_PATTERN.findall(text.lower()))
+
+
+class DescriptionIndex:
+    """
+    In-memory index of saved descriptions for completion at the prompt.
+
+    Descriptions starting with the typed text are found by bisecting a
+    sorted list. When they are not enough, descriptions with a word
+    starting with it are found with str.find over one buffer holding the
+    words of every description, which runs in C and only returns real
+    matches. Typed words no description contains are rejected up front
+    through the sorted list of known words, without scanning.
+
+    Args:
+        descriptions: Descriptions to index, sorted once rather than one
+            at a time like add
+    """
+
+    def __init__(self, descriptions: Iterable[str] = ()) -> None:
+        self._descriptions: List[str] = []
+        self._known: Set[str] = set()
+        # (lowered description, position), sorted for prefix lookups
+        self._sorted: List[Tuple[str, int]] = []
+        # " <words> \n" of every description, in order of position
+        self._buffer = ""
+        self._size = 0
+        # Offset of each description in the buffer
+        self._offsets = array("Q")
+        # Sorted words of all descriptions
+        self._words: List[str] = []
+
+        lines = []
+        for description in descriptions:
+            line = self._append(description)
+            if line is not None:
+                lines.append(line)
+        self._sorted.sort()
+        self._words = sorted({w for line in lines for w in line.split()})
+        self._buffer = "".join(lines)
+
+    def __len__(self) -> int:
+        return len(self._descriptions)
+
+    def _append(self, description: str) -> Optional[str]:
+        lowered = description.lower()
+        if lowered in self._known:
+            return None
+        position = len(self._descriptions)
+        line = f" {_words(lowered)} \n"
+        self._descriptions.append(description)
+        self._known.add(lowered)
+        self._sorted.append((lowered, position))
+        self._offsets.append(self._size)
+        self._size += len(line)
+        return line
+
+    def add(self, description: str) -> None:
+        line = self._append(description)
+        if line is None:
+            return
+        insort(self._sorted, self._sorted.pop())
+        for word in line.split():
+            index = bisect_left(self._words, word)
+            if index == len(self._words) or self._words[index] != word:
+                self._words.insert(index, word)
+        self._buffer += line
+
+    def _has_word(self, word: str, prefix: bool = False) -> bool:
+        index = bisect_left(self._words, word)
+        if index == len(self._words):
+            return False
+        known = self._words[index]
+        return known.startswith(word) if prefix else known == word
+
+    def _containing(self, query: str) -> Iterator[int]:
+        """
+        Positions of descriptions with a word starting with query.
+        """
+        words = TOKEN_PATTERN.findall(query)
+        if not words:
+            return
+        # The last word is still being typed unless something follows it
+        typed = words.pop() if query.endswith(words[-1]) else None
+        if not all(self._has_word(word) for word in words):
+            return
+        if typed is not None and not self._has_word(typed, prefix=True):
+            return
+
+        needle = " " + " ".join(words + ([typed] if typed else [""]))
+        offset = self._buffer.find(needle)
+        while offset >= 0:
+            position = bisect_right(self._offsets, offset) - 1
+            yield position
+            # Continue after the line, one match per description
+            offset = self._buffer.find(needle, self._buffer.find("\n", offset))
+
+    def suggest(self, text: str, limit: int = MAX_SUGGESTIONS) -> List[str]:
+        """
+        Return descriptions starting with text, then ones with a word
+        starting with it, ignoring case.
+        """
+        query = text.lower()
+        found: List[int] = []
+        start = bisect_left(self._sorted, (query, -1))
+        for lowered, position in self._sorted[start : start + limit]:
+            if not lowered.startswith(query):
+                break
+            found.append(position)
+
+        if len(found) < limit:
+            starting = set(found)
+            for position in self._containing(query):
+                if position not in starting:
+                    found.append(position)
+                    if len(found) == limit:
+                        break
+
+        return [self._descriptions[position] for position in found]
+
+
+# Index of the default database, built on first use
+_index: Optional[DescriptionIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_description_index(db_path: Optional[str] = None) -> DescriptionIndex:
+    """
+    Return the index of saved descriptions and aliases, building it once.
+    """
+    global _index
+
+    with _index_lock:
+        if _index is None:
+            _index = DescriptionIndex(
+                description
+                for command in (
+                    vector_database.fetch_all_commands(db_path)
+                    if db_path
+                    else fetch_all_commands()
+                )
+                for description in [
+                    command["description"],
+                    *command.get("aliases", []),
+                ]
+            )
+        return _index
+
+
+def remember_description(description: str) -> None:
+    """
+    Add a newly saved description to the index, if it was built.
+    """
+    with _index_lock:
+        if _index is not None:
+            _index.add(description)
+
+
+def forget_descriptions() -> None:
+    """
+    Drop the index after deletes or bulk changes, the next use rebuilds it.
+    """
+    global _index
+
+    with _index_lock:
+        _index = None
+
+
+def complete_line(
+    line: str, limit: int = MAX_SUGGESTIONS
+) -> List[Tuple[str, str]]:
+    """
+    Complete the description of a "search -d" line being typed.
+
+    Anything else typed at the prompt has no completions. The description
+    is quoted the way it was started, or with shell quoting if needed.
+
+    Returns:
+        List[Tuple[str, str]]: (completed line, description) pairs
+    """
+    match = SEARCH_LINE_PATTERN.match(line)
+    if match is None:
+        return []
+    head, quote, typed = match.groups()
+
+    completions = []
+    for description in get_description_index().suggest(typed, limit):
+        if quote and quote not in description:
+            completed = f"{head}{quote}{description}{quote}"
+        else:
+            completed = f"{head}{shlex.quote(description)}"
+        completions.append((completed, description))
+    return completions
+
+
+class _Completer:
+    """
+    Readline completer over the whole line typed at the prompt.
+    """
+
+    def __init__(self, readline: Any) -> None:
+        self.readline = readline
+        self.completions: Dict[str, str] = {}
+
+    def complete(self, text: str, state: int) -> Optional[str]:
+        if state == 0:
+            try:
+                self.completions = dict(complete_line(text))
+            except Exception:
+                # Completion is best effort, it must not break the prompt
+                self.completions = {}
+        lines = list(self.completions)
+        return lines[state] if state < len(lines) else None
+
+    def display(
+        self, substitution: str, matches: Sequence[str], longest: int
+    ) -> None:
+        # List the descriptions rather than the whole completed lines
+        print()
+        for line in matches:
+            print(f"  {self.completions.get(line, line)}")
+        print(PROMPT + self.readline.get_line_buffer(), end="", flush=True)
+
+
+def install_completer() -> bool:
+    """
+    Complete "search -d" descriptions with Tab at the interactive prompt.
+
+    Returns:
+        bool: False when Python was built without readline, e.g. on Windows
+    """
+    try:
+        import readline
+    except ImportError:
+        return False
+
+    completer = _Completer(readline)
+    # The whole line is one word, descriptions contain spaces
+    readline.set_completer_delims("")
+    readline.set_completer(completer.complete)
+    readline.set_completion_display_matches_hook(completer.display)
+    if "libedit" in (readline.__doc__ or ""):
+        readline.parse_and_bind("bind ^I rl_complete")
+    else:
+        readline.parse_and_bind("tab: complete")
+    return True
@@ -1,36 +1,412 @@
+import base64
+import hashlib
+import json
+import math
 import os
+import re
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
 
 from openai import OpenAI
 
+from src.transport import EmbeddingTransport
+
+# Default model, FASTCMD_EMBEDDING_MODEL overrides it
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_DIMENSIONS = 1536
+
+# Number of inputs sent per embeddings request when embedding in bulk
+EMBEDDING_BATCH_SIZE = 256
+
+EMBEDDING_PROVIDERS = ("openai", "stub", "recorded")
+
+
+class EmptyDescriptionError(ValueError):
+    """
+    Raised when asked to embed an empty text.
+    """
+
+
+# JSON file the "recorded" provider answers from, see record_embeddings
+EMBEDDING_RECORDING = os.getenv("FASTCMD_EMBEDDING_RECORDING", "")
+
+
+def get_embedding_provider() -> str:
+    """
+    Return the embedding provider selected by FASTCMD_EMBEDDING_PROVIDER.
+
+    "openai" calls the OpenAI API, "stub" computes deterministic embeddings
+    locally and is meant for load tests and offline development. "recorded"
+    replays embeddings saved from the API, to evaluate search offline.
+    """
+    provider = os.getenv("FASTCMD_EMBEDDING_PROVIDER", "openai")
+    if provider not in EMBEDDING_PROVIDERS:
+        raise ValueError(
+            f"Unknown embedding provider '{provider}', "
+            f"expected one of {', '.join(EMBEDDING_PROVIDERS)}"
+        )
+    return provider
+
+
+# Model the stored vectors were calculated with, see set_index_model
+_index_model: Optional[str] = None
+
+
+def get_configured_model() -> str:
+    """
+    Return the model of FASTCMD_EMBEDDING_MODEL, which new re-index jobs
+    and databases without an index model use.
+    """
+    return os.getenv("FASTCMD_EMBEDDING_MODEL", EMBEDDING_MODEL)
+
+
+def set_index_model(model: Optional[str]) -> None:
+    """
+    Embed with the model the stored vectors were calculated with, None
+    falls back to the configured model.
+    """
+    global _index_model
+
+    _index_model = model
+
+
+def get_embedding_model() -> str:
+    """
+    Return the model queries and new commands are embedded with.
+
+    Once a re-index recorded the model of the vectors, that model is used
+    whatever FASTCMD_EMBEDDING_MODEL says, so queries stay comparable with
+    the stored vectors.
+    """
+    return _index_model or get_configured_model()
+
+
+def calculate_stub_embedding(description: str) -> Sequence[float]:
+    """
+    Calculate a deterministic embedding without any network call.
+
+    Every word is hashed into one of the vector dimensions, so descriptions
+    sharing words end up close to each other. The vector is L2-normalized.
+
+    Args:
+        description (str): Text to generate embeddings for
+
+    Returns:
+        Sequence[float]: Embedding vector as a float32 array
+    """
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for token in re.findall(r"\w+", description.lower()):
+        digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % EMBEDDING_DIMENSIONS
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+
+    norm = math.sqrt(sum(value * value for value in vector))
+    if not norm:
+        # Text without words still needs a direction, zero vectors cannot
+        # be normalized and would match nothing
+        vector[0], norm = 1.0, 1.0
+    return array("f", [value / norm for value in vector])
+
+
+def decode_embedding(data: Union[str, Sequence[float]]) -> Sequence[float]:
+    """
+    Turn an embedding of an API response into a float32 array.
+
+    Base64 payloads are little-endian float32 and are decoded straight into
+    the array buffer, without creating a Python float per dimension. Float
+    lists, returned by APIs ignoring encoding_format, are converted as well.
+    """
+    if not isinstance(data, str):
+        return array("f", data)
+
+    vector = array("f")
+    vector.frombytes(base64.b64decode(data))
+    if sys.byteorder == "big":
+        vector.byteswap()
+    return vector
+
+
+# Recordings by path, loaded once per process
+_recordings: Dict[str, Dict[str, str]] = {}
+_recordings_lock = threading.Lock()
+
+
+def calculate_recorded_embedding(description: str) -> Sequence[float]:
+    """
+    Look up the embedding of a text in FASTCMD_EMBEDDING_RECORDING.
+
+    Raises:
+        ValueError: If no recording is set or the text was not recorded
+    """
+    path = EMBEDDING_RECORDING
+    if not path:
+        raise ValueError(
+            "FASTCMD_EMBEDDING_RECORDING must name a recording for the "
+            "recorded embedding provider"
+        )
+    with _recordings_lock:
+        if path not in _recordings:
+            with open(path) as f:
+                _recordings[path] = json.load(f)["embeddings"]
+        recording = _recordings[path]
+    if description not in recording:
+        raise ValueError(f"No recorded embedding for '{description}'")
+    return decode_embedding(recording[description])
+
+
+def _simulate_stub_latency() -> None:
+    # Lets load tests model the round trip of a real embeddings request,
+    # also applies to recorded embeddings
+    latency_ms = float(os.getenv("FASTCMD_STUB_EMBEDDING_LATENCY_MS", "0"))
+    if latency_ms > 0:
+        time.sleep(latency_ms / 1000)
+
+
+class UsageMeter:
+    """
+    Hook around every embeddings request, to enforce token budgets before
+    it is sent and to account for its tokens after. Does nothing until one
+    is installed with set_usage_meter, see src/usage.py.
+    """
+
+    def check(self, operation: str, model: str, texts: Sequence[str]) -> None:
+        pass
+
+    def record(
+        self,
+        operation: str,
+        model: str,
+        texts: Sequence[str],
+        tokens: Optional[int],
+    ) -> None:
+        pass
+
+    def flush(self) -> None:
+        """
+        Store the usage recorded so far, if it is buffered.
+        """
+
+
+_meter = UsageMeter()
+
+# Command the embeddings are requested for, recorded with their usage
+_operation: ContextVar[str] = ContextVar(
+    "embedding_operation", default="other"
+)
+
+
+def set_usage_meter(meter: UsageMeter) -> None:
+    global _meter
+
+    _meter = meter
+
+
+def get_usage_meter() -> UsageMeter:
+    return _meter
+
+
+def set_embedding_operation(operation: str) -> None:
+    """
+    Attribute the embeddings of the current thread to an operation, for
+    threads doing one thing only like the drain worker.
+    """
+    _operation.set(operation)
+
+
+@contextmanager
+def embedding_operation(operation: str) -> Iterator[None]:
+    """
+    Attribute the embeddings requested in the block to an operation.
+    """
+    token = _operation.set(operation)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def _reported_tokens(response: Any) -> Optional[int]:
+    # APIs compatible with OpenAI may leave the usage out
+    tokens = getattr(getattr(response, "usage", None), "total_tokens", None)
+    return tokens if isinstance(tokens, int) else None
+
+
+# Shared by all calls so HTTP connections are reused between requests
+_transport: Optional[EmbeddingTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> EmbeddingTransport:
+    """
+    Return the process-wide embedding transport, creating it on first use.
+
+    A new transport is created when the API key changes.
+    """
+    global _transport
 
-def get_openai_client() -> OpenAI:
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         raise ValueError(
             "OpenAI API key is not set. Use the 'key --add' command to set it."
         )
-    return OpenAI(api_key=api_key)
 
+    with _transport_lock:
+        if _transport is None or _transport.api_key != api_key:
+            if _transport is not None:
+                _transport.close()
+            _transport = EmbeddingTransport(api_key=api_key)
+        return _transport
 
-def calculate_embedding(description: str) -> list:
+
+def get_openai_client() -> OpenAI:
+    return get_transport().client
+
+
+def get_transport_stats() -> Dict[str, Any]:
+    """
+    Return the request, error and latency counters of the transport.
+    """
+    transport = _transport
+    if transport is None:
+        return {}
+    return {"circuit": transport.breaker.state, **transport.stats.snapshot()}
+
+
+def calculate_embedding(
+    description: str, timeout: Optional[float] = None
+) -> Sequence[float]:
     """
     Calculate embedding vector for a given description using OpenAI's model.
 
     Args:
         description (str): Text to generate embeddings for
+        timeout (Optional[float]): Deadline in seconds, including retries
 
     Returns:
-        list: Embedding vector as a list of floats
+        Sequence[float]: Embedding vector as a float32 array
     """
     if not description:
-        raise ValueError("Description cannot be empty")
+        raise EmptyDescriptionError("Description cannot be empty")
 
-    client = get_openai_client()
+    operation = _operation.get()
+    if get_embedding_provider() == "stub":
+        _meter.check(operation, "stub", [description])
+        _simulate_stub_latency()
+        _meter.record(operation, "stub", [description], None)
+        return calculate_stub_embedding(description)
+    if get_embedding_provider() == "recorded":
+        _simulate_stub_latency()
+        return calculate_recorded_embedding(description)
 
-    response = client.embeddings.create(
-        model="text-embedding-ada-002", input=description
+    model = get_embedding_model()
+    _meter.check(operation, model, [description])
+    response = get_transport().create_embeddings(
+        model=model,
+        input=description,
+        timeout=timeout,
+        encoding_format="base64",
     )
+    _meter.record(operation, model, [description], _reported_tokens(response))
 
-    embedding = response.data[0].embedding
+    embedding = decode_embedding(response.data[0].embedding)
 
     return embedding
+
+
+def calculate_embeddings(
+    descriptions: List[str], model: Optional[str] = None
+) -> List[Sequence[float]]:
+    """
+    Calculate embedding vectors for many descriptions in batched requests.
+
+    Args:
+        descriptions (List[str]): Texts to generate embeddings for
+        model (Optional[str]): Model to use instead of the configured one
+
+    Returns:
+        List[Sequence[float]]: Float32 embedding vectors in the same order
+        as the input
+    """
+    if any(not description for description in descriptions):
+        raise EmptyDescriptionError("Description cannot be empty")
+
+    if not descriptions:
+        return []
+
+    operation = _operation.get()
+    if get_embedding_provider() == "stub":
+        for start in range(0, len(descriptions), EMBEDDING_BATCH_SIZE):
+            batch = descriptions[start : start + EMBEDDING_BATCH_SIZE]
+            _meter.check(operation, "stub", batch)
+            _simulate_stub_latency()
+            _meter.record(operation, "stub", batch, None)
+        return [calculate_stub_embedding(text) for text in descriptions]
+    if get_embedding_provider() == "recorded":
+        _simulate_stub_latency()
+        return [calculate_recorded_embedding(text) for text in descriptions]
+
+    transport = get_transport()
+    model = model or get_embedding_model()
+
+    embeddings: List[Sequence[float]] = []
+    for start in range(0, len(descriptions), EMBEDDING_BATCH_SIZE):
+        batch = descriptions[start : start + EMBEDDING_BATCH_SIZE]
+        # Checked per request, a bulk job stops at the batch that would
+        # exceed a budget
+        _meter.check(operation, model, batch)
+        response = transport.create_embeddings(
+            model=model, input=batch, encoding_format="base64"
+        )
+        _meter.record(operation, model, batch, _reported_tokens(response))
+        # The API does not guarantee ordering, every item carries its index
+        ordered = sorted(response.data, key=lambda item: item.index)
+        embeddings.extend(decode_embedding(item.embedding) for item in ordered)
+
+    return embeddings
+
+
+def record_embeddings(
+    texts: Iterable[str], path: str, model: Optional[str] = None
+) -> int:
+    """
+    Embed texts with the configured provider and save them for the
+    "recorded" provider.
+
+    Args:
+        texts: Texts to embed, duplicates are embedded once
+        path: JSON file to write
+        model: Model to use instead of the configured one
+
+    Returns:
+        int: Number of embeddings saved
+    """
+    unique = list(dict.fromkeys(texts))
+    embeddings = calculate_embeddings(unique, model=model)
+    encoded = {}
+    for text, embedding in zip(unique, embeddings):
+        # Stored like the API sends them, little-endian float32 in base64
+        vector = array("f", embedding)
+        if sys.byteorder == "big":
+            vector.byteswap()
+        encoded[text] = base64.b64encode(vector.tobytes()).decode()
+    recording = {
+        "model": model or get_embedding_model(),
+        "embeddings": encoded,
+    }
+    with open(path, "w") as f:
+        json.dump(recording, f)
+    return len(unique)
@@ -0,0 +1,176 @@
+import json
+import statistics
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from src.commands import search_commands
+from src.embeddings import calculate_embedding, calculate_embeddings
+from src.shards import add_alias, add_entry, fetch_similar
+from src.vector_database import init_db
+
+# "search" runs queries like the search command, with the query cache,
+# the deadline and the local fallback. "vector" embeds them and only
+# queries the vectors
+EVALUATION_MODES = ("search", "vector")
+
+
+def load_dataset(path: str) -> dict:
+    """
+    Load a labeled dataset for evaluate.
+
+    The file holds "commands", in the format of export, and "queries", each
+    a query text and the command or commands that answer it:
+
+        {"query": "what is using my disk", "expected": ["du -sh *"]}
+
+    Raises:
+        ValueError: If the dataset is malformed or a query expects a
+            command missing from the commands
+    """
+    with open(path) as f:
+        dataset = json.load(f)
+    commands = dataset.get("commands")
+    queries = dataset.get("queries")
+    if not isinstance(commands, list) or not isinstance(queries, list):
+        raise ValueError("The dataset needs 'commands' and 'queries' lists")
+
+    known = {cmd.get("command") for cmd in commands}
+    for query in queries:
+        if not query.get("query") or not query.get("expected"):
+            raise ValueError(f"Query without 'query' or 'expected': {query}")
+        if isinstance(query["expected"], str):
+            query["expected"] = [query["expected"]]
+        missing = [cmd for cmd in query["expected"] if cmd not in known]
+        if missing:
+            raise ValueError(
+                f"'{query['query']}' expects unknown commands: "
+                f"{', '.join(missing)}"
+            )
+    return dataset
+
+
+def dataset_texts(dataset: dict) -> List[str]:
+    """
+    Return every text evaluate embeds, to record their embeddings.
+    """
+    texts = []
+    for cmd in dataset["commands"]:
+        texts.append(cmd["description"])
+        texts.extend(cmd.get("aliases", []))
+    texts.extend(query["query"] for query in dataset["queries"])
+    return texts
+
+
+def load_commands(commands: List[dict]) -> int:
+    """
+    Save the commands of a dataset, with their aliases, in the database.
+
+    Returns:
+        int: Number of commands saved
+    """
+    init_db()
+    embeddings = calculate_embeddings([cmd["description"] for cmd in commands])
+    for cmd, embedding in zip(commands, embeddings):
+        entry_id = add_entry(embedding, cmd["command"], cmd["description"])
+        aliases = cmd.get("aliases", [])
+        for alias, alias_embedding in zip(
+            aliases, calculate_embeddings(aliases)
+        ):
+            add_alias(entry_id, alias_embedding, alias)
+    return len(commands)
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(int(len(ordered) * fraction + 0.5) - 1, 0)]
+
+
+def first_hit(matches: Iterable[dict], expected: List[str]) -> Optional[int]:
+    """
+    Return the rank, from 1, of the first expected command in the matches.
+    """
+    for rank, match in enumerate(matches, start=1):
+        if match["command"] in expected:
+            return rank
+    return None
+
+
+def evaluate(
+    queries: List[dict], top_k: int = 5, mode: str = "search"
+) -> dict:
+    """
+    Run labeled queries against the saved commands and score the matches.
+
+    Every query is timed on its own, from its text to its matches, after one
+    untimed query loading the database and the vector extension.
+
+    Args:
+        queries: Queries with their expected commands, see load_dataset
+        top_k: Matches fetched per query
+        mode: One of EVALUATION_MODES
+
+    Returns:
+        dict: "recall" at 1 and top_k, "mrr", "p50_ms" and "p95_ms" of the
+        query latencies, the share of queries answered by the local
+        fallback as "degraded" and the queries without an expected command
+        among their matches as "misses"
+    """
+    if mode not in EVALUATION_MODES:
+        raise ValueError(
+            f"Unknown mode '{mode}', "
+            f"expected one of {', '.join(EVALUATION_MODES)}"
+        )
+    if not queries:
+        raise ValueError("No queries to evaluate")
+
+    def run(text: str) -> tuple:
+        if mode == "vector":
+            return fetch_similar(calculate_embedding(text), top_k=top_k), False
+        return search_commands(text, top_k=top_k)
+
+    # Not measured, opens the database like the first search of a session
+    fetch_similar(calculate_embedding(queries[0]["query"]), top_k=1)
+
+    ranks: List[Optional[int]] = []
+    latencies: List[float] = []
+    degraded = 0
+    for query in queries:
+        started = time.perf_counter()
+        matches, fallback = run(query["query"])
+        latencies.append((time.perf_counter() - started) * 1000)
+        ranks.append(first_hit(matches, query["expected"]))
+        degraded += fallback
+
+    return {
+        "queries": len(queries),
+        "recall": {
+            k: sum(1 for rank in ranks if rank and rank <= k) / len(ranks)
+            for k in sorted({1, top_k})
+        },
+        "mrr": statistics.mean(1 / rank if rank else 0 for rank in ranks),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": percentile(latencies, 0.95),
+        "degraded": degraded / len(queries),
+        "misses": [
+            query["query"] for query, rank in zip(queries, ranks) if not rank
+        ],
+    }
+
+
+def format_results(results: Dict[str, dict], top_k: int) -> List[str]:
+    """
+    Lay out the results of evaluate per configuration as a table.
+    """
+    ks = sorted({1, top_k})
+    header = f"{'configuration':<24}" + "".join(
+        f"{f'recall@{k}':>10}" for k in ks
+    )
+    lines = [header + f"{'MRR':>8}{'p50 ms':>9}{'p95 ms':>9}{'fallback':>10}"]
+    for name, result in results.items():
+        lines.append(
+            f"{name:<24}"
+            + "".join(f"{result['recall'][k]:>10.3f}" for k in ks)
+            + f"{result['mrr']:>8.3f}{result['p50_ms']:>9.2f}"
+            + f"{result['p95_ms']:>9.2f}{result['degraded']:>10.0%}"
+        )
+    return lines
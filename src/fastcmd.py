@@ -1,28 +1,98 @@
-from commands import COMMAND_FACTORY
-from utils import (
+import shlex
+import sys
+
+from src.commands import COMMAND_FACTORY
+from src.completion import install_completer
+from src.embeddings import embedding_operation
+from src.jobs import job_manager
+from src.transport import EMBEDDING_TIMEOUT
+from src.usage import install_usage_meter
+from src.utils import (
+    fastcmd_print,
     get_user_input,
     parse_command,
     print_instructions,
     set_openai_api_key_for_session,
 )
+from src.vector_database import init_db
+from src.warmup import WARMUP_ENABLED, start_warmup
+from src.write_queue import drain_worker
+
+
+def run_command(user_input: str, interactive: bool = True) -> bool:
+    try:
+        args = parse_command(user_input)
+    except SystemExit:
+        return False
+
+    if args.command is None:
+        return False
+
+    func_command_runner = COMMAND_FACTORY[args.command]
+    # Embedding tokens are accounted to the command, see src/usage.py
+    with embedding_operation(args.command):
+        if interactive and getattr(args, "background", False):
+            job = job_manager.start(
+                user_input, lambda: func_command_runner(args=args)
+            )
+            fastcmd_print(
+                f"🚀 Started job {job.id}, see 'job status {job.id}'.",
+                with_front_space=False,
+                with_front_text=False,
+            )
+            return True
+        return func_command_runner(args=args)
+
+
+def announce_finished_jobs() -> None:
+    """
+    Report jobs finished since the last prompt, like shells report
+    background jobs, rather than printing over the line being typed.
+    """
+    for job in job_manager.finished_unannounced():
+        fastcmd_print(
+            f"[{job.id}] {job.status}: {job.line}"
+            + (f" - {job.summary()}" if job.summary() else ""),
+            with_front_space=False,
+            with_front_text=False,
+        )
 
 
 def main() -> None:
+    # Arguments on the command line run a single command and exit, which
+    # lets scripts call fastcmd without going through the interactive prompt
+    install_usage_meter()
+    if len(sys.argv) > 1:
+        set_openai_api_key_for_session()
+        # Without a prompt to return to, --background runs in the foreground
+        succeeded = run_command(shlex.join(sys.argv[1:]), interactive=False)
+        # Give embeddings queued by this command a chance to be stored,
+        # anything left is picked up by the next session
+        drain_worker.wait(timeout=EMBEDDING_TIMEOUT)
+        sys.exit(0 if succeeded else 1)
+
     print_instructions()
     set_openai_api_key_for_session()
 
+    # Embed commands added while offline in earlier sessions
+    init_db()
+    drain_worker.schedule()
+
+    # Connect to the API and read the database while the user types
+    if WARMUP_ENABLED:
+        start_warmup()
+
+    # Tab completes search descriptions from memory, without the API
+    install_completer()
+
     while True:
+        announce_finished_jobs()
         user_input = get_user_input()
         if user_input is None:
             break
 
-        try:
-            args = parse_command(user_input)
-        except SystemExit:
-            continue
-
-        func_command_runner = COMMAND_FACTORY[args.command]
-        func_command_runner(args=args)
+        run_command(user_input)
 
 
-main()
+if __name__ == "__main__":
+    main()
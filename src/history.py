@@ -0,0 +1,312 @@
+import importlib
+import os
+import re
+import sqlite3
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from src.embeddings import EMBEDDING_BATCH_SIZE, calculate_embeddings
+from src.related import link_commands
+from src.vector_database import connect, get_meta, init_db, insert_entries
+
+# Turns a command from the history into the description that is embedded
+DescriptionGenerator = Callable[[str], str]
+
+# Called with (commands added so far, bytes read, bytes in the file)
+ProgressCallback = Callable[[int, int, int], None]
+
+# Byte offset read so far of every history file, stored in fastcmd_meta
+OFFSET_KEY_PREFIX = "history.offset."
+
+# Name of a DESCRIPTION_GENERATORS entry, or "module:function"
+HISTORY_DESCRIBER = os.getenv("FASTCMD_HISTORY_DESCRIBER", "summary")
+
+# Longer lines are pasted scripts or data rather than commands to reuse
+MAX_COMMAND_LENGTH = 500
+
+# Commands about fastcmd or the history itself are not worth remembering
+IGNORED_PROGRAMS = {"fastcmd", "history"}
+
+# zsh EXTENDED_HISTORY prefixes commands with ": <start>:<elapsed>;"
+ZSH_EXTENDED_PREFIX = re.compile(rb"^: \d+:\d+;")
+# bash writes "#<epoch>" lines before commands when HISTTIMEFORMAT is set
+BASH_TIMESTAMP = re.compile(rb"^#\d+$")
+
+PROGRAM_SUMMARIES = {
+    "apt": "Install or manage system packages",
+    "awk": "Process text by columns",
+    "brew": "Install or manage Homebrew packages",
+    "chmod": "Change file permissions",
+    "chown": "Change file owner",
+    "cp": "Copy files",
+    "curl": "Send an HTTP request or download a URL",
+    "df": "Show disk space usage",
+    "docker": "Manage Docker containers and images",
+    "du": "Show the size of files and directories",
+    "find": "Find files",
+    "git": "Git version control",
+    "grep": "Search text for a pattern",
+    "kill": "Stop a process",
+    "kubectl": "Manage a Kubernetes cluster",
+    "ln": "Create a link to a file",
+    "ls": "List files",
+    "make": "Build a project with make",
+    "mkdir": "Create a directory",
+    "mv": "Move or rename files",
+    "npm": "Manage Node.js packages",
+    "pip": "Manage Python packages",
+    "ps": "List running processes",
+    "python": "Run Python",
+    "python3": "Run Python",
+    "rm": "Remove files",
+    "rsync": "Synchronize files",
+    "scp": "Copy files over SSH",
+    "sed": "Edit text with a stream editor",
+    "ssh": "Open a remote shell over SSH",
+    "systemctl": "Manage system services",
+    "tail": "Show the end of a file",
+    "tar": "Create or extract an archive",
+    "wget": "Download a URL",
+}
+
+
+def _program(command: str) -> str:
+    # Skip sudo and VAR=value assignments in front of the program
+    for word in command.split():
+        if word != "sudo" and "=" not in word:
+            return os.path.basename(word)
+    return ""
+
+
+def describe_with_summary(command: str) -> str:
+    """
+    Prefix a command with a summary of what its program does, if known.
+    """
+    summary = PROGRAM_SUMMARIES.get(_program(command))
+    return f"{summary}: {command}" if summary else command
+
+
+def describe_verbatim(command: str) -> str:
+    """
+    Use the command itself as its description.
+    """
+    return command
+
+
+DESCRIPTION_GENERATORS: Dict[str, DescriptionGenerator] = {
+    "summary": describe_with_summary,
+    "command": describe_verbatim,
+}
+
+
+def get_description_generator(
+    name: Optional[str] = None,
+) -> DescriptionGenerator:
+    """
+    Return a description generator by name.
+
+    Args:
+        name: Name of a DESCRIPTION_GENERATORS entry, or "module:function"
+            of any callable taking a command and returning its description.
+            Defaults to FASTCMD_HISTORY_DESCRIBER.
+
+    Returns:
+        DescriptionGenerator: The generator
+
+    Raises:
+        ValueError: When the name is neither a known generator nor a
+            "module:function" reference
+    """
+    name = name or HISTORY_DESCRIBER
+    if name in DESCRIPTION_GENERATORS:
+        return DESCRIPTION_GENERATORS[name]
+
+    module_name, separator, function_name = name.partition(":")
+    if not separator:
+        raise ValueError(
+            f"Unknown description generator '{name}', expected one of "
+            f"{', '.join(DESCRIPTION_GENERATORS)} or module:function"
+        )
+    generator: DescriptionGenerator = getattr(
+        importlib.import_module(module_name), function_name
+    )
+    return generator
+
+
+def default_history_files() -> List[str]:
+    """
+    Return the bash and zsh history files of the user that exist.
+    """
+    home = os.path.expanduser("~")
+    candidates = [
+        os.getenv("HISTFILE"),
+        os.path.join(home, ".bash_history"),
+        os.path.join(home, ".zsh_history"),
+    ]
+    files: List[str] = []
+    for path in candidates:
+        if path and os.path.isfile(path) and path not in files:
+            files.append(path)
+    return files
+
+
+def read_history(file: BinaryIO, offset: int) -> Iterator[Tuple[str, int]]:
+    """
+    Stream the commands of a history file written after a byte offset.
+
+    Lines are read one at a time, so memory does not grow with the file.
+    zsh timestamps and bash timestamp lines are dropped, and lines ending
+    with a backslash are joined with the next one. A last line without a
+    newline may still be being written by the shell and is left for the
+    next run.
+
+    Args:
+        file: History file opened in binary mode
+        offset: Byte offset to start reading at
+
+    Yields:
+        Tuple[str, int]: Each command and the offset right after it
+    """
+    file.seek(offset)
+    parts: List[bytes] = []
+    for line in file:
+        if not line.endswith(b"\n"):
+            return
+        offset += len(line)
+        line = line.rstrip(b"\r\n")
+        if not parts:
+            if BASH_TIMESTAMP.match(line):
+                continue
+            line = ZSH_EXTENDED_PREFIX.sub(b"", line, count=1)
+        if line.endswith(b"\\"):
+            parts.append(line[:-1])
+            continue
+        parts.append(line)
+        command = b"\n".join(parts).decode("utf-8", errors="replace")
+        parts = []
+        yield command, offset
+
+
+def normalize_command(command: str) -> Optional[str]:
+    """
+    Collapse the whitespace of a command, or return None to skip it.
+
+    Empty, overlong and single-word commands are skipped, as well as calls
+    of IGNORED_PROGRAMS.
+    """
+    command = " ".join(command.split())
+    if len(command) > MAX_COMMAND_LENGTH or " " not in command:
+        return None
+    if _program(command) in IGNORED_PROGRAMS:
+        return None
+    return command
+
+
+def _is_saved(conn: sqlite3.Connection, command: str) -> bool:
+    return (
+        conn.execute(
+            "SELECT 1 FROM commands WHERE command = ? LIMIT 1", (command,)
+        ).fetchone()
+        is not None
+    )
+
+
+def _store_batch(
+    conn: sqlite3.Connection,
+    commands: List[str],
+    describe: DescriptionGenerator,
+    offset_key: str,
+    offset: int,
+) -> List[int]:
+    """
+    Embed and insert new commands, and checkpoint the offset read so far.
+
+    Returns:
+        List[int]: Ids of the inserted commands
+    """
+    descriptions = [describe(command) for command in commands]
+    embeddings = calculate_embeddings(descriptions) if commands else []
+
+    # The offset is committed with the commands, so a failed batch is read
+    # again by the next run
+    return insert_entries(
+        conn,
+        list(zip(embeddings, commands, descriptions)),
+        meta_updates={offset_key: str(offset)},
+    )
+
+
+def ingest_history(
+    path: str,
+    describe: Optional[DescriptionGenerator] = None,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    db_path: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict[str, int]:
+    """
+    Save the commands of a shell history file that are not saved yet.
+
+    Only the lines written since the previous run are read. Commands are
+    normalized, deduplicated and, in batches of batch_size, described,
+    embedded in one request and inserted in one transaction together with
+    the offset read so far, then linked to their related commands. Memory
+    stays bounded by the batch size.
+
+    Args:
+        path: Path to a bash or zsh history file
+        describe: Description generator, see get_description_generator
+        batch_size: Commands embedded per request and per commit
+        db_path: Optional path to the database file
+        progress: Called after every committed batch
+
+    Returns:
+        Dict[str, int]: Number of commands "read" from the file, "added" to
+        the database and "skipped" as duplicates or not worth saving
+    """
+    describe = describe or get_description_generator()
+    offset_key = OFFSET_KEY_PREFIX + os.path.abspath(path)
+    size = os.path.getsize(path)
+
+    init_db(db_path)
+    conn = connect(db_path)
+    try:
+        offset = int(get_meta(conn, offset_key) or 0)
+        if offset > size:
+            # The file was truncated or replaced, read it again
+            offset = 0
+
+        counts = {"read": 0, "added": 0, "skipped": 0}
+        # Insertion ordered set of the commands of the current batch
+        batch: Dict[str, None] = {}
+        with open(path, "rb") as file:
+            for command, end in read_history(file, offset):
+                counts["read"] += 1
+                offset = end
+                normalized = normalize_command(command)
+                if (
+                    normalized is None
+                    or normalized in batch
+                    or _is_saved(conn, normalized)
+                ):
+                    continue
+                batch[normalized] = None
+                if len(batch) >= batch_size:
+                    link_commands(
+                        _store_batch(
+                            conn, list(batch), describe, offset_key, offset
+                        ),
+                        db_path=db_path,
+                    )
+                    counts["added"] += len(batch)
+                    batch.clear()
+                    if progress:
+                        progress(counts["added"], offset, size)
+
+        link_commands(
+            _store_batch(conn, list(batch), describe, offset_key, offset),
+            db_path=db_path,
+        )
+        counts["added"] += len(batch)
+        counts["skipped"] = counts["read"] - counts["added"]
+        return counts
+    finally:
+        conn.close()
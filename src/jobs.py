@@ -0,0 +1,222 @@
+import contextvars
+import sys
+import threading
+import time
+from collections import deque
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    cast,
+)
+
+# Lines of output kept per job, shown by "job status"
+JOB_OUTPUT_LINES = 20
+
+
+class JobCancelled(BaseException):
+    """
+    Raised in a job at its next checkpoint after it was cancelled.
+
+    Not an Exception, so the "except Exception" of the command handlers does
+    not report it as an error and the job stops where it was.
+    """
+
+
+class Job:
+    """
+    A command running in a background thread of the interactive prompt.
+
+    Args:
+        job_id: Number of the job, unique in the session
+        line: The command line that started it
+    """
+
+    def __init__(self, job_id: int, line: str) -> None:
+        self.id = job_id
+        self.line = line
+        # running, cancelling, done, failed or cancelled
+        self.status = "running"
+        self.done = 0
+        self.total: Optional[int] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.output: Deque[str] = deque(maxlen=JOB_OUTPUT_LINES)
+        self._partial = ""
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    def progress(self) -> str:
+        if self.total:
+            percent = int(self.done / self.total * 100)
+            return f"{self.done}/{self.total} ({percent}%)"
+        return str(self.done) if self.done else "-"
+
+    def summary(self) -> str:
+        """
+        Return the last line the job printed, usually its result.
+        """
+        lines = [line for line in self.output if line.strip()]
+        return lines[-1].strip() if lines else ""
+
+    def write(self, text: str) -> None:
+        self._partial += text
+        *lines, self._partial = self._partial.split("\n")
+        self.output.extend(lines)
+
+    def cancel(self) -> None:
+        if not self.finished:
+            self.status = "cancelling"
+            self._cancel.set()
+
+    def checkpoint(self, done: int, total: Optional[int] = None) -> None:
+        self.done = done
+        if total is not None:
+            self.total = total
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def _run(self, func: Callable[[], bool]) -> None:
+        _current.job = self
+        try:
+            status = "done" if func() else "failed"
+        except JobCancelled:
+            self.write(f"⏹️ Cancelled at {self.progress()}\n")
+            status = "cancelled"
+        except Exception as e:
+            self.write(f"❌ {str(e)}\n")
+            status = "failed"
+        finally:
+            _current.job = None
+        if self._partial:
+            self.write("\n")
+        self.status = status
+        self.finished_at = time.time()
+        self._finished.set()
+
+
+# Job running on the current thread, if any
+_current = threading.local()
+
+
+def current_job() -> Optional[Job]:
+    return getattr(_current, "job", None)
+
+
+def checkpoint(done: int, total: Optional[int] = None) -> None:
+    """
+    Report the progress of the current job and stop it if it was cancelled.
+
+    Called between units of work that are committed on their own, so a
+    cancelled job keeps everything done before. Does nothing outside jobs.
+
+    Raises:
+        JobCancelled: If the current job was cancelled
+    """
+    job = current_job()
+    if job is not None:
+        job.checkpoint(done, total)
+
+
+class _JobOutput:
+    """
+    Replacement of sys.stdout sending what jobs print to their job, so it
+    does not interleave with the prompt.
+    """
+
+    def __init__(self, stream: TextIO) -> None:
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        job = current_job()
+        if job is None:
+            return self.stream.write(text)
+        job.write(text)
+        return len(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stream, name)
+
+
+class JobManager:
+    """
+    Runs commands in background threads and keeps track of them.
+
+    Threads rather than processes, so jobs share the embedding client, the
+    caches and the completion index of the session. Jobs write through
+    their own short transactions while searches keep reading in WAL mode.
+    """
+
+    def __init__(self) -> None:
+        self._jobs: Dict[int, Job] = {}
+        self._announced: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def start(self, line: str, func: Callable[[], bool]) -> Job:
+        """
+        Run func in the background, its output goes to the job.
+
+        Args:
+            line: The command line, shown by "jobs"
+            func: The command, returning True when it succeeded
+        """
+        if not isinstance(sys.stdout, _JobOutput):
+            sys.stdout = cast(TextIO, _JobOutput(sys.stdout))
+        with self._lock:
+            job = Job(len(self._jobs) + 1, line)
+            self._jobs[job.id] = job
+        # The job keeps the context of the command, e.g. the operation its
+        # embeddings are recorded under
+        context = contextvars.copy_context()
+        job.thread = threading.Thread(
+            target=context.run,
+            args=(job._run, func),
+            name=f"fastcmd-job-{job.id}",
+            daemon=True,
+        )
+        job.thread.start()
+        return job
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def finished_unannounced(self) -> List[Job]:
+        """
+        Return the jobs finished since the previous call, oldest first.
+        """
+        with self._lock:
+            jobs = [
+                job
+                for job in self._jobs.values()
+                if job.finished and job.id not in self._announced
+            ]
+            self._announced.update(job.id for job in jobs)
+        return jobs
+
+
+job_manager = JobManager()
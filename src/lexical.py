@@ -0,0 +1,78 @@
+import re
+from typing import List, Set
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> Set[str]:
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+
+def normalize_query(text: str) -> str:
+    """
+    Lowercase a query and collapse whitespace, so equivalent queries share
+    cache entries.
+    """
+    return " ".join(text.lower().split())
+
+
+def trigrams(text: str) -> Set[str]:
+    """
+    Character trigrams of every word, padded so word starts weigh more.
+    """
+    grams: Set[str] = set()
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        padded = f"  {token} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _jaccard(left: Set[str], right: Set[str]) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def lexical_similarity(query: str, text: str) -> float:
+    """
+    Jaccard similarity between the word sets of two texts, from 0 to 1.
+    """
+    return _jaccard(tokenize(query), tokenize(text))
+
+
+def trigram_similarity(query: str, text: str) -> float:
+    """
+    Jaccard similarity between the trigram sets of two texts, from 0 to 1.
+    Unlike lexical_similarity it tolerates typos and partial words.
+    """
+    return _jaccard(trigrams(query), trigrams(text))
+
+
+def text_similarity(query: str, text: str) -> float:
+    return max(
+        lexical_similarity(query, text), trigram_similarity(query, text)
+    )
+
+
+def rank_lexical(query: str, candidates: List[dict], top_k: int) -> List[dict]:
+    """
+    Rank commands by word and trigram overlap with their description.
+
+    Args:
+        query: Text to match
+        candidates: Dictionaries with at least a description
+        top_k: Maximum number of results
+
+    Returns:
+        List[dict]: Copies of the matching candidates with a distance
+        (1 - similarity) added, closest first. Candidates sharing nothing
+        with the query are left out.
+    """
+    scored = []
+    for candidate in candidates:
+        similarity = text_similarity(query, candidate["description"] or "")
+        if similarity > 0:
+            scored.append({**candidate, "distance": 1 - similarity})
+
+    scored.sort(key=lambda result: result["distance"])
+    return scored[:top_k]
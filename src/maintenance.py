@@ -0,0 +1,287 @@
+import os
+import sqlite3
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from src.vector_database import (
+    VECTOR_TABLE,
+    compact_vector_table,
+    connect,
+    count_parked,
+    count_pending,
+    delete_orphans,
+    deserialize,
+    get_db_path,
+    get_vector_slots,
+    init_db,
+    is_memory_db,
+    query_similar,
+    retry_on_locked,
+)
+
+# Searches timed before and after maintenance, with stored vectors as queries
+SEARCH_SAMPLES = 20
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+# Called with the description of each step before it runs
+ProgressCallback = Callable[[str], None]
+
+
+def _file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _pragma(conn: sqlite3.Connection, name: str) -> int:
+    return int(conn.execute(f"PRAGMA {name}").fetchone()[0])
+
+
+def _storage_objects(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """
+    List tables and indexes with their size on disk, largest first.
+
+    Sizes come from the dbstat virtual table and are None when SQLite was
+    built without it. Indexes carry their sqlite_stat1 row once analyzed.
+    """
+    sizes: Dict[str, int] = {}
+    try:
+        sizes = dict(
+            conn.execute(
+                "SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"
+            ).fetchall()
+        )
+    except sqlite3.OperationalError:
+        pass
+
+    analyzed: Dict[str, str] = {}
+    has_stat1 = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).fetchone()
+    if has_stat1:
+        analyzed = dict(
+            conn.execute(
+                "SELECT idx, stat FROM sqlite_stat1 WHERE idx IS NOT NULL"
+            ).fetchall()
+        )
+
+    objects = [
+        {
+            "name": name,
+            "type": object_type,
+            "table": table,
+            "bytes": sizes.get(name),
+            "stat": analyzed.get(name),
+        }
+        for name, object_type, table in conn.execute(
+            """
+            SELECT name, type, tbl_name FROM sqlite_master
+            WHERE type IN ('table', 'index') AND rootpage > 0
+        """
+        )
+    ]
+    objects.sort(key=lambda entry: entry["bytes"] or 0, reverse=True)
+    return objects
+
+
+def measure_search_latency(
+    conn: sqlite3.Connection, samples: int = SEARCH_SAMPLES
+) -> Optional[float]:
+    """
+    Return the median milliseconds of a search, None without vectors.
+
+    The vectors of the first commands are used as queries, so runs before
+    and after maintenance search for the same vectors.
+    """
+    ids = conn.execute(
+        "SELECT id FROM commands ORDER BY id LIMIT ?", (samples,)
+    ).fetchall()
+    queries = []
+    for (entry_id,) in ids:
+        row = conn.execute(
+            f"SELECT embedding FROM {VECTOR_TABLE} WHERE id = ?", (entry_id,)
+        ).fetchone()
+        if row:
+            queries.append(deserialize(row[0]))
+    if not queries:
+        return None
+
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        query_similar(conn, query, 5)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def collect_stats(db_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Report row counts, storage usage and search latency of a database.
+
+    Only reads, so it is safe next to any other session.
+
+    Args:
+        db_path: Optional path to the database file
+
+    Returns:
+        Dict[str, Any]: Counts of "commands", "vectors", "orphaned_vectors"
+        without a command, commands "missing_vectors" and not queued,
+        "pending" embeddings, of which "parked" after too many failed
+        attempts, and allocated "vector_slots"; "file_bytes" and
+        "wal_bytes" on disk (None for memory databases), "page_size",
+        "pages", "free_pages", "auto_vacuum", the "objects" of
+        _storage_objects and the median "search_ms"
+    """
+    db_path = db_path or get_db_path()
+    init_db(db_path)
+    conn = connect(db_path)
+    try:
+        # One snapshot, so the numbers add up while others write
+        conn.execute("BEGIN")
+        commands = conn.execute("SELECT COUNT(*) FROM commands").fetchone()[0]
+        orphaned = conn.execute(
+            f"""
+            SELECT COUNT(*) FROM {VECTOR_TABLE}_rowids
+            WHERE rowid NOT IN (SELECT id FROM commands)
+        """
+        ).fetchone()[0]
+        missing = conn.execute(
+            f"""
+            SELECT COUNT(*) FROM commands
+            WHERE id NOT IN (SELECT rowid FROM {VECTOR_TABLE}_rowids)
+            AND id NOT IN (SELECT command_id FROM pending_embeddings)
+        """
+        ).fetchone()[0]
+        slots, vectors = get_vector_slots(conn)
+        memory = is_memory_db(db_path)
+
+        return {
+            "commands": commands,
+            "vectors": vectors,
+            "orphaned_vectors": orphaned,
+            "missing_vectors": missing,
+            "pending": count_pending(conn),
+            "parked": count_parked(conn),
+            "vector_slots": slots,
+            "file_bytes": None if memory else _file_size(db_path),
+            "wal_bytes": None if memory else _file_size(db_path + "-wal"),
+            "page_size": _pragma(conn, "page_size"),
+            "pages": _pragma(conn, "page_count"),
+            "free_pages": _pragma(conn, "freelist_count"),
+            "auto_vacuum": AUTO_VACUUM_MODES.get(
+                _pragma(conn, "auto_vacuum"), "none"
+            ),
+            "objects": _storage_objects(conn),
+            "search_ms": measure_search_latency(conn),
+        }
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@retry_on_locked
+def _remove_orphans(db_path: Optional[str]) -> int:
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        removed = delete_orphans(conn)
+        conn.commit()
+        return removed
+    finally:
+        conn.close()
+
+
+@retry_on_locked
+def _analyze(db_path: Optional[str]) -> None:
+    conn = connect(db_path)
+    try:
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@retry_on_locked
+def _vacuum(db_path: str, full: bool) -> Optional[str]:
+    """
+    Return pages to the file system, "full" or "incremental" if it ran.
+
+    A full VACUUM also switches the database to incremental auto-vacuum,
+    so later runs can reclaim free pages without rewriting the file.
+    """
+    conn = connect(db_path)
+    try:
+        if full:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            mode = "full"
+        elif _pragma(conn, "auto_vacuum") == 2:
+            # Every step of the pragma frees one page, executescript runs
+            # it to completion
+            conn.executescript("PRAGMA incremental_vacuum;")
+            mode = "incremental"
+        else:
+            return None
+
+        if not is_memory_db(db_path):
+            # Best effort, the WAL is only truncated when no reader uses it
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        return mode
+    finally:
+        conn.close()
+
+
+def run_maintenance(
+    full_vacuum: bool = False,
+    db_path: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """
+    Clean up, compact and re-analyze a database.
+
+    Every step is its own short transaction, retried while the database is
+    locked. In WAL mode readers keep their snapshot during each step, so
+    searches in other sessions keep working throughout.
+
+    Args:
+        full_vacuum: Rewrite the whole file with VACUUM instead of only
+            releasing free pages, needs free disk space the size of the file
+        db_path: Optional path to the database file
+        progress: Called before each step
+
+    Returns:
+        Dict[str, Any]: Stats "before" and "after" (see collect_stats),
+        "orphans_removed", whether the vectors were "compacted" and the
+        "vacuum" that ran, if any
+    """
+    db_path = db_path or get_db_path()
+
+    def step(description: str) -> None:
+        if progress:
+            progress(description)
+
+    before = collect_stats(db_path)
+
+    step("Removing orphaned vectors")
+    orphans_removed = _remove_orphans(db_path)
+
+    step("Compacting vector chunks")
+    conn = connect(db_path)
+    try:
+        compacted = compact_vector_table(conn)
+    finally:
+        conn.close()
+
+    step("Updating index statistics (ANALYZE)")
+    _analyze(db_path)
+
+    step("Running full VACUUM" if full_vacuum else "Releasing free pages")
+    vacuum = _vacuum(db_path, full_vacuum)
+
+    return {
+        "before": before,
+        "after": collect_stats(db_path),
+        "orphans_removed": orphans_removed,
+        "compacted": compacted,
+        "vacuum": vacuum,
+    }
@@ -0,0 +1,161 @@
+import sqlite3
+import time
+from typing import Callable, Optional
+
+from src.embeddings import (
+    EMBEDDING_BATCH_SIZE,
+    calculate_embeddings,
+    get_configured_model,
+    set_index_model,
+)
+from src.vector_database import (
+    INDEX_MODEL_KEY,
+    REINDEX_TABLE,
+    connect,
+    count_commands,
+    fetch_commands_after,
+    get_meta,
+    init_db,
+    insert_vectors,
+    replace_vector_table,
+    set_meta,
+)
+
+# Checkpoint of an unfinished job, stored in fastcmd_meta
+CHECKPOINT_MODEL_KEY = "reindex.model"
+CHECKPOINT_LAST_ID_KEY = "reindex.last_id"
+CHECKPOINT_DIMENSIONS_KEY = "reindex.dimensions"
+
+# Called with (embedded commands, total commands, ETA in seconds or None)
+ProgressCallback = Callable[[int, int, Optional[float]], None]
+
+
+def _start_or_resume(
+    conn: sqlite3.Connection, model: str, restart: bool
+) -> int:
+    """
+    Return the command id to continue after, discarding stale checkpoints.
+    """
+    checkpoint_model = get_meta(conn, CHECKPOINT_MODEL_KEY)
+    if not restart and checkpoint_model == model:
+        return int(get_meta(conn, CHECKPOINT_LAST_ID_KEY) or 0)
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS {REINDEX_TABLE}")
+        set_meta(conn, CHECKPOINT_MODEL_KEY, model)
+        set_meta(conn, CHECKPOINT_LAST_ID_KEY, "0")
+        set_meta(conn, CHECKPOINT_DIMENSIONS_KEY, None)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return 0
+
+
+def get_checkpoint(db_path: Optional[str] = None) -> Optional[dict]:
+    """
+    Return the model and position of an unfinished re-index job, if any.
+    """
+    init_db(db_path)
+    conn = connect(db_path)
+    try:
+        model = get_meta(conn, CHECKPOINT_MODEL_KEY)
+        if model is None:
+            return None
+        last_id = int(get_meta(conn, CHECKPOINT_LAST_ID_KEY) or 0)
+        return {
+            "model": model,
+            "done": count_commands(conn, up_to_id=last_id),
+            "total": count_commands(conn),
+        }
+    finally:
+        conn.close()
+
+
+def run_reindex(
+    model: Optional[str] = None,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    restart: bool = False,
+    db_path: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> int:
+    """
+    Re-embed every command description and swap the new vectors in.
+
+    Vectors are written to a separate table in batches, each batch committed
+    together with a checkpoint, so an interrupted job resumes where it
+    stopped. Searches keep using vec_commands until the final swap. Commands
+    added while the job runs are picked up before swapping.
+
+    Args:
+        model: Embedding model to use, defaults to FASTCMD_EMBEDDING_MODEL
+        batch_size: Descriptions embedded per request and per commit
+        restart: Discard the checkpoint of an unfinished job
+        db_path: Optional path to the database file
+        progress: Called after every committed batch
+
+    Returns:
+        int: Number of descriptions embedded by this run
+    """
+    model = model or get_configured_model()
+    init_db(db_path)
+    conn = connect(db_path)
+    try:
+        last_id = _start_or_resume(conn, model, restart)
+        started = time.monotonic()
+        embedded = 0
+
+        while True:
+            rows = fetch_commands_after(conn, last_id, batch_size)
+            if not rows:
+                dimensions = get_meta(conn, CHECKPOINT_DIMENSIONS_KEY)
+                meta_updates = {
+                    CHECKPOINT_MODEL_KEY: None,
+                    CHECKPOINT_LAST_ID_KEY: None,
+                    CHECKPOINT_DIMENSIONS_KEY: None,
+                    INDEX_MODEL_KEY: model,
+                }
+                if dimensions is None:
+                    # Nothing to embed, the database is empty
+                    for key, value in meta_updates.items():
+                        set_meta(conn, key, value)
+                    conn.execute("DELETE FROM query_cache")
+                    conn.commit()
+                    set_index_model(model)
+                    return embedded
+                if replace_vector_table(
+                    conn, REINDEX_TABLE, int(dimensions), last_id, meta_updates
+                ):
+                    # Queries and new commands are embedded with it now
+                    set_index_model(model)
+                    return embedded
+                # Commands were added meanwhile, embed them before swapping
+                continue
+
+            embeddings = calculate_embeddings(
+                [description for _, description in rows], model=model
+            )
+            last_id = rows[-1][0]
+            insert_vectors(
+                conn,
+                REINDEX_TABLE,
+                [
+                    (row[0], embedding)
+                    for row, embedding in zip(rows, embeddings)
+                ],
+                {
+                    CHECKPOINT_LAST_ID_KEY: str(last_id),
+                    CHECKPOINT_DIMENSIONS_KEY: str(len(embeddings[0])),
+                },
+            )
+            embedded += len(rows)
+
+            if progress:
+                done = count_commands(conn, up_to_id=last_id)
+                total = count_commands(conn)
+                rate = embedded / (time.monotonic() - started)
+                eta = (total - done) / rate if rate > 0 else None
+                progress(done, total, eta)
+    finally:
+        conn.close()
@@ -0,0 +1,284 @@
+import os
+import sqlite3
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from src.vector_database import (
+    VECTOR_TABLE,
+    connect,
+    get_vector_metric,
+    retry_on_locked,
+    to_cosine_distance,
+)
+
+# Neighbours kept per command
+RELATED_K = int(os.getenv("FASTCMD_RELATED_K", "5"))
+
+# Commands whose neighbours are computed per matrix product by the rebuild
+REBUILD_BATCH_SIZE = 512
+
+# Called with the number of commands linked so far and the total
+ProgressCallback = Callable[[int, int], None]
+
+NEIGHBOURS_QUERY = f"""
+    SELECT id, distance FROM {VECTOR_TABLE}
+    WHERE embedding MATCH ? AND k = ?
+"""
+
+
+def _neighbours(
+    conn: sqlite3.Connection, entry_id: int, k: int, metric: str
+) -> List[Tuple[int, float]]:
+    row = conn.execute(
+        f"SELECT embedding FROM {VECTOR_TABLE} WHERE id = ?", (entry_id,)
+    ).fetchone()
+    if row is None:
+        return []
+    # One more, the command finds itself first
+    return [
+        (neighbour, to_cosine_distance(metric, distance))
+        for neighbour, distance in conn.execute(
+            NEIGHBOURS_QUERY, (row[0], k + 1)
+        )
+        if neighbour != entry_id
+    ][:k]
+
+
+def _keep_closest(conn: sqlite3.Connection, entry_id: int, k: int) -> None:
+    conn.execute(
+        """
+        DELETE FROM related_commands
+        WHERE command_id = :id AND related_id NOT IN (
+            SELECT related_id FROM related_commands
+            WHERE command_id = :id
+            ORDER BY distance, related_id
+            LIMIT :k
+        )
+    """,
+        {"id": entry_id, "k": k},
+    )
+
+
+@retry_on_locked
+def link_commands(
+    entry_ids: Iterable[int],
+    k: int = RELATED_K,
+    db_path: Optional[str] = None,
+) -> None:
+    """
+    Update the related commands after commands got their vector.
+
+    Each command gets its k nearest neighbours, found with one KNN query,
+    and replaces the farthest related command of those neighbours it is
+    closer to. Commands farther away do not learn about it, so the graph is
+    approximate until rebuild_related. Commands without a vector are
+    skipped.
+
+    Args:
+        entry_ids: Ids of the commands, e.g. ones a deleted command was
+            related to, to find them a replacement
+        k: Neighbours kept per command
+        db_path: Optional path to the database file
+    """
+    entry_ids = list(entry_ids)
+    if not entry_ids:
+        return
+    conn = connect(db_path)
+    try:
+        metric = get_vector_metric(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        for entry_id in entry_ids:
+            neighbours = _neighbours(conn, entry_id, k, metric)
+            conn.execute(
+                "DELETE FROM related_commands WHERE command_id = ?",
+                (entry_id,),
+            )
+            for neighbour, distance in neighbours:
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO related_commands
+                        (command_id, related_id, distance)
+                    VALUES (?, ?, ?)
+                """,
+                    [
+                        (entry_id, neighbour, distance),
+                        (neighbour, entry_id, distance),
+                    ],
+                )
+                _keep_closest(conn, neighbour, k)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+@retry_on_locked
+def fetch_linked(entry_id: int, db_path: Optional[str] = None) -> List[int]:
+    """
+    Fetch the ids of the commands listing entry_id as related.
+    """
+    conn = connect(db_path)
+    try:
+        return [
+            row[0]
+            for row in conn.execute(
+                "SELECT command_id FROM related_commands WHERE related_id = ?",
+                (entry_id,),
+            )
+        ]
+    finally:
+        conn.close()
+
+
+@retry_on_locked
+def fetch_related(
+    entry_id: int, limit: int = RELATED_K, db_path: Optional[str] = None
+) -> List[dict]:
+    """
+    Fetch the commands closest to a saved command, closest first.
+
+    One lookup of the related_commands primary key, no embedding or vector
+    search is needed.
+    """
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT related_id, command, description, distance
+            FROM related_commands
+            JOIN commands ON commands.id = related_id
+            WHERE command_id = ?
+            ORDER BY distance, related_id
+            LIMIT ?
+        """,
+            (entry_id, limit),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [
+        {
+            "id": related_id,
+            "command": command,
+            "description": description,
+            "distance": distance,
+        }
+        for related_id, command, description, distance in rows
+    ]
+
+
+def _load_vectors(conn: sqlite3.Connection) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the ids and normalized vectors of all commands into arrays.
+    """
+    count = conn.execute(
+        f"SELECT COUNT(*) FROM {VECTOR_TABLE} "
+        "WHERE id IN (SELECT id FROM commands)"
+    ).fetchone()[0]
+    ids = np.empty(count, dtype=np.int64)
+    vectors: Optional[np.ndarray] = None
+    rows = conn.execute(
+        f"""
+        SELECT id, embedding FROM {VECTOR_TABLE}
+        WHERE id IN (SELECT id FROM commands)
+        ORDER BY id
+    """
+    )
+    for index, (entry_id, blob) in enumerate(rows):
+        if index == count:
+            # Added after counting
+            break
+        vector = np.frombuffer(blob, dtype=np.float32)
+        if vectors is None:
+            vectors = np.empty((count, len(vector)), dtype=np.float32)
+        ids[index] = entry_id
+        vectors[index] = vector
+    if vectors is None:
+        return ids[:0], np.empty((0, 0), dtype=np.float32)
+    vectors = vectors[: index + 1]
+    ids = ids[: index + 1]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+    return ids, vectors
+
+
+@retry_on_locked
+def _replace_related(
+    edges: List[Tuple[int, int, float]], db_path: Optional[str] = None
+) -> None:
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM related_commands")
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO related_commands
+                (command_id, related_id, distance)
+            VALUES (?, ?, ?)
+        """,
+            edges,
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def rebuild_related(
+    k: int = RELATED_K,
+    batch_size: int = REBUILD_BATCH_SIZE,
+    db_path: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> int:
+    """
+    Recompute the related commands of every command.
+
+    All vectors are loaded into one float32 matrix, N x dimensions x 4
+    bytes, and the cosine similarities of batch_size commands to all others
+    are computed with one matrix product per batch, keeping the k best with
+    argpartition. The graph is replaced in one transaction, searches see
+    the previous one until it commits.
+
+    Args:
+        k: Neighbours kept per command
+        batch_size: Commands compared to all others at once
+        db_path: Optional path to the database file
+        progress: Called after every batch
+
+    Returns:
+        int: Number of commands linked
+    """
+    conn = connect(db_path)
+    try:
+        ids, vectors = _load_vectors(conn)
+        total = len(ids)
+        neighbours = min(k, total - 1)
+        edges: List[Tuple[int, int, float]] = []
+        for start in range(0, total if neighbours > 0 else 0, batch_size):
+            similarities = vectors[start : start + batch_size] @ vectors.T
+            rows = np.arange(len(similarities))
+            # A command is not related to itself
+            similarities[rows, start + rows] = -np.inf
+            closest = np.argpartition(-similarities, neighbours - 1, axis=1)[
+                :, :neighbours
+            ]
+            for row, columns in zip(rows, closest):
+                for column in columns:
+                    edges.append(
+                        (
+                            int(ids[start + row]),
+                            int(ids[column]),
+                            float(1 - similarities[row, column]),
+                        )
+                    )
+            if progress:
+                progress(min(start + batch_size, total), total)
+    finally:
+        conn.close()
+
+    _replace_related(edges, db_path)
+    return total
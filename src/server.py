@@ -0,0 +1,336 @@
+import hmac
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.embeddings import (
+    calculate_embedding,
+    calculate_embeddings,
+    get_transport_stats,
+    set_embedding_operation,
+)
+from src.related import link_commands
+from src.vector_database import (
+    ConnectionPool,
+    import_entries,
+    import_texts,
+    init_db,
+    insert_entries,
+    merge_matches,
+    query_all_commands,
+    query_similar,
+    search_packs,
+    to_import_entries,
+)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# How long a search waits for other searches to share its embeddings request
+DEFAULT_BATCH_WINDOW_MS = 5.0
+MAX_SEARCH_BATCH_SIZE = 64
+REQUEST_TIMEOUT = 60.0
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+# Clients have to send "Authorization: Bearer <token>" when set, except to
+# /health
+SERVER_TOKEN = os.getenv("FASTCMD_SERVER_TOKEN") or None
+
+
+class BadRequest(Exception):
+    pass
+
+
+SearchItem = Tuple[str, int, "Future[list]"]
+
+
+class SearchBatcher:
+    """
+    Coalesce concurrent searches into one embeddings request.
+
+    Searches submitted within the batch window are embedded together on the
+    embedding worker pool and looked up over a single pooled connection.
+
+    Args:
+        pool: Pool providing database connections
+        executor: Worker pool running the embedding calls
+        batch_window_ms: How long the first search of a batch waits for more
+        max_batch_size: Upper bound on the number of searches per batch
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        executor: ThreadPoolExecutor,
+        batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS,
+        max_batch_size: int = MAX_SEARCH_BATCH_SIZE,
+    ) -> None:
+        self.pool = pool
+        self.executor = executor
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._queue: "Queue[Optional[SearchItem]]" = Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="fastcmd-search-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, description: str, top_k: int) -> "Future[list]":
+        future: "Future[list]" = Future()
+        self._queue.put((description, top_k, future))
+        return future
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    next_item = self._queue.get(timeout=remaining)
+                except Empty:
+                    break
+                if next_item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(next_item)
+
+            self.executor.submit(self._process, batch)
+
+    def _process(self, batch: List[SearchItem]) -> None:
+        try:
+            embeddings = calculate_embeddings([item[0] for item in batch])
+            with self.pool.connection() as conn:
+                for (_, top_k, future), embedding in zip(batch, embeddings):
+                    pack_searches = search_packs(embedding, top_k)
+                    matches = query_similar(conn, embedding, top_k)
+                    future.set_result(
+                        merge_matches(matches, pack_searches, top_k)
+                    )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+class FastCmdServer(ThreadingHTTPServer):
+    """
+    HTTP server sharing one command catalog between clients.
+
+    Args:
+        address: (host, port) to listen on, port 0 picks a free port
+        db_path: Optional path to the database file
+        pool_size: Number of pooled database connections
+        embedding_workers: Number of threads calling the embedding provider
+        batch_window_ms: Search batching window, see SearchBatcher
+        token: Token clients authenticate with, None to accept any client
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        db_path: Optional[str] = None,
+        pool_size: int = 4,
+        embedding_workers: int = 4,
+        batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS,
+        token: Optional[str] = SERVER_TOKEN,
+    ) -> None:
+        init_db(db_path)
+        self.db_path = db_path
+        self.token = token
+        self.pool = ConnectionPool(db_path, size=pool_size)
+        self.embedding_executor = ThreadPoolExecutor(
+            max_workers=embedding_workers,
+            thread_name_prefix="fastcmd-embedding",
+            initializer=set_embedding_operation,
+            initargs=("serve",),
+        )
+        self.batcher = SearchBatcher(
+            self.pool, self.embedding_executor, batch_window_ms
+        )
+        super().__init__(address, RequestHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.batcher.close()
+        self.embedding_executor.shutdown(wait=True)
+        self.pool.close()
+
+
+def _require_text(body: Dict[str, Any], key: str) -> str:
+    value = body.get(key)
+    if not isinstance(value, str) or not value.strip():
+        raise BadRequest(f"'{key}' must be a non-empty string")
+    return value
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server: FastCmdServer
+
+    def do_GET(self) -> None:
+        routes: Dict[str, Callable[[], Any]] = {
+            "/health": lambda: {"status": "ok"},
+            "/export": self._export,
+            "/stats": lambda: {"embeddings": get_transport_stats()},
+        }
+        self._dispatch(routes)
+
+    def do_POST(self) -> None:
+        routes: Dict[str, Callable[[], Any]] = {
+            "/add": self._add,
+            "/search": self._search,
+            "/import": self._import,
+        }
+        self._dispatch(routes)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Per-request access logs would dominate the output under load
+        pass
+
+    def _dispatch(self, routes: Dict[str, Callable[[], Any]]) -> None:
+        path = self.path.split("?", 1)[0]
+        route = routes.get(path)
+        if route is None:
+            self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        if path != "/health" and not self._authorized():
+            self._send_json(401, {"error": "Missing or invalid token"})
+            return
+
+        try:
+            self._send_json(200, route())
+        except BadRequest as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+    def _authorized(self) -> bool:
+        if self.server.token is None:
+            return True
+        expected = f"Bearer {self.server.token}"
+        given = self.headers.get("Authorization") or ""
+        return hmac.compare_digest(given.encode(), expected.encode())
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise BadRequest("Request body is too large")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            raise BadRequest(f"Invalid JSON body: {e}")
+        if not isinstance(body, dict):
+            raise BadRequest("Request body must be a JSON object")
+        return body
+
+    def _send_json(self, status: int, payload: Any) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _add(self) -> Dict[str, Any]:
+        body = self._read_json()
+        command = _require_text(body, "command")
+        description = _require_text(body, "description")
+
+        embedding = self.server.embedding_executor.submit(
+            calculate_embedding, description
+        ).result(timeout=REQUEST_TIMEOUT)
+        with self.server.pool.connection() as conn:
+            ids = insert_entries(conn, [(embedding, command, description)])
+        link_commands(ids, db_path=self.server.db_path)
+        return {"added": 1}
+
+    def _search(self) -> Dict[str, Any]:
+        body = self._read_json()
+        description = _require_text(body, "description")
+        top_k = body.get("top_k", 1)
+        if not isinstance(top_k, int) or top_k < 1:
+            raise BadRequest("'top_k' must be a positive integer")
+
+        matches = self.server.batcher.submit(description, top_k).result(
+            timeout=REQUEST_TIMEOUT
+        )
+        return {
+            "matches": [
+                {**match, "score": 1 - match["distance"]} for match in matches
+            ]
+        }
+
+    def _export(self) -> Dict[str, Any]:
+        with self.server.pool.connection() as conn:
+            return {"commands": query_all_commands(conn)}
+
+    def _import(self) -> Dict[str, Any]:
+        body = self._read_json()
+        commands = body.get("commands")
+        if not isinstance(commands, list) or not commands:
+            raise BadRequest("'commands' must be a non-empty list")
+
+        valid = [
+            cmd
+            for cmd in commands
+            if isinstance(cmd, dict)
+            and "description" in cmd
+            and "command" in cmd
+            and isinstance(cmd.get("aliases", []), list)
+        ]
+        # Descriptions and aliases of all commands in one request
+        embeddings = self.server.embedding_executor.submit(
+            calculate_embeddings, import_texts(valid)
+        ).result(timeout=REQUEST_TIMEOUT)
+        entries = to_import_entries(valid, embeddings)
+        with self.server.pool.connection() as conn:
+            ids, skipped_aliases = import_entries(conn, entries)
+        link_commands(ids, db_path=self.server.db_path)
+        return {
+            "imported": len(ids),
+            "skipped": len(commands) - len(ids),
+            "skipped_aliases": skipped_aliases,
+        }
+
+
+def serve(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    db_path: Optional[str] = None,
+    pool_size: int = 4,
+    embedding_workers: int = 4,
+    batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS,
+) -> None:
+    """
+    Run the HTTP server until interrupted.
+    """
+    server = FastCmdServer(
+        (host, port),
+        db_path=db_path,
+        pool_size=pool_size,
+        embedding_workers=embedding_workers,
+        batch_window_ms=batch_window_ms,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,809 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from src import vector_database
+from src.related import fetch_linked, link_commands
+from src.vector_database import (
+    ALIAS_VECTOR_TABLE,
+    DEFAULT_DB_PATH,
+    VECTOR_TABLE,
+    ConnectionPool,
+    ImportEntry,
+    connect,
+    deserialize,
+    get_db_path,
+    get_meta,
+    init_db,
+    insert_entry,
+    is_memory_db,
+    merge_matches,
+    query_similar,
+    retry_on_locked,
+    search_packs,
+    set_meta,
+    snapshot_db,
+)
+
+# FASTCMD_SHARDS=N with N > 1 spreads the commands over N database files,
+# created from the current database with "reshard --shards N"
+SHARD_COUNT = int(os.getenv("FASTCMD_SHARDS", "1"))
+
+SHARD_DIR = os.getenv(
+    "FASTCMD_SHARD_DIR",
+    os.path.join(os.path.dirname(DEFAULT_DB_PATH), "shards"),
+)
+
+# Shards searched and written at the same time
+SHARD_WORKERS = int(
+    os.getenv("FASTCMD_SHARD_WORKERS", str(os.cpu_count() or 4))
+)
+
+# Commands copied per transaction by reshard
+RESHARD_BATCH_SIZE = 1000
+
+# Number of shards of the store, kept in every shard
+COUNT_KEY = "shards.count"
+# Next command id of the store, kept in the first shard
+NEXT_ID_KEY = "shards.next_id"
+
+# Called with the number of commands copied so far and the total
+ProgressCallback = Callable[[int, int], None]
+
+# (id, embedding, command, description)
+ShardEntry = Tuple[int, Sequence[float], str, str]
+
+
+def shard_of(entry_id: int, count: int) -> int:
+    """
+    Index of the shard holding a command.
+
+    Ids are handed out in sequence, so their remainder spreads commands
+    evenly and a command never moves unless the number of shards changes.
+    """
+    return entry_id % count
+
+
+def shard_paths(directory: str, count: int) -> List[str]:
+    return [
+        os.path.join(directory, f"shard-{index:03d}.db")
+        for index in range(count)
+    ]
+
+
+def _existing_shards(directory: str) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.startswith("shard-") and name.endswith(".db")
+    )
+
+
+@retry_on_locked
+def _claim_shard(path: str, count: int) -> None:
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        claimed = get_meta(conn, COUNT_KEY)
+        if claimed is None:
+            set_meta(conn, COUNT_KEY, str(count))
+        elif int(claimed) != count:
+            raise ValueError(
+                f"{path} is one of {claimed} shards, not {count}, "
+                f"run 'reshard --shards {count}' first"
+            )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+@retry_on_locked
+def _insert_shard_entries(path: str, entries: List[ShardEntry]) -> None:
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for entry_id, embedding, command, description in entries:
+            insert_entry(conn, embedding, command, description, entry_id)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+@retry_on_locked
+def _import_shard_entries(
+    path: str, entries: List[ImportEntry], entry_ids: List[int]
+) -> Tuple[List[int], int]:
+    conn = connect(path)
+    try:
+        return vector_database.import_entries(conn, entries, entry_ids)
+    finally:
+        conn.close()
+
+
+class ShardedStore:
+    """
+    Commands spread over several database files, searched in parallel.
+
+    Every shard is a complete FastCmd database holding the commands whose
+    id maps to it, see shard_of. Ids are unique across the store, they are
+    reserved from a counter in the first shard before the commands are
+    written to their shards. Searches query every shard on its own
+    connection in a thread pool and merge their top k; SQLite releases
+    the GIL while a query runs, so the scans use several cores.
+
+    Args:
+        directory: Directory of the shard files
+        count: Number of shards
+        workers: Threads searching and writing shards at the same time
+    """
+
+    def __init__(
+        self, directory: str, count: int, workers: int = SHARD_WORKERS
+    ) -> None:
+        if count < 1:
+            raise ValueError("A sharded store needs at least one shard")
+        self.directory = directory
+        self.count = count
+        self.paths = shard_paths(directory, count)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, min(workers, count)),
+            thread_name_prefix="fastcmd-shards",
+        )
+        self._pools: Dict[str, ConnectionPool] = {}
+        self._pools_lock = threading.Lock()
+
+    def init(self) -> None:
+        """
+        Create missing shards and check none belongs to another count.
+
+        Raises:
+            ValueError: If the directory holds shards of another count
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        list(self._executor.map(init_db, self.paths))
+        for path in self.paths:
+            _claim_shard(path, self.count)
+        extra = set(_existing_shards(self.directory)) - set(self.paths)
+        if extra:
+            raise ValueError(
+                f"{self.directory} holds more than {self.count} shards, "
+                f"run 'reshard --shards {self.count}' first"
+            )
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        with self._pools_lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+
+    def shard_for(self, entry_id: int) -> str:
+        return self.paths[shard_of(entry_id, self.count)]
+
+    def _pool(self, path: str) -> ConnectionPool:
+        with self._pools_lock:
+            if path not in self._pools:
+                self._pools[path] = ConnectionPool(path, size=2)
+            return self._pools[path]
+
+    @retry_on_locked
+    def reserve_ids(self, count: int) -> int:
+        """
+        Reserve count consecutive command ids and return the first one.
+        """
+        conn = connect(self.paths[0])
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            first = int(get_meta(conn, NEXT_ID_KEY) or 1)
+            set_meta(conn, NEXT_ID_KEY, str(first + count))
+            conn.commit()
+            return first
+        finally:
+            conn.close()
+
+    def insert_entries(
+        self, entries: List[Tuple[Sequence[float], str, str]]
+    ) -> List[int]:
+        """
+        Insert (embedding, command, description) entries into their shards.
+
+        Every shard writes its share in one transaction, all shards at the
+        same time. Shards committed before another one failed keep their
+        commands.
+
+        Returns:
+            List[int]: Ids of the commands, in the order of the entries
+        """
+        if not entries:
+            return []
+        first = self.reserve_ids(len(entries))
+        ids = list(range(first, first + len(entries)))
+        groups: Dict[str, List[ShardEntry]] = {}
+        for entry_id, (embedding, command, description) in zip(ids, entries):
+            groups.setdefault(self.shard_for(entry_id), []).append(
+                (entry_id, embedding, command, description)
+            )
+        list(
+            self._executor.map(
+                lambda group: _insert_shard_entries(*group), groups.items()
+            )
+        )
+        return ids
+
+    def import_entries(self, entries: List[ImportEntry]) -> Tuple[int, int]:
+        """
+        Save imported commands with their aliases into their shards, see
+        import_entries.
+
+        Every shard writes its share in one transaction, all shards at the
+        same time.
+
+        Returns:
+            Tuple[int, int]: Number of commands imported and of aliases
+            skipped
+        """
+        if not entries:
+            return 0, 0
+        first = self.reserve_ids(len(entries))
+        groups: Dict[str, Tuple[List[ImportEntry], List[int]]] = {}
+        for entry_id, entry in enumerate(entries, first):
+            group = groups.setdefault(self.shard_for(entry_id), ([], []))
+            group[0].append(entry)
+            group[1].append(entry_id)
+        results = list(
+            self._executor.map(
+                lambda item: _import_shard_entries(item[0], *item[1]),
+                groups.items(),
+            )
+        )
+        return (
+            sum(len(ids) for ids, _ in results),
+            sum(skipped for _, skipped in results),
+        )
+
+    def add_entry(
+        self, embedding: Sequence[float], command: str, description: str
+    ) -> int:
+        return self.insert_entries([(embedding, command, description)])[0]
+
+    def enqueue_entry(self, command: str, description: str) -> int:
+        entry_id = self.reserve_ids(1)
+        return vector_database.enqueue_entry(
+            command, description, self.shard_for(entry_id), entry_id
+        )
+
+    def enqueue_alias(self, command: str, description: str) -> Optional[int]:
+        """
+        Add an alias to the oldest copy of a command, see enqueue_alias.
+        """
+        oldest: Optional[Tuple[int, str]] = None
+        for path, entry_id in zip(
+            self.paths,
+            self._executor.map(
+                lambda path: _oldest_copy(path, command), self.paths
+            ),
+        ):
+            if entry_id is not None and (
+                oldest is None or entry_id < oldest[0]
+            ):
+                oldest = (entry_id, path)
+        if oldest is None:
+            return None
+        return vector_database.enqueue_alias(command, description, oldest[1])
+
+    def search(
+        self, path: str, user_embedding: Sequence[float], top_k: int
+    ) -> list:
+        with self._pool(path).connection() as conn:
+            return query_similar(conn, user_embedding, top_k)
+
+    def fetch_similar(
+        self, user_embedding: Sequence[float], top_k: int = 3
+    ) -> list:
+        """
+        Search every shard and the packs at the same time and merge the
+        top_k of each, see merge_matches.
+        """
+        searches = [
+            self._executor.submit(self.search, path, user_embedding, top_k)
+            for path in self.paths
+        ]
+        return merge_matches(
+            [], searches + search_packs(user_embedding, top_k), top_k
+        )
+
+    def _gather(self, fetch: Callable[[str], list]) -> list:
+        return [
+            row
+            for rows in self._executor.map(fetch, self.paths)
+            for row in rows
+        ]
+
+    def fetch_all_commands(self) -> list:
+        return self._gather(vector_database.fetch_all_commands)
+
+    def fetch_pending_commands(self) -> list:
+        return self._gather(vector_database.fetch_pending_commands)
+
+    def fetch_commands_containing(
+        self, words: List[str], limit: int, pending_only: bool = False
+    ) -> list:
+        matches = self._gather(
+            lambda path: vector_database.fetch_commands_containing(
+                words, limit, path, pending_only
+            )
+        )
+        return sorted(matches, key=lambda match: match["id"])[:limit]
+
+
+def _oldest_copy(path: str, command: str) -> Optional[int]:
+    conn = connect(path)
+    try:
+        row = conn.execute(
+            "SELECT MIN(id) FROM commands WHERE command = ?", (command,)
+        ).fetchone()
+        return row[0]
+    finally:
+        conn.close()
+
+
+# Store of SHARD_DIR, opened on first use
+_store: Optional[ShardedStore] = None
+_store_lock = threading.Lock()
+
+
+def is_sharded() -> bool:
+    return SHARD_COUNT > 1
+
+
+def has_shards(directory: Optional[str] = None) -> bool:
+    """
+    Return whether reshard would read the commands from shard files.
+    """
+    return bool(_existing_shards(directory or SHARD_DIR))
+
+
+def get_store() -> ShardedStore:
+    """
+    Return the store of SHARD_DIR with SHARD_COUNT shards, opening it once.
+    """
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            store = ShardedStore(SHARD_DIR, SHARD_COUNT)
+            try:
+                store.init()
+            except BaseException:
+                store.close()
+                raise
+            _store = store
+        return _store
+
+
+def catalog_paths() -> List[Optional[str]]:
+    """
+    Return the databases holding commands, the shards when sharded, else
+    [None] for the default database.
+    """
+    return list(get_store().paths) if is_sharded() else [None]
+
+
+# The commands are read and written through the functions below, which use
+# the shards when FASTCMD_SHARDS is set and the default database otherwise
+
+
+def add_entry(
+    embedding: Sequence[float], command: str, description: str
+) -> int:
+    if is_sharded():
+        return get_store().add_entry(embedding, command, description)
+    entry_id = vector_database.add_entry(embedding, command, description)
+    link_commands([entry_id])
+    return entry_id
+
+
+def import_entries(entries: List[ImportEntry]) -> Tuple[int, int]:
+    """
+    Save imported commands with their aliases, see
+    vector_database.import_entries.
+
+    Returns:
+        Tuple[int, int]: Number of commands imported and of aliases skipped
+    """
+    if is_sharded():
+        return get_store().import_entries(entries)
+    conn = connect()
+    try:
+        ids, skipped = vector_database.import_entries(conn, entries)
+    finally:
+        conn.close()
+    link_commands(ids)
+    return len(ids), skipped
+
+
+def enqueue_entry(command: str, description: str) -> int:
+    if is_sharded():
+        return get_store().enqueue_entry(command, description)
+    return vector_database.enqueue_entry(command, description)
+
+
+def update_entry(
+    entry_id: int,
+    command: Optional[str] = None,
+    description: Optional[str] = None,
+) -> Optional[bool]:
+    db_path = get_store().shard_for(entry_id) if is_sharded() else None
+    return vector_database.update_entry(
+        entry_id, command=command, description=description, db_path=db_path
+    )
+
+
+def delete_entry(entry_id: int) -> bool:
+    if is_sharded():
+        return vector_database.delete_entry(
+            entry_id, get_store().shard_for(entry_id)
+        )
+    # The commands it was related to get a replacement
+    linked = fetch_linked(entry_id)
+    deleted = vector_database.delete_entry(entry_id)
+    if deleted:
+        link_commands(linked)
+    return deleted
+
+
+def add_alias(
+    entry_id: int, embedding: Sequence[float], description: str
+) -> int:
+    db_path = get_store().shard_for(entry_id) if is_sharded() else None
+    return vector_database.add_alias(entry_id, embedding, description, db_path)
+
+
+def enqueue_alias(command: str, description: str) -> Optional[int]:
+    if is_sharded():
+        return get_store().enqueue_alias(command, description)
+    return vector_database.enqueue_alias(command, description)
+
+
+def fetch_similar(user_embedding: Sequence[float], top_k: int = 3) -> list:
+    if is_sharded():
+        return get_store().fetch_similar(user_embedding, top_k)
+    return vector_database.fetch_similar(user_embedding, top_k)
+
+
+def fetch_similar_batch(
+    user_embeddings: Iterable[Sequence[float]], top_k: int = 3
+) -> Iterator[list]:
+    if not is_sharded():
+        yield from vector_database.fetch_similar_batch(user_embeddings, top_k)
+        return
+    store = get_store()
+    for user_embedding in user_embeddings:
+        yield store.fetch_similar(user_embedding, top_k)
+
+
+def fetch_all_commands() -> list:
+    if is_sharded():
+        return get_store().fetch_all_commands()
+    return vector_database.fetch_all_commands()
+
+
+def fetch_pending_commands() -> list:
+    if is_sharded():
+        return get_store().fetch_pending_commands()
+    return vector_database.fetch_pending_commands()
+
+
+def fetch_commands_containing(
+    words: List[str], limit: int, pending_only: bool = False
+) -> list:
+    if is_sharded():
+        return get_store().fetch_commands_containing(
+            words, limit, pending_only
+        )
+    return vector_database.fetch_commands_containing(
+        words, limit, pending_only=pending_only
+    )
+
+
+@retry_on_locked
+def _clear_catalog(path: str) -> None:
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM commands")
+        vector_database.delete_orphans(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _read_commands(
+    path: str, after: int, limit: int
+) -> List[Tuple[int, str, str, Optional[bytes]]]:
+    """
+    Read commands with an id above after and their vector, if any.
+    """
+    conn = connect(path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT id, command, description FROM commands
+            WHERE id > ? ORDER BY id LIMIT ?
+        """,
+            (after, limit),
+        ).fetchall()
+        copies = []
+        for entry_id, command, description in rows:
+            vector = conn.execute(
+                f"SELECT embedding FROM {VECTOR_TABLE} WHERE id = ?",
+                (entry_id,),
+            ).fetchone()
+            copies.append(
+                (entry_id, command, description, vector[0] if vector else None)
+            )
+        return copies
+    finally:
+        conn.close()
+
+
+def _write_copies(
+    path: str, copies: List[Tuple[int, str, str, Optional[bytes]]]
+) -> None:
+    _insert_shard_entries(
+        path,
+        [
+            (entry_id, deserialize(vector), command, description)
+            for entry_id, command, description, vector in copies
+            if vector is not None
+        ],
+    )
+    # Commands still waiting for their embedding stay queued
+    for entry_id, command, description, vector in copies:
+        if vector is None:
+            vector_database.enqueue_entry(command, description, path, entry_id)
+
+
+def _copy_aliases(source: str, targets: List[str]) -> None:
+    conn = connect(source)
+    try:
+        aliases = conn.execute(
+            "SELECT id, command_id, description FROM command_aliases"
+        ).fetchall()
+        for alias_id, entry_id, description in aliases:
+            vector = conn.execute(
+                f"SELECT embedding FROM {ALIAS_VECTOR_TABLE} WHERE id = ?",
+                (alias_id,),
+            ).fetchone()
+            target = targets[shard_of(entry_id, len(targets))]
+            if vector is not None:
+                vector_database.add_alias(
+                    entry_id, deserialize(vector[0]), description, target
+                )
+                continue
+            # Embedded by the drain worker of the target
+            copy = connect(target)
+            try:
+                copy.execute(
+                    """
+                    INSERT OR IGNORE INTO command_aliases
+                        (command_id, description)
+                    VALUES (?, ?)
+                """,
+                    (entry_id, description),
+                )
+                copy.commit()
+            finally:
+                copy.close()
+    finally:
+        conn.close()
+
+
+def _count_commands(paths: List[str]) -> Tuple[int, int]:
+    """
+    Return the number of commands and the next free id over the databases.
+    """
+    total = 0
+    next_id = 1
+    for path in paths:
+        conn = connect(path)
+        try:
+            count, max_id = conn.execute(
+                "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM commands"
+            ).fetchone()
+            reserved = get_meta(conn, NEXT_ID_KEY)
+        finally:
+            conn.close()
+        total += count
+        next_id = max(next_id, max_id + 1, int(reserved or 1))
+    return total, next_id
+
+
+def _remove_db_file(path: str) -> None:
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _stage_merge(db_path: str, directory: str) -> str:
+    """
+    Copy the default database without its commands to a file the shards
+    are merged into, see _swap_in.
+
+    The copy keeps everything else the database holds, e.g. the usage
+    ledger and the query cache.
+    """
+    if is_memory_db(db_path):
+        merged = directory.rstrip(os.sep) + ".merged.db"
+    else:
+        merged = db_path + ".new"
+    _remove_db_file(merged)
+    conn = connect(db_path)
+    try:
+        snapshot_db(conn, merged)
+    finally:
+        conn.close()
+    _clear_catalog(merged)
+    return merged
+
+
+def _swap_in(merged: str, db_path: str) -> None:
+    """
+    Replace the default database with the merged one.
+    """
+    if is_memory_db(db_path):
+        # An in-memory database cannot be renamed over, it is overwritten
+        source = connect(merged)
+        target = connect(db_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        _remove_db_file(merged)
+        return
+
+    # The write-ahead log of the replaced file would be replayed into the
+    # new one, it is emptied first
+    conn = connect(db_path)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    os.replace(merged, db_path)
+
+
+def _close_store() -> None:
+    global _store
+
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+
+
+def reshard(
+    count: int,
+    db_path: Optional[str] = None,
+    directory: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> int:
+    """
+    Move the commands into count shards, or back into one database.
+
+    The commands are read from the shards in directory if there are any,
+    else from the default database, and keep their ids. New shards are
+    written next to the directory and swapped in once complete, so an
+    interrupted run leaves the current layout untouched. The default
+    database keeps its commands when they move into shards. With count 1
+    they are merged into a copy of the default database, without its
+    stale commands, renamed over it once complete. Commands and aliases
+    without a vector stay queued.
+
+    Only one process may use the commands while they move.
+
+    Args:
+        count: Number of shards, 1 for a single database
+        db_path: Optional path to the default database
+        directory: Directory of the shards, defaults to SHARD_DIR
+        progress: Called after every batch of copied commands
+
+    Returns:
+        int: Number of commands moved
+
+    Raises:
+        ValueError: If count is below 1, or is 1 without shards to merge
+    """
+    if count < 1:
+        raise ValueError("The number of shards must be at least 1")
+    db_path = db_path or get_db_path()
+    directory = directory or SHARD_DIR
+    init_db(db_path)
+    sources = _existing_shards(directory) or [db_path]
+    from_shards = sources != [db_path]
+    if count == 1 and not from_shards:
+        raise ValueError("The commands are in a single database already")
+
+    _close_store()
+    staging = directory.rstrip(os.sep) + ".new"
+    store: Optional[ShardedStore] = None
+    if count > 1:
+        shutil.rmtree(staging, ignore_errors=True)
+        store = ShardedStore(staging, count)
+        store.init()
+        targets = store.paths
+    else:
+        targets = [_stage_merge(db_path, directory)]
+
+    total, next_id = _count_commands(sources)
+    moved = 0
+    try:
+        for source in sources:
+            last_id = 0
+            while True:
+                copies = _read_commands(source, last_id, RESHARD_BATCH_SIZE)
+                if not copies:
+                    break
+                groups: Dict[str, list] = {}
+                for copy in copies:
+                    target = targets[shard_of(copy[0], count)]
+                    groups.setdefault(target, []).append(copy)
+                if store is not None:
+                    list(
+                        store._executor.map(
+                            lambda group: _write_copies(*group), groups.items()
+                        )
+                    )
+                else:
+                    _write_copies(targets[0], copies)
+                last_id = copies[-1][0]
+                moved += len(copies)
+                if progress:
+                    progress(moved, total)
+            _copy_aliases(source, targets)
+    finally:
+        if store is not None:
+            store.close()
+
+    if count > 1:
+        conn = connect(targets[0])
+        try:
+            set_meta(conn, NEXT_ID_KEY, str(next_id))
+            conn.commit()
+        finally:
+            conn.close()
+        retired = directory.rstrip(os.sep) + ".old"
+        shutil.rmtree(retired, ignore_errors=True)
+        if os.path.isdir(directory):
+            os.rename(directory, retired)
+        os.rename(staging, directory)
+        shutil.rmtree(retired, ignore_errors=True)
+    else:
+        _swap_in(targets[0], db_path)
+        shutil.rmtree(directory)
+    return moved
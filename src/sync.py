@@ -0,0 +1,292 @@
+import base64
+import sqlite3
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from src.embeddings import decode_embedding, get_configured_model
+from src.related import link_commands
+from src.vector_database import (
+    INDEX_MODEL_KEY,
+    NODE_ID_KEY,
+    VECTOR_TABLE,
+    connect,
+    delete_command,
+    drop_vectors,
+    get_meta,
+    init_db,
+    retry_on_locked,
+    serialize,
+)
+
+SYNC_FORMAT = "fastcmd-sync"
+SYNC_VERSION = 1
+
+
+def get_index_model(conn: sqlite3.Connection) -> str:
+    """
+    Return the model the vectors of vec_commands were calculated with.
+    """
+    return get_meta(conn, INDEX_MODEL_KEY) or get_configured_model()
+
+
+def _encode_vector(blob: Optional[bytes]) -> Optional[str]:
+    # Vectors travel as little-endian float32, like API embeddings
+    if blob is None:
+        return None
+    if sys.byteorder == "big":
+        vector = array("f")
+        vector.frombytes(blob)
+        vector.byteswap()
+        blob = vector.tobytes()
+    return base64.b64encode(blob).decode()
+
+
+def export_changes(since: int = 0, db_path: Optional[str] = None) -> dict:
+    """
+    Collect the current state of every command changed after a cursor.
+
+    Only the change log after the cursor is read, so the cost grows with the
+    number of changes and not with the size of the catalog. Commands changed
+    several times are exported once, in their latest state.
+
+    Args:
+        since: Cursor returned by the previous export, 0 exports everything
+        db_path: Optional path to the database file
+
+    Returns:
+        dict: Sync document with the changes, their embeddings and the cursor
+        to pass to the next export
+    """
+    init_db(db_path)
+    conn = connect(db_path)
+    try:
+        # One read transaction, so the cursor matches the exported rows
+        conn.execute("BEGIN")
+        cursor = conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM change_log"
+        ).fetchone()[0]
+        rows = conn.execute(
+            """
+            SELECT
+                command_sync.uuid,
+                command_sync.updated_at,
+                command_sync.origin,
+                command_sync.deleted,
+                command_sync.command_id,
+                commands.command,
+                commands.description
+            FROM (
+                SELECT uuid, MAX(seq) AS seq
+                FROM change_log
+                WHERE seq > ? AND seq <= ?
+                GROUP BY uuid
+            ) AS changed
+            JOIN command_sync ON command_sync.uuid = changed.uuid
+            LEFT JOIN commands ON commands.id = command_sync.command_id
+            ORDER BY changed.seq ASC;
+        """,
+            (since, cursor),
+        ).fetchall()
+
+        changes = []
+        for row_uuid, updated_at, origin, deleted, entry_id, cmd, desc in rows:
+            change: Dict[str, Any] = {
+                "uuid": row_uuid,
+                "op": "delete" if deleted else "upsert",
+                "updated_at": updated_at,
+                "origin": origin,
+            }
+            if not deleted:
+                vector = conn.execute(
+                    f"SELECT embedding FROM {VECTOR_TABLE} WHERE id = ?",
+                    (entry_id,),
+                ).fetchone()
+                change["command"] = cmd
+                change["description"] = desc
+                change["embedding"] = _encode_vector(
+                    vector[0] if vector else None
+                )
+            changes.append(change)
+
+        return {
+            "format": SYNC_FORMAT,
+            "version": SYNC_VERSION,
+            "origin": get_meta(conn, NODE_ID_KEY),
+            "model": get_index_model(conn),
+            "cursor": cursor,
+            "changes": changes,
+        }
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def _apply_change(
+    conn: sqlite3.Connection,
+    change: dict,
+    use_vectors: bool,
+    to_link: Set[int],
+) -> str:
+    """
+    Apply one remote change if it is newer than the local version.
+
+    Versions are compared by (updated_at, origin), so every database picks
+    the same winner whatever order changes arrive in. Commands whose related
+    commands have to be updated once committed are added to to_link: ones
+    that got a vector and ones a deleted command was related to.
+
+    Returns:
+        str: "skipped", "applied", or "queued" when the description has to
+        be embedded locally
+    """
+    version = (float(change["updated_at"]), str(change["origin"]))
+    local = conn.execute(
+        """
+        SELECT command_id, updated_at, origin
+        FROM command_sync
+        WHERE uuid = ?
+    """,
+        (change["uuid"],),
+    ).fetchone()
+    if local and (local[1], local[2]) >= version:
+        return "skipped"
+
+    entry_id = local[0] if local else None
+    outcome = "applied"
+    if change["op"] == "delete":
+        if entry_id is not None:
+            # The commands it was related to get a replacement
+            to_link.update(
+                row[0]
+                for row in conn.execute(
+                    "SELECT command_id FROM related_commands "
+                    "WHERE related_id = ?",
+                    (entry_id,),
+                )
+            )
+            to_link.discard(entry_id)
+            delete_command(conn, entry_id)
+        entry_id = None
+    else:
+        current = None
+        if entry_id is not None:
+            current = conn.execute(
+                "SELECT description FROM commands WHERE id = ?", (entry_id,)
+            ).fetchone()
+        if entry_id is None or current is None:
+            cursor = conn.execute(
+                "INSERT INTO commands (command, description) VALUES (?, ?)",
+                (change["command"], change["description"]),
+            )
+            entry_id = int(cursor.lastrowid or 0)
+        else:
+            conn.execute(
+                "UPDATE commands SET command = ?, description = ? "
+                "WHERE id = ?",
+                (change["command"], change["description"], entry_id),
+            )
+
+        # The local vector stays valid as long as the description does
+        if current is None or current[0] != change["description"]:
+            drop_vectors(conn, entry_id)
+            conn.execute(
+                "DELETE FROM pending_embeddings WHERE command_id = ?",
+                (entry_id,),
+            )
+            if use_vectors and change.get("embedding"):
+                conn.execute(
+                    f"INSERT INTO {VECTOR_TABLE} (id, embedding) "
+                    "VALUES (?, vec_normalize(?))",
+                    (
+                        entry_id,
+                        serialize(decode_embedding(change["embedding"])),
+                    ),
+                )
+                to_link.add(entry_id)
+            else:
+                conn.execute(
+                    """
+                    INSERT INTO pending_embeddings (command_id, enqueued_at)
+                    VALUES (?, ?)
+                """,
+                    (entry_id, version[0]),
+                )
+                outcome = "queued"
+
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO command_sync
+            (uuid, command_id, updated_at, origin, deleted)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+        (
+            change["uuid"],
+            entry_id,
+            version[0],
+            version[1],
+            int(change["op"] == "delete"),
+        ),
+    )
+    conn.execute(
+        """
+        INSERT INTO change_log (uuid, op, updated_at, origin)
+        VALUES (?, ?, ?, ?)
+    """,
+        (change["uuid"], change["op"], version[0], version[1]),
+    )
+    return outcome
+
+
+@retry_on_locked
+def _apply_changes(
+    changes: List[dict], model: Optional[str], db_path: Optional[str]
+) -> Tuple[Dict[str, int], Set[int]]:
+    conn = connect(db_path)
+    try:
+        use_vectors = model == get_index_model(conn)
+        counts = {"applied": 0, "queued": 0, "skipped": 0}
+        to_link: Set[int] = set()
+        conn.execute("BEGIN IMMEDIATE")
+        for change in changes:
+            counts[_apply_change(conn, change, use_vectors, to_link)] += 1
+        conn.commit()
+        return counts, to_link
+    finally:
+        conn.close()
+
+
+def import_changes(
+    data: dict, db_path: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    Apply a sync document created by export_changes on another database.
+
+    Conflicts are resolved by last writer wins: a change only replaces the
+    local state of a command if its version is newer. Embeddings are reused
+    when both databases use the same model, otherwise the descriptions are
+    queued for embedding. All changes are applied in one transaction.
+
+    Args:
+        data: Sync document
+        db_path: Optional path to the database file
+
+    Returns:
+        Dict[str, int]: Number of changes "applied", "queued" for embedding
+        and "skipped" as older than the local state
+
+    Raises:
+        ValueError: When the document is not a FastCmd sync document
+    """
+    if data.get("format") != SYNC_FORMAT:
+        raise ValueError("Not a FastCmd sync file")
+    if data.get("version") != SYNC_VERSION:
+        raise ValueError(f"Unsupported sync version {data.get('version')}")
+
+    init_db(db_path)
+    counts, to_link = _apply_changes(
+        data.get("changes", []), data.get("model"), db_path
+    )
+    # Queued descriptions are linked once the drain worker embeds them
+    link_commands(sorted(to_link), db_path=db_path)
+    return counts
@@ -0,0 +1,184 @@
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from src.utils import fastcmd_print
+from src.vector_database import DEFAULT_DB_PATH
+
+# FASTCMD_TELEMETRY=1 records the memory used by each phase of bulk commands
+TELEMETRY_ENABLED = os.getenv("FASTCMD_TELEMETRY") == "1"
+
+# One JSON report per recorded command is written here
+TELEMETRY_DIR = os.getenv(
+    "FASTCMD_TELEMETRY_DIR",
+    os.path.join(os.path.dirname(DEFAULT_DB_PATH), "telemetry"),
+)
+
+# Allocation sites listed per phase, 0 only records sizes and is faster
+TELEMETRY_TOP = int(os.getenv("FASTCMD_TELEMETRY_TOP", "10"))
+
+
+def _rss_kib() -> Optional[int]:
+    """
+    Return the current resident set size, None where /proc is missing.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def _peak_rss_kib() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class OperationRecorder:
+    """
+    Memory telemetry of one command, split into named phases.
+
+    For every phase the recorder keeps its duration, the RSS and the
+    process peak RSS at its end, the peak of Python allocations during the
+    phase and the TELEMETRY_TOP source lines that allocated most of the
+    memory still held when it ended.
+
+    Args:
+        operation: Name of the recorded command, e.g. "export"
+    """
+
+    def __init__(self, operation: str) -> None:
+        self.operation = operation
+        self.started_at = time.time()
+        self.phases: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        # Snapshots take seconds with millions of live objects, skip them
+        # when no allocation sites are wanted
+        before = tracemalloc.take_snapshot() if TELEMETRY_TOP else None
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            current, peak = tracemalloc.get_traced_memory()
+            top = []
+            if before is not None:
+                top = tracemalloc.take_snapshot().compare_to(before, "lineno")
+            self.phases.append(
+                {
+                    "name": name,
+                    "duration_s": round(duration, 4),
+                    "rss_kib": _rss_kib(),
+                    "peak_rss_kib": _peak_rss_kib(),
+                    "traced_kib": current // 1024,
+                    "traced_peak_kib": peak // 1024,
+                    "top_allocations": [
+                        {
+                            "location": f"{stat.traceback[0].filename}:"
+                            f"{stat.traceback[0].lineno}",
+                            "size_kib": stat.size_diff // 1024,
+                            "count": stat.count_diff,
+                        }
+                        for stat in top[:TELEMETRY_TOP]
+                        # Skip the snapshot taken when the phase started
+                        if stat.size_diff >= 1024
+                        and stat.traceback[0].filename != tracemalloc.__file__
+                    ],
+                }
+            )
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "operation": self.operation,
+            "started_at": self.started_at,
+            "duration_s": round(time.time() - self.started_at, 4),
+            "peak_rss_kib": _peak_rss_kib(),
+            "traced_peak_kib": max(
+                (phase["traced_peak_kib"] for phase in self.phases), default=0
+            ),
+            "phases": self.phases,
+        }
+
+    def write_report(self, directory: str) -> str:
+        """
+        Write the report as JSON and return the path of the file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        timestamp = time.strftime(
+            "%Y%m%d-%H%M%S", time.localtime(self.started_at)
+        )
+        path = os.path.join(
+            directory, f"{self.operation}-{timestamp}-{os.getpid()}.json"
+        )
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+
+# Recorder of the command running on the main thread, if enabled
+_recorder: Optional[OperationRecorder] = None
+
+
+@contextmanager
+def record_operation(operation: str) -> Iterator[Optional[OperationRecorder]]:
+    """
+    Record the phases of a command when FASTCMD_TELEMETRY is set.
+
+    Allocations are traced with tracemalloc only while the command runs,
+    which slows it down and costs memory of its own, hence opt-in. The
+    report is written to TELEMETRY_DIR even when the command fails.
+
+    Yields:
+        Optional[OperationRecorder]: The recorder, None when disabled
+    """
+    global _recorder
+
+    if not TELEMETRY_ENABLED or _recorder is not None:
+        yield None
+        return
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    _recorder = OperationRecorder(operation)
+    try:
+        yield _recorder
+    finally:
+        recorder, _recorder = _recorder, None
+        try:
+            path = recorder.write_report(TELEMETRY_DIR)
+            fastcmd_print(
+                f"📈 Resource report written to {path}",
+                with_front_space=False,
+                with_front_text=False,
+            )
+        except OSError as e:
+            fastcmd_print(
+                f"⚠️ Could not write the resource report: {str(e)}",
+                with_front_space=False,
+                with_front_text=False,
+            )
+        if not was_tracing:
+            tracemalloc.stop()
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Record a phase of the current command, does nothing when not recording.
+    """
+    if _recorder is None:
+        yield
+        return
+    with _recorder.phase(name):
+        yield
@@ -0,0 +1,300 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Union
+
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+
+# Per-request deadline in seconds, covering all retries
+EMBEDDING_TIMEOUT = float(os.getenv("FASTCMD_EMBEDDING_TIMEOUT", "10"))
+EMBEDDING_CONNECT_TIMEOUT = 5.0
+EMBEDDING_RETRIES = int(os.getenv("FASTCMD_EMBEDDING_RETRIES", "3"))
+RETRY_BASE_DELAY = 0.25
+RETRY_MAX_DELAY = 4.0
+
+# Consecutive failures that open the circuit, and how long it stays open
+BREAKER_THRESHOLD = int(os.getenv("FASTCMD_EMBEDDING_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("FASTCMD_EMBEDDING_BREAKER_COOLDOWN", "30"))
+
+# Idle connections are kept open for reuse by the next request
+MAX_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 300.0
+
+LATENCY_SAMPLES = 1000
+
+RETRYABLE_ERRORS = (
+    APIConnectionError,
+    APITimeoutError,
+    RateLimitError,
+    InternalServerError,
+)
+
+
+class EmbeddingUnavailableError(Exception):
+    """
+    Raised when the embedding API cannot be reached within the deadline or
+    the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing API for a cooldown period.
+
+    After `threshold` consecutive failures the circuit opens and requests are
+    rejected without a network call. Once `cooldown` seconds have passed a
+    single trial request is let through, its outcome closes or re-opens the
+    circuit.
+    """
+
+    def __init__(
+        self,
+        threshold: int = BREAKER_THRESHOLD,
+        cooldown: float = BREAKER_COOLDOWN,
+    ) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                return "half-open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+class TransportStats:
+    """
+    Thread-safe request, error and latency counters.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, outcome: str, latency: Optional[float] = None) -> None:
+        with self._lock:
+            if outcome == "success":
+                self.requests += 1
+                self.successes += 1
+            elif outcome == "failure":
+                self.requests += 1
+                self.failures += 1
+            elif outcome == "retry":
+                self.retries += 1
+            elif outcome == "rejected":
+                self.rejected += 1
+            if latency is not None:
+                self._latencies.append(latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+        def percentile(pct: float) -> Optional[float]:
+            if not latencies:
+                return None
+            index = min(len(latencies) - 1, int(pct / 100 * len(latencies)))
+            return round(latencies[index] * 1000, 1)
+
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "latency_p50_ms": percentile(50),
+            "latency_p95_ms": percentile(95),
+            "latency_max_ms": percentile(100),
+        }
+
+
+class EmbeddingTransport:
+    """
+    Long-lived connection to the embeddings API.
+
+    Keeps a pool of keep-alive HTTP connections, so consecutive requests skip
+    the TCP and TLS handshakes. Every call is bounded by a deadline, retried
+    with jittered exponential backoff on transient errors and guarded by a
+    circuit breaker.
+
+    Args:
+        api_key: OpenAI API key
+        base_url: Optional API base URL, defaults to the OpenAI API
+        timeout: Default deadline per call in seconds, including retries
+        max_retries: Retries after the first attempt on transient errors
+        breaker: Circuit breaker, a new one is created when omitted
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        timeout: float = EMBEDDING_TIMEOUT,
+        max_retries: int = EMBEDDING_RETRIES,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = TransportStats()
+        self._http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(timeout, connect=EMBEDDING_CONNECT_TIMEOUT),
+        )
+        # Retries are handled here, so the SDK's own retries are disabled
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=self._http_client,
+            max_retries=0,
+            timeout=timeout,
+        )
+
+    def create_embeddings(
+        self,
+        model: str,
+        input: Union[str, List[str]],
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Call the embeddings endpoint within a deadline.
+
+        Args:
+            model: Embedding model name
+            input: Text or list of texts to embed
+            timeout: Deadline in seconds for this call, including retries
+            **kwargs: Extra arguments passed to embeddings.create
+
+        Returns:
+            The CreateEmbeddingResponse of the API
+
+        Raises:
+            EmbeddingUnavailableError: When the circuit is open, or the API
+                kept failing with transient errors until the deadline or the
+                retry limit
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+
+        if not self.breaker.allow():
+            self.stats.record("rejected")
+            raise EmbeddingUnavailableError(
+                "Embedding API is unavailable after repeated failures, "
+                f"retrying in up to {self.breaker.cooldown:.0f}s"
+            )
+
+        # Whatever ends the call, e.g. an unexpected error or an interrupt
+        # while backing off, has to settle it in the breaker, or a trial
+        # request would keep the circuit half-open for good
+        settled = False
+        attempt = 0
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                started = time.monotonic()
+                try:
+                    response = self.client.embeddings.create(
+                        model=model, input=input, timeout=remaining, **kwargs
+                    )
+                except RETRYABLE_ERRORS as e:
+                    self.stats.record("failure", time.monotonic() - started)
+                    delay = min(
+                        RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2**attempt)
+                    )
+                    delay = random.uniform(0, delay)
+                    out_of_time = time.monotonic() + delay >= deadline
+                    if attempt >= self.max_retries or out_of_time:
+                        self.breaker.record_failure()
+                        settled = True
+                        raise EmbeddingUnavailableError(
+                            f"Embedding request failed: {str(e)}"
+                        ) from e
+                    self.stats.record("retry")
+                    attempt += 1
+                    time.sleep(delay)
+                    continue
+                except APIStatusError:
+                    # Client errors (bad key, bad input) say nothing about
+                    # the health of the API, so they do not count for the
+                    # breaker
+                    self.stats.record("failure", time.monotonic() - started)
+                    self.breaker.record_success()
+                    settled = True
+                    raise
+
+                self.stats.record("success", time.monotonic() - started)
+                self.breaker.record_success()
+                settled = True
+                return response
+        finally:
+            if not settled:
+                self.breaker.record_failure()
+
+    def warm_up(self, timeout: float = EMBEDDING_CONNECT_TIMEOUT) -> None:
+        """
+        Open a pooled connection to the API ahead of the first request.
+
+        Any response completes the TCP and TLS handshakes, so a HEAD request
+        is sent and its status ignored. The embeddings resource, which the
+        SDK loads on first use, is loaded as well. Nothing is recorded in
+        the stats or the circuit breaker.
+
+        Args:
+            timeout: Seconds to wait for the response
+        """
+        self.client.embeddings
+        self._http_client.head(str(self.client.base_url), timeout=timeout)
+
+    def close(self) -> None:
+        self._http_client.close()
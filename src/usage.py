@@ -0,0 +1,301 @@
+import atexit
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from src.embeddings import (
+    UsageMeter,
+    get_embedding_model,
+    get_usage_meter,
+    set_usage_meter,
+)
+from src.vector_database import connect, retry_on_locked
+
+# FASTCMD_DAILY_TOKEN_BUDGET caps the tokens embedded per day by all
+# commands together, 0 disables it
+DAILY_TOKEN_BUDGET = int(os.getenv("FASTCMD_DAILY_TOKEN_BUDGET", "0"))
+
+# FASTCMD_TOKEN_BUDGET_<COMMAND> caps the tokens embedded per day by one
+# command, e.g. FASTCMD_TOKEN_BUDGET_IMPORT or FASTCMD_TOKEN_BUDGET_ADD
+OPERATION_BUDGET_PREFIX = "FASTCMD_TOKEN_BUDGET_"
+
+# USD per million tokens, FASTCMD_EMBEDDING_PRICE overrides the price of the
+# configured model
+MODEL_PRICES = {
+    "text-embedding-ada-002": 0.10,
+    "text-embedding-3-small": 0.02,
+    "text-embedding-3-large": 0.13,
+    "stub": 0.0,
+}
+
+# Tokens are estimated before a request from the length of its texts, about
+# four characters per token for English text
+CHARS_PER_TOKEN = 4
+
+# Seconds usage stays in memory before a background write, so requests do
+# not wait for the database
+USAGE_FLUSH_DELAY = 1.0
+
+# (day, operation, model) of a ledger row
+UsageKey = Tuple[str, str, str]
+
+
+class BudgetExceededError(Exception):
+    """
+    Raised before an embeddings request that would exceed a token budget.
+    """
+
+
+def today() -> str:
+    return time.strftime("%Y-%m-%d")
+
+
+def estimate_tokens(texts: Iterable[str]) -> int:
+    return sum(math.ceil(len(text) / CHARS_PER_TOKEN) for text in texts)
+
+
+def estimate_cost(model: str, tokens: int) -> Optional[float]:
+    """
+    Return the price of tokens in USD, None for models of unknown price.
+    """
+    price = os.getenv("FASTCMD_EMBEDDING_PRICE")
+    if price is not None and model == get_embedding_model():
+        return tokens * float(price) / 1_000_000
+    if model not in MODEL_PRICES:
+        return None
+    return tokens * MODEL_PRICES[model] / 1_000_000
+
+
+def get_budgets(operation: str) -> Dict[str, int]:
+    """
+    Return the daily budgets applying to an operation, by name.
+    """
+    budgets = {}
+    if DAILY_TOKEN_BUDGET:
+        budgets["daily"] = DAILY_TOKEN_BUDGET
+    variable = OPERATION_BUDGET_PREFIX + operation.upper().replace("-", "_")
+    budget = int(os.getenv(variable, "0"))
+    if budget:
+        budgets[operation] = budget
+    return budgets
+
+
+@retry_on_locked
+def record_usage(
+    usage: Dict[UsageKey, Tuple[int, int]], db_path: Optional[str] = None
+) -> None:
+    """
+    Add (requests, tokens) by (day, operation, model) to the ledger in one
+    transaction.
+    """
+    conn = connect(db_path)
+    try:
+        conn.executemany(
+            """
+            INSERT INTO embedding_usage (day, operation, model, requests, tokens)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (day, operation, model) DO UPDATE SET
+                requests = requests + excluded.requests,
+                tokens = tokens + excluded.tokens
+        """,
+            [
+                (day, operation, model, requests, tokens)
+                for (day, operation, model), (
+                    requests,
+                    tokens,
+                ) in usage.items()
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@retry_on_locked
+def tokens_used(
+    day: str, operation: Optional[str] = None, db_path: Optional[str] = None
+) -> int:
+    conn = connect(db_path)
+    try:
+        if operation is None:
+            row = conn.execute(
+                "SELECT SUM(tokens) FROM embedding_usage WHERE day = ?",
+                (day,),
+            ).fetchone()
+        else:
+            row = conn.execute(
+                """
+                SELECT SUM(tokens) FROM embedding_usage
+                WHERE day = ? AND operation = ?
+            """,
+                (day, operation),
+            ).fetchone()
+        used = row[0] or 0
+    finally:
+        conn.close()
+
+    meter = get_usage_meter()
+    if isinstance(meter, LedgerMeter):
+        # Not written yet
+        used += meter.unflushed_tokens(day, operation)
+    return used
+
+
+def check_budget(
+    operation: str, tokens: int, db_path: Optional[str] = None
+) -> None:
+    """
+    Check that embedding tokens more today stays within the budgets.
+
+    Raises:
+        BudgetExceededError: If a daily or per-command budget would be
+            exceeded
+    """
+    day = today()
+    for name, budget in get_budgets(operation).items():
+        used = tokens_used(
+            day, None if name == "daily" else operation, db_path
+        )
+        if used + tokens > budget:
+            scope = "daily" if name == "daily" else f"daily '{name}'"
+            raise BudgetExceededError(
+                f"Embedding about {tokens} more tokens would exceed the "
+                f"{scope} budget of {budget} tokens, {used} used today"
+            )
+
+
+@retry_on_locked
+def fetch_usage(days: int = 7, db_path: Optional[str] = None) -> List[dict]:
+    """
+    Fetch the usage of the last days, newest day first.
+
+    Returns:
+        List[dict]: day, operation, model, requests and tokens of every
+        recorded combination
+    """
+    get_usage_meter().flush()
+    since = time.strftime(
+        "%Y-%m-%d", time.localtime(time.time() - (days - 1) * 86400)
+    )
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT day, operation, model, requests, tokens
+            FROM embedding_usage WHERE day >= ?
+            ORDER BY day DESC, tokens DESC
+        """,
+            (since,),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [
+        {
+            "day": day,
+            "operation": operation,
+            "model": model,
+            "requests": requests,
+            "tokens": tokens,
+        }
+        for day, operation, model, requests, tokens in rows
+    ]
+
+
+class LedgerMeter(UsageMeter):
+    """
+    Usage meter keeping the ledger in the embedding_usage table.
+
+    Tokens are those reported by the API, or estimated from the texts when
+    it reports none, like for the stub provider. Budgets are checked with
+    the estimate before every request, counting usage not written yet.
+
+    Usage is buffered in memory and written by a background timer
+    USAGE_FLUSH_DELAY seconds after a request, and at exit. Usage that
+    cannot be written, e.g. while another session holds the write lock, is
+    kept for the next flush.
+
+    Args:
+        db_path: Optional path to the database file
+    """
+
+    def __init__(self, db_path: Optional[str] = None) -> None:
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._unflushed: Dict[UsageKey, Tuple[int, int]] = {}
+        self._timer: Optional[threading.Timer] = None
+        atexit.register(self.flush)
+
+    def unflushed_tokens(self, day: str, operation: Optional[str]) -> int:
+        with self._lock:
+            return sum(
+                tokens
+                for (row_day, row_operation, _), (_, tokens) in (
+                    self._unflushed.items()
+                )
+                if row_day == day
+                and (operation is None or row_operation == operation)
+            )
+
+    def flush(self) -> None:
+        # One flush at a time, so usage put back by a failed one is not
+        # overtaken by a later one
+        with self._flush_lock:
+            with self._lock:
+                usage, self._unflushed = self._unflushed, {}
+                self._timer = None
+            if not usage:
+                return
+            try:
+                record_usage(usage, self.db_path)
+            except sqlite3.Error:
+                # Still locked after the retries, or before init_db
+                with self._lock:
+                    for key, (requests, tokens) in usage.items():
+                        self._add(key, requests, tokens)
+                self._schedule()
+
+    def _add(self, key: UsageKey, requests: int, tokens: int) -> None:
+        previous = self._unflushed.get(key, (0, 0))
+        self._unflushed[key] = (previous[0] + requests, previous[1] + tokens)
+
+    def _schedule(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(USAGE_FLUSH_DELAY, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def check(self, operation: str, model: str, texts: Sequence[str]) -> None:
+        if not get_budgets(operation):
+            return
+        try:
+            check_budget(operation, estimate_tokens(texts), self.db_path)
+        except sqlite3.Error:
+            # Accounting must not stop embeddings, e.g. before init_db
+            pass
+
+    def record(
+        self,
+        operation: str,
+        model: str,
+        texts: Sequence[str],
+        tokens: Optional[int],
+    ) -> None:
+        if tokens is None:
+            tokens = estimate_tokens(texts)
+        with self._lock:
+            self._add((today(), operation, model), 1, tokens)
+        self._schedule()
+
+
+def install_usage_meter(db_path: Optional[str] = None) -> None:
+    """
+    Record the tokens of every embeddings request of the process and
+    enforce the budgets.
+    """
+    set_usage_meter(LedgerMeter(db_path))
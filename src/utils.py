@@ -6,9 +6,11 @@ from typing import Optional
 
 from src.config import load_api_key, save_api_key
 
+PROMPT = "fastcmd> "
+
 
 def get_user_input() -> Optional[str]:
-    user_input = input("fastcmd> ")
+    user_input = input(PROMPT)
     if user_input.lower() in ["exit", "quit"]:
         return None
     return user_input
@@ -70,10 +72,42 @@ def parse_command(user_input: str) -> Namespace:
     parser_add.add_argument(
         "-c", "--commandrun", required=True, help="The command to run"
     )
+    parser_add.add_argument(
+        "--alias",
+        action="store_true",
+        help="Add the description to the saved command instead of saving "
+        "it again",
+    )
     parser_add.add_argument(
         "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
     )
 
+    # Subparser for 'update' command
+    parser_update = subparsers.add_parser(
+        "update", help="Change the command or description of a saved command"
+    )
+    parser_update.add_argument(
+        "id", type=int, help="Id of the command, shown by search"
+    )
+    parser_update.add_argument(
+        "-d", "--description", help="New description of the command"
+    )
+    parser_update.add_argument("-c", "--commandrun", help="New command to run")
+    parser_update.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'delete' command
+    parser_delete = subparsers.add_parser(
+        "delete", help="Delete a saved command"
+    )
+    parser_delete.add_argument(
+        "id", type=int, help="Id of the command, shown by search"
+    )
+    parser_delete.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
     # Subparser for 'search' command
     parser_search = subparsers.add_parser("search", help="search a command")
     parser_search.add_argument(
@@ -94,6 +128,12 @@ def parse_command(user_input: str) -> Namespace:
             "If not specified, saves to Desktop with timestamp."
         ),
     )
+    parser_export.add_argument(
+        "-b",
+        "--background",
+        action="store_true",
+        help="Run as a job and keep using the prompt meanwhile",
+    )
     parser_export.add_argument(
         "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
     )
@@ -106,6 +146,245 @@ def parse_command(user_input: str) -> Namespace:
         "-i", "--input", required=True, help="Path to the JSON file to import"
     )
     parser_import.add_argument(
+        "-b",
+        "--background",
+        action="store_true",
+        help="Run as a job and keep using the prompt meanwhile",
+    )
+    parser_import.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'ingest-history' command
+    parser_ingest_history = subparsers.add_parser(
+        "ingest-history",
+        help="Save the commands of bash/zsh history files",
+    )
+    parser_ingest_history.add_argument(
+        "-f",
+        "--file",
+        action="append",
+        help="History file to read, defaults to the bash and zsh histories",
+    )
+    parser_ingest_history.add_argument(
+        "--describer",
+        help="Description generator: summary, command or module:function",
+    )
+    parser_ingest_history.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'sync-export' command
+    parser_sync_export = subparsers.add_parser(
+        "sync-export", help="Export changes to merge into another machine"
+    )
+    parser_sync_export.add_argument(
+        "--since",
+        type=int,
+        default=0,
+        help="Cursor printed by the previous sync-export, 0 for everything",
+    )
+    parser_sync_export.add_argument(
+        "-o",
+        "--output",
+        default="-",
+        help="Path to write the sync file to, or - for stdout",
+    )
+    parser_sync_export.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'sync-import' command
+    parser_sync_import = subparsers.add_parser(
+        "sync-import", help="Merge changes exported on another machine"
+    )
+    parser_sync_import.add_argument(
+        "-i",
+        "--input",
+        required=True,
+        help="Path to a file written by sync-export, or - for stdin",
+    )
+    parser_sync_import.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'batch-search' command
+    parser_batch_search = subparsers.add_parser(
+        "batch-search",
+        help="Search many descriptions from a file or stdin, one per line",
+    )
+    parser_batch_search.add_argument(
+        "-i",
+        "--input",
+        required=True,
+        help="Path to a file with one description per line, or - for stdin",
+    )
+    parser_batch_search.add_argument(
+        "-k",
+        "--top-k",
+        type=int,
+        default=1,
+        help="Number of matches to return per description",
+    )
+    parser_batch_search.add_argument(
+        "-o",
+        "--output",
+        help="Path to write JSONL results to instead of stdout",
+    )
+    parser_batch_search.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'serve' command
+    parser_serve = subparsers.add_parser(
+        "serve", help="Serve add/search/export/import over HTTP"
+    )
+    parser_serve.add_argument(
+        "--host", default="127.0.0.1", help="Address to listen on"
+    )
+    parser_serve.add_argument(
+        "--port", type=int, default=8765, help="Port to listen on"
+    )
+    parser_serve.add_argument(
+        "--pool-size",
+        type=int,
+        default=4,
+        help="Number of pooled database connections",
+    )
+    parser_serve.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of threads calling the embedding provider",
+    )
+    parser_serve.add_argument(
+        "--batch-window-ms",
+        type=float,
+        default=5.0,
+        help="How long concurrent searches wait to share an embedding request",
+    )
+    parser_serve.add_argument(
+        "--embedding-provider",
+        choices=["openai", "stub"],
+        help="Override the embedding provider (stub is for local testing)",
+    )
+    parser_serve.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'reindex' command
+    parser_reindex = subparsers.add_parser(
+        "reindex", help="Re-embed all commands, resuming unfinished jobs"
+    )
+    parser_reindex.add_argument(
+        "-m", "--model", help="Embedding model to re-embed with"
+    )
+    parser_reindex.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="Descriptions embedded per request and per checkpoint",
+    )
+    parser_reindex.add_argument(
+        "--restart",
+        action="store_true",
+        help="Discard the checkpoint of an unfinished job and start over",
+    )
+    parser_reindex.add_argument(
+        "--status",
+        action="store_true",
+        help="Show the progress of an unfinished job without running it",
+    )
+    parser_reindex.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'maintain' command
+    parser_maintain = subparsers.add_parser(
+        "maintain",
+        help="Report on the database, clean it up and compact it",
+    )
+    parser_maintain.add_argument(
+        "--full",
+        action="store_true",
+        help="Rewrite the whole file with VACUUM instead of only "
+        "releasing free pages",
+    )
+    parser_maintain.add_argument(
+        "--check",
+        action="store_true",
+        help="Only report row counts, sizes and search latency",
+    )
+    parser_maintain.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'reshard' command
+    parser_reshard = subparsers.add_parser(
+        "reshard",
+        help="Spread the commands over several database files",
+    )
+    parser_reshard.add_argument(
+        "--shards",
+        type=int,
+        required=True,
+        help="Number of shard files, 1 moves the commands back into one "
+        "database",
+    )
+    parser_reshard.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'related' command
+    parser_related = subparsers.add_parser(
+        "related", help="Show the commands closest to a saved command"
+    )
+    parser_related.add_argument(
+        "id", type=int, nargs="?", help="Id of the saved command"
+    )
+    parser_related.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Recompute the related commands of all saved commands",
+    )
+    parser_related.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'jobs' command
+    parser_jobs = subparsers.add_parser(
+        "jobs", help="List the commands running in the background"
+    )
+    parser_jobs.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'job' command
+    parser_job = subparsers.add_parser(
+        "job", help="Show or cancel a command running in the background"
+    )
+    parser_job.add_argument("action", choices=["status", "cancel"])
+    parser_job.add_argument("id", type=int, help="Id of the job, see jobs")
+    parser_job.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'usage' command
+    parser_usage = subparsers.add_parser(
+        "usage", help="Report the embedding tokens used per day and command"
+    )
+    parser_usage.add_argument(
+        "--days", type=int, default=7, help="Number of days to report"
+    )
+    parser_usage.add_argument(
+        "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
+    )
+
+    # Subparser for 'stats' command
+    parser_stats = subparsers.add_parser(
+        "stats", help="Show embedding API latency and error counters"
+    )
+    parser_stats.add_argument(
         "--set-api-key", type=str, metavar="API_KEY", help=argparse.SUPPRESS
     )
 
@@ -138,12 +417,65 @@ def print_instructions() -> None:
             "add -c <command> -d <description>",
             "Add a new command with a description",
         ),
+        (
+            "add -c <cmd> -d <desc> --alias",
+            "Find a saved command by one more description",
+        ),
         ("search -d <description>", "Search saved commands by description"),
+        (
+            "update <id> [-c <cmd>] [-d <desc>]",
+            "Edit a saved command, re-embedding changed descriptions",
+        ),
+        ("delete <id>", "Delete a saved command"),
+        (
+            "related <id> | --rebuild",
+            "Show the commands closest to a saved one",
+        ),
         (
             "export [-o <output_path>]",
             "Export all commands to a JSON file (default path if not provided)",
         ),
         ("import -i <input_path>", "Import commands from a JSON file"),
+        (
+            "import/export ... --background",
+            "Run as a job while you keep searching",
+        ),
+        ("jobs", "List background jobs and their progress"),
+        ("job status|cancel <id>", "Show the output of a job or stop it"),
+        (
+            "ingest-history [-f <path>]",
+            "Save new commands from your bash/zsh history",
+        ),
+        (
+            "sync-export [--since <n>] [-o <p>]",
+            "Export changes since a cursor for another machine",
+        ),
+        (
+            "sync-import -i <path|->",
+            "Merge changes exported on another machine",
+        ),
+        (
+            "batch-search -i <path|-> [-k <n>]",
+            "Search descriptions listed one per line, output JSONL",
+        ),
+        (
+            "reindex [-m <model>] [--status]",
+            "Re-embed all commands, search stays available meanwhile",
+        ),
+        (
+            "serve [--host <h>] [--port <p>]",
+            "Share the command catalog over a local HTTP API",
+        ),
+        ("stats", "Show embedding API latency and error counters"),
+        ("usage [--days <n>]", "Report embedding tokens and cost per day"),
+        (
+            "maintain [--full] [--check]",
+            "Report on the database, clean it up and compact it",
+        ),
+        (
+            "reshard --shards <n>",
+            "Spread the commands over n database files",
+        ),
         ("exit / quit", "Exit the FastCmd application"),
     ]
 
@@ -159,6 +491,10 @@ def print_instructions() -> None:
         "  - The JSON file used in export/import must follow FastCmd format",
         with_front_text=False,
     )
+    fastcmd_print(
+        "  - Press Tab after search -d to complete saved descriptions",
+        with_front_text=False,
+    )
     fastcmd_print("", with_front_text=False)
 
 
@@ -171,10 +507,67 @@ def print_command_match(result: dict, distance_percent: int) -> None:
         with_front_space=False,
     )
     fastcmd_print(
-        f"📝 Description : {result['description']}\n",
+        f"📝 Description : {result['description']}",
         with_front_text=False,
         with_front_space=False,
     )
+    if result.get("alias"):
+        fastcmd_print(
+            f"🔁 Matched alias: {result['alias']}",
+            with_front_text=False,
+            with_front_space=False,
+        )
+    if result.get("pack"):
+        # Pack commands are read-only, their ids cannot be updated or deleted
+        fastcmd_print(
+            f"📦 Pack: {result['pack']}\n",
+            with_front_text=False,
+            with_front_space=False,
+        )
+    else:
+        fastcmd_print(
+            f"🆔 Id: {result.get('id', '-')}\n",
+            with_front_text=False,
+            with_front_space=False,
+        )
+    if result.get("pending"):
+        fastcmd_print(
+            "⏳ Matched by words, its embedding is still being calculated\n",
+            with_front_text=False,
+            with_front_space=False,
+        )
+    elif result.get("degraded"):
+        fastcmd_print(
+            "⚠️ Embedding API did not answer in time, matched locally\n",
+            with_front_text=False,
+            with_front_space=False,
+        )
+    if result.get("related"):
+        fastcmd_print(
+            "🔗 See also:", with_front_text=False, with_front_space=False
+        )
+        for related in result["related"]:
+            fastcmd_print(
+                f"   {related['command']}  # {related['description']} "
+                f"(id {related['id']})",
+                with_front_text=False,
+                with_front_space=False,
+            )
+        fastcmd_print("", with_front_text=False, with_front_space=False)
+    if result.get("pending_matches"):
+        fastcmd_print(
+            "⏳ Not embedded yet, matched by words:",
+            with_front_text=False,
+            with_front_space=False,
+        )
+        for pending in result["pending_matches"]:
+            fastcmd_print(
+                f"   {pending['command']}  # {pending['description']} "
+                f"(id {pending['id']})",
+                with_front_text=False,
+                with_front_space=False,
+            )
+        fastcmd_print("", with_front_text=False, with_front_space=False)
 
     # fastcmd_print(
     #     f"\n▶ You can copy the command and use it\n",
@@ -1,151 +1,2101 @@
+import atexit
+import functools
+import heapq
+import itertools
 import os
+import queue
+import random
+import re
 import sqlite3
 import struct
-from typing import List, Optional
+import threading
+import time
+import uuid
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from urllib.parse import quote
 
 import sqlite_vec
 
+from src.embeddings import EMBEDDING_DIMENSIONS, set_index_model
+
+T = TypeVar("T")
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 # This will be used to override the database path during testing
 # If TEST_DB_PATH is set, it will be used instead of DEFAULT_DB_PATH
-TEST_DB_PATH = os.path.join(
-    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-    "commands-test.db",
-)
+TEST_DB_PATH = os.path.join(PROJECT_DIR, "commands-test.db")
+
+
+def _default_db_dir() -> str:
+    # A source checkout keeps the database in the project, an installed
+    # package uses the same directory the Docker launcher mounts
+    if os.path.exists(os.path.join(PROJECT_DIR, "setup.py")):
+        return PROJECT_DIR
+    return os.path.join(os.path.expanduser("~"), ".fastcmd", "db")
+
 
 # Get database path from environment or use default
 DEFAULT_DB_PATH = os.path.join(
-    os.getenv(
-        "FASTCMD_DB_DIR",
-        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-    ),
-    "commands.db",
+    os.getenv("FASTCMD_DB_DIR", _default_db_dir()), "commands.db"
 )
 
+# Read-only command catalogs (*.db) searched alongside the user database
+PACK_DIR = os.getenv(
+    "FASTCMD_PACK_DIR", os.path.join(os.path.dirname(DEFAULT_DB_PATH), "packs")
+)
+PACK_WORKERS = int(os.getenv("FASTCMD_PACK_WORKERS", "4"))
+
+# Connection tuning applied to every connection. The database directory may
+# be shared by several processes (e.g. containers mounting the same
+# FASTCMD_DB_DIR), so WAL is used to let readers run alongside a writer and a
+# busy timeout makes writers wait for each other instead of failing.
+DB_BUSY_TIMEOUT_MS = int(os.getenv("FASTCMD_DB_BUSY_TIMEOUT_MS", "5000"))
+# Negative values are in KiB, positive values in pages (SQLite semantics)
+DB_CACHE_SIZE = int(os.getenv("FASTCMD_DB_CACHE_SIZE", "-16000"))
+DB_MMAP_SIZE = int(os.getenv("FASTCMD_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_SYNCHRONOUS = os.getenv("FASTCMD_DB_SYNCHRONOUS", "NORMAL").upper()
+# Attempts made when a write still hits a lock after the busy timeout
+DB_LOCK_RETRIES = int(os.getenv("FASTCMD_DB_LOCK_RETRIES", "5"))
+DB_LOCK_RETRY_DELAY = 0.05
+
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# FASTCMD_DB_MEMORY=1 keeps the database in memory, shared by every
+# connection of the process. It can be loaded from commands.db when the first
+# connection opens, and copied back to it when the process exits.
+DB_MEMORY = os.getenv("FASTCMD_DB_MEMORY") == "1"
+DB_MEMORY_HYDRATE = os.getenv("FASTCMD_DB_MEMORY_HYDRATE") == "1"
+DB_MEMORY_SNAPSHOT = os.getenv("FASTCMD_DB_MEMORY_SNAPSHOT") == "1"
+
+VECTOR_TABLE = "vec_commands"
+
+# Vectors of further descriptions of commands, keyed by command_aliases.id
+ALIAS_VECTOR_TABLE = "vec_aliases"
+
+# New vectors of an unfinished re-index, see src/reindex.py
+REINDEX_TABLE = "vec_commands_reindex"
+
+# Model the vectors of vec_commands were calculated with, stored in
+# fastcmd_meta by re-index
+INDEX_MODEL_KEY = "embedding_model"
+# Searches fetch top_k * MAX_ALIASES alias vectors, which always contain the
+# best alias of the top_k commands matched through an alias
+MAX_ALIASES = 16
+# Largest k accepted by a vec0 KNN query
+MAX_KNN = 4096
+
+# Vectors are normalized when written, so vec0 compares unit vectors. The
+# metric of new vector tables is "cosine" or "l2", both rank like the dot
+# product and convert exactly to cosine similarity, see to_cosine_distance.
+DISTANCE_METRIC = os.getenv("FASTCMD_DISTANCE_METRIC", "cosine").lower()
+DISTANCE_METRICS = ("cosine", "l2")
+# Metric of every vector table, stored as "<prefix><table>" in fastcmd_meta
+METRIC_KEY_PREFIX = "vector_metric."
+
+# Identifies this database in the change log, see record_change
+NODE_ID_KEY = "sync.node_id"
+# Set once the commands saved before the change log existed were versioned
+SYNC_BACKFILLED_KEY = "sync.backfilled"
+
+# (embedding, command, description, [(embedding, alias), ...]) of an imported
+# command, see import_entries
+ImportEntry = Tuple[
+    Sequence[float], str, str, List[Tuple[Sequence[float], str]]
+]
+
+# Most recent query embeddings kept for reuse, see cache_query_embedding
+QUERY_CACHE_SIZE = 1000
+
+# Failed embedding attempts after which a queued command is parked: it is no
+# longer fetched by fetch_pending until its description changes
+MAX_EMBEDDING_ATTEMPTS = int(os.getenv("FASTCMD_MAX_EMBEDDING_ATTEMPTS", "5"))
+
+
+def memory_db_uri(name: str = "fastcmd") -> str:
+    return f"file:{name}?mode=memory&cache=shared"
+
+
+def is_memory_db(db_path: str) -> bool:
+    return db_path.startswith("file:") and "mode=memory" in db_path
+
+
+# Connection keeping the in-memory database of FASTCMD_DB_MEMORY alive
+_memory_db: Optional[sqlite3.Connection] = None
+_memory_db_lock = threading.Lock()
+
 
 def get_db_path() -> str:
     """
-    Return TEST_DB_PATH if we're explicitly in test mode, else DEFAULT_DB_PATH.
+    Return TEST_DB_PATH if we're explicitly in test mode, the URI of the
+    in-memory database if FASTCMD_DB_MEMORY is set, else DEFAULT_DB_PATH.
     """
+    global _memory_db
+
     if os.getenv("TESTING") == "1":
         return TEST_DB_PATH
-    else:
+    if not DB_MEMORY:
         return DEFAULT_DB_PATH
 
+    with _memory_db_lock:
+        if _memory_db is None:
+            _memory_db = open_memory_db(
+                memory_db_uri(),
+                hydrate_from=DEFAULT_DB_PATH if DB_MEMORY_HYDRATE else None,
+            )
+            atexit.register(close_memory_db)
+    return memory_db_uri()
+
+
+def close_memory_db() -> None:
+    """
+    Release the in-memory database, first copying it to DEFAULT_DB_PATH when
+    FASTCMD_DB_MEMORY_SNAPSHOT is set.
+    """
+    global _memory_db
+
+    with _memory_db_lock:
+        if _memory_db is None:
+            return
+        if DB_MEMORY_SNAPSHOT:
+            snapshot_db(_memory_db, DEFAULT_DB_PATH)
+        _memory_db.close()
+        _memory_db = None
+
 
 # serialize embedding to bytes
-def serialize(vector: List[float]) -> bytes:
+def serialize(vector: Sequence[float]) -> Union[bytes, memoryview]:
+    # float32 arrays already hold the blob sqlite-vec expects, so they are
+    # passed to SQLite without converting a single float
+    if isinstance(vector, array) and vector.typecode == "f":
+        return memoryview(vector)
     return struct.pack("%sf" % len(vector), *vector)
 
 
-def init_db(db_path: Optional[str] = None) -> None:
+def serialize_batch(vectors: Sequence[Sequence[float]]) -> List[memoryview]:
+    """
+    Serialize many vectors into one shared float32 buffer.
+
+    Bulk loads pack every vector of a batch into a single allocation and
+    hand SQLite a view of each slice, instead of one bytes object per vector.
+
+    Returns:
+        List[memoryview]: One float32 blob per vector, in input order
+    """
+    buffer = array("f")
+    bounds = []
+    for vector in vectors:
+        start = len(buffer)
+        buffer.extend(vector)
+        bounds.append((start, len(buffer)))
+
+    view = memoryview(buffer)
+    return [view[start:end] for start, end in bounds]
+
+
+def deserialize(blob: bytes) -> Sequence[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector
+
+
+def connect(
+    db_path: Optional[str] = None, check_same_thread: bool = True
+) -> sqlite3.Connection:
+    """
+    Open a connection to the database with the sqlite-vec extension loaded.
+
+    Args:
+        db_path: Optional path to the database file
+        check_same_thread: Set to False for connections handed between
+            threads, e.g. by a ConnectionPool
+
+    Returns:
+        sqlite3.Connection: Open connection, the caller is responsible for
+        closing it
+    """
     db_path = db_path or get_db_path()
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(
+        db_path,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=check_same_thread,
+        uri=db_path.startswith("file:"),
+    )
     conn.enable_load_extension(True)
     sqlite_vec.load(conn)
     conn.enable_load_extension(False)
+    apply_pragmas(conn)
+    return conn
 
-    conn.execute(
+
+def open_memory_db(
+    uri: str, hydrate_from: Optional[str] = None
+) -> sqlite3.Connection:
+    """
+    Create a shared-cache in-memory database.
+
+    Every connection to the URI sees the same database, which lives as long
+    as at least one of them is open.
+
+    Args:
+        uri: URI of the database, see memory_db_uri
+        hydrate_from: Optional database file copied into memory
+
+    Returns:
+        sqlite3.Connection: Connection keeping the database alive, closing
+        it discards the database once no other connection is open
+    """
+    conn = connect(uri, check_same_thread=False)
+    if hydrate_from and os.path.exists(hydrate_from):
+        source = connect(hydrate_from)
+        try:
+            source.backup(conn)
+        finally:
+            source.close()
+    return conn
+
+
+def snapshot_db(conn: sqlite3.Connection, path: str) -> None:
+    """
+    Copy a database to a file with the SQLite backup API.
+
+    The copy is consistent even while other connections keep writing.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    target = connect(path)
+    try:
+        conn.backup(target)
+    finally:
+        target.close()
+
+
+def apply_pragmas(conn: sqlite3.Connection) -> None:
+    """
+    Apply the journal, cache, mmap and durability settings to a connection.
+
+    Args:
+        conn: Connection to tune
+    """
+    if DB_SYNCHRONOUS not in SYNCHRONOUS_LEVELS:
+        raise ValueError(
+            f"Invalid FASTCMD_DB_SYNCHRONOUS value '{DB_SYNCHRONOUS}', "
+            f"expected one of {', '.join(SYNCHRONOUS_LEVELS)}"
+        )
+
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    # WAL is persistent in the database file, only switch when needed since
+    # changing the journal mode requires a write lock
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if journal_mode not in ("wal", "memory"):
+        # auto_vacuum can only be set before the first page is written,
+        # existing databases switch on 'maintain --full'
+        if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        _retry_on_locked(
+            lambda: conn.execute("PRAGMA journal_mode = WAL").fetchone()
+        )
+    conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = {DB_CACHE_SIZE}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+
+
+def _is_locked_error(error: sqlite3.OperationalError) -> bool:
+    # "database table is locked" is raised at once, without waiting on the
+    # busy timeout, when a connection to the shared-cache in-memory database
+    # reads a table another one is writing
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def _retry_on_locked(operation: Callable[[], T]) -> T:
+    """
+    Run an operation, retrying with jittered backoff while the DB is locked.
+    """
+    for attempt in range(DB_LOCK_RETRIES):
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            if not _is_locked_error(e) or attempt == DB_LOCK_RETRIES - 1:
+                raise
+            delay = DB_LOCK_RETRY_DELAY * (2**attempt)
+            time.sleep(delay + random.uniform(0, delay))
+    raise RuntimeError("DB_LOCK_RETRIES must be at least 1")
+
+
+def retry_on_locked(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Decorator retrying a database function while the DB is locked.
+
+    The decorated function must open and close its own connection, so every
+    attempt starts from a clean transaction.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        return _retry_on_locked(lambda: func(*args, **kwargs))
+
+    return wrapper
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of tuned connections to one database, shared by threads.
+
+    Args:
+        db_path: Optional path to the database file
+        size: Number of connections kept open
+    """
+
+    def __init__(self, db_path: Optional[str] = None, size: int = 4) -> None:
+        self.db_path = db_path or get_db_path()
+        self._connections: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(size):
+            self._connections.put(
+                connect(self.db_path, check_same_thread=False)
+            )
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
         """
-        CREATE TABLE IF NOT EXISTS commands (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            command TEXT,
-            description TEXT
-        );
+        Borrow a connection, blocking until one is free.
+
+        Uncommitted work is rolled back when the block raises, so the next
+        borrower always gets a connection outside of a transaction.
+        """
+        conn = self._connections.get()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._connections.put(conn)
+
+    def close(self) -> None:
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+
+@retry_on_locked
+def init_db(db_path: Optional[str] = None) -> None:
+    db_path = db_path or get_db_path()
+    if not is_memory_db(db_path):
+        # Installed packages create ~/.fastcmd/db on first use
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = connect(db_path)
+    try:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS commands (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                command TEXT,
+                description TEXT
+            );
+        """
+        )
+
+        # Looked up by ingest-history to skip commands saved already
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_commands_command
+            ON commands (command);
+        """
+        )
+
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fastcmd_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """
+        )
+
+        create_vector_table(conn)
+
+        # Further descriptions of commands, see enqueue_alias
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS command_aliases (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                command_id INTEGER NOT NULL,
+                description TEXT NOT NULL,
+                UNIQUE (command_id, description)
+            );
+        """
+        )
+        create_vector_table(
+            conn,
+            ALIAS_VECTOR_TABLE,
+            _vector_dimensions(conn, VECTOR_TABLE),
+            get_vector_metric(conn),
+        )
+
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS query_cache (
+                query TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                used_at REAL NOT NULL
+            );
+        """
+        )
+
+        # Commands saved without a vector yet, see src/write_queue.py
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_embeddings (
+                command_id INTEGER PRIMARY KEY,
+                enqueued_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            );
+        """
+        )
+
+        # Version of every command for last-writer-wins sync between
+        # databases, deleted commands stay as tombstones
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS command_sync (
+                uuid TEXT PRIMARY KEY,
+                command_id INTEGER UNIQUE,
+                updated_at REAL NOT NULL,
+                origin TEXT NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+        """
+        )
+
+        # Append-only log of changes, its seq is the cursor of sync-export
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS change_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                uuid TEXT NOT NULL,
+                op TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                origin TEXT NOT NULL
+            );
+        """
+        )
+
+        # Nearest neighbours of every command, see src/related.py
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS related_commands (
+                command_id INTEGER NOT NULL,
+                related_id INTEGER NOT NULL,
+                distance REAL NOT NULL,
+                PRIMARY KEY (command_id, related_id)
+            ) WITHOUT ROWID;
+        """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_related_commands_related_id
+            ON related_commands (related_id);
+        """
+        )
+
+        # Embedding requests and tokens per day and command, see src/usage.py
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_usage (
+                day TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                model TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                tokens INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, operation, model)
+            );
+        """
+        )
+
+        if get_meta(conn, NODE_ID_KEY) is None:
+            set_meta(conn, NODE_ID_KEY, uuid.uuid4().hex)
+
+        # Commands saved before the change log existed, every later insert
+        # records its change
+        if get_meta(conn, SYNC_BACKFILLED_KEY) is None:
+            untracked = conn.execute(
+                """
+                SELECT id FROM commands
+                WHERE id NOT IN (
+                    SELECT command_id FROM command_sync
+                    WHERE command_id IS NOT NULL
+                )
+            """
+            ).fetchall()
+            for (entry_id,) in untracked:
+                record_change(conn, entry_id, "upsert")
+            set_meta(conn, SYNC_BACKFILLED_KEY, "1")
+        conn.commit()
+
+        # Tables of raw vectors, or of another metric than configured
+        if get_meta(conn, METRIC_KEY_PREFIX + VECTOR_TABLE) != DISTANCE_METRIC:
+            migrate_vector_table(conn, DISTANCE_METRIC)
+
+        if db_path == get_db_path():
+            # Queries have to be embedded like the stored vectors
+            set_index_model(get_meta(conn, INDEX_MODEL_KEY))
+    finally:
+        conn.close()
+
+
+def create_vector_table(
+    conn: sqlite3.Connection,
+    table: str = VECTOR_TABLE,
+    dimensions: int = EMBEDDING_DIMENSIONS,
+    metric: Optional[str] = None,
+) -> None:
     """
-    )
+    Create a vec0 table unless it exists, recording its distance metric.
+
+    Args:
+        conn: Open connection
+        table: Name of the vec0 table
+        dimensions: Dimensions of the vectors
+        metric: "cosine" or "l2", defaults to DISTANCE_METRIC
+    """
+    metric = metric or DISTANCE_METRIC
+    if metric not in DISTANCE_METRICS:
+        raise ValueError(
+            f"Invalid distance metric '{metric}', "
+            f"expected one of {', '.join(DISTANCE_METRICS)}"
+        )
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (table,)
+    ).fetchone()
+    if exists:
+        return
 
     conn.execute(
-        """
-        CREATE VIRTUAL TABLE IF NOT EXISTS vec_commands USING vec0(
+        f"""
+        CREATE VIRTUAL TABLE {table} USING vec0(
             id INTEGER PRIMARY KEY,
-            embedding FLOAT[1536]
+            embedding FLOAT[{dimensions}] distance_metric={metric}
         );
     """
     )
-    conn.commit()
-    conn.close()
+    set_meta(conn, METRIC_KEY_PREFIX + table, metric)
 
 
-def add_entry(
-    embedding: List[float],
-    command: str,
-    description: str,
-    db_path: Optional[str] = None,
+def get_vector_metric(
+    conn: sqlite3.Connection, table: str = VECTOR_TABLE
+) -> str:
+    """
+    Return the distance metric of a vec0 table.
+
+    Tables created before the metric was recorded, e.g. in packs built by
+    older versions, compare raw vectors by L2 distance.
+    """
+    try:
+        return get_meta(conn, METRIC_KEY_PREFIX + table) or "l2"
+    except sqlite3.OperationalError:
+        # Databases without fastcmd_meta
+        return "l2"
+
+
+def to_cosine_distance(metric: str, distance: Optional[float]) -> float:
+    """
+    Convert a vec0 distance between unit vectors into 1 - cosine similarity.
+    """
+    if distance is None:
+        # Zero vectors have no direction, hence no similarity
+        return 1.0
+    if metric == "l2":
+        # |a - b|^2 = 2 - 2 * a.b for unit vectors a and b
+        return distance * distance / 2
+    return distance
+
+
+def _vector_dimensions(conn: sqlite3.Connection, table: str) -> int:
+    sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE name = ?", (table,)
+    ).fetchone()[0]
+    match = re.search(r"float\[(\d+)\]", sql, re.IGNORECASE)
+    return int(match.group(1)) if match else EMBEDDING_DIMENSIONS
+
+
+def _rebuild_vector_table(
+    conn: sqlite3.Connection, metric: str, table: str = VECTOR_TABLE
 ) -> None:
-    db_path = db_path or get_db_path()
-    conn = sqlite3.connect(db_path)
-    conn.enable_load_extension(True)
-    sqlite_vec.load(conn)
-    conn.enable_load_extension(False)
+    """
+    Recreate a vec0 table with its normalized vectors packed in id order.
 
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO commands (command, description) VALUES (?, ?)",
-        (command, description),
+    Must run inside a write transaction. Does not commit.
+    """
+    dimensions = _vector_dimensions(conn, table)
+    conn.execute(
+        f"""
+        CREATE TEMP TABLE vec_migration AS
+        SELECT id, vec_normalize(embedding) AS embedding
+        FROM {table};
+    """
     )
-    entry_id = cursor.lastrowid
-
-    cursor.execute(
-        "INSERT INTO vec_commands (id, embedding) VALUES (?, ?)",
-        (entry_id, serialize(embedding)),
+    conn.execute(f"DROP TABLE {table}")
+    create_vector_table(conn, table, dimensions, metric)
+    conn.execute(
+        f"""
+        INSERT INTO {table} (id, embedding)
+        SELECT id, embedding FROM temp.vec_migration ORDER BY id;
+    """
     )
-    conn.commit()
-    conn.close()
+    conn.execute("DROP TABLE temp.vec_migration")
 
 
-def fetch_similar(
-    user_embedding: List[float], top_k: int = 3, db_path: Optional[str] = None
-) -> list:
-    db_path = db_path or get_db_path()
-    conn = sqlite3.connect(db_path)
-    conn.enable_load_extension(True)
-    sqlite_vec.load(conn)
-    conn.enable_load_extension(False)
+def migrate_vector_table(conn: sqlite3.Connection, metric: str) -> bool:
+    """
+    Rebuild vec_commands and vec_aliases with normalized vectors and the
+    given metric.
 
-    results = conn.execute(
+    vec0 tables cannot be altered, so the normalized vectors are copied to a
+    temporary table and vec_commands is recreated from it, in one write
+    transaction. Readers keep seeing the old table until the commit. No
+    vector is re-embedded.
+
+    Args:
+        conn: Open connection, outside of a transaction
+        metric: "cosine" or "l2"
+
+    Returns:
+        bool: False when another connection migrated the table first
+    """
+
+    def migrate() -> bool:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_meta(conn, METRIC_KEY_PREFIX + VECTOR_TABLE) == metric:
+                conn.rollback()
+                return False
+
+            for table in (VECTOR_TABLE, ALIAS_VECTOR_TABLE):
+                if get_meta(conn, METRIC_KEY_PREFIX + table) != metric:
+                    _rebuild_vector_table(conn, metric, table)
+            conn.commit()
+            return True
+        except BaseException:
+            conn.rollback()
+            raise
+
+    return _retry_on_locked(migrate)
+
+
+def get_vector_slots(
+    conn: sqlite3.Connection, table: str = VECTOR_TABLE
+) -> Tuple[int, int]:
+    """
+    Return the vector slots allocated by a vec0 table and how many are used.
+
+    vec0 stores vectors in fixed-size chunks. Deleting a vector only clears
+    its slot, a chunk is freed once all of its slots are empty.
+    """
+    allocated = conn.execute(
+        f"SELECT COALESCE(SUM(size), 0) FROM {table}_chunks"
+    ).fetchone()[0]
+    used = conn.execute(f"SELECT COUNT(*) FROM {table}_rowids").fetchone()[0]
+    return int(allocated), int(used)
+
+
+def compact_vector_table(conn: sqlite3.Connection) -> bool:
+    """
+    Rebuild vec_commands and vec_aliases, each when deletes left enough
+    empty slots to free one of its chunks.
+
+    Runs in one write transaction like migrate_vector_table, readers keep
+    searching the old tables until the commit.
+
+    Args:
+        conn: Open connection, outside of a transaction
+
+    Returns:
+        bool: True if a table was rebuilt
+    """
+
+    def compact() -> bool:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            compacted = False
+            for table in (VECTOR_TABLE, ALIAS_VECTOR_TABLE):
+                chunk_size = conn.execute(
+                    f"SELECT MAX(size) FROM {table}_chunks"
+                ).fetchone()[0]
+                allocated, used = get_vector_slots(conn, table)
+                if chunk_size and allocated - used >= chunk_size:
+                    _rebuild_vector_table(
+                        conn, get_vector_metric(conn, table), table
+                    )
+                    compacted = True
+            if compacted:
+                conn.commit()
+            else:
+                conn.rollback()
+            return compacted
+        except BaseException:
+            conn.rollback()
+            raise
+
+    return _retry_on_locked(compact)
+
+
+def get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute(
+        "SELECT value FROM fastcmd_meta WHERE key = ?", (key,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(conn: sqlite3.Connection, key: str, value: Optional[str]) -> None:
+    """
+    Store a metadata value, None removes the key. Does not commit.
+    """
+    if value is None:
+        conn.execute("DELETE FROM fastcmd_meta WHERE key = ?", (key,))
+    else:
+        conn.execute(
+            "INSERT OR REPLACE INTO fastcmd_meta (key, value) VALUES (?, ?)",
+            (key, value),
+        )
+
+
+def record_change(conn: sqlite3.Connection, entry_id: int, op: str) -> None:
+    """
+    Version a local change of a command and append it to the change log.
+
+    Must run in the transaction making the change, before the command row
+    is deleted. Does not commit.
+
+    Args:
+        conn: Open connection inside a write transaction
+        entry_id: Id of the changed command
+        op: "upsert" for inserts and updates, "delete" for deletes
+    """
+    origin = get_meta(conn, NODE_ID_KEY) or ""
+    row = conn.execute(
+        "SELECT uuid, updated_at FROM command_sync WHERE command_id = ?",
+        (entry_id,),
+    ).fetchone()
+    row_uuid = row[0] if row else uuid.uuid4().hex
+    # Versions only move forward, even if the clock went back
+    updated_at = max(time.time(), row[1] + 1e-6) if row else time.time()
+
+    conn.execute(
         """
-        SELECT
-            commands.command,
-            commands.description,
-            distance
-        FROM vec_commands
-        LEFT JOIN commands ON commands.id = vec_commands.id
-        WHERE embedding MATCH ?
-          AND k = ?
-        ORDER BY distance ASC;
+        INSERT OR REPLACE INTO command_sync
+            (uuid, command_id, updated_at, origin, deleted)
+        VALUES (?, ?, ?, ?, ?)
     """,
-        (serialize(user_embedding), top_k),
-    ).fetchall()
+        (
+            row_uuid,
+            None if op == "delete" else entry_id,
+            updated_at,
+            origin,
+            int(op == "delete"),
+        ),
+    )
+    conn.execute(
+        """
+        INSERT INTO change_log (uuid, op, updated_at, origin)
+        VALUES (?, ?, ?, ?)
+    """,
+        (row_uuid, op, updated_at, origin),
+    )
 
-    conn.close()
 
-    return [
-        {"command": row[0], "description": row[1], "distance": row[2]}
-        for row in results
-    ]
+def insert_entry(
+    conn: sqlite3.Connection,
+    embedding: Sequence[float],
+    command: str,
+    description: str,
+    entry_id: Optional[int] = None,
+) -> int:
+    """
+    Insert a command and its embedding on an open connection.
 
+    The caller owns the transaction and has to commit it.
 
-def fetch_all_commands(db_path: Optional[str] = None) -> list:
+    Args:
+        entry_id: Id to insert the command with, the next free id if None
+
+    Returns:
+        int: Id of the new command
     """
-    Fetch all commands from the database.
+    cursor = conn.execute(
+        "INSERT INTO commands (id, command, description) VALUES (?, ?, ?)",
+        (entry_id, command, description),
+    )
+    entry_id = cursor.lastrowid
+
+    conn.execute(
+        "INSERT INTO vec_commands (id, embedding) "
+        "VALUES (?, vec_normalize(?))",
+        (entry_id, serialize(embedding)),
+    )
+    record_change(conn, int(entry_id or 0), "upsert")
+    return int(entry_id or 0)
+
+
+def insert_entries(
+    conn: sqlite3.Connection,
+    entries: List[Tuple[Sequence[float], str, str]],
+    meta_updates: Optional[Dict[str, Optional[str]]] = None,
+) -> List[int]:
+    """
+    Insert many (embedding, command, description) entries in one write
+    transaction.
 
     Args:
-        db_path: Optional path to the database file
+        conn: Open connection, outside of a transaction
+        entries: Entries to insert
+        meta_updates: fastcmd_meta values written in the same transaction
 
     Returns:
-        list: List of dictionaries containing command and description
+        List[int]: Ids of the commands, in the order of the entries
     """
-    db_path = db_path or get_db_path()
-    conn = sqlite3.connect(db_path)
 
-    results = conn.execute(
-        """
-        SELECT command, description
-        FROM commands
-        ORDER BY id ASC;
+    def write() -> List[int]:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [
+                insert_entry(conn, embedding, command, description)
+                for embedding, command, description in entries
+            ]
+            for key, value in (meta_updates or {}).items():
+                set_meta(conn, key, value)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return ids
+
+    return _retry_on_locked(write)
+
+
+def import_entries(
+    conn: sqlite3.Connection,
+    entries: List[ImportEntry],
+    entry_ids: Optional[List[int]] = None,
+) -> Tuple[List[int], int]:
     """
-    ).fetchall()
+    Insert imported (embedding, command, description, aliases) entries in
+    one write transaction, aliases being (embedding, alias) pairs.
 
+    Aliases a command cannot take, ones repeating its description or
+    another alias and ones beyond MAX_ALIASES, are skipped.
+
+    Args:
+        conn: Open connection, outside of a transaction
+        entries: Entries to insert
+        entry_ids: Ids to insert the commands with, the next free ids if
+            None
+
+    Returns:
+        Tuple[List[int], int]: Ids of the commands, in the order of the
+        entries, and the number of aliases skipped
+    """
+
+    given_ids: List[Optional[int]] = (
+        list(entry_ids) if entry_ids else [None] * len(entries)
+    )
+
+    def write() -> Tuple[List[int], int]:
+        ids = []
+        skipped = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for (embedding, command, description, aliases), given_id in zip(
+                entries, given_ids
+            ):
+                entry_id = insert_entry(
+                    conn, embedding, command, description, given_id
+                )
+                for alias_embedding, alias in aliases:
+                    try:
+                        alias_id = _insert_alias(conn, entry_id, alias)
+                    except ValueError:
+                        skipped += 1
+                        continue
+                    _insert_alias_vector(conn, alias_id, alias_embedding)
+                ids.append(entry_id)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return ids, skipped
+
+    return _retry_on_locked(write)
+
+
+def import_texts(commands: List[Dict[str, Any]]) -> List[str]:
+    """
+    Return the descriptions and aliases of imported commands to embed, in
+    the order to_import_entries reads their embeddings.
+    """
+    return [
+        text
+        for cmd in commands
+        for text in [cmd["description"], *cmd.get("aliases", [])]
+    ]
+
+
+def to_import_entries(
+    commands: List[Dict[str, Any]], embeddings: List[Sequence[float]]
+) -> List[ImportEntry]:
+    """
+    Pair imported commands with the embeddings of their import_texts.
+    """
+    vectors = iter(embeddings)
+    return [
+        (
+            next(vectors),
+            cmd["command"],
+            cmd["description"],
+            [(next(vectors), alias) for alias in cmd.get("aliases", [])],
+        )
+        for cmd in commands
+    ]
+
+
+@retry_on_locked
+def add_entry(
+    embedding: Sequence[float],
+    command: str,
+    description: str,
+    db_path: Optional[str] = None,
+) -> int:
+    conn = connect(db_path)
+    try:
+        # Take the write lock up front so concurrent writers queue on the
+        # busy timeout instead of failing on a lock upgrade
+        conn.execute("BEGIN IMMEDIATE")
+        entry_id = insert_entry(conn, embedding, command, description)
+        conn.commit()
+        return entry_id
+    finally:
+        conn.close()
+
+
+def _insert_alias(
+    conn: sqlite3.Connection, entry_id: int, description: str
+) -> int:
+    """
+    Add an alias to a command inside a write transaction, return its id.
+
+    Raises:
+        ValueError: When the command is already described this way, or has
+            MAX_ALIASES aliases
+    """
+    row = conn.execute(
+        "SELECT description FROM commands WHERE id = ?", (entry_id,)
+    ).fetchone()
+    known = conn.execute(
+        "SELECT 1 FROM command_aliases WHERE command_id = ? "
+        "AND description = ?",
+        (entry_id, description),
+    ).fetchone()
+    if (row and row[0] == description) or known:
+        raise ValueError(f"Command {entry_id} is already described this way")
+    count = conn.execute(
+        "SELECT COUNT(*) FROM command_aliases WHERE command_id = ?",
+        (entry_id,),
+    ).fetchone()[0]
+    if count >= MAX_ALIASES:
+        raise ValueError(
+            f"Command {entry_id} already has {MAX_ALIASES} aliases"
+        )
+    cursor = conn.execute(
+        "INSERT INTO command_aliases (command_id, description) VALUES (?, ?)",
+        (entry_id, description),
+    )
+    return int(cursor.lastrowid or 0)
+
+
+def _insert_alias_vector(
+    conn: sqlite3.Connection, alias_id: int, embedding: Sequence[float]
+) -> None:
+    conn.execute(
+        f"INSERT INTO {ALIAS_VECTOR_TABLE} (id, embedding) "
+        "VALUES (?, vec_normalize(?))",
+        (alias_id, serialize(embedding)),
+    )
+
+
+@retry_on_locked
+def add_alias(
+    entry_id: int,
+    embedding: Sequence[float],
+    description: str,
+    db_path: Optional[str] = None,
+) -> int:
+    """
+    Add another description of a command together with its embedding.
+
+    Args:
+        entry_id: Id of the command
+        embedding: Embedding of the description
+        description: The further description
+        db_path: Optional path to the database file
+
+    Returns:
+        int: Id of the new alias
+
+    Raises:
+        ValueError: See _insert_alias
+    """
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        alias_id = _insert_alias(conn, entry_id, description)
+        _insert_alias_vector(conn, alias_id, embedding)
+        conn.commit()
+        return alias_id
+    finally:
+        conn.close()
+
+
+@retry_on_locked
+def enqueue_alias(
+    command: str, description: str, db_path: Optional[str] = None
+) -> Optional[int]:
+    """
+    Add another description to a saved command, embedded in the background.
+
+    Aliases without a vector are embedded by the drain worker, see
+    fetch_pending_aliases. With several copies of the command saved, the
+    oldest one gets the alias.
+
+    Args:
+        command: The saved command
+        description: The further description
+        db_path: Optional path to the database file
+
+    Returns:
+        Optional[int]: Id of the new alias, None if the command is not saved
+
+    Raises:
+        ValueError: See _insert_alias
+    """
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT MIN(id) FROM commands WHERE command = ?", (command,)
+        ).fetchone()
+        if row[0] is None:
+            conn.rollback()
+            return None
+        alias_id = _insert_alias(conn, row[0], description)
+        conn.commit()
+        return alias_id
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def fetch_pending_aliases(
+    conn: sqlite3.Connection, limit: int
+) -> List[Tuple[int, str]]:
+    """
+    Fetch (alias id, description) pairs of aliases without a vector.
+    """
+    return conn.execute(
+        f"""
+        SELECT id, description
+        FROM command_aliases
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {ALIAS_VECTOR_TABLE}
+            WHERE {ALIAS_VECTOR_TABLE}.id = command_aliases.id
+        )
+        ORDER BY id ASC
+        LIMIT ?;
+    """,
+        (limit,),
+    ).fetchall()
+
+
+def complete_pending_aliases(
+    conn: sqlite3.Connection, vectors: List[Tuple[int, Sequence[float]]]
+) -> int:
+    """
+    Store embeddings of aliases, skipping aliases deleted or completed
+    meanwhile.
+
+    Args:
+        conn: Open connection, outside of a transaction
+        vectors: (alias id, embedding) pairs
+
+    Returns:
+        int: Number of vectors stored
+    """
+
+    def write() -> int:
+        stored = 0
+        blobs = serialize_batch([embedding for _, embedding in vectors])
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for (alias_id, _), blob in zip(vectors, blobs):
+                pending = conn.execute(
+                    f"""
+                    SELECT 1 FROM command_aliases
+                    WHERE id = ? AND NOT EXISTS (
+                        SELECT 1 FROM {ALIAS_VECTOR_TABLE} WHERE id = ?
+                    )
+                """,
+                    (alias_id, alias_id),
+                ).fetchone()
+                if pending is None:
+                    continue
+                conn.execute(
+                    f"INSERT INTO {ALIAS_VECTOR_TABLE} (id, embedding) "
+                    "VALUES (?, vec_normalize(?))",
+                    (alias_id, blob),
+                )
+                stored += 1
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return stored
+
+    return _retry_on_locked(write)
+
+
+@retry_on_locked
+def enqueue_entry(
+    command: str,
+    description: str,
+    db_path: Optional[str] = None,
+    entry_id: Optional[int] = None,
+) -> int:
+    """
+    Save a command right away and queue its description for embedding.
+
+    Args:
+        command: The command to save
+        description: Description to embed later
+        db_path: Optional path to the database file
+        entry_id: Id to save the command with, the next free id if None
+
+    Returns:
+        int: Id of the new command
+    """
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.execute(
+            "INSERT INTO commands (id, command, description) VALUES (?, ?, ?)",
+            (entry_id, command, description),
+        )
+        entry_id = int(cursor.lastrowid or 0)
+        conn.execute(
+            """
+            INSERT INTO pending_embeddings (command_id, enqueued_at)
+            VALUES (?, ?)
+        """,
+            (entry_id, time.time()),
+        )
+        record_change(conn, entry_id, "upsert")
+        conn.commit()
+        return entry_id
+    finally:
+        conn.close()
+
+
+def fetch_pending(
+    conn: sqlite3.Connection, limit: int
+) -> List[Tuple[int, str]]:
+    """
+    Fetch (id, description) pairs waiting for an embedding, oldest first.
+
+    Parked entries, which failed MAX_EMBEDDING_ATTEMPTS times, are skipped.
+    """
+    return conn.execute(
+        """
+        SELECT commands.id, commands.description
+        FROM pending_embeddings
+        JOIN commands ON commands.id = pending_embeddings.command_id
+        WHERE pending_embeddings.attempts < ?
+        ORDER BY pending_embeddings.enqueued_at ASC
+        LIMIT ?;
+    """,
+        (MAX_EMBEDDING_ATTEMPTS, limit),
+    ).fetchall()
+
+
+def count_pending(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT COUNT(*) FROM pending_embeddings").fetchone()
+    return int(row[0])
+
+
+def count_parked(conn: sqlite3.Connection) -> int:
+    row = conn.execute(
+        "SELECT COUNT(*) FROM pending_embeddings WHERE attempts >= ?",
+        (MAX_EMBEDDING_ATTEMPTS,),
+    ).fetchone()
+    return int(row[0])
+
+
+def complete_pending(
+    conn: sqlite3.Connection,
+    vectors: List[Tuple[int, Sequence[float]]],
+    descriptions: Optional[Dict[int, str]] = None,
+) -> int:
+    """
+    Store embeddings of queued commands and remove them from the queue.
+
+    Entries already completed by another process, or deleted meanwhile, are
+    skipped.
+
+    Args:
+        conn: Open connection, outside of a transaction
+        vectors: (id, embedding) pairs
+        descriptions: Descriptions the vectors were calculated from, by id.
+            Entries whose description was updated since stay queued.
+
+    Returns:
+        int: Number of vectors stored
+    """
+
+    def write() -> int:
+        stored = 0
+        blobs = serialize_batch([embedding for _, embedding in vectors])
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for (entry_id, _), blob in zip(vectors, blobs):
+                if descriptions is not None:
+                    row = conn.execute(
+                        "SELECT description FROM commands WHERE id = ?",
+                        (entry_id,),
+                    ).fetchone()
+                    if row is not None and row[0] != descriptions[entry_id]:
+                        continue
+                cursor = conn.execute(
+                    "DELETE FROM pending_embeddings WHERE command_id = ?",
+                    (entry_id,),
+                )
+                if cursor.rowcount == 0:
+                    continue
+                exists = conn.execute(
+                    f"SELECT 1 FROM {VECTOR_TABLE} WHERE id = ?", (entry_id,)
+                ).fetchone()
+                if exists:
+                    continue
+                conn.execute(
+                    f"INSERT INTO {VECTOR_TABLE} (id, embedding) "
+                    "VALUES (?, vec_normalize(?))",
+                    (entry_id, blob),
+                )
+                stored += 1
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return stored
+
+    return _retry_on_locked(write)
+
+
+@retry_on_locked
+def update_entry(
+    entry_id: int,
+    command: Optional[str] = None,
+    description: Optional[str] = None,
+    db_path: Optional[str] = None,
+) -> Optional[bool]:
+    """
+    Change the command and/or description of a saved command.
+
+    The vector is only dropped and the command queued for embedding when the
+    description text actually changes.
+
+    Args:
+        entry_id: Id of the command
+        command: New command, None keeps the current one
+        description: New description, None keeps the current one
+        db_path: Optional path to the database file
+
+    Returns:
+        Optional[bool]: None if there is no command with this id, otherwise
+        whether its description has to be embedded again
+    """
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT command, description FROM commands WHERE id = ?",
+            (entry_id,),
+        ).fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+
+        reembed = description is not None and description != row[1]
+        conn.execute(
+            "UPDATE commands SET command = ?, description = ? WHERE id = ?",
+            (
+                row[0] if command is None else command,
+                row[1] if description is None else description,
+                entry_id,
+            ),
+        )
+        if reembed:
+            drop_vectors(conn, entry_id)
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO pending_embeddings
+                    (command_id, enqueued_at)
+                VALUES (?, ?)
+            """,
+                (entry_id, time.time()),
+            )
+        if reembed or (command is not None and command != row[0]):
+            record_change(conn, entry_id, "upsert")
+        conn.commit()
+        return reembed
+    finally:
+        conn.close()
+
+
+def drop_vectors(conn: sqlite3.Connection, entry_id: int) -> None:
+    """
+    Remove the vectors of a command whose description changed.
+
+    Besides vec_commands, this drops the vector an unfinished re-index
+    built from the old description, so the swap does not bring it back.
+    The caller owns the transaction and has to queue the command.
+    """
+    conn.execute(f"DELETE FROM {VECTOR_TABLE} WHERE id = ?", (entry_id,))
+    reindexing = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (REINDEX_TABLE,)
+    ).fetchone()
+    if reindexing:
+        conn.execute(f"DELETE FROM {REINDEX_TABLE} WHERE id = ?", (entry_id,))
+
+
+def delete_orphans(conn: sqlite3.Connection) -> int:
+    """
+    Remove vectors, queue entries, aliases and related commands left without
+    a command.
+
+    The caller owns the transaction and has to commit it.
+
+    Returns:
+        int: Number of rows removed
+    """
+    vectors = conn.execute(
+        f"""
+        DELETE FROM {VECTOR_TABLE}
+        WHERE id NOT IN (SELECT id FROM commands)
+    """
+    ).rowcount
+    pending = conn.execute(
+        """
+        DELETE FROM pending_embeddings
+        WHERE command_id NOT IN (SELECT id FROM commands)
+    """
+    ).rowcount
+    aliases = conn.execute(
+        """
+        DELETE FROM command_aliases
+        WHERE command_id NOT IN (SELECT id FROM commands)
+    """
+    ).rowcount
+    alias_vectors = conn.execute(
+        f"""
+        DELETE FROM {ALIAS_VECTOR_TABLE}
+        WHERE id NOT IN (SELECT id FROM command_aliases)
+    """
+    ).rowcount
+    related = conn.execute(
+        """
+        DELETE FROM related_commands
+        WHERE command_id NOT IN (SELECT id FROM commands)
+           OR related_id NOT IN (SELECT id FROM commands)
+    """
+    ).rowcount
+    return vectors + pending + aliases + alias_vectors + related
+
+
+def delete_aliases(conn: sqlite3.Connection, entry_id: int) -> None:
+    """
+    Remove the aliases of a command and their vectors. Does not commit.
+    """
+    conn.execute(
+        f"""
+        DELETE FROM {ALIAS_VECTOR_TABLE}
+        WHERE id IN (SELECT id FROM command_aliases WHERE command_id = ?)
+    """,
+        (entry_id,),
+    )
+    conn.execute(
+        "DELETE FROM command_aliases WHERE command_id = ?", (entry_id,)
+    )
+
+
+def delete_command(conn: sqlite3.Connection, entry_id: int) -> None:
+    """
+    Remove a command with its vector, queue entry, aliases and related
+    commands. Does not commit.
+    """
+    conn.execute("DELETE FROM commands WHERE id = ?", (entry_id,))
+    conn.execute(f"DELETE FROM {VECTOR_TABLE} WHERE id = ?", (entry_id,))
+    conn.execute(
+        "DELETE FROM pending_embeddings WHERE command_id = ?", (entry_id,)
+    )
+    delete_aliases(conn, entry_id)
+    conn.execute(
+        "DELETE FROM related_commands WHERE command_id = ? OR related_id = ?",
+        (entry_id, entry_id),
+    )
+
+
+@retry_on_locked
+def delete_entry(entry_id: int, db_path: Optional[str] = None) -> bool:
+    """
+    Delete a command together with its vector, queue entry and aliases.
+
+    Only the rows of this command are touched, rows orphaned otherwise are
+    left to maintain, see delete_orphans.
+
+    Args:
+        entry_id: Id of the command
+        db_path: Optional path to the database file
+
+    Returns:
+        bool: False if there is no command with this id
+    """
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        exists = conn.execute(
+            "SELECT 1 FROM commands WHERE id = ?", (entry_id,)
+        ).fetchone()
+        if exists:
+            record_change(conn, entry_id, "delete")
+            delete_command(conn, entry_id)
+        conn.commit()
+        return exists is not None
+    finally:
+        conn.close()
+
+
+def record_pending_failure(
+    conn: sqlite3.Connection,
+    entry_ids: List[int],
+    error: str,
+    attempt: bool = True,
+) -> None:
+    """
+    Record the error of a failed embedding of queued commands.
+
+    Args:
+        conn: Open connection, outside of a transaction
+        entry_ids: Ids of the commands
+        error: Error message, kept as last_error
+        attempt: Whether the failure counts as an attempt towards
+            MAX_EMBEDDING_ATTEMPTS, False when the API was unreachable
+    """
+
+    def write() -> None:
+        conn.executemany(
+            """
+            UPDATE pending_embeddings
+            SET attempts = attempts + ?, last_error = ?
+            WHERE command_id = ?
+        """,
+            [(int(attempt), error, entry_id) for entry_id in entry_ids],
+        )
+        conn.commit()
+
+    _retry_on_locked(write)
+
+
+@retry_on_locked
+def fetch_pending_commands(db_path: Optional[str] = None) -> list:
+    """
+    Fetch the commands that do not have an embedding yet.
+
+    Args:
+        db_path: Optional path to the database file
+
+    Returns:
+        list: List of dictionaries containing id, command and description
+    """
+    conn = connect(db_path)
+    results = conn.execute(
+        """
+        SELECT commands.id, commands.command, commands.description
+        FROM pending_embeddings
+        JOIN commands ON commands.id = pending_embeddings.command_id;
+    """
+    ).fetchall()
+    conn.close()
+
+    return [
+        {"id": row[0], "command": row[1], "description": row[2]}
+        for row in results
+    ]
+
+
+@retry_on_locked
+def get_cached_embedding(
+    query: str, db_path: Optional[str] = None
+) -> Optional[Sequence[float]]:
+    """
+    Return the embedding stored for a normalized query, if any.
+    """
+    conn = connect(db_path)
+    row = conn.execute(
+        "SELECT embedding FROM query_cache WHERE query = ?", (query,)
+    ).fetchone()
+    conn.close()
+
+    return deserialize(row[0]) if row else None
+
+
+@retry_on_locked
+def fetch_cached_queries(db_path: Optional[str] = None) -> List[str]:
+    conn = connect(db_path)
+    rows = conn.execute("SELECT query FROM query_cache").fetchall()
+    conn.close()
+
+    return [row[0] for row in rows]
+
+
+@retry_on_locked
+def cache_query_embedding(
+    query: str, embedding: Sequence[float], db_path: Optional[str] = None
+) -> None:
+    """
+    Remember the embedding of a normalized query, evicting the least
+    recently stored entries beyond QUERY_CACHE_SIZE.
+    """
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO query_cache (query, embedding, used_at)
+            VALUES (?, ?, ?)
+        """,
+            (query, serialize(embedding), time.time()),
+        )
+        conn.execute(
+            """
+            DELETE FROM query_cache WHERE query NOT IN (
+                SELECT query FROM query_cache
+                ORDER BY used_at DESC
+                LIMIT ?
+            )
+        """,
+            (QUERY_CACHE_SIZE,),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@retry_on_locked
+def fetch_commands_containing(
+    words: List[str],
+    limit: int,
+    db_path: Optional[str] = None,
+    pending_only: bool = False,
+) -> list:
+    """
+    Fetch commands whose description contains any of the words.
+
+    Used to narrow down candidates for local word matching without loading
+    the whole catalog.
+
+    Args:
+        words: Words to look for, case-insensitively
+        limit: Maximum number of commands returned
+        db_path: Optional path to the database file
+        pending_only: Only fetch commands still waiting for their embedding
+
+    Returns:
+        list: List of dictionaries containing id, command and description
+    """
+    if not words:
+        return []
+
+    conditions = " OR ".join("commands.description LIKE ?" for _ in words)
+    join = (
+        "JOIN pending_embeddings "
+        "ON pending_embeddings.command_id = commands.id"
+        if pending_only
+        else ""
+    )
+    conn = connect(db_path)
+    results = conn.execute(
+        f"""
+        SELECT commands.id, commands.command, commands.description
+        FROM commands {join}
+        WHERE {conditions}
+        LIMIT ?;
+    """,
+        [f"%{word}%" for word in words] + [limit],
+    ).fetchall()
+    conn.close()
+
+    return [
+        {"id": row[0], "command": row[1], "description": row[2]}
+        for row in results
+    ]
+
+
+# Matches descriptions and aliases, keeping the closest vector of every
+# command. SQLite takes the bare "alias" column from the row of the MIN.
+SIMILAR_QUERY = f"""
+    WITH matches AS (
+        SELECT id, distance, NULL AS alias
+        FROM {VECTOR_TABLE}
+        WHERE embedding MATCH vec_normalize(:embedding)
+          AND k = :k
+        UNION ALL
+        SELECT command_aliases.command_id, nearest.distance,
+               command_aliases.description
+        FROM (
+            SELECT id, distance
+            FROM {ALIAS_VECTOR_TABLE}
+            WHERE embedding MATCH vec_normalize(:embedding)
+              AND k = :alias_k
+        ) AS nearest
+        JOIN command_aliases ON command_aliases.id = nearest.id
+    )
+    SELECT
+        matches.id,
+        commands.command,
+        commands.description,
+        MIN(matches.distance) AS distance,
+        matches.alias
+    FROM matches
+    LEFT JOIN commands ON commands.id = matches.id
+    GROUP BY matches.id
+    ORDER BY distance ASC
+    LIMIT :k;
+"""
+
+# Databases created before aliases existed, e.g. packs built by older
+# versions
+SIMILAR_COMMANDS_QUERY = f"""
+    SELECT
+        {VECTOR_TABLE}.id,
+        commands.command,
+        commands.description,
+        distance,
+        NULL
+    FROM {VECTOR_TABLE}
+    LEFT JOIN commands ON commands.id = {VECTOR_TABLE}.id
+    WHERE embedding MATCH vec_normalize(:embedding)
+      AND k = :k
+    ORDER BY distance ASC;
+"""
+
+
+def query_similar(
+    conn: sqlite3.Connection, user_embedding: Sequence[float], top_k: int
+) -> list:
+    """
+    Find the commands closest to an embedding.
+
+    A command matches by its description or by any of its aliases, and is
+    listed once with its closest one.
+
+    Returns:
+        list: Matches closest first, their "distance" is 1 - the cosine
+        similarity to the embedding whatever the metric of the table.
+        Matches found through an alias carry it as "alias".
+    """
+
+    def query() -> Tuple[str, list]:
+        metric = get_vector_metric(conn)
+        has_aliases = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (ALIAS_VECTOR_TABLE,)
+        ).fetchone()
+        rows = conn.execute(
+            SIMILAR_QUERY if has_aliases else SIMILAR_COMMANDS_QUERY,
+            {
+                "embedding": serialize(user_embedding),
+                "k": top_k,
+                "alias_k": min(top_k * MAX_ALIASES, MAX_KNN),
+            },
+        ).fetchall()
+        return metric, rows
+
+    metric, results = _retry_on_locked(query)
+    matches = []
+    for entry_id, command, description, distance, alias in results:
+        match = {
+            "id": entry_id,
+            "command": command,
+            "description": description,
+            "distance": to_cosine_distance(metric, distance),
+        }
+        if alias is not None:
+            match["alias"] = alias
+        matches.append(match)
+    return matches
+
+
+def list_packs() -> List[str]:
+    """
+    Return the paths of the pack files in PACK_DIR, sorted by name.
+    """
+    if not os.path.isdir(PACK_DIR):
+        return []
+    return sorted(
+        os.path.join(PACK_DIR, name)
+        for name in os.listdir(PACK_DIR)
+        if name.endswith(".db")
+    )
+
+
+def open_pack(path: str) -> sqlite3.Connection:
+    """
+    Open a pack read-only, with the sqlite-vec extension loaded.
+
+    Packs are never written, so they are opened immutable: SQLite skips
+    locking and journal checks and reads the file through mmap.
+
+    Args:
+        path: Path to the pack file
+
+    Returns:
+        sqlite3.Connection: Open connection, the caller is responsible for
+        closing it
+    """
+    conn = sqlite3.connect(
+        f"file:{quote(os.path.abspath(path))}?mode=ro&immutable=1",
+        uri=True,
+        check_same_thread=False,
+    )
+    conn.enable_load_extension(True)
+    sqlite_vec.load(conn)
+    conn.enable_load_extension(False)
+    conn.execute(f"PRAGMA cache_size = {DB_CACHE_SIZE}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    return conn
+
+
+def _query_pack(
+    path: str, user_embedding: Sequence[float], top_k: int
+) -> list:
+    name = os.path.splitext(os.path.basename(path))[0]
+    try:
+        conn = open_pack(path)
+        try:
+            matches = query_similar(conn, user_embedding, top_k)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        # Not a FastCmd database, or embedded with other dimensions
+        return []
+    return [{**match, "pack": name} for match in matches]
+
+
+# Packs are searched on their own connections, SQLite releases the GIL while
+# a query runs so the searches overlap
+_pack_executor = ThreadPoolExecutor(
+    max_workers=PACK_WORKERS, thread_name_prefix="fastcmd-packs"
+)
+
+
+def search_packs(user_embedding: Sequence[float], top_k: int) -> List[Future]:
+    """
+    Start searching every pack in the background.
+
+    Args:
+        user_embedding: Query embedding
+        top_k: Number of matches to return per pack
+
+    Returns:
+        List[Future]: One future per pack resolving to its matches, each
+        tagged with the name of the pack; see merge_matches
+    """
+    return [
+        _pack_executor.submit(_query_pack, path, user_embedding, top_k)
+        for path in list_packs()
+    ]
+
+
+def merge_matches(
+    matches: list, pack_searches: List[Future], top_k: int
+) -> list:
+    """
+    Merge the matches of the user database with those of the packs.
+
+    Args:
+        matches: Matches of the user database, closest first
+        pack_searches: Futures returned by search_packs
+        top_k: Number of matches to keep
+
+    Returns:
+        list: The top_k closest matches, the user database first on ties
+    """
+    if not pack_searches:
+        return matches
+    return heapq.nsmallest(
+        top_k,
+        itertools.chain(
+            matches, *(search.result() for search in pack_searches)
+        ),
+        key=lambda match: match["distance"],
+    )
+
+
+def fetch_similar(
+    user_embedding: Sequence[float],
+    top_k: int = 3,
+    db_path: Optional[str] = None,
+) -> list:
+    pack_searches = search_packs(user_embedding, top_k)
+    conn = connect(db_path)
+    results = query_similar(conn, user_embedding, top_k)
+    conn.close()
+
+    return merge_matches(results, pack_searches, top_k)
+
+
+def fetch_similar_batch(
+    user_embeddings: Iterable[Sequence[float]],
+    top_k: int = 3,
+    db_path: Optional[str] = None,
+) -> Iterator[list]:
+    """
+    Lazily fetch the most similar commands for many embeddings.
+
+    All lookups share a single connection, which stays open until the input
+    is exhausted or the generator is closed.
+
+    Args:
+        user_embeddings: Query embeddings, consumed one at a time
+        top_k: Number of matches to return per query
+        db_path: Optional path to the database file
+
+    Yields:
+        list: Matches for each query embedding, in input order
+    """
+    conn = connect(db_path)
+    try:
+        for user_embedding in user_embeddings:
+            pack_searches = search_packs(user_embedding, top_k)
+            yield merge_matches(
+                query_similar(conn, user_embedding, top_k),
+                pack_searches,
+                top_k,
+            )
+    finally:
+        conn.close()
+
+
+def query_all_commands(conn: sqlite3.Connection) -> list:
+    def query() -> Tuple[list, Dict[int, List[str]]]:
+        rows = conn.execute(
+            """
+            SELECT id, command, description
+            FROM commands
+            ORDER BY id ASC;
+        """
+        ).fetchall()
+        by_command: Dict[int, List[str]] = {}
+        for entry_id, alias in conn.execute(
+            "SELECT command_id, description FROM command_aliases ORDER BY id"
+        ):
+            by_command.setdefault(entry_id, []).append(alias)
+        return rows, by_command
+
+    results, aliases = _retry_on_locked(query)
+
+    commands = []
+    for entry_id, command, description in results:
+        entry = {"command": command, "description": description}
+        if entry_id in aliases:
+            entry["aliases"] = aliases[entry_id]
+        commands.append(entry)
+    return commands
+
+
+def fetch_commands_after(
+    conn: sqlite3.Connection, last_id: int, limit: int
+) -> List[Tuple[int, str]]:
+    """
+    Fetch (id, description) pairs with an id above last_id, in id order.
+    """
+    return conn.execute(
+        """
+        SELECT id, description
+        FROM commands
+        WHERE id > ?
+        ORDER BY id ASC
+        LIMIT ?;
+    """,
+        (last_id, limit),
+    ).fetchall()
+
+
+def count_commands(
+    conn: sqlite3.Connection, up_to_id: Optional[int] = None
+) -> int:
+    if up_to_id is None:
+        row = conn.execute("SELECT COUNT(*) FROM commands").fetchone()
+    else:
+        row = conn.execute(
+            "SELECT COUNT(*) FROM commands WHERE id <= ?", (up_to_id,)
+        ).fetchone()
+    return int(row[0])
+
+
+def insert_vectors(
+    conn: sqlite3.Connection,
+    table: str,
+    vectors: List[Tuple[int, Sequence[float]]],
+    meta_updates: Optional[Dict[str, Optional[str]]] = None,
+) -> None:
+    """
+    Insert (id, embedding) rows into a vec0 table in one write transaction.
+
+    The table is created with the dimensions of the first vector if it does
+    not exist yet.
+
+    Args:
+        conn: Open connection, outside of a transaction
+        table: Name of the vec0 table
+        vectors: Rows to insert
+        meta_updates: fastcmd_meta values written in the same transaction
+    """
+    if not vectors:
+        return
+
+    def write() -> None:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            create_vector_table(conn, table, len(vectors[0][1]))
+            conn.executemany(
+                f"INSERT INTO {table} (id, embedding) "
+                "VALUES (?, vec_normalize(?))",
+                zip(
+                    [entry_id for entry_id, _ in vectors],
+                    serialize_batch([vector for _, vector in vectors]),
+                ),
+            )
+            for key, value in (meta_updates or {}).items():
+                set_meta(conn, key, value)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    _retry_on_locked(write)
+
+
+def replace_vector_table(
+    conn: sqlite3.Connection,
+    source_table: str,
+    dimensions: int,
+    last_id: int,
+    meta_updates: Optional[Dict[str, Optional[str]]] = None,
+) -> bool:
+    """
+    Atomically replace vec_commands with the vectors of source_table.
+
+    vec0 tables cannot be renamed, so vec_commands is recreated and filled
+    from source_table in one write transaction, after which source_table is
+    dropped. Readers keep seeing the old vectors until the commit. Vectors
+    of commands deleted in the meantime are not carried over. Commands left
+    without a vector, e.g. whose description changed during the re-index,
+    are queued for embedding. The vectors of aliases are dropped,
+    fetch_pending_aliases returns them all again, and so are the cached
+    query embeddings, which belong to the previous model.
+
+    Args:
+        conn: Open connection, outside of a transaction
+        source_table: vec0 table holding the new vectors
+        dimensions: Dimensions of the vectors in source_table
+        last_id: Highest command id with a vector in source_table
+        meta_updates: fastcmd_meta values written in the same transaction
+
+    Returns:
+        bool: False, without changing anything, when commands were added
+        after last_id and still need to be embedded into source_table
+    """
+
+    def swap() -> bool:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            max_id = conn.execute("SELECT MAX(id) FROM commands").fetchone()[0]
+            if (max_id or 0) > last_id:
+                conn.rollback()
+                return False
+
+            metric = get_vector_metric(conn, source_table)
+            conn.execute(f"DROP TABLE IF EXISTS {VECTOR_TABLE}")
+            create_vector_table(conn, VECTOR_TABLE, dimensions, metric)
+            conn.execute(
+                f"""
+                INSERT INTO {VECTOR_TABLE} (id, embedding)
+                SELECT id, vec_normalize(embedding) FROM {source_table}
+                WHERE id IN (SELECT id FROM commands);
+            """
+            )
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO pending_embeddings
+                    (command_id, enqueued_at)
+                SELECT id, ? FROM commands
+                WHERE id NOT IN (SELECT id FROM {VECTOR_TABLE})
+            """,
+                (time.time(),),
+            )
+            conn.execute(f"DROP TABLE {source_table}")
+            set_meta(conn, METRIC_KEY_PREFIX + source_table, None)
+            # Aliases were embedded by the previous model, the drain worker
+            # embeds them again
+            conn.execute(f"DROP TABLE IF EXISTS {ALIAS_VECTOR_TABLE}")
+            create_vector_table(conn, ALIAS_VECTOR_TABLE, dimensions, metric)
+            conn.execute("DELETE FROM query_cache")
+            for key, value in (meta_updates or {}).items():
+                set_meta(conn, key, value)
+            conn.commit()
+            return True
+        except BaseException:
+            conn.rollback()
+            raise
+
+    return _retry_on_locked(swap)
+
+
+def fetch_all_commands(db_path: Optional[str] = None) -> list:
+    """
+    Fetch all commands from the database.
+
+    Args:
+        db_path: Optional path to the database file
+
+    Returns:
+        list: List of dictionaries containing command and description
+    """
+    conn = connect(db_path)
+    results = query_all_commands(conn)
     conn.close()
 
-    return [{"command": row[0], "description": row[1]} for row in results]
+    return results
@@ -0,0 +1,76 @@
+import os
+import threading
+from typing import Callable, List, Optional
+
+from src.completion import get_description_index
+from src.embeddings import get_embedding_provider, get_transport
+from src.vector_database import VECTOR_TABLE, connect
+
+# FASTCMD_WARMUP=0 disables the warm-up of the interactive prompt
+WARMUP_ENABLED = os.getenv("FASTCMD_WARMUP", "1") == "1"
+
+
+def warm_up_api() -> None:
+    """
+    Create the embedding transport and connect it to the API.
+    """
+    if get_embedding_provider() == "openai":
+        get_transport().warm_up()
+
+
+def warm_up_db(db_path: Optional[str] = None) -> None:
+    """
+    Load sqlite-vec and read the vectors and commands once.
+
+    Searches scan every vector, reading them here moves the pages into the
+    OS page cache (and the mmap) before the first search needs them.
+    """
+    conn = connect(db_path)
+    try:
+        conn.execute(f"SELECT COUNT(embedding) FROM {VECTOR_TABLE}").fetchone()
+        conn.execute("SELECT COUNT(description) FROM commands").fetchone()
+    finally:
+        conn.close()
+
+
+def _quietly(task: Callable[[], None]) -> None:
+    try:
+        task()
+    except Exception:
+        # Warming up is best effort, the command that needs the resource
+        # reports the error
+        pass
+
+
+def start_warmup(db_path: Optional[str] = None) -> List[threading.Thread]:
+    """
+    Warm up the API connection, the database and the completion index in
+    background threads.
+
+    Meant to run while the user types the first command, so it does not pay
+    for the TLS handshake and cold database pages.
+
+    Args:
+        db_path: Optional path to the database file
+
+    Returns:
+        List[threading.Thread]: The started daemon threads
+    """
+    tasks = {
+        "api": warm_up_api,
+        "db": lambda: warm_up_db(db_path),
+        # Tab completion is instant once the descriptions are indexed
+        "completion": lambda: get_description_index(db_path),
+    }
+    threads = [
+        threading.Thread(
+            target=_quietly,
+            args=(task,),
+            name=f"fastcmd-warmup-{name}",
+            daemon=True,
+        )
+        for name, task in tasks.items()
+    ]
+    for thread in threads:
+        thread.start()
+    return threads
@@ -0,0 +1,218 @@
+import sqlite3
+import threading
+from typing import Callable, List, Optional, Sequence, Set, Tuple
+
+from openai import BadRequestError, UnprocessableEntityError
+
+from src.embeddings import (
+    EMBEDDING_BATCH_SIZE,
+    EmptyDescriptionError,
+    calculate_embeddings,
+    set_embedding_operation,
+)
+from src.related import link_commands
+from src.shards import catalog_paths, is_sharded
+from src.vector_database import (
+    complete_pending,
+    complete_pending_aliases,
+    connect,
+    count_pending,
+    fetch_pending,
+    fetch_pending_aliases,
+    record_pending_failure,
+)
+
+# Delay before retrying after a failed drain, doubled up to the maximum
+RETRY_DELAY = 5.0
+MAX_RETRY_DELAY = 300.0
+
+# Errors caused by a description itself, e.g. one over the token limit of
+# the model. Retrying it fails again, so it is isolated from its batch.
+# Configuration errors, e.g. a missing API key, are raised like the API
+# being unreachable and do not count as attempts
+INPUT_ERRORS = (
+    BadRequestError,
+    UnprocessableEntityError,
+    EmptyDescriptionError,
+)
+
+Row = Tuple[int, str]
+
+
+def _embed_rows(
+    rows: List[Row], reject: Callable[[int, str], None]
+) -> List[Tuple[Row, Sequence[float]]]:
+    """
+    Embed (id, description) rows, halving a batch rejected for its input
+    until the rejected rows are found, which are passed to reject with the
+    error. Any other error, e.g. the API being unreachable, is raised.
+    """
+    try:
+        return list(
+            zip(rows, calculate_embeddings([text for _, text in rows]))
+        )
+    except INPUT_ERRORS as e:
+        if len(rows) == 1:
+            reject(rows[0][0], str(e))
+            return []
+        middle = len(rows) // 2
+        return _embed_rows(rows[:middle], reject) + _embed_rows(
+            rows[middle:], reject
+        )
+
+
+def drain_pending(
+    batch_size: int = EMBEDDING_BATCH_SIZE, db_path: Optional[str] = None
+) -> int:
+    """
+    Embed queued descriptions in batches and store their vectors.
+
+    Commands are embedded first, then aliases without a vector. Stops at
+    the first batch failing for another reason than its input, e.g. while
+    offline, which stays queued for the next drain. Descriptions the API
+    rejects are skipped, and a command rejected MAX_EMBEDDING_ATTEMPTS
+    times is parked until its description changes.
+
+    Args:
+        batch_size: Descriptions embedded per request
+        db_path: Optional path to the database file
+
+    Returns:
+        int: Number of vectors stored
+    """
+    stored = 0
+    conn = connect(db_path)
+    # Rejected during this drain, kept out of the next batches
+    rejected: Set[int] = set()
+
+    def reject(entry_id: int, error: str) -> None:
+        rejected.add(entry_id)
+        record_pending_failure(conn, [entry_id], error)
+
+    try:
+        while True:
+            rows = [
+                row
+                for row in fetch_pending(conn, batch_size + len(rejected))
+                if row[0] not in rejected
+            ][:batch_size]
+            if not rows:
+                return stored + _drain_aliases(conn, batch_size)
+
+            try:
+                embedded = _embed_rows(rows, reject)
+            except Exception as e:
+                record_pending_failure(
+                    conn, [row[0] for row in rows], str(e), attempt=False
+                )
+                raise
+            if not embedded:
+                continue
+            stored += complete_pending(
+                conn,
+                [(row[0], embedding) for row, embedding in embedded],
+                descriptions=dict(rows),
+            )
+            if not is_sharded():
+                link_commands([row[0] for row, _ in embedded], db_path=db_path)
+    finally:
+        conn.close()
+
+
+def _drain_aliases(conn: sqlite3.Connection, batch_size: int) -> int:
+    stored = 0
+    # Aliases have no attempt count, a rejected one is retried next drain
+    rejected: Set[int] = set()
+    while True:
+        rows = [
+            row
+            for row in fetch_pending_aliases(conn, batch_size + len(rejected))
+            if row[0] not in rejected
+        ][:batch_size]
+        if not rows:
+            return stored
+        embedded = _embed_rows(
+            rows, lambda alias_id, _: rejected.add(alias_id)
+        )
+        if embedded:
+            stored += complete_pending_aliases(
+                conn,
+                [(row[0], embedding) for row, embedding in embedded],
+            )
+
+
+def pending_count(db_path: Optional[str] = None) -> int:
+    conn = connect(db_path)
+    try:
+        return count_pending(conn)
+    finally:
+        conn.close()
+
+
+class DrainWorker:
+    """
+    Background thread draining the embedding queue.
+
+    Draining starts whenever schedule() is called. After a failure, e.g.
+    while offline, it is retried with exponential backoff until the queue is
+    empty.
+
+    Args:
+        db_path: Optional path to the database file, defaults to every
+            database holding commands
+    """
+
+    def __init__(self, db_path: Optional[str] = None) -> None:
+        self.db_path = db_path
+        self._wakeup = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+
+    def schedule(self) -> None:
+        with self._lock:
+            self._idle.clear()
+            self._wakeup.set()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="fastcmd-drain", daemon=True
+                )
+                self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the queue has been drained or a drain attempt failed.
+
+        Returns:
+            bool: False if the timeout expired first
+        """
+        return self._idle.wait(timeout)
+
+    def _run(self) -> None:
+        # Queued descriptions come from add, and from update and sync-import
+        set_embedding_operation("add")
+        delay: Optional[float] = None
+        while True:
+            # Without a pending retry this blocks until schedule() is called
+            self._wakeup.wait(timeout=delay)
+            self._wakeup.clear()
+
+            try:
+                # Every shard has its own queue
+                paths = [self.db_path] if self.db_path else catalog_paths()
+                for path in paths:
+                    drain_pending(db_path=path)
+                self.last_error = None
+                delay = None
+            except Exception as e:
+                self.last_error = str(e)
+                delay = min(MAX_RETRY_DELAY, (delay or RETRY_DELAY / 2) * 2)
+
+            with self._lock:
+                if not self._wakeup.is_set():
+                    self._idle.set()
+
+
+drain_worker = DrainWorker()
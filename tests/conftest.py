@@ -0,0 +1,42 @@
+import uuid
+from pathlib import Path
+from typing import Any, Generator
+
+import pytest
+
+import src.completion
+import src.embeddings
+import src.shards
+import src.vector_database
+from src.vector_database import memory_db_uri, open_memory_db
+
+
+@pytest.fixture
+def memory_db() -> Generator[str, None, None]:
+    """Create an empty in-memory database, dropped after the test."""
+    uri = memory_db_uri(f"test-{uuid.uuid4().hex}")
+    conn = open_memory_db(uri)
+    yield uri
+    conn.close()
+
+
+@pytest.fixture(autouse=True)
+def test_db(memory_db: str, tmp_path: Path, monkeypatch: Any) -> str:
+    """Point the default database of every test to its own memory DB."""
+    monkeypatch.setenv("TESTING", "1")
+    monkeypatch.setattr(src.vector_database, "TEST_DB_PATH", memory_db)
+    # No packs unless the test adds some
+    monkeypatch.setattr(
+        src.vector_database, "PACK_DIR", str(tmp_path / "packs")
+    )
+    # The completion index is built from the database of the test
+    monkeypatch.setattr(src.completion, "_index", None)
+    # Single database unless the test shards it
+    monkeypatch.setattr(src.shards, "SHARD_COUNT", 1)
+    monkeypatch.setattr(src.shards, "SHARD_DIR", str(tmp_path / "shards"))
+    monkeypatch.setattr(src.shards, "_store", None)
+    # No usage ledger unless the test installs it
+    monkeypatch.setattr(src.embeddings, "_meter", src.embeddings.UsageMeter())
+    # Embedding model of FASTCMD_EMBEDDING_MODEL until a re-index
+    monkeypatch.setattr(src.embeddings, "_index_model", None)
+    return memory_db
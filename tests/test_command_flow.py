@@ -1,43 +1,20 @@
-import os
-import tempfile
 from argparse import Namespace
-from typing import Generator
 from unittest.mock import patch
 
 import pytest
 
 from src.commands import handle_add, handle_search
 from src.vector_database import init_db
+from src.write_queue import drain_pending
 
 
 class TestCommandFlow:
 
     @pytest.fixture
-    def temp_db_path(self) -> Generator[str, None, None]:
-        """Create a temporary database file for testing the flow."""
-        with tempfile.NamedTemporaryFile(
-            suffix=".db", delete=False
-        ) as temp_file:
-            temp_db_path = temp_file.name
-
-        # Set the test database path
-        from src.vector_database import TEST_DB_PATH
-
-        original_test_db_path = TEST_DB_PATH
-        import src.vector_database
-
-        src.vector_database.TEST_DB_PATH = temp_db_path
-
-        # Initialize the database
+    def temp_db_path(self, test_db: str) -> str:
+        """Initialize the in-memory database of the test for the flow."""
         init_db()
-        yield temp_db_path
-
-        # Reset the test database path
-        src.vector_database.TEST_DB_PATH = original_test_db_path
-
-        # Clean up after tests
-        if os.path.exists(temp_db_path):
-            os.unlink(temp_db_path)
+        return test_db
 
     def test_add_then_search_flow(self, temp_db_path: str) -> None:
         """Test a complete flow of adding a command then searching for it."""
@@ -51,16 +28,22 @@ class TestCommandFlow:
         add_args = Namespace(
             description="List files in color format",
             commandrun="ls --color=auto",
+            alias=False,
         )
 
-        with patch(
-            "src.commands.calculate_embedding", return_value=mock_embedding1
-        ):
+        with patch("src.commands.drain_worker"):
             result_add = handle_add(add_args)
 
         assert result_add is True
 
-        # 2. Then search for a similar command
+        # 2. The embedding is stored once the queue is drained
+        with patch(
+            "src.write_queue.calculate_embeddings",
+            return_value=[mock_embedding1],
+        ):
+            assert drain_pending() == 1
+
+        # 3. Then search for a similar command
         search_args = Namespace(description="Show files with colors")
 
         mock_results = [
@@ -1,110 +1,132 @@
 import json
-import os
-import tempfile
+import time
 from argparse import Namespace
 from pathlib import Path
-from typing import Any, Generator
+from typing import Any
 from unittest.mock import patch
 
 import pytest
 
 from src.commands import (
+    SEARCH_DEADLINE,
     handle_add,
+    handle_batch_search,
+    handle_delete,
     handle_export,
     handle_import,
+    handle_maintain,
     handle_search,
+    handle_sync_export,
+    handle_sync_import,
+    handle_update,
+)
+from src.transport import EmbeddingUnavailableError
+from src.vector_database import (
+    add_alias,
+    add_entry,
+    cache_query_embedding,
+    enqueue_entry,
+    fetch_all_commands,
+    fetch_pending_commands,
+    init_db,
 )
 
 
 class TestAddCommand:
 
     @pytest.fixture
-    def temp_db_path(self) -> Generator[str, None, None]:
-        """Create a temporary database file path for testing."""
-        with tempfile.NamedTemporaryFile(
-            suffix=".db", delete=False
-        ) as temp_file:
-            temp_db_path = temp_file.name
-
-        # Set the test database path
-        from src.vector_database import TEST_DB_PATH
-
-        original_test_db_path = TEST_DB_PATH
-        import src.vector_database
-
-        src.vector_database.TEST_DB_PATH = temp_db_path
+    def temp_db_path(self, test_db: str) -> str:
+        """Use the in-memory database of the test."""
+        return test_db
 
-        yield temp_db_path
+    def test_add_command_success(self, temp_db_path: str) -> None:
+        # Arrange
+        args = Namespace(
+            description="List all files", commandrun="ls -la", alias=False
+        )
 
-        # Reset the test database path
-        src.vector_database.TEST_DB_PATH = original_test_db_path
+        # Act
+        with patch("src.commands.enqueue_entry") as mock_enqueue:
+            with patch("src.commands.drain_worker") as mock_worker:
+                with patch("src.commands.fastcmd_print") as mock_print:
+                    result = handle_add(args)
 
-        # Clean up after tests
-        if os.path.exists(temp_db_path):
-            os.unlink(temp_db_path)
+        # Assert
+        mock_enqueue.assert_called_once_with(
+            command="ls -la", description="List all files"
+        )
+        mock_worker.schedule.assert_called_once()
+        mock_print.assert_called_once()
+        assert result is True
 
-    def test_add_command_success(self, temp_db_path: str) -> None:
+    def test_add_command_works_offline(self, temp_db_path: str) -> None:
         # Arrange
-        args = Namespace(description="List all files", commandrun="ls -la")
-        mock_embedding = [0.1] * 1536
+        args = Namespace(
+            description="List all files", commandrun="ls -la", alias=False
+        )
 
         # Act
-        with patch(
-            "src.commands.calculate_embedding", return_value=mock_embedding
-        ) as mock_calc_embedding:
-            with patch("src.commands.fastcmd_print") as mock_print:
-                result = handle_add(args)
+        with patch("src.commands.enqueue_entry"):
+            with patch("src.commands.drain_worker"):
+                with patch(
+                    "src.commands.calculate_embedding",
+                    side_effect=Exception("Connection error"),
+                ) as mock_calc_embedding:
+                    with patch("src.commands.fastcmd_print"):
+                        result = handle_add(args)
 
         # Assert
-        mock_calc_embedding.assert_called_once_with("List all files")
-        mock_print.assert_called_once()
+        mock_calc_embedding.assert_not_called()
         assert result is True
 
     def test_add_command_handles_exception(self, temp_db_path: str) -> None:
         # Arrange
-        args = Namespace(description="List all files", commandrun="ls -la")
+        args = Namespace(
+            description="List all files", commandrun="ls -la", alias=False
+        )
 
         # Act
         with patch(
-            "src.commands.calculate_embedding",
+            "src.commands.enqueue_entry",
             side_effect=Exception("Test error"),
-        ) as mock_calc_embedding:
+        ) as mock_enqueue:
             with patch("src.commands.fastcmd_print") as mock_print:
                 result = handle_add(args)
 
         # Assert
-        mock_calc_embedding.assert_called_once()
+        mock_enqueue.assert_called_once()
         mock_print.assert_called_once()
         assert "Error adding command" in mock_print.call_args[0][0]
         assert result is False
 
+    def test_add_alias_to_saved_command(self, temp_db_path: str) -> None:
+        # Arrange
+        init_db()
+        add_entry([0.1] * 1536, "ls -la", "List all files", temp_db_path)
+        args = Namespace(
+            description="Show my files", commandrun="ls -la", alias=True
+        )
 
-class TestSearchCommand:
-
-    @pytest.fixture
-    def temp_db_path(self) -> Generator[str, None, None]:
-        """Create a temporary database file path for testing."""
-        with tempfile.NamedTemporaryFile(
-            suffix=".db", delete=False
-        ) as temp_file:
-            temp_db_path = temp_file.name
-
-        # Set the test database path
-        from src.vector_database import TEST_DB_PATH
-
-        original_test_db_path = TEST_DB_PATH
-        import src.vector_database
+        # Act
+        with patch("src.commands.enqueue_entry") as mock_enqueue:
+            with patch("src.commands.drain_worker") as mock_worker:
+                with patch("src.commands.fastcmd_print") as mock_print:
+                    result = handle_add(args)
 
-        src.vector_database.TEST_DB_PATH = temp_db_path
+        # Assert
+        mock_enqueue.assert_not_called()
+        mock_worker.schedule.assert_called_once()
+        assert "added as an alias" in mock_print.call_args[0][0]
+        assert result is True
+        assert len(fetch_all_commands(temp_db_path)) == 1
 
-        yield temp_db_path
 
-        # Reset the test database path
-        src.vector_database.TEST_DB_PATH = original_test_db_path
+class TestSearchCommand:
 
-        # Clean up after tests
-        if os.path.exists(temp_db_path):
-            os.unlink(temp_db_path)
+    @pytest.fixture
+    def temp_db_path(self, test_db: str) -> str:
+        """Use the in-memory database of the test."""
+        return test_db
 
     def test_search_command_no_results(self, temp_db_path: str) -> None:
         # Arrange
@@ -118,12 +140,13 @@ class TestSearchCommand:
             with patch(
                 "src.commands.fetch_similar", return_value=[]
             ) as mock_fetch:
-                with patch("src.commands.fastcmd_print") as mock_print:
-                    result = handle_search(args)
+                with patch("src.commands.match_pending", return_value=[]):
+                    with patch("src.commands.fastcmd_print") as mock_print:
+                        result = handle_search(args)
 
         # Assert
         mock_calc_embedding.assert_called_once_with(
-            "Find non-existent command"
+            "Find non-existent command", timeout=SEARCH_DEADLINE
         )
         mock_fetch.assert_called_once_with(mock_embedding, top_k=1)
         assert "No matching commands found" in mock_print.call_args[0][0]
@@ -162,14 +185,212 @@ class TestSearchCommand:
         mock_print_match.assert_called_once()
         assert result is True
 
+    def test_search_command_matches_pending_by_words(
+        self, temp_db_path: str
+    ) -> None:
+        # Arrange
+        init_db()
+        enqueue_entry(
+            "sudo systemctl restart docker", "restart docker service"
+        )
+        enqueue_entry("df -h", "disk usage")
+
+        # Act
+        with patch(
+            "src.commands.calculate_embedding", return_value=[0.1] * 1536
+        ):
+            with patch("src.commands.print_command_match") as mock_print_match:
+                result = handle_search(
+                    Namespace(description="restart docker service")
+                )
+
+        # Assert
+        assert result is True
+        match = mock_print_match.call_args[0][0]
+        assert match["command"] == "sudo systemctl restart docker"
+        assert match["pending"] is True
+
+    def test_search_command_lists_pending_after_vector_match(
+        self, temp_db_path: str
+    ) -> None:
+        # Arrange
+        init_db()
+        add_entry([0.1] * 1536, "systemctl restart nginx", "restart nginx")
+        enqueue_entry(
+            "sudo systemctl restart docker", "restart docker service"
+        )
+
+        # Act
+        with patch(
+            "src.commands.calculate_embedding", return_value=[0.1] * 1536
+        ):
+            with patch("src.commands.print_command_match") as mock_print_match:
+                result = handle_search(
+                    Namespace(description="restart docker service")
+                )
+
+        # Assert
+        assert result is True
+        match = mock_print_match.call_args[0][0]
+        assert match["command"] == "systemctl restart nginx"
+        assert "pending" not in match
+        assert [p["command"] for p in match["pending_matches"]] == [
+            "sudo systemctl restart docker"
+        ]
+
+    def test_search_command_repeated_query_uses_cache(
+        self, temp_db_path: str
+    ) -> None:
+        # Arrange
+        init_db(temp_db_path)
+        add_entry([0.1] * 1536, "ls -la", "list all files", temp_db_path)
+
+        # Act
+        with patch(
+            "src.commands.calculate_embedding", return_value=[0.1] * 1536
+        ) as mock_calc_embedding:
+            with patch("src.commands.print_command_match"):
+                first = handle_search(Namespace(description="List  files"))
+                second = handle_search(Namespace(description="list files"))
+
+        # Assert
+        assert first is True and second is True
+        mock_calc_embedding.assert_called_once()
+
+    def test_search_command_falls_back_after_deadline(
+        self, temp_db_path: str
+    ) -> None:
+        # Arrange
+        init_db(temp_db_path)
+        add_entry([0.1] * 1536, "df -h", "show disk usage", temp_db_path)
+        add_entry([0.2] * 1536, "ls -la", "list all files", temp_db_path)
+
+        def slow_embedding(description: str, timeout: float) -> list:
+            time.sleep(0.5)
+            return [0.1] * 1536
+
+        # Act
+        started = time.monotonic()
+        with patch("src.commands.SEARCH_DEADLINE", 0.05):
+            with patch(
+                "src.commands.calculate_embedding", side_effect=slow_embedding
+            ):
+                with patch(
+                    "src.commands.print_command_match"
+                ) as mock_print_match:
+                    result = handle_search(Namespace(description="disk usgae"))
+        elapsed = time.monotonic() - started
+
+        # Assert
+        assert result is True
+        assert elapsed < 0.4
+        match = mock_print_match.call_args[0][0]
+        assert match["command"] == "df -h"
+        assert match["degraded"] is True
+
+    def test_search_command_falls_back_to_similar_cached_query(
+        self, temp_db_path: str
+    ) -> None:
+        # Arrange
+        disk_embedding = [0.0] * 1536
+        disk_embedding[0] = 1.0
+        files_embedding = [0.0] * 1536
+        files_embedding[1] = 1.0
+        init_db(temp_db_path)
+        add_entry(disk_embedding, "df -h", "free space", temp_db_path)
+        add_entry(files_embedding, "ls -la", "list all files", temp_db_path)
+        cache_query_embedding("show disk usage", disk_embedding, temp_db_path)
+
+        # Act
+        with patch(
+            "src.commands.calculate_embedding",
+            side_effect=EmbeddingUnavailableError("unavailable"),
+        ):
+            with patch("src.commands.print_command_match") as mock_print_match:
+                result = handle_search(
+                    Namespace(description="show the disk usage")
+                )
+
+        # Assert
+        assert result is True
+        match = mock_print_match.call_args[0][0]
+        assert match["command"] == "df -h"
+        assert match["degraded"] is True
+
+
+class TestUpdateDeleteCommands:
+    def test_update_command_queues_new_description(self, test_db: str) -> None:
+        # Arrange
+        init_db()
+        add_entry([0.1] * 1536, "ls -la", "List files", test_db)
+        args = Namespace(id=1, commandrun=None, description="List all files")
+
+        # Act
+        with patch("src.commands.drain_worker") as mock_worker:
+            with patch("src.commands.fastcmd_print") as mock_print:
+                result = handle_update(args)
+
+        # Assert
+        assert result is True
+        mock_worker.schedule.assert_called_once()
+        assert "updated successfully" in mock_print.call_args[0][0]
+        assert fetch_pending_commands(test_db)[0]["description"] == (
+            "List all files"
+        )
+
+    def test_update_command_keeps_vector_of_same_description(
+        self, test_db: str
+    ) -> None:
+        # Arrange
+        init_db()
+        add_entry([0.1] * 1536, "ls -la", "List files", test_db)
+        args = Namespace(id=1, commandrun="ls -lah", description="List files")
+
+        # Act
+        with patch("src.commands.drain_worker") as mock_worker:
+            with patch("src.commands.fastcmd_print"):
+                result = handle_update(args)
+
+        # Assert
+        assert result is True
+        mock_worker.schedule.assert_not_called()
+        assert fetch_pending_commands(test_db) == []
+
+    def test_update_command_unknown_id(self) -> None:
+        args = Namespace(id=42, commandrun="pwd", description=None)
+
+        with patch("src.commands.fastcmd_print") as mock_print:
+            result = handle_update(args)
+
+        assert result is False
+        assert "No command with id 42" in mock_print.call_args[0][0]
+
+    def test_delete_command(self, test_db: str) -> None:
+        # Arrange
+        init_db()
+        add_entry([0.1] * 1536, "ls -la", "List files", test_db)
+
+        # Act
+        with patch("src.commands.fastcmd_print") as mock_print:
+            deleted = handle_delete(Namespace(id=1))
+            deleted_again = handle_delete(Namespace(id=1))
+
+        # Assert
+        assert (deleted, deleted_again) == (True, False)
+        assert "No command with id 1" in mock_print.call_args[0][0]
+        assert fetch_all_commands(test_db) == []
+
 
 class TestExportImportCommands:
     def test_export_command_success(
         self, tmp_path: Path, monkeypatch: Any
     ) -> None:
         # Arrange
-        args_add = Namespace(description="List files", commandrun="ls -l")
-        handle_add(args_add)
+        args_add = Namespace(
+            description="List files", commandrun="ls -l", alias=False
+        )
+        with patch("src.commands.drain_worker"):
+            handle_add(args_add)
         export_path = tmp_path / "exported.json"
         args_export = Namespace(output=str(export_path))
         # Act
@@ -225,7 +446,8 @@ class TestExportImportCommands:
             m.setenv("HOST_HOME", str(tmp_path))
             m.setenv("USER_HOME", str(tmp_path))
             with patch(
-                "src.commands.calculate_embedding", return_value=[0.1] * 1536
+                "src.commands.calculate_embeddings",
+                side_effect=lambda texts: [[0.1] * 1536 for _ in texts],
             ):
                 with patch("src.commands.fastcmd_print") as mock_print:
                     result = handle_import(args_import)
@@ -236,6 +458,80 @@ class TestExportImportCommands:
             for call in mock_print.call_args_list
         )
 
+    def test_export_import_keeps_aliases(
+        self, test_db: str, tmp_path: Path
+    ) -> None:
+        # Arrange
+        init_db()
+        entry_id = add_entry([0.1] * 1536, "ls -la", "List files", test_db)
+        add_alias(entry_id, [0.2] * 1536, "Show files", test_db)
+        export_path = tmp_path / "exported.json"
+        with patch("src.commands.fastcmd_print"):
+            handle_export(Namespace(output=str(export_path)))
+            handle_delete(Namespace(id=entry_id))
+
+        # Act
+        with patch(
+            "src.commands.calculate_embeddings",
+            side_effect=lambda texts: [[0.1] * 1536 for _ in texts],
+        ) as mock_calc_embedding:
+            with patch("src.commands.fastcmd_print"):
+                result = handle_import(Namespace(input=str(export_path)))
+
+        # Assert
+        assert result is True
+        mock_calc_embedding.assert_called_once_with(
+            ["List files", "Show files"]
+        )
+        (command,) = fetch_all_commands(test_db)
+        assert command["aliases"] == ["Show files"]
+
+    def test_import_skips_repeated_aliases(
+        self, test_db: str, tmp_path: Path
+    ) -> None:
+        # Arrange
+        init_db()
+        import_path = tmp_path / "import.json"
+        import_path.write_text(
+            json.dumps(
+                {
+                    "commands": [
+                        {
+                            "command": "ls -la",
+                            "description": "List files",
+                            "aliases": ["Show files", "List files"],
+                        },
+                        {
+                            "command": "df -h",
+                            "description": "Disk usage",
+                            "aliases": ["Free space", "Free space"],
+                        },
+                    ]
+                }
+            )
+        )
+
+        # Act
+        with patch(
+            "src.commands.calculate_embeddings",
+            side_effect=lambda texts: [[0.1] * 1536 for _ in texts],
+        ):
+            with patch("src.commands.fastcmd_print") as mock_print:
+                result = handle_import(Namespace(input=str(import_path)))
+
+        # Assert
+        assert result is True
+        assert [cmd.get("aliases") for cmd in fetch_all_commands()] == [
+            ["Show files"],
+            ["Free space"],
+        ]
+        assert mock_print.call_args_list[-1][0][0].startswith(
+            "\n✅ Imported 2 commands"
+        )
+        assert "skipped 2 repeated or surplus aliases" in (
+            mock_print.call_args_list[-1][0][0]
+        )
+
     def test_import_command_file_not_found(
         self, tmp_path: Path, monkeypatch: Any
     ) -> None:
@@ -254,3 +550,126 @@ class TestExportImportCommands:
             "File not found" in str(call[0][0])
             for call in mock_print.call_args_list
         )
+
+
+class TestSyncCommands:
+    def test_sync_export_then_import_the_same_file(
+        self, test_db: str, tmp_path: Path
+    ) -> None:
+        # Arrange
+        init_db()
+        add_entry([0.1] * 1536, "ls -la", "List files", test_db)
+        sync_path = tmp_path / "sync.json"
+
+        # Act
+        with patch("src.commands.fastcmd_print") as mock_print:
+            exported = handle_sync_export(
+                Namespace(since=0, output=str(sync_path))
+            )
+            export_message = mock_print.call_args[0][0]
+            imported = handle_sync_import(Namespace(input=str(sync_path)))
+
+        # Assert
+        assert (exported, imported) == (True, True)
+        assert "Exported 1 changes" in export_message
+        assert "--since 1" in export_message
+        assert "1 older changes skipped" in mock_print.call_args[0][0]
+        assert json.loads(sync_path.read_text())["cursor"] == 1
+
+    def test_sync_import_rejects_other_files(self, tmp_path: Path) -> None:
+        other_path = tmp_path / "commands.json"
+        other_path.write_text(json.dumps({"commands": []}))
+
+        with patch("src.commands.fastcmd_print") as mock_print:
+            result = handle_sync_import(Namespace(input=str(other_path)))
+
+        assert result is False
+        assert "Not a FastCmd sync file" in mock_print.call_args[0][0]
+
+
+class TestMaintainCommand:
+    def test_maintain_check_only_reports(self, test_db: str) -> None:
+        # Arrange
+        init_db()
+        add_entry([0.1] * 1536, "ls -la", "List files", test_db)
+
+        # Act
+        with patch("src.commands.run_maintenance") as mock_run:
+            with patch("src.commands.fastcmd_print") as mock_print:
+                result = handle_maintain(Namespace(check=True, full=False))
+
+        # Assert
+        assert result is True
+        mock_run.assert_not_called()
+        printed = [call[0][0] for call in mock_print.call_args_list]
+        assert any("commands" in line and "1" in line for line in printed)
+
+    def test_maintain_prints_before_and_after(self, test_db: str) -> None:
+        # Arrange
+        init_db()
+        add_entry([0.1] * 1536, "ls -la", "List files", test_db)
+
+        # Act
+        with patch("src.commands.fastcmd_print") as mock_print:
+            result = handle_maintain(Namespace(check=False, full=True))
+
+        # Assert
+        assert result is True
+        printed = [call[0][0] for call in mock_print.call_args_list]
+        assert any("before" in line and "after" in line for line in printed)
+        assert "vacuum full" in printed[-1]
+
+
+class TestBatchSearchCommand:
+    def test_batch_search_streams_jsonl(self, tmp_path: Path) -> None:
+        # Arrange
+        input_path = tmp_path / "queries.txt"
+        input_path.write_text("list files\n\ngit state\n")
+        output_path = tmp_path / "results.jsonl"
+        args = Namespace(
+            input=str(input_path), top_k=1, output=str(output_path)
+        )
+        match = {"command": "ls", "description": "List", "distance": 0.25}
+
+        # Act
+        with patch(
+            "src.commands.calculate_embeddings",
+            side_effect=lambda batch: [[0.1] * 1536 for _ in batch],
+        ) as mock_calc_embeddings:
+            with patch(
+                "src.commands.fetch_similar_batch",
+                side_effect=lambda embeddings, top_k: (
+                    [match] for _ in embeddings
+                ),
+            ):
+                with patch("src.commands.init_db"):
+                    with patch("src.commands.fastcmd_print"):
+                        result = handle_batch_search(args)
+
+        # Assert
+        assert result is True
+        mock_calc_embeddings.assert_called_once_with(
+            ["list files", "git state"]
+        )
+        lines = output_path.read_text().splitlines()
+        records = [json.loads(line) for line in lines]
+        assert [record["query"] for record in records] == [
+            "list files",
+            "git state",
+        ]
+        assert records[0]["matches"][0]["score"] == 0.75
+
+    def test_batch_search_file_not_found(self, tmp_path: Path) -> None:
+        # Arrange
+        args = Namespace(
+            input=str(tmp_path / "missing.txt"), top_k=1, output=None
+        )
+
+        # Act
+        with patch("src.commands.init_db"):
+            with patch("src.commands.fastcmd_print") as mock_print:
+                result = handle_batch_search(args)
+
+        # Assert
+        assert result is False
+        assert "File not found" in mock_print.call_args[0][0]
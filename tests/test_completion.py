@@ -0,0 +1,129 @@
+import time
+from argparse import Namespace
+from unittest.mock import patch
+
+from src.commands import handle_add, handle_delete
+from src.completion import (
+    DescriptionIndex,
+    _Completer,
+    complete_line,
+    get_description_index,
+)
+from src.vector_database import add_alias, add_entry, init_db
+
+# Slowest lookup allowed at CATALOG_SIZE descriptions
+SUGGEST_BUDGET_MS = 10
+CATALOG_SIZE = 100_000
+
+
+def test_suggest_lists_prefix_matches_first() -> None:
+    index = DescriptionIndex(
+        [
+            "Show running docker containers",
+            "List docker images",
+            "docker compose up",
+            "Remove stopped docker containers",
+            "Run docker-compose in the background",
+        ]
+    )
+    index.add("Docker system prune")
+
+    assert index.suggest("docker") == [
+        "docker compose up",
+        "Docker system prune",
+        "Show running docker containers",
+        "List docker images",
+        "Remove stopped docker containers",
+        "Run docker-compose in the background",
+    ]
+    assert index.suggest("docker-compose in") == [
+        "Run docker-compose in the background"
+    ]
+    assert index.suggest("docker cont") == [
+        "Show running docker containers",
+        "Remove stopped docker containers",
+    ]
+    assert index.suggest("running dock") == ["Show running docker containers"]
+    assert index.suggest("ocker") == []
+    assert index.suggest("Docker Compose Up") == ["docker compose up"]
+    assert index.suggest("docker", limit=2) == [
+        "docker compose up",
+        "Docker system prune",
+    ]
+
+
+def test_complete_line_keeps_the_typed_quote(test_db: str) -> None:
+    init_db()
+    add_entry([0.1] * 1536, "ls -la", "List all files", test_db)
+    add_entry([0.2] * 1536, "git log", "Show the team's commits", test_db)
+
+    assert complete_line("search -d 'list") == [
+        ("search -d 'List all files'", "List all files")
+    ]
+    assert complete_line('search -d "show') == [
+        ('search -d "Show the team\'s commits"', "Show the team's commits")
+    ]
+    assert complete_line("search --description all") == [
+        ("search --description 'List all files'", "List all files")
+    ]
+    assert complete_line("search -d 'show") == [
+        (
+            "search -d 'Show the team'\"'\"'s commits'",
+            "Show the team's commits",
+        )
+    ]
+    assert complete_line("add -d 'list") == []
+
+
+def test_index_follows_added_and_deleted_commands(test_db: str) -> None:
+    init_db()
+    entry_id = add_entry([0.1] * 1536, "ls -la", "List all files", test_db)
+    add_alias(entry_id, [0.2] * 1536, "Show my files", test_db)
+    index = get_description_index()
+    assert index.suggest("show") == ["Show my files"]
+
+    with patch("src.commands.drain_worker"):
+        with patch("src.commands.fastcmd_print"):
+            handle_add(
+                Namespace(
+                    description="Disk usage", commandrun="df -h", alias=False
+                )
+            )
+            assert get_description_index().suggest("disk") == ["Disk usage"]
+            handle_delete(Namespace(id=entry_id))
+
+    assert get_description_index() is not index
+    assert get_description_index().suggest("list") == []
+
+
+def test_completer_lists_descriptions(test_db: str, capsys: object) -> None:
+    init_db()
+    add_entry([0.1] * 1536, "ls -la", "List all files", test_db)
+    add_entry([0.2] * 1536, "lsblk", "List block devices", test_db)
+    completer = _Completer(readline=None)
+
+    lines = []
+    state = 0
+    while (line := completer.complete("search -d list", state)) is not None:
+        lines.append(line)
+        state += 1
+
+    assert lines == [
+        "search -d 'List all files'",
+        "search -d 'List block devices'",
+    ]
+    assert completer.complete("exit", 0) is None
+
+
+def test_suggestions_stay_within_budget() -> None:
+    services = ["api", "web", "worker", "db", "cache", "queue", "auth"]
+    actions = ["restart", "show logs of", "scale", "describe", "delete"]
+    index = DescriptionIndex(
+        f"{actions[i % 5]} the {services[i % 7]} pods of team {i}"
+        for i in range(CATALOG_SIZE)
+    )
+
+    for query in ["re", "show logs", "the api pods", "pods of team 4", "x"]:
+        started = time.perf_counter()
+        index.suggest(query)
+        assert (time.perf_counter() - started) * 1000 < SUGGEST_BUDGET_MS
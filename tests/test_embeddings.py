@@ -1,17 +1,36 @@
+import base64
+import struct
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from src.embeddings import calculate_embedding, get_openai_client
+from src.embeddings import (
+    calculate_embedding,
+    calculate_embeddings,
+    calculate_stub_embedding,
+    decode_embedding,
+    get_openai_client,
+)
+
+
+def _base64_embedding(vector: list) -> str:
+    return base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode()
 
 
 class TestEmbeddings:
 
     def test_get_openai_client_with_key(self) -> None:
         with patch("os.environ.get", return_value="test-api-key"):
-            with patch("src.embeddings.OpenAI") as mock_openai:
-                get_openai_client()
-                mock_openai.assert_called_once_with(api_key="test-api-key")
+            with patch("src.embeddings._transport", None):
+                with patch("src.transport.OpenAI") as mock_openai:
+                    client = get_openai_client()
+                    # The client is created once and reused afterwards
+                    assert get_openai_client() is client
+                    mock_openai.assert_called_once()
+                    assert (
+                        mock_openai.call_args.kwargs["api_key"]
+                        == "test-api-key"
+                    )
 
     def test_get_openai_client_without_key(self) -> None:
         with patch("os.environ.get", return_value=None):
@@ -25,23 +44,75 @@ class TestEmbeddings:
         assert "Description cannot be empty" in str(excinfo.value)
 
     def test_calculate_embedding(self) -> None:
-        # Mock the OpenAI client and response
-        mock_embedding = [0.1, 0.2, 0.3, 0.4, 0.5]
+        # Mock the OpenAI client and a base64 encoded response
+        mock_embedding = [0.5, 0.25, -1.0, 2.0]
         mock_response = MagicMock()
-        mock_response.data = [MagicMock(embedding=mock_embedding)]
+        mock_response.data = [
+            MagicMock(embedding=_base64_embedding(mock_embedding))
+        ]
 
-        mock_client = MagicMock()
-        mock_client.embeddings.create.return_value = mock_response
+        mock_transport = MagicMock()
+        mock_transport.create_embeddings.return_value = mock_response
 
         with patch(
-            "src.embeddings.get_openai_client", return_value=mock_client
+            "src.embeddings.get_transport", return_value=mock_transport
         ):
             result = calculate_embedding("test description")
 
             # Check if client was called with correct parameters
-            mock_client.embeddings.create.assert_called_once_with(
-                model="text-embedding-ada-002", input="test description"
+            mock_transport.create_embeddings.assert_called_once_with(
+                model="text-embedding-ada-002",
+                input="test description",
+                timeout=None,
+                encoding_format="base64",
             )
 
             # Check if result matches expected embedding
-            assert result == mock_embedding
+            assert list(result) == mock_embedding
+
+    def test_calculate_embeddings_batches_and_orders(self) -> None:
+        def create(model: str, input: list, encoding_format: str) -> MagicMock:
+            response = MagicMock()
+            # Return items out of order to check they are re-ordered
+            response.data = [
+                MagicMock(
+                    index=i, embedding=_base64_embedding([float(len(text))])
+                )
+                for i, text in reversed(list(enumerate(input)))
+            ]
+            return response
+
+        mock_transport = MagicMock()
+        mock_transport.create_embeddings.side_effect = create
+
+        with patch(
+            "src.embeddings.get_transport", return_value=mock_transport
+        ):
+            with patch("src.embeddings.EMBEDDING_BATCH_SIZE", 2):
+                result = calculate_embeddings(["a", "bb", "ccc"])
+
+        assert [list(vector) for vector in result] == [[1.0], [2.0], [3.0]]
+        assert mock_transport.create_embeddings.call_count == 2
+
+    def test_calculate_embeddings_empty_description(self) -> None:
+        with pytest.raises(ValueError) as excinfo:
+            calculate_embeddings(["ok", ""])
+        assert "Description cannot be empty" in str(excinfo.value)
+
+    def test_stub_provider_is_deterministic_and_local(self) -> None:
+        with patch.dict("os.environ", {"FASTCMD_EMBEDDING_PROVIDER": "stub"}):
+            with patch("src.embeddings.get_transport") as mock_client:
+                first = calculate_embedding("list all files")
+                second = calculate_embeddings(["list all files"])[0]
+
+        mock_client.assert_not_called()
+        assert first == second
+        assert len(first) == 1536
+        assert first == calculate_stub_embedding("List all files")
+
+    def test_decode_embedding_accepts_base64_and_floats(self) -> None:
+        from_base64 = decode_embedding(_base64_embedding([0.5, -0.25]))
+        from_floats = decode_embedding([0.5, -0.25])
+
+        assert from_base64 == from_floats
+        assert from_base64.typecode == "f"  # type: ignore[attr-defined]
@@ -0,0 +1,110 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+import src.embeddings
+from src.embeddings import (
+    calculate_embedding,
+    calculate_stub_embedding,
+    record_embeddings,
+)
+from src.evaluation import (
+    dataset_texts,
+    evaluate,
+    first_hit,
+    format_results,
+    load_commands,
+    load_dataset,
+)
+
+DATASET = {
+    "commands": [
+        {"command": "ls -la", "description": "list all files"},
+        {
+            "command": "df -h",
+            "description": "show free disk space",
+            "aliases": ["disk usage"],
+        },
+        {"command": "docker ps", "description": "list running containers"},
+    ],
+    "queries": [
+        {"query": "list running containers", "expected": "docker ps"},
+        {"query": "disk usage", "expected": ["df -h"]},
+        {"query": "list all running files", "expected": "docker ps"},
+    ],
+}
+
+
+@pytest.fixture
+def dataset_path(tmp_path: Path) -> str:
+    path = tmp_path / "dataset.json"
+    path.write_text(json.dumps(DATASET))
+    return str(path)
+
+
+def test_load_dataset_checks_expected_commands(
+    dataset_path: str, tmp_path: Path
+) -> None:
+    dataset = load_dataset(dataset_path)
+    assert dataset["queries"][0]["expected"] == ["docker ps"]
+    assert "disk usage" in dataset_texts(dataset)
+
+    broken = tmp_path / "broken.json"
+    broken.write_text(
+        json.dumps(
+            {**DATASET, "queries": [{"query": "x", "expected": "rm -rf"}]}
+        )
+    )
+    with pytest.raises(ValueError, match="unknown commands: rm -rf"):
+        load_dataset(str(broken))
+
+
+def test_evaluate_scores_ranks_and_latency(
+    test_db: str, dataset_path: str, monkeypatch: Any
+) -> None:
+    monkeypatch.setenv("FASTCMD_EMBEDDING_PROVIDER", "stub")
+    dataset = load_dataset(dataset_path)
+    assert load_commands(dataset["commands"]) == 3
+
+    for mode in ("search", "vector"):
+        result = evaluate(dataset["queries"], top_k=3, mode=mode)
+        # "list all running files" is closer to "list all files"
+        assert result["recall"] == {1: 2 / 3, 3: 1.0}
+        assert result["mrr"] == pytest.approx((1 + 1 + 1 / 2) / 3)
+        assert 0 < result["p50_ms"] <= result["p95_ms"]
+        assert result["degraded"] == 0
+        assert result["misses"] == []
+
+    with pytest.raises(ValueError, match="Unknown mode"):
+        evaluate(dataset["queries"], mode="ann")
+
+    lines = format_results({"baseline": result}, top_k=3)
+    assert lines[0].split()[:3] == ["configuration", "recall@1", "recall@3"]
+    assert lines[1].split()[:3] == ["baseline", "0.667", "1.000"]
+
+
+def test_first_hit() -> None:
+    matches = [{"command": "a"}, {"command": "b"}, {"command": "c"}]
+    assert first_hit(matches, ["c", "b"]) == 2
+    assert first_hit(matches, ["d"]) is None
+
+
+def test_recorded_embeddings_replay_offline(
+    tmp_path: Path, monkeypatch: Any
+) -> None:
+    recording = tmp_path / "recording.json"
+    monkeypatch.setenv("FASTCMD_EMBEDDING_PROVIDER", "stub")
+    assert (
+        record_embeddings(["list files", "list files", "df"], str(recording))
+        == 2
+    )
+
+    monkeypatch.setenv("FASTCMD_EMBEDDING_PROVIDER", "recorded")
+    monkeypatch.setattr(src.embeddings, "EMBEDDING_RECORDING", str(recording))
+    assert list(calculate_embedding("list files")) == list(
+        calculate_stub_embedding("list files")
+    )
+    with pytest.raises(ValueError, match="No recorded embedding for 'ls'"):
+        calculate_embedding("ls")
@@ -0,0 +1,46 @@
+import importlib
+from unittest.mock import patch
+
+import pytest
+
+
+def test_import_does_not_start_the_prompt() -> None:
+    # The console script imports the module and then calls main()
+    with patch("builtins.input", side_effect=AssertionError("prompted")):
+        module = importlib.import_module("src.fastcmd")
+
+    assert callable(module.main)
+
+
+def test_main_runs_a_single_command_and_exits() -> None:
+    from src import fastcmd
+
+    with patch("sys.argv", ["fastcmd", "search", "-d", "list files"]):
+        with patch("src.fastcmd.set_openai_api_key_for_session"):
+            with patch("src.fastcmd.drain_worker"):
+                with patch(
+                    "src.fastcmd.run_command", return_value=True
+                ) as mock_run:
+                    with pytest.raises(SystemExit) as excinfo:
+                        fastcmd.main()
+
+    mock_run.assert_called_once_with(
+        "search -d 'list files'", interactive=False
+    )
+    assert excinfo.value.code == 0
+
+
+def test_prompt_starts_the_warmup() -> None:
+    from src import fastcmd
+
+    with patch("sys.argv", ["fastcmd"]):
+        with patch("src.fastcmd.print_instructions"):
+            with patch("src.fastcmd.set_openai_api_key_for_session"):
+                with patch("src.fastcmd.drain_worker"):
+                    with patch(
+                        "src.fastcmd.get_user_input", return_value=None
+                    ):
+                        with patch("src.fastcmd.start_warmup") as mock_warmup:
+                            fastcmd.main()
+
+    mock_warmup.assert_called_once_with()
@@ -0,0 +1,158 @@
+import io
+from pathlib import Path
+from typing import List
+from unittest.mock import patch
+
+import pytest
+
+from src.embeddings import calculate_stub_embedding
+from src.history import (
+    describe_with_summary,
+    get_description_generator,
+    ingest_history,
+    normalize_command,
+    read_history,
+)
+from src.related import fetch_related
+from src.vector_database import add_entry, fetch_all_commands, init_db
+
+
+@pytest.fixture
+def temp_db(memory_db: str) -> str:
+    init_db(memory_db)
+    return memory_db
+
+
+class EmbeddingCalls:
+    """Stand-in for calculate_embeddings recording every request."""
+
+    def __init__(self) -> None:
+        self.batches: List[List[str]] = []
+
+    def __call__(self, descriptions: List[str]) -> list:
+        self.batches.append(list(descriptions))
+        return [calculate_stub_embedding(text) for text in descriptions]
+
+
+def test_read_history_handles_bash_and_zsh_formats() -> None:
+    data = (
+        b"#1700000000\n"
+        b"git status\n"
+        b": 1700000001:0;docker ps -a\n"
+        b": 1700000002:3;echo one \\\n"
+        b"two\n"
+        b"ls -la"
+    )
+
+    commands = list(read_history(io.BytesIO(data), 0))
+
+    assert [command for command, _ in commands] == [
+        "git status",
+        "docker ps -a",
+        "echo one \ntwo",
+    ]
+    # The unterminated last line is left for the next run
+    assert commands[-1][1] == len(data) - len(b"ls -la")
+
+
+def test_normalize_command() -> None:
+    assert normalize_command("  git   log  --oneline ") == "git log --oneline"
+    assert normalize_command("ls") is None
+    assert normalize_command("fastcmd search -d 'x'") is None
+    assert normalize_command("echo " + "x" * 600) is None
+
+
+def test_ingest_reads_only_new_lines_and_batches(
+    temp_db: str, tmp_path: Path
+) -> None:
+    history = tmp_path / ".bash_history"
+    history.write_text(
+        "git status\n"
+        "ls\n"
+        "git  status\n"
+        "docker ps -a\n"
+        "df -h\n"
+        "du -sh .\n"
+        "tar xzf a.tgz\n"
+    )
+    add_entry(calculate_stub_embedding("x"), "df -h", "Disk", db_path=temp_db)
+    calls = EmbeddingCalls()
+
+    with patch("src.history.calculate_embeddings", calls):
+        counts = ingest_history(str(history), batch_size=2, db_path=temp_db)
+
+    assert counts == {"read": 7, "added": 4, "skipped": 3}
+    assert calls.batches == [
+        [
+            "Git version control: git status",
+            "Manage Docker containers and images: docker ps -a",
+        ],
+        [
+            "Show the size of files and directories: du -sh .",
+            "Create or extract an archive: tar xzf a.tgz",
+        ],
+    ]
+    assert len(fetch_all_commands(temp_db)) == 5
+    # Every batch is linked when stored, no full rebuild is needed
+    assert all(fetch_related(i, db_path=temp_db) for i in range(1, 6))
+
+    # A second run only reads what the shell appended since
+    with history.open("a") as file:
+        file.write("docker ps -a\nkubectl get pods\n")
+    with patch("src.history.calculate_embeddings", calls):
+        counts = ingest_history(str(history), batch_size=2, db_path=temp_db)
+
+    assert counts == {"read": 2, "added": 1, "skipped": 1}
+    assert calls.batches[-1] == [
+        "Manage a Kubernetes cluster: kubectl get pods"
+    ]
+
+
+def test_ingest_resumes_after_a_failed_batch(
+    temp_db: str, tmp_path: Path
+) -> None:
+    history = tmp_path / ".zsh_history"
+    history.write_text(": 1:0;git pull\n: 2:0;git push\n: 3:0;make test\n")
+
+    calls = EmbeddingCalls()
+
+    def flaky(descriptions: List[str]) -> list:
+        # The second request of the first run fails
+        if len(calls.batches) == 1 and "make test" in descriptions[0]:
+            calls.batches.append([])
+            raise RuntimeError("API down")
+        return calls(descriptions)
+
+    with patch("src.history.calculate_embeddings", flaky):
+        with pytest.raises(RuntimeError):
+            ingest_history(str(history), batch_size=2, db_path=temp_db)
+        counts = ingest_history(str(history), batch_size=2, db_path=temp_db)
+
+    assert counts["added"] == 1
+    assert [c["command"] for c in fetch_all_commands(temp_db)] == [
+        "git pull",
+        "git push",
+        "make test",
+    ]
+
+
+def test_ingest_rereads_a_truncated_file(temp_db: str, tmp_path: Path) -> None:
+    history = tmp_path / ".bash_history"
+    history.write_text("git status\ngit log --oneline\n")
+    with patch("src.history.calculate_embeddings", EmbeddingCalls()):
+        ingest_history(str(history), db_path=temp_db)
+        history.write_text("make test\n")
+        counts = ingest_history(str(history), db_path=temp_db)
+
+    assert counts == {"read": 1, "added": 1, "skipped": 0}
+
+
+def test_description_generators() -> None:
+    assert get_description_generator("summary") is describe_with_summary
+    assert describe_with_summary("sudo systemctl restart nginx") == (
+        "Manage system services: sudo systemctl restart nginx"
+    )
+    assert describe_with_summary("terraform plan") == "terraform plan"
+    assert get_description_generator("shlex:quote")("a b") == "'a b'"
+    with pytest.raises(ValueError):
+        get_description_generator("unknown")
@@ -0,0 +1,62 @@
+import os
+import re
+import stat
+import subprocess
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# Records its arguments and stdin, and reports the image as present
+STUB_DOCKER = """#!/bin/bash
+echo "$@" >> "$DOCKER_LOG"
+if [ "$1" = "run" ]; then
+    cat >> "$DOCKER_LOG"
+fi
+"""
+
+
+def _launcher() -> str:
+    # The launcher is the heredoc install.sh writes to /usr/local/bin
+    script = (PROJECT_DIR / "install.sh").read_text()
+    match = re.search(r"<< 'EOL'\n(.*?)\nEOL\n", script, re.S)
+    assert match is not None
+    return match.group(1)
+
+
+def _executable(path: Path, content: str) -> None:
+    path.write_text(content)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+
+
+def test_launcher_passes_arguments_and_stdin_to_fastcmd(
+    tmp_path: Path,
+) -> None:
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    _executable(bin_dir / "docker", STUB_DOCKER)
+    _executable(tmp_path / "fastcmd", _launcher())
+    log = tmp_path / "docker.log"
+
+    process = subprocess.run(
+        [str(tmp_path / "fastcmd"), "batch-search", "-i", "-"],
+        input="list files\n",
+        capture_output=True,
+        text=True,
+        env={
+            **os.environ,
+            "PATH": f"{bin_dir}{os.pathsep}{os.environ['PATH']}",
+            "HOME": str(tmp_path),
+            "USER": "",
+            "FASTCMD_NO_UPDATE_CHECK": "1",
+            "DOCKER_LOG": str(log),
+        },
+    )
+
+    assert process.returncode == 0, process.stderr
+    run, piped = log.read_text().splitlines()
+    # Without a terminal no TTY is allocated, so stdin reaches the command
+    assert run.startswith("run -i --rm ")
+    assert run.endswith(
+        " lukakap/fastcmd:latest python src/fastcmd.py batch-search -i -"
+    )
+    assert piped == "list files"
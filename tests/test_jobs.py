@@ -0,0 +1,127 @@
+import json
+import sys
+import threading
+from argparse import Namespace
+from pathlib import Path
+from typing import Any, List
+from unittest.mock import patch
+
+import pytest
+
+import src.commands
+import src.fastcmd
+import src.vector_database
+from src.commands import handle_job, handle_jobs
+from src.embeddings import calculate_stub_embedding
+from src.fastcmd import announce_finished_jobs, run_command
+from src.jobs import JobManager, checkpoint
+from src.vector_database import add_entry, fetch_all_commands, fetch_similar
+
+
+@pytest.fixture
+def manager(tmp_path: Path, monkeypatch: Any) -> JobManager:
+    # Jobs write while the test reads, like the prompt does, which needs
+    # a WAL database file rather than the shared memory database
+    monkeypatch.setattr(
+        src.vector_database, "TEST_DB_PATH", str(tmp_path / "commands.db")
+    )
+    # Restored after the test, jobs replace it to capture their output
+    monkeypatch.setattr(sys, "stdout", sys.stdout)
+    manager = JobManager()
+    monkeypatch.setattr(src.commands, "job_manager", manager)
+    monkeypatch.setattr(src.fastcmd, "job_manager", manager)
+    return manager
+
+
+def _write_import(path: Path, count: int) -> None:
+    commands = [
+        {"description": f"task {i}", "command": f"run {i}"}
+        for i in range(count)
+    ]
+    path.write_text(json.dumps({"commands": commands}))
+
+
+def test_cancelled_import_keeps_committed_commands(
+    manager: JobManager, tmp_path: Path, monkeypatch: Any
+) -> None:
+    monkeypatch.setattr(src.commands, "IMPORT_BATCH_SIZE", 5)
+    import_path = tmp_path / "import.json"
+    _write_import(import_path, 50)
+    blocked = threading.Event()
+    release = threading.Event()
+
+    def embed(texts: List[str]) -> List[List[float]]:
+        if "task 5" in texts:
+            blocked.set()
+            release.wait(timeout=10)
+        return [list(calculate_stub_embedding(text)) for text in texts]
+
+    with patch("src.commands.calculate_embeddings", side_effect=embed):
+        with patch("src.fastcmd.fastcmd_print"):
+            assert run_command(f"import -i {import_path} --background")
+        assert blocked.wait(timeout=10)
+
+        # Searches read the commands committed so far meanwhile
+        matches = fetch_similar(calculate_stub_embedding("task 2"), top_k=1)
+        assert matches[0]["command"] == "run 2"
+
+        with patch("src.commands.fastcmd_print"):
+            assert handle_job(Namespace(action="cancel", id=1))
+        release.set()
+        (job,) = manager.list()
+        assert job.wait(timeout=10)
+
+    # The batch being imported when cancelled was committed too
+    assert job.status == "cancelled"
+    assert job.progress() == "10/50 (20%)"
+    assert job.summary() == "⏹️ Cancelled at 10/50 (20%)"
+    assert len(fetch_all_commands()) == 10
+
+
+def test_export_job_output_is_kept_off_the_prompt(
+    manager: JobManager, tmp_path: Path, capsys: Any
+) -> None:
+    src.vector_database.init_db()
+    add_entry(calculate_stub_embedding("a"), "ls -la", "List files")
+    output_path = tmp_path / "out" / "commands.json"
+
+    assert run_command(f"export -o {output_path} --background")
+    (job,) = manager.list()
+    assert job.wait(timeout=10)
+    announce_finished_jobs()
+    announce_finished_jobs()
+
+    out = capsys.readouterr().out
+    assert "Started job 1" in out
+    assert "Exported commands" not in out
+    assert out.count("[1] done: export") == 1
+    assert "Commands exported" in job.summary()
+    assert json.loads(output_path.read_text())["commands"][0]["command"] == (
+        "ls -la"
+    )
+    assert not (tmp_path / "out" / "commands.json.part").exists()
+
+
+def test_job_commands(manager: JobManager) -> None:
+    def count_up() -> bool:
+        for done in range(1, 4):
+            checkpoint(done, 3)
+        print("✅ Counted")
+        return True
+
+    job = manager.start("count", count_up)
+    assert job.wait(timeout=10)
+    # Outside of jobs checkpoints do nothing
+    checkpoint(1, 1)
+
+    with patch("src.commands.fastcmd_print") as mock_print:
+        assert handle_jobs(Namespace())
+        assert handle_job(Namespace(action="status", id=1))
+        assert not handle_job(Namespace(action="cancel", id=1))
+        assert not handle_job(Namespace(action="status", id=2))
+
+    printed = [call[0][0] for call in mock_print.call_args_list]
+    assert "done" in printed[1] and "3/3 (100%)" in printed[1]
+    assert "  ✅ Counted" in printed
+    assert "already done" in printed[-2]
+    assert "No job with id 2" in printed[-1]
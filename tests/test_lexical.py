@@ -0,0 +1,21 @@
+from src.lexical import lexical_similarity, rank_lexical
+
+
+def test_lexical_similarity() -> None:
+    assert lexical_similarity("List Files", "list files") == 1.0
+    assert lexical_similarity("list files", "list all files") == 2 / 3
+    assert lexical_similarity("list files", "disk usage") == 0.0
+    assert lexical_similarity("", "disk usage") == 0.0
+
+
+def test_rank_lexical_orders_and_filters() -> None:
+    candidates = [
+        {"command": "du -sh", "description": "disk usage of a folder"},
+        {"command": "df -h", "description": "disk usage"},
+        {"command": "ls", "description": "list files"},
+    ]
+
+    results = rank_lexical("disk usage", candidates, top_k=5)
+
+    assert [result["command"] for result in results] == ["df -h", "du -sh"]
+    assert results[0]["distance"] == 0.0
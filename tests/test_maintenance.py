@@ -0,0 +1,160 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from src.embeddings import calculate_stub_embedding
+from src.maintenance import collect_stats, run_maintenance
+from src.vector_database import (
+    ALIAS_VECTOR_TABLE,
+    add_entry,
+    connect,
+    enqueue_entry,
+    get_vector_slots,
+    import_entries,
+    init_db,
+    insert_entries,
+    query_similar,
+)
+
+
+@pytest.fixture
+def file_db(tmp_path: Path) -> str:
+    db_path = str(tmp_path / "commands.db")
+    init_db(db_path)
+    return db_path
+
+
+def _fill(db_path: str, count: int) -> None:
+    conn = connect(db_path)
+    insert_entries(
+        conn,
+        [
+            (calculate_stub_embedding(f"task {i}"), f"run {i}", f"task {i}")
+            for i in range(count)
+        ],
+    )
+    conn.close()
+
+
+def _fill_with_aliases(db_path: str, count: int) -> None:
+    conn = connect(db_path)
+    import_entries(
+        conn,
+        [
+            (
+                calculate_stub_embedding(f"task {i}"),
+                f"run {i}",
+                f"task {i}",
+                [(calculate_stub_embedding(f"job {i}"), f"job {i}")],
+            )
+            for i in range(count)
+        ],
+    )
+    conn.close()
+
+
+def _delete_commands_only(db_path: str, where: str) -> None:
+    # Leaves the vectors behind, like writes interrupted by older versions
+    conn = connect(db_path)
+    conn.execute(f"DELETE FROM commands WHERE {where}")
+    conn.commit()
+    conn.close()
+
+
+def test_collect_stats_counts_rows(test_db: str) -> None:
+    init_db()
+    add_entry(calculate_stub_embedding("a"), "ls -la", "List files", test_db)
+    add_entry(calculate_stub_embedding("b"), "df -h", "Disk usage", test_db)
+    enqueue_entry("du -sh .", "Directory size", db_path=test_db)
+    _delete_commands_only(test_db, "command = 'df -h'")
+
+    stats = collect_stats(test_db)
+
+    assert stats["commands"] == 2
+    assert stats["vectors"] == 2
+    assert stats["orphaned_vectors"] == 1
+    assert stats["missing_vectors"] == 0
+    assert stats["pending"] == 1
+    assert stats["parked"] == 0
+    assert stats["file_bytes"] is None
+    assert stats["search_ms"] is not None
+    names = {entry["name"] for entry in stats["objects"]}
+    assert {"commands", "idx_commands_command"} <= names
+
+
+def test_maintenance_compacts_vectors_and_releases_pages(
+    file_db: str,
+) -> None:
+    # Two vec0 chunks of 1024 slots per vector table, mostly emptied by
+    # deletes
+    _fill_with_aliases(file_db, 1100)
+    _delete_commands_only(file_db, "id % 10 != 0")
+
+    result = run_maintenance(db_path=file_db)
+
+    before, after = result["before"], result["after"]
+    # Vectors, aliases and alias vectors of 990 commands
+    assert result["orphans_removed"] == 3 * 990
+    assert result["compacted"] is True
+    assert result["vacuum"] == "incremental"
+    assert (before["vector_slots"], after["vector_slots"]) == (2048, 1024)
+    assert after["vectors"] == after["commands"] == 110
+    assert after["orphaned_vectors"] == 0
+    assert after["free_pages"] == 0
+    # A freed chunk of 1024 float32 vectors per table went back to the file
+    # system
+    assert before["file_bytes"] - after["file_bytes"] >= 2 * 1024 * 1536 * 4
+    assert after["search_ms"] is not None
+    analyzed = {e["name"]: e["stat"] for e in after["objects"]}
+    assert analyzed["idx_commands_command"] is not None
+
+    conn = connect(file_db)
+    assert get_vector_slots(conn, ALIAS_VECTOR_TABLE) == (1024, 110)
+    matches = query_similar(conn, calculate_stub_embedding("task 49"), 1)
+    alias_matches = query_similar(conn, calculate_stub_embedding("job 59"), 1)
+    conn.close()
+    assert matches[0]["command"] == "run 49"
+    assert alias_matches[0]["command"] == "run 59"
+
+    # Nothing left to do on a second run
+    result = run_maintenance(db_path=file_db)
+    assert (result["orphans_removed"], result["compacted"]) == (0, False)
+
+
+def test_full_vacuum_converts_legacy_databases(tmp_path: Path) -> None:
+    db_path = str(tmp_path / "legacy.db")
+    # Created before auto-vacuum was enabled for new databases
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE legacy (id INTEGER)")
+    conn.close()
+    init_db(db_path)
+    _fill(db_path, 50)
+
+    assert run_maintenance(db_path=db_path)["vacuum"] is None
+    result = run_maintenance(full_vacuum=True, db_path=db_path)
+
+    assert result["before"]["auto_vacuum"] == "none"
+    assert result["after"]["auto_vacuum"] == "incremental"
+    assert result["vacuum"] == "full"
+    assert result["after"]["commands"] == 50
+
+
+def test_readers_keep_their_snapshot_during_maintenance(
+    file_db: str,
+) -> None:
+    _fill(file_db, 20)
+    _delete_commands_only(file_db, "id <= 10")
+    reader = connect(file_db)
+    reader.execute("BEGIN")
+    query = calculate_stub_embedding("task 15")
+    snapshot = query_similar(reader, query, 20)
+
+    result = run_maintenance(full_vacuum=True, db_path=file_db)
+
+    # The open read transaction still sees the orphaned vectors
+    assert result["orphans_removed"] == 10
+    assert query_similar(reader, query, 20) == snapshot
+    reader.rollback()
+    assert len(query_similar(reader, query, 20)) == 10
+    reader.close()
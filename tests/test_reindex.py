@@ -0,0 +1,216 @@
+import base64
+import struct
+from argparse import Namespace
+from typing import Any, Generator, List
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import src.embeddings
+from src.commands import handle_reindex, handle_search
+from src.reindex import REINDEX_TABLE, get_checkpoint, run_reindex
+from src.vector_database import (
+    add_alias,
+    add_entry,
+    cache_query_embedding,
+    complete_pending,
+    connect,
+    fetch_pending,
+    fetch_pending_aliases,
+    fetch_similar,
+    get_cached_embedding,
+    get_meta,
+    init_db,
+    update_entry,
+)
+
+EMB_SIZE = 1536
+old_embedding = [0.1] * EMB_SIZE
+
+
+@pytest.fixture
+def temp_db(memory_db: str) -> Generator[str, None, None]:
+    """Create a temporary database with a few commands."""
+    db_path = memory_db
+    init_db(db_path)
+    for i in range(5):
+        add_entry(old_embedding, f"cmd-{i}", f"description {i}", db_path)
+    yield db_path
+
+
+def _new_embeddings(descriptions: List[str], model: str) -> List[list]:
+    # Each description gets its own direction, keyed by its number
+    embeddings = []
+    for description in descriptions:
+        vector = [0.0] * EMB_SIZE
+        vector[int(description.split()[-1])] = 1.0
+        embeddings.append(vector)
+    return embeddings
+
+
+def _one_hot(index: int) -> List[float]:
+    vector = [0.0] * EMB_SIZE
+    vector[index] = 1.0
+    return vector
+
+
+def test_reindex_swaps_in_new_vectors(temp_db: str) -> None:
+    """Test that all vectors are replaced and the job state cleared."""
+    cache_query_embedding("list files", old_embedding, temp_db)
+    progress = []
+    with patch(
+        "src.reindex.calculate_embeddings", side_effect=_new_embeddings
+    ):
+        embedded = run_reindex(
+            model="new-model",
+            batch_size=2,
+            db_path=temp_db,
+            progress=lambda done, total, eta: progress.append((done, total)),
+        )
+
+    assert embedded == 5
+    assert progress == [(2, 5), (4, 5), (5, 5)]
+    results = fetch_similar(_one_hot(3), top_k=1, db_path=temp_db)
+    assert results[0]["command"] == "cmd-3"
+
+    conn = connect(temp_db)
+    tables = conn.execute(
+        "SELECT name FROM sqlite_master WHERE name = ?", (REINDEX_TABLE,)
+    ).fetchall()
+    index_model = get_meta(conn, "embedding_model")
+    conn.close()
+    assert tables == []
+    assert index_model == "new-model"
+    assert get_checkpoint(temp_db) is None
+    # Embedded by the previous model
+    assert get_cached_embedding("list files", temp_db) is None
+
+
+def test_reindex_resumes_after_failure(temp_db: str) -> None:
+    """Test that an interrupted job keeps its progress and old vectors."""
+    calls = []
+
+    def fail_on_second_batch(descriptions: List[str], model: str) -> list:
+        calls.append(descriptions)
+        if len(calls) == 2:
+            raise RuntimeError("provider unavailable")
+        return _new_embeddings(descriptions, model)
+
+    with patch(
+        "src.reindex.calculate_embeddings", side_effect=fail_on_second_batch
+    ):
+        with pytest.raises(RuntimeError):
+            run_reindex(model="new-model", batch_size=2, db_path=temp_db)
+
+    # Search still answers from the old vectors
+    results = fetch_similar(old_embedding, top_k=5, db_path=temp_db)
+    assert len(results) == 5
+    checkpoint = get_checkpoint(temp_db)
+    assert checkpoint == {"model": "new-model", "done": 2, "total": 5}
+
+    with patch(
+        "src.reindex.calculate_embeddings", side_effect=_new_embeddings
+    ) as mock_calc_embeddings:
+        embedded = run_reindex(
+            model="new-model", batch_size=2, db_path=temp_db
+        )
+
+    assert embedded == 3
+    assert mock_calc_embeddings.call_args_list[0][0][0] == [
+        "description 2",
+        "description 3",
+    ]
+    results = fetch_similar(_one_hot(0), top_k=1, db_path=temp_db)
+    assert results[0]["command"] == "cmd-0"
+
+
+def test_reindex_queues_aliases_again(temp_db: str) -> None:
+    """Test that alias vectors of the old model are dropped with the swap."""
+    add_alias(1, old_embedding, "alias 1", temp_db)
+
+    with patch(
+        "src.reindex.calculate_embeddings", side_effect=_new_embeddings
+    ):
+        run_reindex(model="new-model", batch_size=5, db_path=temp_db)
+
+    conn = connect(temp_db)
+    pending = fetch_pending_aliases(conn, 10)
+    conn.close()
+    assert [alias[1] for alias in pending] == ["alias 1"]
+
+
+def test_description_changed_during_reindex_is_embedded_again(
+    temp_db: str,
+) -> None:
+    """Test that the swap does not bring back a vector of an old description."""
+    # Interrupted after the first batch, with cmd-0 embedded
+    with patch(
+        "src.reindex.calculate_embeddings",
+        side_effect=[_new_embeddings(["d 0", "d 1"], ""), RuntimeError()],
+    ):
+        with pytest.raises(RuntimeError):
+            run_reindex(model="new-model", batch_size=2, db_path=temp_db)
+
+    assert update_entry(1, description="description 7", db_path=temp_db)
+    conn = connect(temp_db)
+    # Drained before the re-index resumes
+    complete_pending(conn, [(1, _one_hot(7))])
+    conn.close()
+
+    with patch(
+        "src.reindex.calculate_embeddings", side_effect=_new_embeddings
+    ):
+        run_reindex(model="new-model", batch_size=2, db_path=temp_db)
+
+    conn = connect(temp_db)
+    assert fetch_pending(conn, 10) == [(1, "description 7")]
+    complete_pending(conn, [(1, _one_hot(7))])
+    conn.close()
+    results = fetch_similar(_one_hot(7), top_k=1, db_path=temp_db)
+    assert (results[0]["command"], results[0]["distance"]) == ("cmd-0", 0)
+
+
+def test_search_after_reindex_embeds_with_the_new_model(
+    monkeypatch: Any,
+) -> None:
+    """Test that queries use the model of the vectors, not the variable."""
+    monkeypatch.setenv("FASTCMD_EMBEDDING_MODEL", "old-model")
+    init_db()
+    for i in range(3):
+        add_entry(old_embedding, f"cmd-{i}", f"description {i}")
+
+    with patch(
+        "src.reindex.calculate_embeddings", side_effect=_new_embeddings
+    ):
+        with patch("src.commands.fastcmd_print"):
+            assert handle_reindex(
+                Namespace(
+                    model="new-model",
+                    batch_size=2,
+                    restart=False,
+                    status=False,
+                )
+            )
+
+    response = MagicMock()
+    response.data = [
+        MagicMock(
+            embedding=base64.b64encode(
+                struct.pack(f"<{EMB_SIZE}f", *_one_hot(2))
+            ).decode()
+        )
+    ]
+    transport = MagicMock()
+    transport.create_embeddings.return_value = response
+    with patch("src.embeddings.get_transport", return_value=transport):
+        with patch("src.utils.fastcmd_print") as mock_print:
+            assert handle_search(Namespace(description="second"))
+
+    assert transport.create_embeddings.call_args[1]["model"] == "new-model"
+    printed = [call[0][0] for call in mock_print.call_args_list]
+    assert any("cmd-2" in line for line in printed)
+
+    # A new session reads the model from the database
+    monkeypatch.setattr(src.embeddings, "_index_model", None)
+    init_db()
+    assert src.embeddings.get_embedding_model() == "new-model"
@@ -0,0 +1,157 @@
+from argparse import Namespace
+from typing import Any, Dict, List
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from src import shards
+from src.commands import handle_related, handle_search
+from src.embeddings import EMBEDDING_DIMENSIONS, calculate_stub_embedding
+from src.related import RELATED_K, fetch_related, rebuild_related
+from src.vector_database import connect, init_db, insert_entries
+from src.write_queue import drain_pending
+
+
+@pytest.fixture
+def vectors(test_db: str) -> List[List[float]]:
+    init_db()
+    rng = np.random.default_rng(7)
+    return [
+        list(vector / np.linalg.norm(vector))
+        for vector in rng.normal(size=(12, EMBEDDING_DIMENSIONS))
+    ]
+
+
+def _graph() -> Dict[int, List[int]]:
+    conn = connect()
+    try:
+        graph: Dict[int, List[int]] = {}
+        for command_id, related_id in conn.execute(
+            """
+            SELECT command_id, related_id FROM related_commands
+            ORDER BY command_id, distance, related_id
+        """
+        ):
+            graph.setdefault(command_id, []).append(related_id)
+        return graph
+    finally:
+        conn.close()
+
+
+def _nearest(vectors: List[List[float]], k: int) -> Dict[int, List[int]]:
+    # Ids start at 1 in insertion order
+    matrix = np.array(vectors)
+    similarities = matrix @ matrix.T
+    np.fill_diagonal(similarities, -np.inf)
+    return {
+        index + 1: [int(column) + 1 for column in np.argsort(-row)[:k]]
+        for index, row in enumerate(similarities)
+    }
+
+
+def test_rebuild_matches_exact_nearest_neighbours(
+    vectors: List[List[float]],
+) -> None:
+    conn = connect()
+    try:
+        insert_entries(
+            conn,
+            [
+                (vector, f"cmd {i}", f"task {i}")
+                for i, vector in enumerate(vectors)
+            ],
+        )
+    finally:
+        conn.close()
+    assert _graph() == {}
+
+    progress: List[int] = []
+    linked = rebuild_related(
+        k=3, batch_size=5, progress=lambda done, total: progress.append(done)
+    )
+
+    assert linked == len(vectors)
+    assert progress == [5, 10, 12]
+    assert _graph() == _nearest(vectors, 3)
+    related = fetch_related(1, limit=3)
+    expected = 1 - float(np.dot(vectors[0], vectors[related[0]["id"] - 1]))
+    assert related[0]["distance"] == pytest.approx(expected, abs=1e-5)
+    assert [match["distance"] for match in related] == sorted(
+        match["distance"] for match in related
+    )
+
+
+def test_added_and_deleted_commands_are_linked(
+    vectors: List[List[float]],
+) -> None:
+    for i, vector in enumerate(vectors):
+        shards.add_entry(vector, f"cmd {i}", f"task {i}")
+
+    graph, nearest = _graph(), _nearest(vectors, RELATED_K)
+    # The last command added found its nearest ones, the others are
+    # linked approximately until a rebuild
+    assert graph[12] == nearest[12]
+    assert all(len(related) == RELATED_K for related in graph.values())
+    found = sum(len(set(graph[i]) & set(nearest[i])) for i in nearest)
+    assert found >= 0.8 * len(vectors) * RELATED_K
+
+    assert shards.delete_entry(1)
+    graph = _graph()
+    assert 1 not in graph
+    assert all(1 not in related for related in graph.values())
+    # Commands related to the deleted one found a replacement
+    assert all(len(related) == RELATED_K for related in graph.values())
+
+
+def test_drained_commands_are_linked(test_db: str) -> None:
+    init_db()
+    for command, description in [
+        ("ls -la", "list all files"),
+        ("ls -lh", "list files with sizes"),
+        ("df -h", "disk usage"),
+    ]:
+        shards.enqueue_entry(command, description)
+    assert _graph() == {}
+
+    with patch(
+        "src.write_queue.calculate_embeddings",
+        side_effect=lambda texts: [calculate_stub_embedding(t) for t in texts],
+    ):
+        assert drain_pending() == 3
+
+    assert {match["command"] for match in fetch_related(1)} == {
+        "ls -lh",
+        "df -h",
+    }
+    assert fetch_related(1)[0]["command"] == "ls -lh"
+
+
+def test_search_shows_related_commands(test_db: str, monkeypatch: Any) -> None:
+    init_db()
+    monkeypatch.setenv("FASTCMD_EMBEDDING_PROVIDER", "stub")
+    for command, description in [
+        ("git status", "show git status"),
+        ("git log", "show git history"),
+        ("df -h", "show disk usage"),
+    ]:
+        shards.add_entry(
+            calculate_stub_embedding(description), command, description
+        )
+
+    with patch("src.utils.fastcmd_print") as mock_print:
+        assert handle_search(Namespace(description="show git status"))
+    printed = [call[0][0] for call in mock_print.call_args_list]
+    see_also = printed.index("🔗 See also:")
+    assert printed[see_also + 1].strip() == (
+        "git log  # show git history (id 2)"
+    )
+
+    with patch("src.commands.fastcmd_print") as mock_print:
+        assert handle_related(Namespace(id=1, rebuild=False))
+        assert not handle_related(Namespace(id=9, rebuild=False))
+        assert handle_related(Namespace(id=None, rebuild=True))
+    printed = [call[0][0] for call in mock_print.call_args_list]
+    assert "git log (show git history, id 2)" in printed[0]
+    assert "No related commands for id 9" in printed[2]
+    assert printed[-1] == "✅ Related commands of 3 commands rebuilt."
@@ -0,0 +1,145 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Generator, Optional
+from unittest.mock import patch
+
+import pytest
+
+from src.embeddings import calculate_embeddings
+from src.related import fetch_related
+from src.server import FastCmdServer
+
+
+@pytest.fixture
+def server_url(memory_db: str, monkeypatch: Any) -> Generator[str, None, None]:
+    """Run a server on a free port with the stub embedding provider."""
+    monkeypatch.setenv("FASTCMD_EMBEDDING_PROVIDER", "stub")
+    server = FastCmdServer(
+        ("127.0.0.1", 0),
+        db_path=memory_db,
+        batch_window_ms=50,
+    )
+    thread = threading.Thread(
+        target=server.serve_forever, args=(0.05,), daemon=True
+    )
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def _request(url: str, payload: Optional[dict] = None) -> Any:
+    data = json.dumps(payload).encode() if payload is not None else None
+    with urllib.request.urlopen(url, data=data, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def test_add_search_export_import(server_url: str, memory_db: str) -> None:
+    _request(
+        f"{server_url}/add",
+        {"command": "ls -la", "description": "list all files"},
+    )
+    result = _request(
+        f"{server_url}/import",
+        {
+            "commands": [
+                {
+                    "command": "git status",
+                    "description": "git repo status",
+                    "aliases": ["changed files", "changed files"],
+                },
+                {"command": "missing description"},
+            ]
+        },
+    )
+    assert result == {"imported": 1, "skipped": 1, "skipped_aliases": 1}
+    # Both writes linked their commands
+    assert [r["command"] for r in fetch_related(1, db_path=memory_db)] == [
+        "git status"
+    ]
+    assert [r["command"] for r in fetch_related(2, db_path=memory_db)] == [
+        "ls -la"
+    ]
+
+    search = _request(
+        f"{server_url}/search", {"description": "git status", "top_k": 2}
+    )
+    assert search["matches"][0]["command"] == "git status"
+    assert "score" in search["matches"][0]
+
+    export = _request(f"{server_url}/export")
+    assert [cmd["command"] for cmd in export["commands"]] == [
+        "ls -la",
+        "git status",
+    ]
+    assert export["commands"][1]["aliases"] == ["changed files"]
+
+    # An export imports back with its aliases
+    result = _request(f"{server_url}/import", export)
+    assert result == {"imported": 2, "skipped": 0, "skipped_aliases": 0}
+    export = _request(f"{server_url}/export")
+    assert export["commands"][3]["aliases"] == ["changed files"]
+
+
+def test_concurrent_searches_are_batched(server_url: str) -> None:
+    _request(
+        f"{server_url}/add",
+        {"command": "df -h", "description": "show disk usage"},
+    )
+
+    with patch(
+        "src.server.calculate_embeddings",
+        wraps=calculate_embeddings,
+    ) as mock_calc_embeddings:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(
+                executor.map(
+                    lambda _: _request(
+                        f"{server_url}/search", {"description": "disk usage"}
+                    ),
+                    range(16),
+                )
+            )
+
+    assert all(r["matches"][0]["command"] == "df -h" for r in results)
+    assert mock_calc_embeddings.call_count < 16
+
+
+def test_invalid_requests(server_url: str) -> None:
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        _request(f"{server_url}/search", {"description": ""})
+    assert excinfo.value.code == 400
+
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        _request(f"{server_url}/unknown")
+    assert excinfo.value.code == 404
+
+
+def test_token_is_required_when_set(memory_db: str) -> None:
+    server = FastCmdServer(("127.0.0.1", 0), db_path=memory_db, token="s3cret")
+    thread = threading.Thread(
+        target=server.serve_forever, args=(0.05,), daemon=True
+    )
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        assert _request(f"{url}/health") == {"status": "ok"}
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            _request(f"{url}/export")
+        assert excinfo.value.code == 401
+
+        request = urllib.request.Request(
+            f"{url}/export", headers={"Authorization": "Bearer s3cret"}
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            assert json.loads(response.read()) == {"commands": []}
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,223 @@
+from argparse import Namespace
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Sequence
+from unittest.mock import patch
+
+import pytest
+
+from src import shards, vector_database
+from src.commands import handle_maintain
+from src.embeddings import calculate_stub_embedding
+from src.shards import ShardedStore, reshard
+from src.vector_database import connect, init_db
+from src.write_queue import DrainWorker
+
+
+@pytest.fixture
+def shard_dir(test_db: str) -> Generator[str, None, None]:
+    init_db()
+    yield shards.SHARD_DIR
+    shards._close_store()
+
+
+def _use_shards(monkeypatch: Any, count: int) -> None:
+    monkeypatch.setattr(shards, "SHARD_COUNT", count)
+
+
+def _embeddings(descriptions: List[str]) -> List[Sequence[float]]:
+    return [calculate_stub_embedding(d) for d in descriptions]
+
+
+def _ids(path: str) -> List[int]:
+    conn = connect(path)
+    try:
+        return [row[0] for row in conn.execute("SELECT id FROM commands")]
+    finally:
+        conn.close()
+
+
+def _fill(count: int) -> None:
+    for i in range(count):
+        vector_database.add_entry(
+            calculate_stub_embedding(f"task {i}"), f"run {i}", f"task {i}"
+        )
+
+
+def test_search_matches_single_database(
+    shard_dir: str, monkeypatch: Any
+) -> None:
+    _fill(40)
+    query = calculate_stub_embedding("task 7")
+    expected = vector_database.fetch_similar(query, top_k=5)
+
+    assert reshard(4) == 40
+    _use_shards(monkeypatch, 4)
+
+    matches = shards.fetch_similar(query, top_k=5)
+    # Stub embeddings tie, only the order of distances is fixed
+    assert matches[0] == expected[0]
+    assert [m["distance"] for m in matches] == [
+        m["distance"] for m in expected
+    ]
+    # Spread by id, the default database keeps its copy
+    for index, path in enumerate(shards.get_store().paths):
+        ids = _ids(path)
+        assert len(ids) == 10
+        assert all(entry_id % 4 == index for entry_id in ids)
+    assert len(vector_database.fetch_all_commands()) == 40
+
+
+def test_writes_go_to_the_shard_of_their_id(
+    shard_dir: str, monkeypatch: Any
+) -> None:
+    _use_shards(monkeypatch, 3)
+    store = shards.get_store()
+
+    ids = store.insert_entries(
+        [(calculate_stub_embedding(d), d, d) for d in ["a", "b", "c", "d"]]
+    )
+    entry_id = shards.enqueue_entry("df -h", "Disk usage")
+    assert shards.enqueue_alias("df -h", "Free space") is not None
+
+    assert ids == [1, 2, 3, 4]
+    assert entry_id == 5
+    assert _ids(store.shard_for(entry_id)) == [2, 5]
+    assert [c["id"] for c in shards.fetch_pending_commands()] == [5]
+
+    with patch(
+        "src.write_queue.calculate_embeddings", side_effect=_embeddings
+    ):
+        worker = DrainWorker()
+        worker.schedule()
+        assert worker.wait(timeout=10)
+
+    assert worker.last_error is None
+    assert shards.fetch_pending_commands() == []
+    (match,) = shards.fetch_similar(calculate_stub_embedding("Free space"), 1)
+    assert match["command"] == "df -h"
+    assert match["alias"] == "Free space"
+
+    assert shards.delete_entry(entry_id)
+    assert _ids(store.shard_for(entry_id)) == [2]
+    assert not shards.delete_entry(entry_id)
+
+
+def test_import_spreads_a_batch_over_the_shards(
+    shard_dir: str, monkeypatch: Any
+) -> None:
+    _use_shards(monkeypatch, 3)
+    store = shards.get_store()
+    commands: List[Dict[str, Any]] = [
+        {"command": f"run {i}", "description": f"task {i}"} for i in range(5)
+    ]
+    commands[0]["aliases"] = ["first task", "first task"]
+    texts = vector_database.import_texts(commands)
+
+    imported, skipped = shards.import_entries(
+        vector_database.to_import_entries(commands, _embeddings(texts))
+    )
+
+    assert (imported, skipped) == (5, 1)
+    assert [_ids(path) for path in store.paths] == [[3], [1, 4], [2, 5]]
+    (match,) = shards.fetch_similar(calculate_stub_embedding("first task"), 1)
+    assert match["command"] == "run 0"
+    assert store.reserve_ids(1) == 6
+
+
+def test_reshard_round_trip(shard_dir: str, monkeypatch: Any) -> None:
+    _fill(25)
+    vector_database.add_alias(
+        3, calculate_stub_embedding("Third"), "Third task"
+    )
+    vector_database.enqueue_entry("df -h", "Disk usage")
+    expected = sorted(
+        vector_database.fetch_all_commands(), key=lambda c: c["command"]
+    )
+    progress: List[int] = []
+
+    reshard(4, progress=lambda done, total: progress.append(done))
+    _use_shards(monkeypatch, 4)
+    assert progress == [26]
+    assert shards.enqueue_entry("du -sh", "Size") == 27
+    shards.delete_entry(27)
+
+    reshard(2)
+    _use_shards(monkeypatch, 2)
+    assert len(list(Path(shard_dir).iterdir())) == 2
+    assert (
+        sorted(shards.fetch_all_commands(), key=lambda c: c["command"])
+        == expected
+    )
+
+    reshard(1)
+    _use_shards(monkeypatch, 1)
+    assert not Path(shard_dir).exists()
+    assert (
+        sorted(shards.fetch_all_commands(), key=lambda c: c["command"])
+        == expected
+    )
+    # Still queued for the drain worker, with its id
+    assert shards.fetch_pending_commands() == [
+        {"id": 26, "command": "df -h", "description": "Disk usage"}
+    ]
+    (match,) = shards.fetch_similar(calculate_stub_embedding("Third"), 1)
+    assert (match["id"], match["alias"]) == (3, "Third task")
+
+
+def test_interrupted_merge_keeps_the_database(
+    shard_dir: str, tmp_path: Path, monkeypatch: Any
+) -> None:
+    db_path = str(tmp_path / "commands.db")
+    monkeypatch.setattr(vector_database, "TEST_DB_PATH", db_path)
+    init_db()
+    _fill(10)
+    vector_database.cache_query_embedding(
+        "list files", calculate_stub_embedding("list files")
+    )
+    assert reshard(2) == 10
+    _use_shards(monkeypatch, 2)
+    shards.delete_entry(4)
+    _use_shards(monkeypatch, 1)
+    shards._close_store()
+
+    with patch("src.shards._write_copies", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            reshard(1)
+    assert len(vector_database.fetch_all_commands()) == 10
+
+    assert reshard(1) == 9
+    assert not Path(db_path + ".new").exists()
+    assert [c["command"] for c in vector_database.fetch_all_commands()] == [
+        f"run {i}" for i in range(10) if i != 3
+    ]
+    # Everything but the commands comes from the replaced file
+    assert vector_database.get_cached_embedding("list files") is not None
+
+
+def test_reshard_needs_shards_to_merge(shard_dir: str) -> None:
+    with pytest.raises(ValueError, match="single database already"):
+        reshard(1)
+    with pytest.raises(ValueError, match="at least 1"):
+        reshard(0)
+
+
+def test_shards_of_another_count_are_refused(shard_dir: str) -> None:
+    store = ShardedStore(shard_dir, 4)
+    store.init()
+    store.close()
+
+    store = ShardedStore(shard_dir, 2)
+    with pytest.raises(ValueError, match="reshard --shards 2"):
+        store.init()
+    store.close()
+
+
+def test_single_database_commands_are_refused(
+    shard_dir: str, monkeypatch: Any
+) -> None:
+    _use_shards(monkeypatch, 2)
+
+    with patch("src.commands.fastcmd_print") as mock_print:
+        assert not handle_maintain(Namespace(full=False, check=True))
+
+    assert "reshard --shards 1" in mock_print.call_args[0][0]
@@ -0,0 +1,200 @@
+import uuid
+from typing import Generator, List, Tuple
+
+import pytest
+
+from src.related import fetch_related
+from src.sync import SYNC_FORMAT, export_changes, import_changes
+from src.vector_database import (
+    INDEX_MODEL_KEY,
+    SYNC_BACKFILLED_KEY,
+    add_entry,
+    connect,
+    delete_entry,
+    fetch_similar,
+    init_db,
+    memory_db_uri,
+    open_memory_db,
+    set_meta,
+    update_entry,
+)
+
+EMB_SIZE = 1536
+embedding1 = [1.0, 0.0] * (EMB_SIZE // 2)
+embedding2 = [0.0, 1.0] * (EMB_SIZE // 2)
+
+
+@pytest.fixture
+def local_db(memory_db: str) -> str:
+    init_db(memory_db)
+    return memory_db
+
+
+@pytest.fixture
+def remote_db() -> Generator[str, None, None]:
+    """Second database standing in for another machine."""
+    uri = memory_db_uri(f"test-{uuid.uuid4().hex}")
+    conn = open_memory_db(uri)
+    init_db(uri)
+    yield uri
+    conn.close()
+
+
+def _commands(db_path: str) -> List[Tuple[str, str]]:
+    conn = connect(db_path)
+    rows = conn.execute(
+        "SELECT command, description FROM commands ORDER BY command"
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def _count(db_path: str, table: str) -> int:
+    conn = connect(db_path)
+    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.close()
+    return int(count)
+
+
+def test_round_trip_reuses_embeddings(local_db: str, remote_db: str) -> None:
+    add_entry(embedding1, "ls -la", "List all files", db_path=local_db)
+    add_entry(embedding2, "df -h", "Disk usage", db_path=local_db)
+
+    data = export_changes(db_path=local_db)
+    counts = import_changes(data, db_path=remote_db)
+
+    assert data["format"] == SYNC_FORMAT
+    assert counts == {"applied": 2, "queued": 0, "skipped": 0}
+    assert _commands(remote_db) == _commands(local_db)
+    assert _count(remote_db, "pending_embeddings") == 0
+    results = fetch_similar(embedding2, top_k=1, db_path=remote_db)
+    assert results[0]["command"] == "df -h"
+    assert results[0]["distance"] == pytest.approx(0, abs=1e-6)
+    related = fetch_related(results[0]["id"], db_path=remote_db)
+    assert [r["command"] for r in related] == ["ls -la"]
+
+    # Importing the same changes again is a no-op
+    counts = import_changes(data, db_path=remote_db)
+    assert counts == {"applied": 0, "queued": 0, "skipped": 2}
+
+
+def test_export_since_cursor_returns_only_deltas(local_db: str) -> None:
+    add_entry(embedding1, "ls -la", "List all files", db_path=local_db)
+    cursor = export_changes(db_path=local_db)["cursor"]
+
+    add_entry(embedding2, "df -h", "Disk usage", db_path=local_db)
+    entry_id = fetch_similar(embedding2, 1, db_path=local_db)[0]["id"]
+    update_entry(entry_id, command="df -hT", db_path=local_db)
+
+    data = export_changes(since=cursor, db_path=local_db)
+    assert [change["command"] for change in data["changes"]] == ["df -hT"]
+    assert export_changes(data["cursor"], db_path=local_db)["changes"] == []
+
+
+def test_last_writer_wins_on_both_sides(local_db: str, remote_db: str) -> None:
+    add_entry(embedding1, "ls -la", "List all files", db_path=local_db)
+    import_changes(export_changes(db_path=local_db), db_path=remote_db)
+    local_cursor = export_changes(db_path=local_db)["cursor"]
+    remote_cursor = export_changes(db_path=remote_db)["cursor"]
+
+    local_id = fetch_similar(embedding1, 1, db_path=local_db)[0]["id"]
+    remote_id = fetch_similar(embedding1, 1, db_path=remote_db)[0]["id"]
+    update_entry(local_id, command="ls -l", db_path=local_db)
+    update_entry(remote_id, command="ls -lah", db_path=remote_db)
+
+    # Exchange the concurrent edits in both directions
+    to_remote = export_changes(local_cursor, db_path=local_db)
+    to_local = export_changes(remote_cursor, db_path=remote_db)
+    assert import_changes(to_remote, db_path=remote_db)["skipped"] == 1
+    assert import_changes(to_local, db_path=local_db)["applied"] == 1
+
+    assert _commands(local_db) == [("ls -lah", "List all files")]
+    assert _commands(remote_db) == [("ls -lah", "List all files")]
+
+
+def test_ties_are_broken_by_origin(local_db: str, remote_db: str) -> None:
+    change = {
+        "uuid": uuid.uuid4().hex,
+        "op": "upsert",
+        "updated_at": 1000.0,
+        "command": "ls",
+        "description": "List files",
+        "embedding": None,
+    }
+    data = export_changes(db_path=local_db)
+    data["changes"] = [
+        {**change, "origin": "b", "command": "ls -b"},
+        {**change, "origin": "a", "command": "ls -a"},
+    ]
+    import_changes(data, db_path=local_db)
+    data["changes"].reverse()
+    import_changes(data, db_path=remote_db)
+
+    assert _commands(local_db) == [("ls -b", "List files")]
+    assert _commands(remote_db) == [("ls -b", "List files")]
+
+
+def test_deletes_are_synced_as_tombstones(
+    local_db: str, remote_db: str
+) -> None:
+    add_entry(embedding1, "ls -la", "List all files", db_path=local_db)
+    import_changes(export_changes(db_path=local_db), db_path=remote_db)
+    cursor = export_changes(db_path=local_db)["cursor"]
+
+    entry_id = fetch_similar(embedding1, 1, db_path=local_db)[0]["id"]
+    delete_entry(entry_id, db_path=local_db)
+    data = export_changes(cursor, db_path=local_db)
+
+    assert [change["op"] for change in data["changes"]] == ["delete"]
+    assert import_changes(data, db_path=remote_db)["applied"] == 1
+    assert _commands(remote_db) == []
+    assert _count(remote_db, "vec_commands") == 0
+    assert _count(remote_db, "related_commands") == 0
+
+    # An older copy of the command does not bring it back
+    import_changes(export_changes(db_path=remote_db), db_path=local_db)
+    assert _commands(local_db) == []
+
+
+def test_model_mismatch_queues_descriptions(
+    local_db: str, remote_db: str
+) -> None:
+    add_entry(embedding1, "ls -la", "List all files", db_path=local_db)
+    conn = connect(remote_db)
+    set_meta(conn, INDEX_MODEL_KEY, "other-embedding-model")
+    conn.commit()
+    conn.close()
+
+    counts = import_changes(export_changes(db_path=local_db), remote_db)
+
+    assert counts == {"applied": 0, "queued": 1, "skipped": 0}
+    assert _count(remote_db, "vec_commands") == 0
+    assert _count(remote_db, "pending_embeddings") == 1
+
+
+def test_rejects_other_files(local_db: str) -> None:
+    with pytest.raises(ValueError):
+        import_changes({"commands": []}, db_path=local_db)
+
+
+def test_commands_saved_before_the_change_log_are_versioned_once(
+    local_db: str,
+) -> None:
+    add_entry(embedding1, "ls -la", "List all files", db_path=local_db)
+    # A database from before the change log
+    conn = connect(local_db)
+    conn.execute("DELETE FROM command_sync")
+    set_meta(conn, SYNC_BACKFILLED_KEY, None)
+    conn.commit()
+    conn.close()
+
+    init_db(local_db)
+    assert _count(local_db, "command_sync") == 1
+
+    # Later sessions skip the scan
+    conn = connect(local_db)
+    conn.execute("DELETE FROM command_sync")
+    conn.commit()
+    conn.close()
+    init_db(local_db)
+    assert _count(local_db, "command_sync") == 0
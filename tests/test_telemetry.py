@@ -0,0 +1,124 @@
+import json
+import tracemalloc
+from argparse import Namespace
+from pathlib import Path
+from typing import Any, List
+from unittest.mock import patch
+
+import pytest
+
+import src.telemetry
+from src.commands import handle_export, handle_import
+from src.telemetry import phase, record_operation
+from src.vector_database import connect, init_db
+
+# Peak of traced Python allocations allowed while exporting CATALOG_SIZE
+# commands, about 115 MiB when the budget was set
+EXPORT_BUDGET_KIB = 160 * 1024
+CATALOG_SIZE = 100_000
+
+
+@pytest.fixture
+def telemetry_dir(tmp_path: Path, monkeypatch: Any) -> Path:
+    directory = tmp_path / "telemetry"
+    monkeypatch.setattr(src.telemetry, "TELEMETRY_ENABLED", True)
+    monkeypatch.setattr(src.telemetry, "TELEMETRY_DIR", str(directory))
+    return directory
+
+
+def _reports(directory: Path) -> List[dict]:
+    return [json.loads(path.read_text()) for path in directory.glob("*.json")]
+
+
+def test_disabled_by_default(tmp_path: Path, monkeypatch: Any) -> None:
+    monkeypatch.setattr(src.telemetry, "TELEMETRY_DIR", str(tmp_path))
+
+    with record_operation("export") as recorder:
+        with phase("fetch_all_commands"):
+            pass
+
+    assert recorder is None
+    assert not tracemalloc.is_tracing()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_report_lists_phases_and_allocations(telemetry_dir: Path) -> None:
+    with patch("src.telemetry.fastcmd_print") as mock_print:
+        with record_operation("import"):
+            with phase("build"):
+                kept = [str(i) * 100 for i in range(10_000)]
+            with phase("idle"):
+                pass
+
+    (report,) = _reports(telemetry_dir)
+    build, idle = report["phases"]
+    assert report["operation"] == "import"
+    assert (build["name"], idle["name"]) == ("build", "idle")
+    assert build["traced_peak_kib"] >= len(kept) * 100 // 1024
+    assert build["peak_rss_kib"] > 0
+    assert "test_telemetry.py" in build["top_allocations"][0]["location"]
+    assert idle["top_allocations"] == []
+    assert "Resource report written" in mock_print.call_args[0][0]
+    assert not tracemalloc.is_tracing()
+
+
+def test_import_records_its_phases(
+    telemetry_dir: Path, tmp_path: Path
+) -> None:
+    import_path = tmp_path / "import.json"
+    import_path.write_text(
+        json.dumps({"commands": [{"description": "Echo", "command": "echo"}]})
+    )
+
+    with patch(
+        "src.commands.calculate_embeddings",
+        side_effect=lambda texts: [[0.1] * 1536 for _ in texts],
+    ):
+        with patch("src.commands.fastcmd_print"):
+            with patch("src.telemetry.fastcmd_print"):
+                assert handle_import(Namespace(input=str(import_path)))
+
+    (report,) = _reports(telemetry_dir)
+    assert [p["name"] for p in report["phases"]] == [
+        "json.load",
+        "embed_and_insert",
+    ]
+
+
+def test_export_memory_stays_within_budget(
+    test_db: str, telemetry_dir: Path, tmp_path: Path, monkeypatch: Any
+) -> None:
+    # Peaks only, allocation sites would take snapshots of every row
+    monkeypatch.setattr(src.telemetry, "TELEMETRY_TOP", 0)
+    # Synthetic catalog, only the commands table is read by export
+    init_db()
+    conn = connect(test_db)
+    conn.executemany(
+        "INSERT INTO commands (command, description) VALUES (?, ?)",
+        (
+            (
+                f"kubectl get pods -n team-{i} -o wide -l app=service-{i}",
+                f"List the pods of service {i} with the nodes they run on",
+            )
+            for i in range(CATALOG_SIZE)
+        ),
+    )
+    conn.commit()
+    conn.close()
+    init_db()
+
+    with patch("src.commands.fastcmd_print"):
+        with patch("src.telemetry.fastcmd_print"):
+            exported = handle_export(
+                Namespace(output=str(tmp_path / "exported.json"))
+            )
+
+    (report,) = _reports(telemetry_dir)
+    assert exported is True
+    assert [p["name"] for p in report["phases"]] == [
+        "fetch_all_commands",
+        "json.dumps",
+        "print",
+        "write_file",
+    ]
+    assert report["traced_peak_kib"] < EXPORT_BUDGET_KIB
@@ -0,0 +1,226 @@
+import base64
+import json
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Generator, List, Set, Tuple
+from unittest.mock import patch
+
+import pytest
+from openai import AuthenticationError
+
+from src.transport import (
+    CircuitBreaker,
+    EmbeddingTransport,
+    EmbeddingUnavailableError,
+)
+
+
+class StubEmbeddingsAPI(ThreadingHTTPServer):
+    """Local stand-in for the embeddings endpoint of the OpenAI API."""
+
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        # Status codes returned by the next requests, 200 once exhausted
+        self.statuses: List[int] = []
+        self.delay = 0.0
+        self.requests = 0
+        self.connections: Set[Tuple[str, int]] = set()
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StubEmbeddingsAPI
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.connections.add(self.client_address)
+            status = (
+                self.server.statuses.pop(0) if self.server.statuses else 200
+            )
+        time.sleep(self.server.delay)
+
+        inputs = body["input"] if isinstance(body["input"], list) else [1]
+        vector = [0.5, 0.25]
+        if body.get("encoding_format") == "base64":
+            embedding: Any = base64.b64encode(struct.pack("2f", *vector))
+            embedding = embedding.decode()
+        else:
+            embedding = vector
+        payload: Any = {
+            "object": "list",
+            "model": body["model"],
+            "data": [
+                {"object": "embedding", "index": i, "embedding": embedding}
+                for i in range(len(inputs))
+            ],
+            "usage": {"prompt_tokens": 1, "total_tokens": 1},
+        }
+        if status != 200:
+            payload = {"error": {"message": f"status {status}"}}
+
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self) -> None:
+        with self.server.lock:
+            self.server.connections.add(self.client_address)
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def stub_api() -> Generator[StubEmbeddingsAPI, None, None]:
+    server = StubEmbeddingsAPI()
+    thread = threading.Thread(
+        target=server.serve_forever, args=(0.05,), daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _transport(api: StubEmbeddingsAPI, **kwargs: Any) -> EmbeddingTransport:
+    return EmbeddingTransport(
+        api_key="test-key",
+        base_url=f"http://127.0.0.1:{api.server_address[1]}/v1",
+        **kwargs,
+    )
+
+
+def test_connections_are_reused(stub_api: StubEmbeddingsAPI) -> None:
+    transport = _transport(stub_api)
+    for _ in range(5):
+        response = transport.create_embeddings("model", "list files")
+        assert response.data[0].embedding == [0.5, 0.25]
+    transport.close()
+
+    assert stub_api.requests == 5
+    assert len(stub_api.connections) == 1
+    stats = transport.stats.snapshot()
+    assert stats["successes"] == 5
+    assert stats["latency_p50_ms"] is not None
+
+
+def test_warm_up_opens_the_connection_used_later(
+    stub_api: StubEmbeddingsAPI,
+) -> None:
+    transport = _transport(stub_api)
+    transport.warm_up()
+    assert len(stub_api.connections) == 1
+    assert transport.stats.snapshot()["successes"] == 0
+
+    transport.create_embeddings("model", "list files")
+    transport.close()
+
+    assert len(stub_api.connections) == 1
+
+
+def test_transient_errors_are_retried(stub_api: StubEmbeddingsAPI) -> None:
+    stub_api.statuses = [500, 503]
+    transport = _transport(stub_api, max_retries=3)
+
+    transport.create_embeddings("model", "list files")
+    transport.close()
+
+    stats = transport.stats.snapshot()
+    assert stub_api.requests == 3
+    assert stats["retries"] == 2
+    assert stats["failures"] == 2
+    assert stats["successes"] == 1
+
+
+def test_client_errors_are_not_retried(stub_api: StubEmbeddingsAPI) -> None:
+    stub_api.statuses = [401]
+    transport = _transport(stub_api)
+
+    with pytest.raises(AuthenticationError):
+        transport.create_embeddings("model", "list files")
+    transport.close()
+
+    assert stub_api.requests == 1
+    assert transport.breaker.state == "closed"
+
+
+def test_deadline_bounds_slow_requests(stub_api: StubEmbeddingsAPI) -> None:
+    stub_api.delay = 1.0
+    transport = _transport(stub_api, max_retries=5)
+
+    started = time.monotonic()
+    with pytest.raises(EmbeddingUnavailableError):
+        transport.create_embeddings("model", "list files", timeout=0.2)
+    elapsed = time.monotonic() - started
+    transport.close()
+
+    assert elapsed < 0.9
+
+
+def test_circuit_opens_after_failures(stub_api: StubEmbeddingsAPI) -> None:
+    stub_api.statuses = [500] * 10
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    transport = _transport(stub_api, max_retries=0, breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(EmbeddingUnavailableError):
+            transport.create_embeddings("model", "list files")
+    requests_before = stub_api.requests
+
+    with pytest.raises(EmbeddingUnavailableError) as excinfo:
+        transport.create_embeddings("model", "list files")
+    transport.close()
+
+    assert "unavailable" in str(excinfo.value)
+    assert stub_api.requests == requests_before
+    assert breaker.state == "open"
+    assert transport.stats.snapshot()["rejected"] == 1
+
+
+def test_circuit_half_open_trial_closes_it() -> None:
+    breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    assert breaker.allow() is False
+
+    time.sleep(0.06)
+    assert breaker.allow() is True
+    # Only one trial request at a time
+    assert breaker.allow() is False
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_unexpected_error_releases_the_trial(
+    stub_api: StubEmbeddingsAPI,
+) -> None:
+    breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    transport = _transport(stub_api, breaker=breaker)
+
+    with patch.object(
+        transport.client.embeddings, "create", side_effect=RuntimeError
+    ):
+        with pytest.raises(RuntimeError):
+            transport.create_embeddings("model", "list files")
+    # Counted as a failed trial, the next one is let through after the
+    # cooldown instead of being rejected for good
+    assert breaker.state == "open"
+    time.sleep(0.06)
+    transport.create_embeddings("model", "list files")
+    transport.close()
+
+    assert breaker.state == "closed"
@@ -0,0 +1,194 @@
+import base64
+import json
+import sqlite3
+import struct
+from argparse import Namespace
+from pathlib import Path
+from typing import Any, Generator
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import src.commands
+import src.usage
+from src.commands import handle_import, handle_usage
+from src.embeddings import (
+    calculate_embedding,
+    calculate_embeddings,
+    embedding_operation,
+    set_usage_meter,
+)
+from src.usage import (
+    BudgetExceededError,
+    LedgerMeter,
+    estimate_cost,
+    fetch_usage,
+    today,
+    tokens_used,
+)
+from src.vector_database import fetch_all_commands, init_db
+
+
+@pytest.fixture
+def ledger(test_db: str, monkeypatch: Any) -> Generator[str, None, None]:
+    init_db()
+    monkeypatch.setenv("FASTCMD_EMBEDDING_PROVIDER", "stub")
+    meter = LedgerMeter()
+    set_usage_meter(meter)
+    yield test_db
+    # Nothing left for the timer to write into the database of another test
+    meter.flush()
+
+
+def test_usage_is_recorded_per_operation_and_day(ledger: str) -> None:
+    with embedding_operation("import"):
+        calculate_embeddings(["abcdefgh", "abcd"])
+        calculate_embedding("abc")
+    calculate_embedding("abcd efgh")
+
+    assert fetch_usage() == [
+        {
+            "day": today(),
+            "operation": "import",
+            "model": "stub",
+            "requests": 2,
+            "tokens": 4,
+        },
+        {
+            "day": today(),
+            "operation": "other",
+            "model": "stub",
+            "requests": 1,
+            "tokens": 3,
+        },
+    ]
+
+
+def test_tokens_reported_by_the_api_are_recorded(
+    ledger: str, monkeypatch: Any
+) -> None:
+    monkeypatch.setenv("FASTCMD_EMBEDDING_PROVIDER", "openai")
+    response = MagicMock()
+    response.data = [
+        MagicMock(embedding=base64.b64encode(struct.pack("<2f", 1, 0)))
+    ]
+    response.usage.total_tokens = 42
+    transport = MagicMock()
+    transport.create_embeddings.return_value = response
+
+    with patch("src.embeddings.get_transport", return_value=transport):
+        with embedding_operation("search"):
+            calculate_embedding("find large files")
+
+    (row,) = fetch_usage()
+    assert (row["operation"], row["model"]) == (
+        "search",
+        "text-embedding-ada-002",
+    )
+    assert row["tokens"] == 42
+    assert estimate_cost(row["model"], 1_000_000) == pytest.approx(0.10)
+
+
+def test_budgets_stop_requests_before_they_are_exceeded(
+    ledger: str, monkeypatch: Any
+) -> None:
+    monkeypatch.setenv("FASTCMD_TOKEN_BUDGET_INGEST_HISTORY", "10")
+    monkeypatch.setattr(src.usage, "DAILY_TOKEN_BUDGET", 20)
+
+    with embedding_operation("ingest-history"):
+        calculate_embeddings(["x" * 32])
+        with pytest.raises(BudgetExceededError, match="'ingest-history'"):
+            calculate_embeddings(["x" * 12])
+    calculate_embedding("x" * 48)
+    with pytest.raises(BudgetExceededError, match="daily budget of 20"):
+        calculate_embedding("x")
+
+    assert tokens_used(today(), "ingest-history") == 8
+    assert tokens_used(today()) == 20
+
+
+def test_import_shows_estimate_and_respects_budget(
+    ledger: str, tmp_path: Path, monkeypatch: Any
+) -> None:
+    monkeypatch.setenv("FASTCMD_TOKEN_BUDGET_IMPORT", "5")
+    import_path = tmp_path / "import.json"
+    commands = [
+        {"description": "List all files", "command": "ls -la"},
+        {"description": "Disk usage", "command": "df -h", "aliases": ["df"]},
+    ]
+    import_path.write_text(json.dumps({"commands": commands}))
+
+    with patch("src.commands.fastcmd_print") as mock_print:
+        assert not handle_import(Namespace(input=str(import_path)))
+
+    printed = [call[0][0] for call in mock_print.call_args_list]
+    assert printed[0] == "🧮 About 8 tokens to embed, $0.0000 with stub"
+    assert "budget of 5 tokens" in printed[-1]
+    assert fetch_all_commands() == []
+
+    monkeypatch.setenv("FASTCMD_TOKEN_BUDGET_IMPORT", "8")
+    with patch("src.commands.fastcmd_print"):
+        assert handle_import(Namespace(input=str(import_path)))
+    # The import is recorded as "other" outside of the prompt
+    assert tokens_used(today()) == 8
+
+
+def test_usage_report(ledger: str, monkeypatch: Any) -> None:
+    monkeypatch.setattr(src.commands, "DAILY_TOKEN_BUDGET", 100)
+    with embedding_operation("add"):
+        calculate_embedding("x" * 40)
+
+    with patch("src.commands.fastcmd_print") as mock_print:
+        assert handle_usage(Namespace(days=7))
+
+    printed = [call[0][0] for call in mock_print.call_args_list]
+    assert any(
+        line.split()[1:5] == ["add", "stub", "1", "10"] for line in printed
+    )
+    assert "Total 10 tokens, $0.0000" in printed[-2]
+    assert "Today 10 of 100 tokens" in printed[-1]
+
+
+def test_usage_is_written_off_the_request_path(
+    ledger: str, monkeypatch: Any
+) -> None:
+    monkeypatch.setattr(src.usage, "USAGE_FLUSH_DELAY", 60.0)
+    monkeypatch.setattr(src.usage, "DAILY_TOKEN_BUDGET", 5)
+    meter = LedgerMeter()
+    set_usage_meter(meter)
+    writes = []
+    monkeypatch.setattr(
+        src.usage,
+        "record_usage",
+        lambda usage, db_path=None: writes.append(usage),
+    )
+
+    calculate_embedding("x" * 16)
+    # Buffered, but counted by the budgets already
+    assert writes == []
+    assert tokens_used(today()) == 4
+    with pytest.raises(BudgetExceededError):
+        calculate_embedding("x" * 8)
+
+    meter.flush()
+    assert writes == [{(today(), "other", "stub"): (1, 4)}]
+
+
+def test_usage_is_kept_while_the_database_is_locked(
+    ledger: str, monkeypatch: Any
+) -> None:
+    monkeypatch.setattr(src.usage, "USAGE_FLUSH_DELAY", 60.0)
+    meter = LedgerMeter()
+    set_usage_meter(meter)
+    calculate_embedding("x" * 16)
+
+    with patch(
+        "src.usage.record_usage",
+        side_effect=sqlite3.OperationalError("database is locked"),
+    ):
+        meter.flush()
+    calculate_embedding("x" * 4)
+    meter.flush()
+
+    (row,) = fetch_usage()
+    assert (row["requests"], row["tokens"]) == (2, 5)
@@ -17,6 +17,16 @@ def test_add_command() -> None:
     assert parsed_command.command == "add"
     assert parsed_command.description == "Print hello"
     assert parsed_command.commandrun == "echo hello"
+    assert parsed_command.alias is False
+
+
+def test_add_alias_command() -> None:
+    parsed_command = parse_command(
+        user_input="add -c 'echo hello' -d 'Greet' --alias"
+    )
+
+    assert parsed_command.commandrun == "echo hello"
+    assert parsed_command.alias is True
 
 
 def test_search_command() -> None:
@@ -27,6 +37,39 @@ def test_search_command() -> None:
     assert parsed_command.description == "find files"
 
 
+def test_update_and_delete_commands() -> None:
+    parsed_update = parse_command(user_input="update 3 -d 'List all files'")
+    parsed_delete = parse_command(user_input="delete 3")
+
+    assert parsed_update.command == "update"
+    assert parsed_update.id == 3
+    assert parsed_update.description == "List all files"
+    assert parsed_update.commandrun is None
+    assert parsed_delete.command == "delete"
+    assert parsed_delete.id == 3
+
+
+def test_batch_search_command() -> None:
+    user_input = "batch-search -i - -k 3"
+    parsed_command = parse_command(user_input=user_input)
+
+    assert parsed_command.command == "batch-search"
+    assert parsed_command.input == "-"
+    assert parsed_command.top_k == 3
+    assert parsed_command.output is None
+
+
+def test_background_job_commands() -> None:
+    parsed_import = parse_command(user_input="import -i cmds.json -b")
+    parsed_export = parse_command(user_input="export")
+    parsed_cancel = parse_command(user_input="job cancel 2")
+
+    assert parsed_import.background is True
+    assert parsed_export.background is False
+    assert parse_command(user_input="jobs").command == "jobs"
+    assert (parsed_cancel.action, parsed_cancel.id) == ("cancel", 2)
+
+
 def test_set_api_key_flag_global() -> None:
     user_input = "--set-api-key"
     parsed_command = parse_command(user_input=user_input)
@@ -111,3 +154,31 @@ def test_get_user_input_quit() -> None:
     with patch("src.utils.input", return_value="quit"):
         result = get_user_input()
         assert result is None
+
+
+def test_sync_commands() -> None:
+    parsed_export = parse_command(user_input="sync-export --since 42")
+    parsed_import = parse_command(user_input="sync-import -i -")
+
+    assert parsed_export.command == "sync-export"
+    assert parsed_export.since == 42
+    assert parsed_export.output == "-"
+    assert parsed_import.command == "sync-import"
+    assert parsed_import.input == "-"
+
+
+def test_maintain_command() -> None:
+    parsed_command = parse_command(user_input="maintain --full")
+
+    assert parsed_command.command == "maintain"
+    assert parsed_command.full is True
+    assert parsed_command.check is False
+
+
+def test_ingest_history_command() -> None:
+    user_input = "ingest-history -f ~/a -f ~/b --describer command"
+    parsed_command = parse_command(user_input=user_input)
+
+    assert parsed_command.command == "ingest-history"
+    assert parsed_command.file == ["~/a", "~/b"]
+    assert parsed_command.describer == "command"
@@ -1,21 +1,48 @@
+import multiprocessing
+import sqlite3
+import struct
+import threading
+from array import array
 from pathlib import Path
-from typing import Generator
+from typing import Any, Generator
 
 import pytest
 
-from src.vector_database import add_entry, fetch_similar, init_db
+import src.vector_database
+from src.vector_database import (
+    VECTOR_TABLE,
+    add_alias,
+    add_entry,
+    close_memory_db,
+    connect,
+    delete_entry,
+    delete_orphans,
+    deserialize,
+    fetch_all_commands,
+    fetch_similar,
+    fetch_similar_batch,
+    get_db_path,
+    get_vector_metric,
+    init_db,
+    memory_db_uri,
+    open_memory_db,
+    serialize,
+    serialize_batch,
+    snapshot_db,
+    update_entry,
+)
 
-# Example embeddings
+# Example embeddings, the query is closer to embedding2
 EMB_SIZE = 1536
-embedding1 = [0.1] * EMB_SIZE
-embedding2 = [0.2] * EMB_SIZE
-query_embedding = [0.15] * EMB_SIZE
+embedding1 = [1.0, 0.0] * (EMB_SIZE // 2)
+embedding2 = [0.0, 1.0] * (EMB_SIZE // 2)
+query_embedding = [0.4, 0.6] * (EMB_SIZE // 2)
 
 
 @pytest.fixture
-def temp_db(tmp_path: Path) -> Generator[str, None, None]:
+def temp_db(memory_db: str) -> Generator[str, None, None]:
     """Create a temporary database for testing."""
-    db_path = str(tmp_path / "test_commands.db")
+    db_path = memory_db
     init_db(db_path)
     yield db_path
 
@@ -51,3 +78,379 @@ def test_no_similar_entries(temp_db: str) -> None:
     """Test that no similar entries are found in an empty database."""
     results = fetch_similar(query_embedding, top_k=3, db_path=temp_db)
     assert len(results) == 0
+
+
+def test_fetch_similar_batch(temp_db: str) -> None:
+    """Test fetching matches for several embeddings in one pass."""
+    add_entry(embedding1, "ls -la", "List all files", db_path=temp_db)
+    add_entry(
+        embedding2,
+        "git status",
+        "Check git repository status",
+        db_path=temp_db,
+    )
+
+    results = list(
+        fetch_similar_batch([embedding1, embedding2], top_k=1, db_path=temp_db)
+    )
+
+    assert len(results) == 2
+    assert results[0][0]["command"] == "ls -la"
+    assert results[1][0]["command"] == "git status"
+
+
+def test_update_entry_reembeds_only_changed_descriptions(
+    temp_db: str,
+) -> None:
+    """Test that only a new description drops the vector and queues it."""
+    add_entry(embedding1, "ls -la", "List all files", db_path=temp_db)
+    entry_id = fetch_similar(embedding1, top_k=1, db_path=temp_db)[0]["id"]
+
+    assert update_entry(entry_id, command="ls -lah", db_path=temp_db) is False
+    assert (
+        update_entry(entry_id, description="List all files", db_path=temp_db)
+        is False
+    )
+    results = fetch_similar(embedding1, top_k=1, db_path=temp_db)
+    assert results[0]["command"] == "ls -lah"
+
+    assert (
+        update_entry(
+            entry_id, description="List files, sizes readable", db_path=temp_db
+        )
+        is True
+    )
+    assert fetch_similar(embedding1, top_k=1, db_path=temp_db) == []
+    conn = connect(temp_db)
+    pending = conn.execute("SELECT command_id FROM pending_embeddings")
+    assert pending.fetchall() == [(entry_id,)]
+    conn.close()
+
+    assert update_entry(entry_id + 1, command="pwd", db_path=temp_db) is None
+
+
+def test_delete_entry_removes_only_its_rows(temp_db: str) -> None:
+    """Test that deleting removes the command's rows and leaves orphans."""
+    first = add_entry(embedding1, "ls -la", "List all files", db_path=temp_db)
+    second = add_entry(embedding2, "df -h", "Disk usage", db_path=temp_db)
+    add_alias(first, embedding2, "Show files", db_path=temp_db)
+
+    # A vector left behind without its command
+    conn = connect(temp_db)
+    conn.execute("DELETE FROM commands WHERE id = ?", (second,))
+    conn.commit()
+    conn.close()
+
+    assert delete_entry(first, db_path=temp_db) is True
+    assert delete_entry(first, db_path=temp_db) is False
+    assert fetch_all_commands(temp_db) == []
+
+    conn = connect(temp_db)
+    try:
+        vectors = conn.execute(f"SELECT id FROM {VECTOR_TABLE}").fetchall()
+        aliases = conn.execute("SELECT COUNT(*) FROM command_aliases")
+        assert aliases.fetchone()[0] == 0
+        # The orphan is left to maintain
+        assert vectors == [(second,)]
+        assert delete_orphans(conn) == 1
+    finally:
+        conn.close()
+
+
+def test_memory_reads_wait_for_writers(temp_db: str) -> None:
+    """Test that shared-cache reads retry instead of reading dirty rows."""
+    add_entry(embedding1, "ls -la", "List all files", db_path=temp_db)
+    writer = connect(temp_db, check_same_thread=False)
+    writer.execute("BEGIN IMMEDIATE")
+    writer.execute(
+        "INSERT INTO commands (command, description) VALUES ('df', 'Disk')"
+    )
+    # Rolled back while the read below is retrying
+    timer = threading.Timer(0.1, writer.rollback)
+    timer.start()
+    try:
+        commands = fetch_all_commands(temp_db)
+    finally:
+        timer.join()
+        writer.close()
+
+    assert [c["command"] for c in commands] == ["ls -la"]
+
+
+def test_float32_arrays_serialize_like_lists(temp_db: str) -> None:
+    """Test that array, list and batch serialization give the same blob."""
+    packed = struct.pack(f"{EMB_SIZE}f", *embedding1)
+    vectors = [array("f", embedding1), embedding1]
+
+    assert bytes(serialize(vectors[0])) == packed
+    assert [bytes(blob) for blob in serialize_batch(vectors)] == [packed] * 2
+
+    add_entry(vectors[0], "ls -la", "List all files", db_path=temp_db)
+    results = fetch_similar(array("f", embedding1), top_k=1, db_path=temp_db)
+    assert results[0]["command"] == "ls -la"
+    assert results[0]["distance"] == pytest.approx(0.0)
+
+
+@pytest.fixture
+def file_db(tmp_path: Path) -> Generator[str, None, None]:
+    """Create a database file, for tests relying on on-disk behaviour."""
+    db_path = str(tmp_path / "test_commands.db")
+    init_db(db_path)
+    yield db_path
+
+
+def test_connection_uses_wal(file_db: str) -> None:
+    """Test that connections are switched to WAL journal mode."""
+    conn = connect(file_db)
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    busy_timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+    conn.close()
+
+    assert journal_mode == "wal"
+    assert busy_timeout > 0
+
+
+def _write_entries(
+    db_path: str, worker: int, count: int, errors: multiprocessing.Queue
+) -> None:
+    try:
+        for i in range(count):
+            add_entry(
+                embedding1, f"echo {worker}-{i}", "Stress", db_path=db_path
+            )
+    except Exception as e:
+        errors.put(repr(e))
+
+
+def _read_entries(
+    db_path: str, count: int, errors: multiprocessing.Queue
+) -> None:
+    try:
+        for _ in range(count):
+            fetch_similar(query_embedding, top_k=3, db_path=db_path)
+    except Exception as e:
+        errors.put(repr(e))
+
+
+def test_concurrent_processes_no_errors_or_lost_rows(file_db: str) -> None:
+    """Test that concurrent writer and reader processes do not collide."""
+    writers, readers, count = 4, 4, 25
+    errors: multiprocessing.Queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=_write_entries, args=(file_db, worker, count, errors)
+        )
+        for worker in range(writers)
+    ] + [
+        multiprocessing.Process(
+            target=_read_entries, args=(file_db, count, errors)
+        )
+        for _ in range(readers)
+    ]
+
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+
+    failures = []
+    while not errors.empty():
+        failures.append(errors.get())
+
+    assert failures == []
+    assert all(process.exitcode == 0 for process in processes)
+
+    conn = sqlite3.connect(file_db)
+    commands_count = conn.execute("SELECT COUNT(*) FROM commands").fetchone()
+    conn.close()
+    vectors_count = len(
+        fetch_similar(query_embedding, top_k=writers * count, db_path=file_db)
+    )
+
+    assert commands_count[0] == writers * count
+    assert vectors_count == writers * count
+
+
+def test_memory_db_hydrates_from_and_snapshots_to_disk(file_db: str) -> None:
+    """Test loading a file into memory and writing the changes back."""
+    add_entry(embedding1, "ls -la", "List all files", db_path=file_db)
+
+    uri = memory_db_uri("test-snapshot")
+    conn = open_memory_db(uri, hydrate_from=file_db)
+    add_entry(embedding2, "df -h", "Disk usage", db_path=uri)
+    assert len(fetch_all_commands(file_db)) == 1
+
+    snapshot_db(conn, file_db)
+    conn.close()
+
+    commands = [cmd["command"] for cmd in fetch_all_commands(file_db)]
+    assert commands == ["ls -la", "df -h"]
+    results = fetch_similar(embedding2, top_k=1, db_path=file_db)
+    assert results[0]["command"] == "df -h"
+
+
+def test_memory_mode_snapshots_on_close(
+    file_db: str, monkeypatch: Any
+) -> None:
+    """Test the process-wide memory DB enabled by FASTCMD_DB_MEMORY."""
+    add_entry(embedding1, "ls -la", "List all files", db_path=file_db)
+    monkeypatch.delenv("TESTING")
+    monkeypatch.setattr(src.vector_database, "DEFAULT_DB_PATH", file_db)
+    monkeypatch.setattr(src.vector_database, "DB_MEMORY", True)
+    monkeypatch.setattr(src.vector_database, "DB_MEMORY_HYDRATE", True)
+    monkeypatch.setattr(src.vector_database, "DB_MEMORY_SNAPSHOT", True)
+
+    assert get_db_path() == memory_db_uri()
+    add_entry(embedding2, "df -h", "Disk usage")
+    assert len(fetch_all_commands()) == 2
+    assert len(fetch_all_commands(file_db)) == 1
+
+    close_memory_db()
+
+    assert len(fetch_all_commands(file_db)) == 2
+
+
+def _build_pack(path: Path, entries: list) -> None:
+    init_db(str(path))
+    for embedding, command, description in entries:
+        add_entry(embedding, command, description, db_path=str(path))
+
+
+def test_fetch_similar_merges_packs(
+    temp_db: str, tmp_path: Path, monkeypatch: Any
+) -> None:
+    """Test that packs are searched with the user DB and never written."""
+    pack_dir = tmp_path / "packs"
+    pack_dir.mkdir()
+    monkeypatch.setattr(src.vector_database, "PACK_DIR", str(pack_dir))
+    _build_pack(pack_dir / "git.db", [(embedding2, "git status", "Status")])
+    _build_pack(pack_dir / "disk.db", [([-1.0, 0.0] * 768, "df -h", "Disk")])
+    # Packs that cannot be searched are skipped
+    conn = sqlite3.connect(pack_dir / "broken.db")
+    conn.execute("CREATE TABLE commands (id INTEGER PRIMARY KEY)")
+    conn.close()
+    before = {p.name: p.read_bytes() for p in pack_dir.iterdir()}
+
+    add_entry(embedding1, "ls -la", "List all files", db_path=temp_db)
+    results = fetch_similar(query_embedding, top_k=2, db_path=temp_db)
+    batch = list(fetch_similar_batch([embedding2], top_k=3, db_path=temp_db))
+
+    assert [r["command"] for r in results] == ["git status", "ls -la"]
+    assert results[0]["pack"] == "git"
+    assert "pack" not in results[1]
+    assert [r["command"] for r in batch[0]] == [
+        "git status",
+        "ls -la",
+        "df -h",
+    ]
+    assert {p.name: p.read_bytes() for p in pack_dir.iterdir()} == before
+
+
+def test_distance_is_cosine_for_every_metric(
+    memory_db: str, monkeypatch: Any
+) -> None:
+    """Test that both metrics score matches by true cosine similarity."""
+    # cos(query, embedding1) = 0.4 / sqrt(0.52)
+    expected = 1 - 0.4 / 0.52**0.5
+    for metric in ("cosine", "l2"):
+        monkeypatch.setattr(src.vector_database, "DISTANCE_METRIC", metric)
+        init_db(memory_db)
+        # Stored vectors are unit vectors, whatever the input scale
+        add_entry([3 * x for x in embedding1], "ls", "List", db_path=memory_db)
+
+        result = fetch_similar(query_embedding, top_k=1, db_path=memory_db)[0]
+        assert result["distance"] == pytest.approx(expected, abs=1e-5)
+        conn = connect(memory_db)
+        blob = conn.execute("SELECT embedding FROM vec_commands").fetchone()[0]
+        conn.execute("DELETE FROM vec_commands")
+        conn.commit()
+        conn.close()
+        assert sum(x * x for x in deserialize(blob)) == pytest.approx(1.0)
+
+
+def test_legacy_vector_table_is_migrated(memory_db: str) -> None:
+    """Test that raw L2 vectors are normalized without re-embedding."""
+    conn = connect(memory_db)
+    conn.execute(
+        f"""
+        CREATE VIRTUAL TABLE vec_commands USING vec0(
+            id INTEGER PRIMARY KEY,
+            embedding FLOAT[{EMB_SIZE}]
+        );
+    """
+    )
+    conn.execute(
+        "INSERT INTO vec_commands (id, embedding) VALUES (1, ?)",
+        (serialize([2 * x for x in embedding1]),),
+    )
+    conn.commit()
+
+    init_db(memory_db)
+
+    sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'vec_commands'"
+    ).fetchone()[0]
+    blob = conn.execute("SELECT embedding FROM vec_commands").fetchone()[0]
+    assert get_vector_metric(conn) == "cosine"
+    assert "distance_metric=cosine" in sql
+    assert sum(x * x for x in deserialize(blob)) == pytest.approx(1.0)
+    conn.close()
+
+
+def test_aliases_match_once_per_command(temp_db: str) -> None:
+    """Test that a command is found by its aliases and listed once."""
+    add_entry(embedding1, "ls -la", "List all files", db_path=temp_db)
+    add_entry(embedding2, "df -h", "Disk usage", db_path=temp_db)
+    entry_id = fetch_similar(embedding1, 1, db_path=temp_db)[0]["id"]
+    add_alias(entry_id, query_embedding, "show my files", db_path=temp_db)
+    add_alias(entry_id, [0.45, 0.55] * 768, "files here", db_path=temp_db)
+
+    results = fetch_similar(query_embedding, top_k=2, db_path=temp_db)
+
+    assert [r["command"] for r in results] == ["ls -la", "df -h"]
+    assert results[0]["description"] == "List all files"
+    assert results[0]["alias"] == "show my files"
+    assert results[0]["distance"] == pytest.approx(0, abs=1e-6)
+    assert "alias" not in results[1]
+    assert fetch_all_commands(temp_db)[0]["aliases"] == [
+        "show my files",
+        "files here",
+    ]
+    with pytest.raises(ValueError):
+        add_alias(entry_id, embedding1, "List all files", db_path=temp_db)
+
+
+def test_delete_entry_removes_aliases(temp_db: str) -> None:
+    """Test that deleting a command deletes its aliases and their vectors."""
+    add_entry(embedding1, "ls -la", "List all files", db_path=temp_db)
+    entry_id = fetch_similar(embedding1, 1, db_path=temp_db)[0]["id"]
+    add_alias(entry_id, embedding2, "show files", db_path=temp_db)
+
+    delete_entry(entry_id, db_path=temp_db)
+
+    conn = connect(temp_db)
+    aliases = conn.execute("SELECT COUNT(*) FROM command_aliases").fetchone()
+    vectors = conn.execute("SELECT COUNT(*) FROM vec_aliases").fetchone()
+    conn.close()
+    assert (aliases[0], vectors[0]) == (0, 0)
+    assert fetch_similar(embedding2, 1, db_path=temp_db) == []
+
+
+def test_packs_without_aliases_are_searched(
+    temp_db: str, tmp_path: Path, monkeypatch: Any
+) -> None:
+    """Test that packs built before aliases existed still match."""
+    pack_dir = tmp_path / "packs"
+    pack_dir.mkdir()
+    monkeypatch.setattr(src.vector_database, "PACK_DIR", str(pack_dir))
+    _build_pack(pack_dir / "old.db", [(embedding2, "git status", "Status")])
+    conn = connect(str(pack_dir / "old.db"))
+    conn.execute("DROP TABLE vec_aliases")
+    conn.execute("DROP TABLE command_aliases")
+    conn.commit()
+    conn.close()
+
+    results = fetch_similar(embedding2, top_k=1, db_path=temp_db)
+
+    assert results[0]["command"] == "git status"
+    assert results[0]["pack"] == "old"
@@ -0,0 +1,38 @@
+import threading
+from typing import Any, List
+from unittest.mock import patch
+
+from src.vector_database import add_entry, connect, init_db
+from src.warmup import start_warmup
+
+
+def _run_warmup() -> List[threading.Thread]:
+    threads = start_warmup()
+    for thread in threads:
+        thread.join(timeout=5)
+    return threads
+
+
+def test_warmup_connects_to_the_api_and_reads_the_db(test_db: str) -> None:
+    init_db()
+    add_entry([1.0] + [0.0] * 1535, "ls -la", "List files", test_db)
+
+    with patch("src.warmup.get_embedding_provider", return_value="openai"):
+        with patch("src.warmup.get_transport") as mock_transport:
+            with patch("src.warmup.connect", wraps=connect) as mock_connect:
+                _run_warmup()
+
+    mock_transport.return_value.warm_up.assert_called_once()
+    mock_connect.assert_called_once_with(None)
+
+
+def test_warmup_failures_stay_in_the_background() -> None:
+    uncaught: List[Any] = []
+
+    with patch("threading.excepthook", uncaught.append):
+        with patch("src.warmup.get_embedding_provider", return_value="openai"):
+            with patch("src.warmup.get_transport", side_effect=ValueError):
+                with patch("src.warmup.connect", side_effect=OSError):
+                    _run_warmup()
+
+    assert uncaught == []
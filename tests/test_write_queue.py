@@ -0,0 +1,219 @@
+from typing import Any, Generator, List
+from unittest.mock import patch
+
+import httpx
+import pytest
+from openai import BadRequestError
+
+from src.maintenance import collect_stats
+from src.vector_database import (
+    MAX_EMBEDDING_ATTEMPTS,
+    add_entry,
+    complete_pending,
+    connect,
+    enqueue_alias,
+    enqueue_entry,
+    fetch_pending,
+    fetch_pending_commands,
+    fetch_similar,
+    init_db,
+    update_entry,
+)
+from src.write_queue import DrainWorker, drain_pending, pending_count
+
+EMB_SIZE = 1536
+
+
+@pytest.fixture
+def temp_db(memory_db: str) -> Generator[str, None, None]:
+    """Create a temporary database for testing."""
+    db_path = memory_db
+    init_db(db_path)
+    yield db_path
+
+
+def _embeddings(descriptions: List[str]) -> List[list]:
+    return [[0.1] * EMB_SIZE for _ in descriptions]
+
+
+def test_enqueue_saves_command_without_vector(temp_db: str) -> None:
+    enqueue_entry("ls -la", "List all files", db_path=temp_db)
+
+    assert pending_count(temp_db) == 1
+    assert fetch_pending_commands(temp_db)[0]["command"] == "ls -la"
+    assert fetch_similar([0.1] * EMB_SIZE, top_k=1, db_path=temp_db) == []
+
+
+def test_drain_stores_vectors_in_batches(temp_db: str) -> None:
+    for i in range(5):
+        enqueue_entry(f"cmd-{i}", f"description {i}", db_path=temp_db)
+
+    with patch(
+        "src.write_queue.calculate_embeddings", side_effect=_embeddings
+    ) as mock_calc_embeddings:
+        stored = drain_pending(batch_size=2, db_path=temp_db)
+
+    assert stored == 5
+    assert mock_calc_embeddings.call_count == 3
+    assert pending_count(temp_db) == 0
+    results = fetch_similar([0.1] * EMB_SIZE, top_k=5, db_path=temp_db)
+    assert len(results) == 5
+
+
+def test_drain_embeds_aliases_after_commands(temp_db: str) -> None:
+    add_entry([1.0, 0.0] * (EMB_SIZE // 2), "ls -la", "List", temp_db)
+    enqueue_entry("df -h", "Disk usage", db_path=temp_db)
+    assert enqueue_alias("ls -la", "Show files", db_path=temp_db)
+    assert enqueue_alias("unknown", "Show files", db_path=temp_db) is None
+    with pytest.raises(ValueError):
+        enqueue_alias("ls -la", "Show files", db_path=temp_db)
+
+    with patch(
+        "src.write_queue.calculate_embeddings", side_effect=_embeddings
+    ) as mock_calc_embeddings:
+        stored = drain_pending(db_path=temp_db)
+
+    assert stored == 2
+    assert [call[0][0] for call in mock_calc_embeddings.call_args_list] == [
+        ["Disk usage"],
+        ["Show files"],
+    ]
+    # The alias ties with "df -h", the command is listed once
+    results = fetch_similar([0.1] * EMB_SIZE, top_k=3, db_path=temp_db)
+    assert sorted(r["command"] for r in results) == ["df -h", "ls -la"]
+
+
+def test_failed_drain_keeps_queue(temp_db: str) -> None:
+    enqueue_entry("ls -la", "List all files", db_path=temp_db)
+
+    with patch(
+        "src.write_queue.calculate_embeddings",
+        side_effect=Exception("Connection error"),
+    ):
+        with pytest.raises(Exception):
+            drain_pending(db_path=temp_db)
+
+    conn = connect(temp_db)
+    attempts, last_error = conn.execute(
+        "SELECT attempts, last_error FROM pending_embeddings"
+    ).fetchone()
+    conn.close()
+    # Not an attempt, the description was not what failed
+    assert attempts == 0
+    assert last_error == "Connection error"
+
+
+def test_missing_api_key_does_not_park_the_queue(
+    temp_db: str, monkeypatch: Any
+) -> None:
+    monkeypatch.setenv("FASTCMD_EMBEDDING_PROVIDER", "openai")
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    for i in range(3):
+        enqueue_entry(f"cmd-{i}", f"description {i}", db_path=temp_db)
+
+    for _ in range(MAX_EMBEDDING_ATTEMPTS + 1):
+        with pytest.raises(ValueError, match="API key is not set"):
+            drain_pending(db_path=temp_db)
+
+    stats = collect_stats(temp_db)
+    assert (stats["pending"], stats["parked"]) == (3, 0)
+    conn = connect(temp_db)
+    assert len(fetch_pending(conn, 10)) == 3
+    conn.close()
+
+
+def test_drain_parks_rejected_description(temp_db: str) -> None:
+    for i in range(5):
+        description = "too long" if i == 2 else f"description {i}"
+        enqueue_entry(f"cmd-{i}", description, db_path=temp_db)
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+
+    def embed(descriptions: List[str]) -> List[list]:
+        if "too long" in descriptions:
+            raise BadRequestError(
+                "maximum context length exceeded",
+                response=httpx.Response(400, request=request),
+                body=None,
+            )
+        return _embeddings(descriptions)
+
+    with patch(
+        "src.write_queue.calculate_embeddings", side_effect=embed
+    ) as mock_calc_embeddings:
+        # The failing batch is halved until the rejected description is
+        # found, the others are stored
+        assert drain_pending(batch_size=4, db_path=temp_db) == 4
+        assert [
+            call[0][0] for call in mock_calc_embeddings.call_args_list
+        ] == [
+            ["description 0", "description 1", "too long", "description 3"],
+            ["description 0", "description 1"],
+            ["too long", "description 3"],
+            ["too long"],
+            ["description 3"],
+            ["description 4"],
+        ]
+
+        for _ in range(MAX_EMBEDDING_ATTEMPTS - 1):
+            assert drain_pending(batch_size=4, db_path=temp_db) == 0
+        mock_calc_embeddings.reset_mock()
+        assert drain_pending(batch_size=4, db_path=temp_db) == 0
+        assert mock_calc_embeddings.call_count == 0
+
+    stats = collect_stats(temp_db)
+    assert (stats["pending"], stats["parked"]) == (1, 1)
+
+    # A new description is queued again
+    update_entry(3, description="shorter", db_path=temp_db)
+    conn = connect(temp_db)
+    assert fetch_pending(conn, 10) == [(3, "shorter")]
+    conn.close()
+
+
+def test_complete_pending_skips_completed_entries(temp_db: str) -> None:
+    entry_id = enqueue_entry("ls -la", "List all files", db_path=temp_db)
+
+    conn = connect(temp_db)
+    first = complete_pending(conn, [(entry_id, [0.1] * EMB_SIZE)])
+    second = complete_pending(conn, [(entry_id, [0.1] * EMB_SIZE)])
+    conn.close()
+
+    assert (first, second) == (1, 0)
+
+
+def test_drain_reembeds_entries_updated_meanwhile(temp_db: str) -> None:
+    entry_id = enqueue_entry("ls -la", "List files", db_path=temp_db)
+    calls: List[List[str]] = []
+
+    def embed_then_update(descriptions: List[str]) -> List[list]:
+        calls.append(descriptions)
+        if len(calls) == 1:
+            # The description changes while its old text is being embedded
+            update_entry(
+                entry_id, description="List all files", db_path=temp_db
+            )
+        return _embeddings(descriptions)
+
+    with patch(
+        "src.write_queue.calculate_embeddings", side_effect=embed_then_update
+    ):
+        stored = drain_pending(db_path=temp_db)
+
+    # The stale vector is discarded and the new description embedded
+    assert calls == [["List files"], ["List all files"]]
+    assert stored == 1
+    assert pending_count(temp_db) == 0
+
+
+def test_worker_drains_in_background(temp_db: str) -> None:
+    enqueue_entry("ls -la", "List all files", db_path=temp_db)
+    worker = DrainWorker(db_path=temp_db)
+
+    with patch(
+        "src.write_queue.calculate_embeddings", side_effect=_embeddings
+    ):
+        worker.schedule()
+        assert worker.wait(timeout=10)
+
+    assert worker.last_error is None
+    assert pending_count(temp_db) == 0